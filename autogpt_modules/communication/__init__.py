@@ -1,11 +1,24 @@
 from .message_manager import MessageManager
-from .plan_manager import ActionPlanManager
+from .plan_manager import ActionPlanManager, get_plan_prefetch_stats
 from .result_manager import ResultManager
 from .websocket_manager import WebSocketManager
+from .chat_compactor import ChatCompactor
+from .outbound_queue import OutboundQueue
+from .input_coalescer import InputCoalescer
+from .worker_pool import HashRing, WorkerPool, LoopShardPool, RemoteWebSocket, run_worker
 
 __all__ = [
     "MessageManager",
     "WebSocketManager",
     "ActionPlanManager",
-    "ResultManager"
+    "ResultManager",
+    "ChatCompactor",
+    "OutboundQueue",
+    "InputCoalescer",
+    "HashRing",
+    "WorkerPool",
+    "LoopShardPool",
+    "RemoteWebSocket",
+    "run_worker",
+    "get_plan_prefetch_stats"
 ] 
\ No newline at end of file
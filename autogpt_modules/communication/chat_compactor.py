@@ -0,0 +1,146 @@
+import asyncio
+import functools
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from .message_manager import MessageManager
+from ..core.custom_congif import CHAT_KEEP_RECENT_MESSAGES, CHAT_COMPACTION_BATCH
+from ..utils.llm.llm_chains import generate_chat_compaction
+
+logger = logging.getLogger(__name__)
+
+
+class ChatCompactor:
+    """チャット履歴を「古い対話の要約 + 最新N件の原文」に圧縮するクラス
+
+    要約はバックグラウンドで少しずつ更新する。1回の更新で要約に畳み込むのは
+    まだ要約に含まれていないメッセージだけで、結果はルームにキャッシュされる。
+    プロンプトに載るのは要約と、要約されていないメッセージだけになるため、
+    セッションが長くなっても各ステップのプロンプトの大きさは一定に収まる。
+    要約に失敗した場合は、さらに batch_size 件（失敗が続くたびに倍）のメッセージが
+    届くまでやり直さない（失敗するLLM呼び出しを毎ステップ繰り返さない）。
+
+    Args:
+        message_manager (MessageManager): 圧縮対象のメッセージ
+        keep_recent (int): 原文のまま残す最新メッセージ数
+        batch_size (int): 未圧縮のメッセージがこの件数を超えたら要約を更新する
+        summarize (Optional[Callable]): (これまでの要約, 追加のメッセージ) -> 更新した要約
+        room_id (Optional[str]): 既定の要約関数で、LLMのスケジューラに渡すルームID
+    """
+    def __init__(
+        self,
+        message_manager: MessageManager,
+        keep_recent: int = CHAT_KEEP_RECENT_MESSAGES,
+        batch_size: int = CHAT_COMPACTION_BATCH,
+        summarize: Optional[Callable[[str, List[Dict]], Awaitable[str]]] = None,
+        room_id: Optional[str] = None,
+    ):
+        self.message_manager = message_manager
+        self.keep_recent = keep_recent
+        self.batch_size = batch_size
+        self._summarize = summarize or functools.partial(generate_chat_compaction, room_id=room_id)
+        self._summary = ""
+        self._folded_count = 0
+        self._task: Optional[asyncio.Task] = None
+        # 連続して失敗した回数と、次にやり直せるメッセージ数
+        self._failures_in_row = 0
+        self._retry_at_count = 0
+        self._stats: Dict[str, int] = {"compactions": 0, "folded_messages": 0, "failures": 0, "backed_off": 0}
+
+    @property
+    def summary(self) -> str:
+        """これまでに畳み込んだ対話の要約"""
+        return self._summary
+
+    @property
+    def folded_count(self) -> int:
+        """要約に畳み込んだメッセージ数"""
+        return self._folded_count
+
+    def get_compacted_history(self) -> Tuple[str, int, List[Dict]]:
+        """圧縮したチャット履歴を取得し、必要であれば要約の更新を開始する
+
+        Returns:
+            Tuple[str, int, List[Dict]]: (古い対話の要約, 原文の先頭メッセージの位置, 原文のメッセージ)
+        """
+        total = self.message_manager.count_messages()
+        if total < self._folded_count:
+            # メッセージがクリアされた場合は要約も破棄する
+            self.reset()
+
+        self.maybe_compact()
+        return self._summary, self._folded_count, self.message_manager.get_chat_history(start=self._folded_count)
+
+    def maybe_compact(self) -> bool:
+        """未圧縮のメッセージがたまっていれば、要約の更新をバックグラウンドで開始する
+
+        Returns:
+            bool: 更新を開始した場合True
+        """
+        if self._task is not None and not self._task.done():
+            return False
+
+        total = self.message_manager.count_messages()
+        if total - self._folded_count <= self.keep_recent + self.batch_size:
+            return False
+        if total < self._retry_at_count:
+            self._stats["backed_off"] += 1
+            return False
+
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return False
+
+        start, end = self._folded_count, total - self.keep_recent
+        self._task = loop.create_task(self._compact(start, end))
+        return True
+
+    async def _compact(self, start: int, end: int) -> None:
+        """[start, end) のメッセージを要約に畳み込む"""
+        messages = self.message_manager.get_chat_history(start=start)[:end - start]
+        try:
+            summary = await self._summarize(self._summary, messages)
+        except Exception as e:
+            self._stats["failures"] += 1
+            self._failures_in_row += 1
+            backoff = self.batch_size * 2 ** (self._failures_in_row - 1)
+            self._retry_at_count = self.message_manager.count_messages() + backoff
+            logger.warning(f"Chat compaction failed (retrying after {backoff} more messages): {e}")
+            return
+        self._failures_in_row = 0
+        self._retry_at_count = 0
+
+        # 要約している間に履歴がクリアされていたら結果を捨てる
+        if self._folded_count != start or self.message_manager.count_messages() < end:
+            return
+
+        self._summary = summary
+        self._folded_count = end
+        self._stats["compactions"] += 1
+        self._stats["folded_messages"] += end - start
+        logger.debug(f"Compacted chat history: folded {end - start} messages (total folded: {end})")
+
+    async def wait(self) -> None:
+        """実行中の要約の更新が終わるまで待つ"""
+        if self._task is not None:
+            await asyncio.gather(self._task, return_exceptions=True)
+
+    def reset(self) -> None:
+        """要約を破棄する"""
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+        self._task = None
+        self._summary = ""
+        self._folded_count = 0
+        self._failures_in_row = 0
+        self._retry_at_count = 0
+
+    def stats(self) -> Dict[str, Any]:
+        """圧縮の実行状況を取得"""
+        return {
+            **self._stats,
+            "folded_count": self._folded_count,
+            "summary_chars": len(self._summary),
+            "running": self._task is not None and not self._task.done(),
+        }
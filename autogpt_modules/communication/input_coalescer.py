@@ -0,0 +1,183 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from ..core.custom_congif import (
+    INPUT_COALESCE_MIN_WINDOW,
+    INPUT_COALESCE_MAX_WINDOW,
+    INPUT_COALESCE_GAP_FACTOR,
+    INPUT_COALESCE_MAX_HOLD,
+)
+
+logger = logging.getLogger(__name__)
+
+# 連続したメッセージの間隔の移動平均の重み
+_GAP_SMOOTHING = 0.3
+# 区切りの後に間隔の長いメッセージが来るたびに、間隔の見積もりをこの割合で縮める
+_GAP_DECAY = 0.8
+
+
+class InputCoalescer:
+    """ユーザーが短いメッセージを連投したときに、まとめて1回の発言として確定させるクラス
+
+    add() で受け取った断片は、最後の断片から待ち時間（quiet window）の間に次の断片が来なければ
+    改行でつないで commit(text, fragments) に渡す。エージェントは確定した発言ごとに1回だけ反応する。
+
+    待ち時間はルームごとに、そのユーザーの連投の間隔から決める（間隔の移動平均 × gap_factor を
+    min_window〜max_window に収める）。区切った後に max_window 以内で次の断片が来た場合は
+    区切るのが早すぎたとみなして late_fragments に数える。最初の断片から max_hold 秒たったら、
+    連投が続いていても確定させる。
+
+    Args:
+        commit (Callable[[str, int], Awaitable[Any]]): 確定した発言と断片の数を受け取る関数
+        min_window (float): 待ち時間の下限（秒）. 0以下の場合はまとめずにすぐ確定させる
+        max_window (float): 待ち時間の上限（秒）. これより間隔が空いたメッセージは別の発言とみなす
+        gap_factor (float): 連投の間隔の何倍を待つか
+        max_hold (float): 最初の断片から確定までの最大秒数
+    """
+    def __init__(
+        self,
+        commit: Callable[[str, int], Awaitable[Any]],
+        min_window: float = INPUT_COALESCE_MIN_WINDOW,
+        max_window: float = INPUT_COALESCE_MAX_WINDOW,
+        gap_factor: float = INPUT_COALESCE_GAP_FACTOR,
+        max_hold: float = INPUT_COALESCE_MAX_HOLD,
+    ):
+        self._commit = commit
+        self.min_window = min_window
+        self.max_window = max(max_window, min_window)
+        self.gap_factor = gap_factor
+        self.max_hold = max_hold
+        self._pending: List[str] = []
+        self._first_at: Optional[float] = None
+        self._last_at: Optional[float] = None
+        # 連投の間隔の見積もり（秒）. 最初は待ち時間が min_window × gap_factor になる
+        self._gap = min_window
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._flush_task: Optional[asyncio.Task] = None
+        self._stats: Dict[str, int] = {
+            "fragments": 0,
+            "turns": 0,
+            "max_hold_flushes": 0,
+            "late_fragments": 0,
+            "commit_failures": 0,
+        }
+
+    @property
+    def enabled(self) -> bool:
+        return self.min_window > 0
+
+    def window(self) -> float:
+        """現在の待ち時間（秒）"""
+        return min(max(self._gap * self.gap_factor, self.min_window), self.max_window)
+
+    def has_pending(self) -> bool:
+        return bool(self._pending)
+
+    async def add(self, content: str) -> None:
+        """ユーザーのメッセージの断片を受け取る"""
+        self._stats["fragments"] += 1
+        if not self.enabled:
+            await self._commit_turn([content])
+            return
+
+        now = asyncio.get_running_loop().time()
+        self._observe_gap(now)
+        self._last_at = now
+        if not self._pending:
+            self._first_at = now
+        self._pending.append(content)
+
+        hold_left = self._first_at + self.max_hold - now
+        if hold_left <= 0:
+            self._stats["max_hold_flushes"] += 1
+            await self.flush()
+            return
+        window = self.window()
+        self._schedule(min(window, hold_left), by_max_hold=hold_left < window)
+
+    def _observe_gap(self, now: float) -> None:
+        """前のメッセージとの間隔から、連投の間隔の見積もりを更新する"""
+        previous = self._last_at
+        if previous is None:
+            return
+        gap = now - previous
+        if gap <= self.max_window:
+            if not self._pending:
+                # 区切った直後に続きが来た（待ち時間が短すぎた）
+                self._stats["late_fragments"] += 1
+            self._gap += _GAP_SMOOTHING * (gap - self._gap)
+        else:
+            # 1通で言い終えるユーザーには待ち時間を縮めていく
+            self._gap *= _GAP_DECAY
+
+    def _schedule(self, delay: float, by_max_hold: bool = False) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+        self._timer = asyncio.get_running_loop().call_later(delay, self._on_timer, by_max_hold)
+
+    def _on_timer(self, by_max_hold: bool) -> None:
+        self._timer = None
+        if by_max_hold:
+            self._stats["max_hold_flushes"] += 1
+        self._flush_task = asyncio.create_task(self.flush())
+
+    async def flush(self) -> None:
+        """待っている断片をすぐに確定させる（セッション終了時など）"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._pending:
+            return
+        fragments, self._pending = self._pending, []
+        self._first_at = None
+        await self._commit_turn(fragments)
+
+    async def _commit_turn(self, fragments: List[str]) -> None:
+        self._stats["turns"] += 1
+        try:
+            await self._commit("\n".join(fragments), len(fragments))
+        except Exception as e:
+            self._stats["commit_failures"] += 1
+            logger.error(f"Failed to commit coalesced user input: {e}")
+
+    def close(self) -> None:
+        """待っている断片を捨ててタイマーを止める"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._flush_task is not None and not self._flush_task.done():
+            self._flush_task.cancel()
+        self._flush_task = None
+        self._pending.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """まとめた断片数と現在の待ち時間"""
+        return {
+            **self._stats,
+            "pending": len(self._pending),
+            "window": self.window(),
+        }
+
+
+def merge_input_stats(stats_list: Any) -> Dict[str, Any]:
+    """複数ルームの InputCoalescer.stats() を集計する"""
+    totals: Dict[str, Any] = {
+        "rooms": 0,
+        "fragments": 0,
+        "turns": 0,
+        "pending": 0,
+        "max_hold_flushes": 0,
+        "late_fragments": 0,
+        "commit_failures": 0,
+    }
+    windows = []
+    for stats in stats_list:
+        totals["rooms"] += 1
+        for key in ("fragments", "turns", "pending", "max_hold_flushes", "late_fragments", "commit_failures"):
+            totals[key] += stats[key]
+        windows.append(stats["window"])
+    # 断片ごとに決定ステップを動かしていた場合と比べて省いたステップ数
+    totals["coalesced_fragments"] = totals["fragments"] - totals["turns"]
+    totals["avg_window"] = sum(windows) / len(windows) if windows else 0.0
+    return totals
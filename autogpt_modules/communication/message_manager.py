@@ -1,6 +1,10 @@
+import sys
 from datetime import datetime
-from typing import List, Dict
+from typing import Any, List, Dict, Optional
 from ..core.event_manager import EventManager
+from ..core.bounded_history import BoundedHistory
+from ..core.custom_congif import HISTORY_HOT_WINDOW
+from ..core.session_store import RoomSession, RECORD_MESSAGE
 
 class Message:
     def __init__(self, content: str, sender: str):
@@ -17,9 +21,28 @@ class Message:
             "timestamp": self.timestamp.isoformat()
         }
 
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "Message":
+        """to_dict の結果からメッセージを復元"""
+        message = cls(data["content"], data["sender"])
+        message.id = data["id"]
+        message.timestamp = datetime.fromisoformat(data["timestamp"])
+        return message
+
 class MessageManager:
-    def __init__(self):
-        self._messages: List[Message] = []
+    def __init__(
+        self,
+        spill_path: Optional[str] = None,
+        max_in_memory: int = HISTORY_HOT_WINDOW,
+        session: Optional[RoomSession] = None,
+    ):
+        self._session = session
+        # 古いメッセージは spill_path に追い出し、参照されたときだけ読み戻す
+        self._messages: BoundedHistory[Message] = BoundedHistory(
+            spill_path, max_in_memory, serialize=Message.to_dict, deserialize=Message.from_dict,
+            sizeof=lambda message: sys.getsizeof(message.content),
+        )
+        self._sender_counts: Dict[str, int] = {}
 
 
 
@@ -27,27 +50,52 @@ class MessageManager:
         """新しいメッセージを追加してイベントを発火"""
         message = Message(content, sender)
         self._messages.append(message)
+        self._sender_counts[sender] = self._sender_counts.get(sender, 0) + 1
         self.new_messages_since_last_check = True
+        if self._session:
+            self._session.record(RECORD_MESSAGE, message.to_dict())
 
         return message
 
+    def restore(self, records: List[Dict[str, Any]]) -> None:
+        """保存されていたメッセージを復元（ストアには記録し直さない）"""
+        for data in records:
+            message = Message.from_dict(data)
+            self._messages.append(message)
+            self._sender_counts[message.sender] = self._sender_counts.get(message.sender, 0) + 1
+
     def get_messages(self) -> List[Dict]:
         """全メッセージを取得"""
         return [msg.to_dict() for msg in self._messages]
 
-    def get_chat_history(self) -> List[Dict]:
-        """LLMに渡すためのチャット履歴を取得"""
+    def get_chat_history(self, start: int = 0) -> List[Dict]:
+        """LLMに渡すためのチャット履歴を取得
+
+        Args:
+            start (int): 取得を開始するメッセージの位置（それより前は含めない）
+        """
         return [
             {
                 "role": msg.sender,
                 "content": msg.content
             }
-            for msg in self._messages
+            for msg in self._messages[start:]
         ]
 
+    def count_messages(self, sender: Optional[str] = None) -> int:
+        """メッセージ数を取得（senderを指定した場合はその送信者の数）"""
+        if sender is None:
+            return len(self._messages)
+        return self._sender_counts.get(sender, 0)
+
+    def memory_bytes(self) -> int:
+        """メモリに置いているメッセージのおおよそのバイト数（ファイルに追い出した分は含まない）"""
+        return self._messages.hot_bytes
+
     def clear(self) -> None:
         """メッセージをクリア"""
         self._messages.clear()
+        self._sender_counts.clear()
 
     def has_new_messages(self) -> bool:
         """新しいメッセージがあるかチェック"""
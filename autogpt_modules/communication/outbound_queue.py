@@ -0,0 +1,200 @@
+import asyncio
+import logging
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+
+from ..core.custom_congif import OUTBOUND_QUEUE_SIZE, OUTBOUND_OVERFLOW_POLICY
+
+logger = logging.getLogger(__name__)
+
+# キューが一杯のときの動作
+#   block:       空きができるまで送信側（ツール）を待たせる
+#   drop_oldest: 最も古い未送信のメッセージを捨てる
+#   drop_newest: 新しいメッセージを捨てる
+#   close:       クライアントが遅すぎるとみなして未送信のメッセージを捨て、接続を閉じる
+OVERFLOW_POLICIES = ("block", "drop_oldest", "drop_newest", "close")
+
+# 送信遅延のヒストグラムの各区間の上限（秒）. 1ms から倍々に約65秒まで、最後の区間はそれ以上
+LATENCY_BUCKETS: Tuple[float, ...] = tuple(0.001 * 2 ** i for i in range(17))
+
+
+def _latency_bucket(latency: float) -> int:
+    for i, bound in enumerate(LATENCY_BUCKETS):
+        if latency <= bound:
+            return i
+    return len(LATENCY_BUCKETS)
+
+
+class OutboundQueue:
+    """ルームごとの送信キュー
+
+    ツールは put() でキューに積むだけで戻り、送信は専用の書き込みタスクが順番どおりに行う。
+    遅いクライアントへの送信がエージェントのループを止めず、未送信のメッセージは max_size 件までに抑える。
+    書き込みタスクはキューにメッセージがある間だけ動き、空になったら終了する。
+
+    Args:
+        send (Callable[[str], Awaitable[Any]]): 1件を送信する関数
+        max_size (int): 未送信のメッセージを保持する最大件数
+        policy (str): キューが一杯のときの動作（OVERFLOW_POLICIES）
+        on_close (Optional[Callable[[], Any]]): policy="close" であふれたときに呼ぶ関数
+    """
+    def __init__(
+        self,
+        send: Callable[[str], Awaitable[Any]],
+        max_size: int = OUTBOUND_QUEUE_SIZE,
+        policy: str = OUTBOUND_OVERFLOW_POLICY,
+        on_close: Optional[Callable[[], Any]] = None,
+    ):
+        if policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy: {policy} (expected one of {OVERFLOW_POLICIES})")
+        self._send = send
+        self.max_size = max(max_size, 1)
+        self.policy = policy
+        self._on_close = on_close
+        # (メッセージ, キューに積んだ時刻)
+        self._queue: Deque[Tuple[str, float]] = deque()
+        self._space = asyncio.Event()
+        self._writer: Optional[asyncio.Task] = None
+        self._closed = False
+        # 送信遅延はサンプルを残さず、区間ごとの件数と最大値だけを数える
+        self._latency_counts: List[int] = [0] * (len(LATENCY_BUCKETS) + 1)
+        self._latency_max = 0.0
+        self._stats: Dict[str, int] = {
+            "enqueued": 0,
+            "sent": 0,
+            "send_failures": 0,
+            "dropped": 0,
+            "blocked": 0,
+            "overflow_closes": 0,
+            "max_depth": 0,
+        }
+
+    def __len__(self) -> int:
+        return len(self._queue)
+
+    async def put(self, message: str) -> bool:
+        """メッセージを送信キューに積む
+
+        Returns:
+            bool: キューに積んだ場合True. あふれて捨てた場合False
+        """
+        if self._closed:
+            return False
+
+        if len(self._queue) >= self.max_size:
+            if self.policy == "block":
+                self._stats["blocked"] += 1
+                while len(self._queue) >= self.max_size and not self._closed:
+                    self._space.clear()
+                    await self._space.wait()
+                if self._closed:
+                    return False
+            elif self.policy == "drop_oldest":
+                self._queue.popleft()
+                self._stats["dropped"] += 1
+            elif self.policy == "drop_newest":
+                self._stats["dropped"] += 1
+                return False
+            else:
+                self._stats["dropped"] += len(self._queue) + 1
+                self._stats["overflow_closes"] += 1
+                self._queue.clear()
+                logger.warning(f"Outbound queue overflowed ({self.max_size} messages); closing slow connection")
+                if self._on_close is not None:
+                    self._on_close()
+                return False
+
+        self._queue.append((message, asyncio.get_running_loop().time()))
+        self._stats["enqueued"] += 1
+        self._stats["max_depth"] = max(self._stats["max_depth"], len(self._queue))
+        if self._writer is None or self._writer.done():
+            self._writer = asyncio.create_task(self._drain())
+        return True
+
+    async def _drain(self) -> None:
+        """キューが空になるまで順番に送信する"""
+        loop = asyncio.get_running_loop()
+        while self._queue:
+            message, queued_at = self._queue.popleft()
+            self._space.set()
+            try:
+                await self._send(message)
+            except Exception as e:
+                self._stats["send_failures"] += 1
+                logger.warning(f"Failed to send queued message: {e}")
+                continue
+            self._stats["sent"] += 1
+            latency = loop.time() - queued_at
+            self._latency_counts[_latency_bucket(latency)] += 1
+            self._latency_max = max(self._latency_max, latency)
+
+    async def flush(self) -> None:
+        """キューに積んだメッセージを送信し終えるまで待つ"""
+        while self._writer is not None and not self._writer.done():
+            await asyncio.gather(self._writer, return_exceptions=True)
+
+    def close(self) -> None:
+        """書き込みタスクを止め、未送信のメッセージを捨てる"""
+        self._closed = True
+        if self._writer is not None and not self._writer.done():
+            self._writer.cancel()
+        self._writer = None
+        self._queue.clear()
+        # 空きを待っている送信側を起こす
+        self._space.set()
+
+    def stats(self) -> Dict[str, Any]:
+        """キューの深さと送信遅延のヒストグラム（LATENCY_BUCKETS の区間ごとの件数）"""
+        return {
+            **self._stats,
+            "depth": len(self._queue),
+            "latency_histogram": list(self._latency_counts),
+            "latency_max": self._latency_max,
+        }
+
+
+def merge_outbound_stats(stats_list: Any) -> Dict[str, Any]:
+    """複数ルームの OutboundQueue.stats() を集計する（送信遅延は秒ではなくミリ秒で返す）"""
+    totals: Dict[str, Any] = {
+        "rooms": 0,
+        "depth": 0,
+        "max_depth": 0,
+        "enqueued": 0,
+        "sent": 0,
+        "send_failures": 0,
+        "dropped": 0,
+        "blocked": 0,
+        "overflow_closes": 0,
+    }
+    counts = [0] * (len(LATENCY_BUCKETS) + 1)
+    latency_max = 0.0
+    for stats in stats_list:
+        totals["rooms"] += 1
+        totals["max_depth"] = max(totals["max_depth"], stats["max_depth"])
+        for key in ("depth", "enqueued", "sent", "send_failures", "dropped", "blocked", "overflow_closes"):
+            totals[key] += stats[key]
+        for i, count in enumerate(stats["latency_histogram"]):
+            counts[i] += count
+        latency_max = max(latency_max, stats["latency_max"])
+
+    totals["send_latency_ms"] = {
+        "p50": _histogram_percentile(counts, 0.5, latency_max) * 1000,
+        "p99": _histogram_percentile(counts, 0.99, latency_max) * 1000,
+        "max": latency_max * 1000,
+    }
+    return totals
+
+
+def _histogram_percentile(counts: List[int], q: float, latency_max: float) -> float:
+    """ヒストグラムから分位点を求める（その分位点を含む区間の上限. 最大値を超えない）"""
+    total = sum(counts)
+    if not total:
+        return 0.0
+    rank = max(int(total * q + 0.999999), 1)
+    seen = 0
+    for i, count in enumerate(counts):
+        seen += count
+        if seen >= rank:
+            bound = LATENCY_BUCKETS[i] if i < len(LATENCY_BUCKETS) else latency_max
+            return min(bound, latency_max)
+    return latency_max
@@ -1,32 +1,121 @@
-from typing import List, Dict, Optional
+import asyncio
+import sys
+import re
+from typing import Any, Awaitable, List, Dict, Optional
 from datetime import datetime
 import json
 from pydantic import BaseModel, Field
 
+from ..core.bounded_history import BoundedHistory
+from ..core.custom_congif import HISTORY_HOT_WINDOW
+from ..core.session_store import RoomSession, RECORD_PLAN
+
+# 先読みしたプランの利用状況（プロセス全体の累計）
+_PREFETCH_STAT_KEYS = ("started", "ready", "used", "joined", "stale", "missed", "bypassed", "failed")
+_prefetch_totals: Dict[str, int] = {key: 0 for key in _PREFETCH_STAT_KEYS}
+
+
+def get_plan_prefetch_stats() -> Dict[str, Any]:
+    """プロセス全体での先読みプランの利用状況を取得"""
+    return _with_hit_rate(dict(_prefetch_totals))
+
+
+def _with_hit_rate(stats: Dict[str, Any]) -> Dict[str, Any]:
+    served = stats["used"] + stats["joined"]
+    requested = served + stats["stale"] + stats["missed"] + stats["bypassed"]
+    stats["hit_rate"] = served / requested if requested else 0.0
+    return stats
+
+
+# LLMが plan_action に渡すゴールには、プロンプトの current_goal の接頭辞が付くことがある
+_GOAL_INDEX_PREFIX = re.compile(r"^\s*goal index:\s*\d+\s*,\s*")
+
+
+def _goal_key(goal: str) -> str:
+    """先読みを探すためのゴールのキー（current_goal の接頭辞と空白の揺れを除く）"""
+    return re.sub(r"\s+", " ", _GOAL_INDEX_PREFIX.sub("", goal)).strip()
+
+
 class ActionPlan(BaseModel):
     """アクションプランを表すモデル"""
+    goal: str = Field(default="", description="プランに対応するゴール")
     plan: str = Field(..., description="実行プランの内容")
     timestamp: datetime = Field(default_factory=datetime.now, description="プラン作成時のタイムスタンプ")
     metadata: Optional[Dict] = Field(default=None, description="追加のメタデータ")
 
 
+class PrefetchedPlan:
+    """次のゴールのために先読みしたプラン
+
+    Args:
+        goal (str): 対象のゴール
+        user_message_count (int): 先読み開始時点のユーザーメッセージ数
+        task (asyncio.Task): プランを生成するタスク
+        result_count (int): 先読み開始時点の結果の数（生成中の要約を含む）
+    """
+    def __init__(self, goal: str, user_message_count: int, task: asyncio.Task, result_count: int = 0):
+        self.goal = goal
+        self.user_message_count = user_message_count
+        self.task = task
+        self.result_count = result_count
+        self.created_at = datetime.now()
+
+    def is_fresh(self, user_message_count: int, max_new_messages: int, result_count: Optional[int] = None) -> bool:
+        """先読み後に届いたユーザーメッセージが許容数未満で、結果が増えていないか
+
+        ゴールを終えるとその要約が結果に加わるため、それ以前の先読みは終えたゴールを知らない。
+        """
+        if result_count is not None and result_count != self.result_count:
+            return False
+        return user_message_count - self.user_message_count < max_new_messages
+
+
 class ActionPlanManager:
-    """アクションプランを管理するクラス"""
-    def __init__(self):
-        self._plans: List[ActionPlan] = []
+    """アクションプランを管理するクラス
+
+    次のゴールのプランを待機中に先読みしておき、plan_action で新鮮なうちは
+    そのプランを使う（prefetch / take_prefetched）。
+    """
+    def __init__(
+        self,
+        spill_path: Optional[str] = None,
+        max_in_memory: int = HISTORY_HOT_WINDOW,
+        session: Optional[RoomSession] = None,
+    ):
+        self._session = session
+        self._plans: BoundedHistory[ActionPlan] = BoundedHistory(
+            spill_path, max_in_memory,
+            serialize=lambda plan: plan.model_dump(mode="json"),
+            deserialize=ActionPlan.model_validate,
+            sizeof=lambda plan: sys.getsizeof(plan.plan),
+        )
+        self._prefetched: Dict[str, PrefetchedPlan] = {}
+        self._prefetch_stats: Dict[str, int] = {key: 0 for key in _PREFETCH_STAT_KEYS}
 
-    async def add_plan(self, plan: str, metadata: Optional[Dict] = None) -> ActionPlan:
+    async def add_plan(self, plan: str, metadata: Optional[Dict] = None, goal: str = "") -> ActionPlan:
         """新しいプランを追加"""
         plan_obj = ActionPlan(
+            goal=goal,
             plan=plan,
             metadata=metadata
         )
         self._plans.append(plan_obj)
+        if self._session:
+            self._session.record(RECORD_PLAN, plan_obj.model_dump(mode="json"))
         return plan_obj
 
+    def restore(self, records: List[Dict[str, Any]]) -> None:
+        """保存されていたプランを復元（ストアには記録し直さない）"""
+        for data in records:
+            self._plans.append(ActionPlan.model_validate(data))
+
     def get_plans(self) -> List[ActionPlan]:
         """全てのプランを取得"""
-        return self._plans
+        return list(self._plans)
+
+    def memory_bytes(self) -> int:
+        """メモリに置いているプランのおおよそのバイト数（ファイルに追い出した分は含まない）"""
+        return self._plans.hot_bytes
 
     def get_latest_plan(self) -> Optional[ActionPlan]:
         """最新のプランを取得"""
@@ -36,9 +125,120 @@ class ActionPlanManager:
         """特定のゴールに関連するプランを取得"""
         return [plan for plan in self._plans if plan.goal == goal]
 
+    def needs_prefetch(
+        self, goal: str, user_message_count: int, max_new_messages: int, result_count: Optional[int] = None
+    ) -> bool:
+        """ゴールのプランを（再）先読みする必要があるか"""
+        prefetched = self._prefetched.get(_goal_key(goal))
+        if prefetched is None:
+            return True
+        if result_count is not None and result_count != prefetched.result_count:
+            return True
+        if not prefetched.task.done():
+            return False
+        if prefetched.task.cancelled() or prefetched.task.exception() is not None:
+            return True
+        return not prefetched.is_fresh(user_message_count, max_new_messages)
+
+    def prefetch(
+        self, goal: str, user_message_count: int, generate: Awaitable[str], result_count: int = 0
+    ) -> PrefetchedPlan:
+        """ゴールのプラン生成をバックグラウンドで開始する
+
+        Args:
+            goal (str): 対象のゴール
+            user_message_count (int): 現在のユーザーメッセージ数
+            generate (Awaitable[str]): プランを生成するコルーチン
+            result_count (int): 現在の結果の数（生成中の要約を含む）
+        """
+        key = _goal_key(goal)
+        old = self._prefetched.get(key)
+        if old is not None and not old.task.done():
+            old.task.cancel()
+
+        task = asyncio.create_task(generate)
+        task.add_done_callback(self._on_prefetch_done)
+        prefetched = PrefetchedPlan(goal, user_message_count, task, result_count)
+        self._prefetched[key] = prefetched
+        self._count("started")
+        return prefetched
+
+    def _on_prefetch_done(self, task: asyncio.Task) -> None:
+        if task.cancelled():
+            return
+        self._count("failed" if task.exception() is not None else "ready")
+
+    async def take_prefetched(
+        self,
+        goal: str,
+        user_message_count: int,
+        max_new_messages: int,
+        result_count: Optional[int] = None,
+    ) -> Optional[str]:
+        """先読み済みのプランが新鮮であれば取り出す
+
+        生成中であれば完了を待って合流する。古くなったプランや生成に失敗したプランは破棄する。
+
+        Args:
+            goal (str): plan_action に渡されたゴール
+            user_message_count (int): 現在のユーザーメッセージ数
+            max_new_messages (int): 先読み後に許容するユーザーメッセージ数
+            result_count (Optional[int]): 現在の結果の数（生成中の要約を含む）. 先読み後に増えていれば使わない
+
+        Returns:
+            Optional[str]: 使えるプラン. 無ければNone
+        """
+        key = _goal_key(goal)
+        prefetched = self._prefetched.pop(key, None)
+        if prefetched is None:
+            self._count("missed")
+            return None
+
+        if not prefetched.is_fresh(user_message_count, max_new_messages, result_count):
+            prefetched.task.cancel()
+            self._count("stale")
+            return None
+
+        joined = not prefetched.task.done()
+        try:
+            plan = await prefetched.task
+        except (asyncio.CancelledError, Exception):
+            self._count("missed")
+            return None
+
+        self._count("joined" if joined else "used")
+        return plan
+
+    def discard_prefetched(self, goal: str) -> None:
+        """ゴールの先読みを使わずに破棄する（plan_action に先読みに無いコンテキストが渡された場合）"""
+        prefetched = self._prefetched.pop(_goal_key(goal), None)
+        if prefetched is None:
+            return
+        if not prefetched.task.done():
+            prefetched.task.cancel()
+        self._count("bypassed")
+
+    def cancel_prefetch(self) -> None:
+        """生成中の先読みをすべて取り消す"""
+        for prefetched in self._prefetched.values():
+            if not prefetched.task.done():
+                prefetched.task.cancel()
+        self._prefetched.clear()
+
+    def get_prefetch_stats(self) -> Dict[str, Any]:
+        """このルームでの先読みプランの利用状況を取得"""
+        return _with_hit_rate(dict(self._prefetch_stats))
+
+    def _count(self, key: str) -> None:
+        self._prefetch_stats[key] += 1
+        _prefetch_totals[key] += 1
+
+    def clear(self) -> None:
+        """プランを削除（追い出したファイルも消す）"""
+        self._plans.clear()
+
     def to_dict(self) -> Dict:
         """プラン一覧をdict形式で取得"""
         return {
             "plans": [plan.model_dump() for plan in self._plans]
         }
-
@@ -1,30 +1,90 @@
-from typing import List, Dict, Optional
+import asyncio
+import sys
+from typing import Any, List, Dict, Optional
 from datetime import datetime
 from pydantic import BaseModel, Field
 
+from ..core.bounded_history import BoundedHistory
+from ..core.custom_congif import HISTORY_HOT_WINDOW
+from ..core.session_store import RoomSession, RECORD_RESULT
+
+# 要約がまだ生成中のゴールをプロンプトに表示するときの結果
+PENDING_RESULT_PLACEHOLDER = "(summarizing in background ...)"
+
 class Result(BaseModel):
     """タスク実行結果を表すモデル"""
+    goal: str = Field(default="", description="結果に対応するゴール")
     summary: str = Field(..., description="実行結果の要約")
     timestamp: datetime = Field(default_factory=datetime.now, description="結果記録時のタイムスタンプ")
     metadata: Optional[Dict] = Field(default=None, description="追加のメタデータ")
 
 class ResultManager:
-    """タスク実行結果を管理するクラス"""
-    def __init__(self):
-        self._results: List[Result] = []
+    """タスク実行結果を管理するクラス
+
+    save_result はバックグラウンドで実行されることがあるため、実行中のタスクを
+    ゴールごとに保持する。結果を読む側は wait_for_pending() で合流してから読む。
+    """
+    def __init__(
+        self,
+        spill_path: Optional[str] = None,
+        max_in_memory: int = HISTORY_HOT_WINDOW,
+        session: Optional[RoomSession] = None,
+    ):
+        self._session = session
+        self._results: BoundedHistory[Result] = BoundedHistory(
+            spill_path, max_in_memory,
+            serialize=lambda result: result.model_dump(mode="json"),
+            deserialize=Result.model_validate,
+            sizeof=lambda result: sys.getsizeof(result.summary),
+        )
+        self._pending: Dict[str, asyncio.Task] = {}
 
-    async def add_result(self, summary: str, metadata: Optional[Dict] = None) -> Result:
+    async def add_result(self, summary: str, metadata: Optional[Dict] = None, goal: str = "") -> Result:
         """新しい結果を追加"""
         result_obj = Result(
+            goal=goal,
             summary=summary,
             metadata=metadata
         )
         self._results.append(result_obj)
+        if self._session:
+            self._session.record(RECORD_RESULT, result_obj.model_dump(mode="json"))
         return result_obj
 
+    def restore(self, records: List[Dict[str, Any]]) -> None:
+        """保存されていた結果を復元（ストアには記録し直さない）"""
+        for data in records:
+            self._results.append(Result.model_validate(data))
+
+    def track_pending(self, goal: str, task: asyncio.Task) -> None:
+        """バックグラウンドで実行中の save_result を登録する"""
+        self._pending[goal] = task
+        task.add_done_callback(lambda t: self._pending.pop(goal, None) if self._pending.get(goal) is t else None)
+
+    def has_pending(self) -> bool:
+        """生成中の結果があるか"""
+        return bool(self._pending)
+
+    def get_pending_goals(self) -> List[str]:
+        """要約が生成中のゴール一覧"""
+        return list(self._pending)
+
+    async def wait_for_pending(self) -> None:
+        """生成中の結果がすべて保存されるまで待つ"""
+        while self._pending:
+            await asyncio.gather(*list(self._pending.values()), return_exceptions=True)
+
+    def count_results(self, include_pending: bool = False) -> int:
+        """結果の数（include_pending の場合は生成中の要約も数える）"""
+        return len(self._results) + (len(self._pending) if include_pending else 0)
+
     def get_results(self) -> List[Result]:
         """全ての結果を取得"""
-        return self._results
+        return list(self._results)
+
+    def memory_bytes(self) -> int:
+        """メモリに置いている結果のおおよそのバイト数（ファイルに追い出した分は含まない）"""
+        return self._results.hot_bytes
 
     def get_latest_result(self) -> Optional[Result]:
         """最新の結果を取得"""
@@ -34,12 +94,23 @@ class ResultManager:
         """特定のゴールに関連する結果を取得"""
         return [result for result in self._results if result.goal == goal]
 
-    def get_goal_result_pairs(self) -> List[Dict[str, str]]:
-        """全てのゴールと結果のペアを取得"""
-        return [{"goal": r.goal, "result": r.summary} for r in self._results]
+    def get_goal_result_pairs(self, include_pending: bool = False) -> List[Dict[str, str]]:
+        """全てのゴールと結果のペアを取得
+
+        Args:
+            include_pending (bool): 生成中のゴールをプレースホルダ付きで含めるか
+        """
+        pairs = [{"goal": r.goal, "result": r.summary} for r in self._results]
+        if include_pending:
+            pairs.extend({"goal": goal, "result": PENDING_RESULT_PLACEHOLDER} for goal in self._pending)
+        return pairs
+
+    def clear(self) -> None:
+        """結果を削除（追い出したファイルも消す）"""
+        self._results.clear()
 
     def to_dict(self) -> Dict:
         """結果一覧をdict形式で取得"""
         return {
             "results": [result.model_dump() for result in self._results]
-        } 
\ No newline at end of file
+        }
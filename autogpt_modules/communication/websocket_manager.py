@@ -1,53 +1,127 @@
+import asyncio
+import heapq
 from datetime import datetime, timedelta
-from typing import Dict, Optional
+from typing import Any, Callable, Dict, List, Optional, Tuple
 
 from fastapi import WebSocket
 import logging
 
 from ..core.room import Room
+from .outbound_queue import merge_outbound_stats
+from .input_coalescer import merge_input_stats
+from ..core.session_store import SessionStore
 
 logger = logging.getLogger(__name__)
 
 class WebSocketManager:
-    def __init__(self, room_timeout: int = 30):
+    """ルームとWebSocket接続を管理するクラス
+
+    user_id -> ルームの索引で接続時のルーム検索を定数時間で行い、
+    有効期限のヒープを使ってバックグラウンドで期限切れのルームを破棄する。
+
+    Args:
+        room_timeout (int): 最後の操作からルームを破棄するまでの分数
+        sweep_interval (float): 期限切れのルームを確認する間隔（秒）
+        session_store (Optional[SessionStore]): ルームの状態の保存先. 指定した場合は再起動後も復元できる
+    """
+    def __init__(self, room_timeout: int = 30, sweep_interval: float = 60, session_store: Optional[SessionStore] = None):
+        self._session_store = session_store
         self._rooms: Dict[str, Room] = {}
         self._sockets: Dict[str, WebSocket] = {}
+        self._user_rooms: Dict[str, str] = {}
+        self._socket_rooms: Dict[Any, str] = {}
+        # (期限のタイムスタンプ, room_id) のヒープ。ルームの操作のたびには更新せず、取り出したときに最新の期限を確認する
+        self._expiry_heap: List[Tuple[float, str]] = []
         self._room_timeout = timedelta(minutes=room_timeout)
+        self._sweep_interval = sweep_interval
+        self._sweeper_task: Optional[asyncio.Task] = None
+        self._sweep_stats: Dict[str, Any] = {
+            "sweeps": 0,
+            "evicted_rooms": 0,
+            "cancelled_agent_tasks": 0,
+            "reclaimed_bytes_estimate": 0,
+            "last_sweep": None,
+        }
         logger.debug("WebSocketManager initialized")
 
     def get_or_create_room(self, user_id: str) -> Room:
         """ルームを取得または作成"""
         logger.debug(f"Attempting to get/create room for user_id: {user_id}")
-        logger.debug(f"Current rooms before get/create: {list(self._rooms.keys())}")
-        
+
         active_room = self._find_active_room(user_id)
         if active_room:
             logger.debug(f"Found active room: {active_room.id}")
             active_room.update_activity()
             return active_room
-        
-        room = Room(user_id)
+
+        room = Room(user_id, session_store=self._session_store)
         logger.debug(f"Created new room with ID: {room.id}")
+        self._register(room)
+        return room
+
+    def _register(self, room: Room) -> None:
         self._rooms[room.id] = room
-        logger.debug(f"Current rooms after creation: {list(self._rooms.keys())}")
+        self._user_rooms[room.user_id] = room.id
+        heapq.heappush(self._expiry_heap, (self._deadline(room), room.id))
+
+    async def restore_room(self, user_id: str) -> Optional[Room]:
+        """ストアからユーザーの有効期限内のルームを復元する
+
+        メモリ上にアクティブなルームがある場合はそれを返す。
+        """
+        active_room = self._find_active_room(user_id)
+        if active_room or self._session_store is None:
+            return active_room
+
+        meta = await self._session_store.find_latest_room(user_id)
+        if meta is None or datetime.now() - datetime.fromtimestamp(meta["last_active"]) > self._room_timeout:
+            return None
+        # 読み出している間に同じユーザーのルームが作られていればそちらを使う
+        active_room = self._find_active_room(user_id)
+        if active_room:
+            return active_room
+
+        room = await Room.restore(self._session_store, meta)
+        self._register(room)
+        logger.info(f"Restored room {room.id} for user_id: {user_id}")
         return room
 
+    async def restore_rooms(self, user_filter: Optional[Callable[[str], bool]] = None) -> int:
+        """起動時に、ストアにある有効期限内のルームをすべて復元する
+
+        Args:
+            user_filter (Optional[Callable[[str], bool]]): 復元するユーザーを絞り込む関数
+                （ワーカープロセスが自分の担当するユーザーだけを復元するときに使う）
+
+        Returns:
+            int: 復元したルーム数
+        """
+        if self._session_store is None:
+            return 0
+        active_since = (datetime.now() - self._room_timeout).timestamp()
+        restored = 0
+        for meta in await self._session_store.list_rooms(active_since=active_since):
+            if meta["room_id"] in self._rooms or meta["user_id"] in self._user_rooms:
+                continue
+            if user_filter is not None and not user_filter(meta["user_id"]):
+                continue
+            self._register(await Room.restore(self._session_store, meta))
+            restored += 1
+        if restored:
+            logger.info(f"Restored {restored} rooms from session store")
+        return restored
+
     def _find_active_room(self, user_id: str) -> Optional[Room]:
         """アクティブなルームを探す"""
-        current_time = datetime.now()
-        for room in self._rooms.values():
-            if (room.user_id == user_id and 
-                current_time - room.last_active <= self._room_timeout):
-                return room
+        room = self._rooms.get(self._user_rooms.get(user_id, ""))
+        if room and not self._is_expired(room, datetime.now()):
+            return room
         return None
 
     def get_room(self, room_id: str) -> Optional[Room]:
         """指定されたIDのルームを取得"""
-        logger.debug(f"Attempting to get room with ID: {room_id}")
-        logger.debug(f"Current rooms in manager: {list(self._rooms.keys())}")
         room = self._rooms.get(room_id)
         if room:
-            logger.debug(f"Found room: {room.id}")
             room.update_activity()
         else:
             logger.debug(f"Room not found for ID: {room_id}")
@@ -55,12 +129,13 @@ class WebSocketManager:
 
     def get_room_by_sid(self, sid: str) -> Optional[Room]:
         """SIDからルームを取得"""
-        socket = self._sockets.get(sid)
-        if socket:
-            for room in self._rooms.values():
-                if room.websocket == socket:
-                    return room
-        return None
+        return self._rooms.get(self._socket_rooms.get(sid, ""))
+
+    def _deadline(self, room: Room) -> float:
+        return (room.last_active + self._room_timeout).timestamp()
+
+    def _is_expired(self, room: Room, now: datetime) -> bool:
+        return now - room.last_active > self._room_timeout
 
     async def on_message(self, room_id: str, message: str):
         """メッセージ受信時の処理"""
@@ -68,27 +143,49 @@ class WebSocketManager:
         if room:
             await room.message_manager.add_message(message, "user")
 
-    async def send_message(self, room_id: str, message: str):
-        """ツールからの送信用メソッド"""
+    async def send_message(self, room_id: str, message: str) -> bool:
+        """ツールからの送信用メソッド
+
+        ルームの送信キューに積んで戻る（送信は書き込みタスクが行うため、遅いクライアントを待たない）。
+
+        Returns:
+            bool: キューに積んだ場合True
+        """
         room = self._rooms.get(room_id)
         if room and room.websocket:
-            await room.websocket.send_text(message)
-            print(f"####### sent message to room {room_id}: {message} #######")
+            queued = await room.outbound.put(message)
+            print(f"####### queued message to room {room_id}: {message} #######")
+            return queued
+        return False
 
     async def on_disconnect(self, room_id: str):
         """切断時の処理"""
-        if room_id in self._rooms:
-            del self._rooms[room_id]
+        room = self._remove_room(room_id)
+        if room:
+            room.discard()
+
+    def _remove_room(self, room_id: str) -> Optional[Room]:
+        """ルームと索引を削除する（ヒープの要素は取り出したときに捨てる）"""
+        room = self._rooms.pop(room_id, None)
+        if room is None:
+            return None
+        if self._user_rooms.get(room.user_id) == room_id:
+            del self._user_rooms[room.user_id]
+        for sid in [sid for sid, rid in self._socket_rooms.items() if rid == room_id]:
+            del self._socket_rooms[sid]
+            self._sockets.pop(sid, None)
+        return room
 
     async def connect(self, websocket: WebSocket, user_id: str):
         """WebSocket接続時の処理"""
         logger.debug(f"Connecting WebSocket for user_id: {user_id}")
         await websocket.accept()
-        room = self.get_or_create_room(user_id)
+        room = await self.restore_room(user_id) or self.get_or_create_room(user_id)
+        room.update_activity()
         logger.debug(f"Room for connection: {room.id}")
         room.websocket = websocket
         self._sockets[websocket.client.port] = websocket
-        logger.debug(f"WebSocket connected, current rooms: {list(self._rooms.keys())}")
+        self._socket_rooms[websocket.client.port] = room.id
         return room
 
     async def disconnect(self, websocket: WebSocket):
@@ -98,14 +195,108 @@ class WebSocketManager:
             room = self.get_room_by_sid(sid)
             if room:
                 await self.on_disconnect(room.id)
-            del self._sockets[sid]
+            self._sockets.pop(sid, None)
+            self._socket_rooms.pop(sid, None)
+
+    def detach(self, websocket: WebSocket) -> None:
+        """接続が切れたソケットをルームから外す
+
+        ルームは残しておき、有効期限内に再接続すれば同じルームを使う。
+        期限を過ぎたルームはスイーパーが破棄する。
+        """
+        sid = websocket.client.port
+        room = self.get_room_by_sid(sid)
+        if room and room.websocket is websocket:
+            room.websocket = None
+            room.update_activity()
+            room.save()
+        self._sockets.pop(sid, None)
+        self._socket_rooms.pop(sid, None)
+
+    def sweep_expired(self) -> Dict[str, int]:
+        """期限切れのルームを破棄する
+
+        接続中のルームは期限を延長する。破棄するルームのエージェントのタスクは取り消す。
+
+        Returns:
+            Dict[str, int]: 今回の破棄数と、解放したおおよそのバイト数
+        """
+        now = datetime.now()
+        now_ts = now.timestamp()
+        evicted, cancelled, reclaimed = 0, 0, 0
+
+        while self._expiry_heap and self._expiry_heap[0][0] <= now_ts:
+            _, room_id = heapq.heappop(self._expiry_heap)
+            room = self._rooms.get(room_id)
+            if room is None:
+                continue
+            if room.websocket is not None:
+                room.update_activity()
+            if not self._is_expired(room, now) or room.websocket is not None:
+                heapq.heappush(self._expiry_heap, (self._deadline(room), room_id))
+                continue
+
+            if room.agent_task is not None and not room.agent_task.done():
+                cancelled += 1
+            reclaimed += room.estimate_memory()
+            room.discard()
+            self._remove_room(room_id)
+            evicted += 1
+
+        self._sweep_stats["sweeps"] += 1
+        self._sweep_stats["evicted_rooms"] += evicted
+        self._sweep_stats["cancelled_agent_tasks"] += cancelled
+        self._sweep_stats["reclaimed_bytes_estimate"] += reclaimed
+        self._sweep_stats["last_sweep"] = now.isoformat()
+        if evicted:
+            logger.info(f"Evicted {evicted} expired rooms (cancelled agents: {cancelled}, ~{reclaimed} bytes)")
+        return {"evicted_rooms": evicted, "cancelled_agent_tasks": cancelled, "reclaimed_bytes_estimate": reclaimed}
+
+    async def _run_sweeper(self) -> None:
+        while True:
+            await asyncio.sleep(self._sweep_interval)
+            try:
+                self.sweep_expired()
+            except Exception as e:
+                logger.error(f"Room sweep failed: {e}")
+
+    def start_sweeper(self) -> None:
+        """期限切れのルームを定期的に破棄するタスクを開始する"""
+        if self._sweeper_task is None or self._sweeper_task.done():
+            self._sweeper_task = asyncio.create_task(self._run_sweeper())
+
+    async def stop_sweeper(self) -> None:
+        """スイーパーのタスクを止める"""
+        if self._sweeper_task is not None:
+            self._sweeper_task.cancel()
+            await asyncio.gather(self._sweeper_task, return_exceptions=True)
+            self._sweeper_task = None
+
+    def stats(self) -> Dict[str, Any]:
+        """ルーム数と破棄の累計を取得"""
+        return {
+            "rooms": len(self._rooms),
+            "users": len(self._user_rooms),
+            "connected": sum(1 for room in self._rooms.values() if room.websocket is not None),
+            **self._sweep_stats,
+        }
+
+    def outbound_stats(self) -> Dict[str, Any]:
+        """全ルームの送信キューの深さと送信遅延を集計"""
+        return merge_outbound_stats(room.outbound.stats() for room in list(self._rooms.values()))
+
+    def input_stats(self) -> Dict[str, Any]:
+        """全ルームの連投のまとめ状況を集計"""
+        return merge_input_stats(room.input_coalescer.stats() for room in list(self._rooms.values()))
 
     def cleanup_inactive_rooms(self):
         """非アクティブなルームを削除する"""
         current_time = datetime.now()
         inactive_rooms = [
             room_id for room_id, room in self._rooms.items()
-            if current_time - room.last_active > self._room_timeout
+            if self._is_expired(room, current_time)
         ]
         for room_id in inactive_rooms:
-            del self._rooms[room_id]
\ No newline at end of file
+            room = self._remove_room(room_id)
+            if room:
+                room.discard()
@@ -0,0 +1,501 @@
+import asyncio
+import bisect
+import hashlib
+import itertools
+import logging
+import multiprocessing
+import queue
+import threading
+from types import SimpleNamespace
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+from fastapi import WebSocket, WebSocketDisconnect
+
+logger = logging.getLogger(__name__)
+
+# ゲートウェイ -> ワーカーのフレーム
+FRAME_OPEN = "open"              # (FRAME_OPEN, conn_id, user_id, headers, query_params)
+FRAME_MESSAGE = "message"        # (FRAME_MESSAGE, conn_id, text)
+FRAME_DISCONNECT = "disconnect"  # (FRAME_DISCONNECT, conn_id, code)
+FRAME_METRICS = "metrics"        # (FRAME_METRICS, request_id)
+FRAME_STOP = "stop"              # (FRAME_STOP,)
+# ワーカー -> ゲートウェイのフレーム
+FRAME_SEND = "send"              # (FRAME_SEND, conn_id, text)
+FRAME_CLOSE = "close"            # (FRAME_CLOSE, conn_id)
+FRAME_METRICS_REPLY = "metrics_reply"  # (FRAME_METRICS_REPLY, request_id, worker_index, metrics)
+
+
+class HashRing:
+    """ユーザーIDをワーカーに割り当てるコンシステントハッシュ
+
+    同じユーザーは常に同じワーカーに割り当てられるため、ルームの状態はそのワーカーだけが持つ。
+    ワーカー数を変えても、移動するユーザーは全体の 1/ワーカー数 程度に収まる。
+
+    Args:
+        nodes (Iterable[int]): ワーカー番号
+        replicas (int): 1ワーカーあたりの仮想ノード数（多いほど偏りが小さい）
+    """
+    def __init__(self, nodes: Iterable[int], replicas: int = 100):
+        self._ring: List[Tuple[int, int]] = sorted(
+            (self._hash(f"{node}:{i}"), node) for node in nodes for i in range(replicas)
+        )
+        if not self._ring:
+            raise ValueError("HashRing needs at least one node")
+        self._keys = [key for key, _ in self._ring]
+
+    @staticmethod
+    def _hash(key: str) -> int:
+        return int.from_bytes(hashlib.md5(key.encode("utf-8")).digest()[:8], "big")
+
+    def node_for(self, key: str) -> int:
+        """キーを担当するワーカー番号"""
+        index = bisect.bisect(self._keys, self._hash(key)) % len(self._ring)
+        return self._ring[index][1]
+
+
+class RemoteWebSocket:
+    """ワーカー側で、ゲートウェイが持つ WebSocket の代わりになるオブジェクト
+
+    main の websocket_endpoint が使う accept / receive_text / send_text / client.port だけを持つ。
+    受信したテキストはゲートウェイから feed() で渡され、送信したテキストはゲートウェイへのキューに積む。
+
+    Args:
+        conn_id (int): ゲートウェイが割り当てた接続ID（WebSocketManager では client.port として使う）
+        outbox: ゲートウェイへのキュー
+        headers (Optional[Dict[str, str]]): 接続時のヘッダー
+        query_params (Optional[Dict[str, str]]): 接続時のクエリパラメータ
+    """
+    def __init__(self, conn_id: int, outbox: Any, headers: Optional[Dict[str, str]] = None, query_params: Optional[Dict[str, str]] = None):
+        self.conn_id = conn_id
+        self.client = SimpleNamespace(host="gateway", port=conn_id)
+        self.headers = headers or {}
+        self.query_params = query_params or {}
+        self._outbox = outbox
+        self._inbox: asyncio.Queue = asyncio.Queue()
+        self._closed = False
+
+    async def accept(self) -> None:
+        """ゲートウェイで受け付け済みのため何もしない"""
+
+    def feed(self, text: str) -> None:
+        """ゲートウェイから届いたテキストを受信する"""
+        self._inbox.put_nowait(text)
+
+    def feed_disconnect(self, code: int = 1000) -> None:
+        """ゲートウェイで接続が切れたことを受け取る"""
+        self._inbox.put_nowait(WebSocketDisconnect(code=code))
+
+    async def receive_text(self) -> str:
+        item = await self._inbox.get()
+        if isinstance(item, WebSocketDisconnect):
+            self._closed = True
+            raise item
+        return item
+
+    async def send_text(self, text: str) -> None:
+        if self._closed:
+            raise RuntimeError("WebSocket is closed")
+        self._outbox.put((FRAME_SEND, self.conn_id, text))
+
+    async def close(self, code: int = 1000) -> None:
+        if not self._closed:
+            self._closed = True
+            self._outbox.put((FRAME_CLOSE, self.conn_id))
+
+
+async def serve_worker(
+    index: int,
+    inbox: Any,
+    outbox: Any,
+    handler: Callable[[Any, str], Awaitable[Any]],
+    collect_metrics: Optional[Callable[[], Awaitable[Dict[str, Any]]]] = None,
+) -> None:
+    """ワーカーのイベントループでゲートウェイからのフレームを処理する
+
+    接続ごとに RemoteWebSocket を作り、handler(websocket, user_id) をタスクとして実行する。
+    FRAME_STOP を受け取るまで続ける。
+
+    Args:
+        index (int): ワーカー番号
+        inbox: ゲートウェイからのキュー
+        outbox: ゲートウェイへのキュー
+        handler (Callable): 1接続を処理するコルーチン関数（main の websocket_endpoint）
+        collect_metrics (Optional[Callable]): ワーカーの /metrics を返すコルーチン関数
+    """
+    sockets: Dict[int, RemoteWebSocket] = {}
+    tasks: Dict[int, asyncio.Task] = {}
+
+    async def run_session(websocket: RemoteWebSocket, user_id: str) -> None:
+        try:
+            await handler(websocket, user_id)
+        except Exception as e:
+            logger.error(f"Worker {index}: session for {user_id} failed: {e}")
+        finally:
+            sockets.pop(websocket.conn_id, None)
+            tasks.pop(websocket.conn_id, None)
+            # ワーカー側でセッションが終わったらゲートウェイのソケットも閉じる
+            await websocket.close()
+
+    async def reply_metrics(request_id: int) -> None:
+        metrics = await collect_metrics() if collect_metrics else {}
+        outbox.put((FRAME_METRICS_REPLY, request_id, index, metrics))
+
+    logger.info(f"Agent worker {index} started")
+    while True:
+        # multiprocessing のキューはブロッキングのため、受信だけ別スレッドで待つ
+        frame = await asyncio.to_thread(inbox.get)
+        kind = frame[0]
+        if kind == FRAME_STOP:
+            break
+        if kind == FRAME_OPEN:
+            _, conn_id, user_id, headers, query_params = frame
+            websocket = RemoteWebSocket(conn_id, outbox, headers, query_params)
+            sockets[conn_id] = websocket
+            tasks[conn_id] = asyncio.create_task(run_session(websocket, user_id))
+        elif kind == FRAME_MESSAGE:
+            websocket = sockets.get(frame[1])
+            if websocket is not None:
+                websocket.feed(frame[2])
+        elif kind == FRAME_DISCONNECT:
+            websocket = sockets.get(frame[1])
+            if websocket is not None:
+                websocket.feed_disconnect(frame[2])
+        elif kind == FRAME_METRICS:
+            asyncio.create_task(reply_metrics(frame[1]))
+
+    for task in list(tasks.values()):
+        task.cancel()
+    await asyncio.gather(*tasks.values(), return_exceptions=True)
+    logger.info(f"Agent worker {index} stopped")
+
+
+class _GatewayConnection:
+    """ゲートウェイ側の1接続. ワーカーからの送信を順番どおりに書き込む"""
+    def __init__(self, conn_id: int, websocket: WebSocket, worker: int):
+        self.conn_id = conn_id
+        self.websocket = websocket
+        self.worker = worker
+        self.outgoing: asyncio.Queue = asyncio.Queue()
+        self.writer: Optional[asyncio.Task] = None
+
+    async def write_loop(self) -> None:
+        while True:
+            item = await self.outgoing.get()
+            try:
+                if item is None:
+                    await self.websocket.close()
+                    return
+                await self.websocket.send_text(item)
+            except Exception as e:
+                logger.debug(f"Gateway connection {self.conn_id} write failed: {e}")
+                return
+
+
+class WorkerPool:
+    """ゲートウェイプロセスから、エージェントを動かすワーカープロセスを管理する
+
+    ゲートウェイは WebSocket の送受信だけを行い、受信したテキストはJSONとして解釈せずに
+    担当のワーカーへ転送する。プロンプトの組み立てやLLMの呼び出しはワーカーで行うため、
+    あるルームのCPU処理が他のワーカーのルームの送受信を遅らせない。
+    ユーザーは HashRing で常に同じワーカーに割り当てる。
+    止まったワーカーは接続の受け付け・転送のときに見つけ、担当の接続を閉じてから起動し直す
+    （クライアントは再接続すれば、新しいワーカーが保存済みのルームを復元する）。
+
+    Args:
+        num_workers (int): ワーカープロセス数
+        worker_target (Callable): ワーカープロセスで実行する関数 (index, num_workers, inbox, outbox).
+            spawn で起動するためモジュールのトップレベルの関数であること
+        start_method (str): multiprocessing の起動方法
+    """
+    def __init__(self, num_workers: int, worker_target: Callable[..., Any], start_method: str = "spawn"):
+        if num_workers < 1:
+            raise ValueError("num_workers must be at least 1")
+        self.num_workers = num_workers
+        self._target = worker_target
+        self._ctx = multiprocessing.get_context(start_method)
+        self._ring = HashRing(range(num_workers))
+        self._inboxes: List[Any] = []
+        self._outbox: Any = None
+        # multiprocessing.Process または threading.Thread
+        self._workers: List[Any] = []
+        self._pump: Optional[threading.Thread] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._connections: Dict[int, _GatewayConnection] = {}
+        self._conn_ids = itertools.count(1)
+        self._request_ids = itertools.count(1)
+        self._metrics_requests: Dict[int, Tuple[asyncio.Future, Dict[int, Any]]] = {}
+        self._stopping = False
+        self._stats: Dict[str, int] = {
+            "connections": 0, "frames_in": 0, "frames_out": 0, "restarted_workers": 0, "dropped_connections": 0,
+        }
+
+    def worker_for(self, user_id: str) -> int:
+        """ユーザーを担当するワーカー番号"""
+        return self._ring.node_for(user_id)
+
+    def start(self) -> None:
+        """ワーカープロセスと、ワーカーからの送信を受け取るスレッドを起動する"""
+        self._loop = asyncio.get_running_loop()
+        self._outbox = self._ctx.Queue()
+        for index in range(self.num_workers):
+            inbox = self._ctx.Queue()
+            self._inboxes.append(inbox)
+            self._workers.append(self._spawn(index, inbox))
+        self._pump = threading.Thread(target=self._pump_outbox, name="gateway-outbox", daemon=True)
+        self._pump.start()
+        logger.info(f"Started {self.num_workers} agent workers")
+
+    def _spawn(self, index: int, inbox: Any) -> Any:
+        process = self._ctx.Process(
+            target=self._target,
+            args=(index, self.num_workers, inbox, self._outbox),
+            name=f"agent-worker-{index}",
+            daemon=True,
+        )
+        process.start()
+        return process
+
+    def _new_inbox(self) -> Any:
+        return self._ctx.Queue()
+
+    def _ensure_alive(self, index: int) -> bool:
+        """ワーカーが止まっていれば担当の接続を閉じて起動し直す
+
+        Returns:
+            bool: ワーカーが動いていたか（False なら担当の接続は閉じた）
+        """
+        if self._workers[index].is_alive() or self._stopping:
+            return True
+        logger.error(f"{self._workers[index].name} is not alive; closing its connections and restarting it")
+        for conn_id, connection in list(self._connections.items()):
+            if connection.worker == index:
+                del self._connections[conn_id]
+                # 書き込み待ちの送信を流したあとでソケットを閉じる（serve の受信ループもそれで終わる）
+                connection.outgoing.put_nowait(None)
+                self._stats["dropped_connections"] += 1
+        # 止まったワーカー宛てに積まれたフレームは捨てる
+        self._inboxes[index] = self._new_inbox()
+        self._workers[index] = self._spawn(index, self._inboxes[index])
+        self._stats["restarted_workers"] += 1
+        return False
+
+    def _pump_outbox(self) -> None:
+        """ワーカーからのフレームをイベントループに渡す（別スレッド）"""
+        while True:
+            frame = self._outbox.get()
+            if frame is None:
+                return
+            self._loop.call_soon_threadsafe(self._dispatch, frame)
+
+    def _dispatch(self, frame: Tuple[Any, ...]) -> None:
+        kind = frame[0]
+        if kind == FRAME_METRICS_REPLY:
+            _, request_id, index, metrics = frame
+            request = self._metrics_requests.get(request_id)
+            if request is not None:
+                future, replies = request
+                replies[index] = metrics
+                if len(replies) == self.num_workers and not future.done():
+                    future.set_result(replies)
+            return
+
+        connection = self._connections.get(frame[1])
+        if connection is None:
+            return
+        if kind == FRAME_SEND:
+            self._stats["frames_out"] += 1
+            connection.outgoing.put_nowait(frame[2])
+        elif kind == FRAME_CLOSE:
+            connection.outgoing.put_nowait(None)
+
+    def open(self, websocket: WebSocket, user_id: str) -> int:
+        """受け付けた WebSocket を担当のワーカーに登録する
+
+        Returns:
+            int: 接続ID
+        """
+        conn_id = next(self._conn_ids)
+        worker = self.worker_for(user_id)
+        self._ensure_alive(worker)
+        connection = _GatewayConnection(conn_id, websocket, worker)
+        connection.writer = asyncio.create_task(connection.write_loop())
+        self._connections[conn_id] = connection
+        self._stats["connections"] += 1
+        self._inboxes[worker].put((
+            FRAME_OPEN, conn_id, user_id,
+            dict(getattr(websocket, "headers", {}) or {}),
+            dict(getattr(websocket, "query_params", {}) or {}),
+        ))
+        return conn_id
+
+    def forward(self, conn_id: int, text: str) -> None:
+        """受信したテキストを担当のワーカーへ転送する"""
+        connection = self._connections.get(conn_id)
+        if connection is None or not self._ensure_alive(connection.worker):
+            return
+        self._stats["frames_in"] += 1
+        self._inboxes[connection.worker].put((FRAME_MESSAGE, conn_id, text))
+
+    def disconnect(self, conn_id: int, code: int = 1000) -> None:
+        """接続が切れたことをワーカーに伝える"""
+        connection = self._connections.pop(conn_id, None)
+        if connection is None:
+            return
+        if connection.writer is not None:
+            connection.writer.cancel()
+        self._inboxes[connection.worker].put((FRAME_DISCONNECT, conn_id, code))
+
+    async def serve(self, websocket: WebSocket, user_id: str) -> None:
+        """1つの WebSocket の受信を担当のワーカーへ転送し続ける"""
+        await websocket.accept()
+        conn_id = self.open(websocket, user_id)
+        code = 1000
+        try:
+            while True:
+                self.forward(conn_id, await websocket.receive_text())
+        except WebSocketDisconnect as e:
+            code = e.code
+        except RuntimeError:
+            # ワーカーの指示でゲートウェイがソケットを閉じた場合
+            pass
+        finally:
+            self.disconnect(conn_id, code)
+
+    async def collect_metrics(self, timeout: float = 2.0) -> Dict[int, Any]:
+        """全ワーカーの /metrics を集める（応答しなかったワーカーは含まない）"""
+        request_id = next(self._request_ids)
+        future = self._loop.create_future()
+        replies: Dict[int, Any] = {}
+        self._metrics_requests[request_id] = (future, replies)
+        for inbox in self._inboxes:
+            inbox.put((FRAME_METRICS, request_id))
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout=timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Only {len(replies)}/{self.num_workers} workers replied to metrics")
+        finally:
+            self._metrics_requests.pop(request_id, None)
+        return dict(replies)
+
+    async def stop(self, timeout: float = 5.0) -> None:
+        """ワーカーを止める（時間内に止まらないワーカーは強制終了する）"""
+        self._stopping = True
+        for inbox in self._inboxes:
+            inbox.put((FRAME_STOP,))
+        await self._join_workers(timeout)
+        for connection in self._connections.values():
+            if connection.writer is not None:
+                connection.writer.cancel()
+        self._connections.clear()
+
+    async def _join_workers(self, timeout: float) -> None:
+        for process in self._workers:
+            await asyncio.to_thread(process.join, timeout)
+            if process.is_alive():
+                process.terminate()
+        if self._outbox is not None:
+            self._outbox.put(None)
+
+    def stats(self) -> Dict[str, Any]:
+        """ゲートウェイの接続数と転送したフレーム数"""
+        per_worker = [0] * self.num_workers
+        for connection in self._connections.values():
+            per_worker[connection.worker] += 1
+        return {
+            "workers": self.num_workers,
+            "alive_workers": sum(1 for worker in self._workers if worker.is_alive()),
+            "open_connections": len(self._connections),
+            "connections_per_worker": per_worker,
+            **self._stats,
+        }
+
+
+class _LoopOutbox:
+    """シャードのスレッドから、ゲートウェイのイベントループへフレームを直接渡すキュー"""
+    def __init__(self, loop: asyncio.AbstractEventLoop, dispatch: Callable[[Tuple[Any, ...]], None]):
+        self._loop = loop
+        self._dispatch = dispatch
+
+    def put(self, frame: Tuple[Any, ...]) -> None:
+        self._loop.call_soon_threadsafe(self._dispatch, frame)
+
+
+class LoopShardPool(WorkerPool):
+    """1つのプロセス内で、ルームを複数のイベントループ（スレッド）に分けて動かす
+
+    WorkerPool と同じくゲートウェイのイベントループは WebSocket の送受信だけを行い、
+    ルームの状態・エージェントのタスク・ツールは担当シャードのイベントループだけで扱う。
+    ループをまたぐのはソケットとの受け渡しだけになる。
+    複数プロセスを使えない環境向けで、GILがあるためCPU処理の合計の速さは変わらないが、
+    あるシャードの重いプロンプト構築やJSON処理が他のシャードのルームの応答を止めなくなる。
+
+    Args:
+        num_shards (int): シャード（スレッド）数
+        shard_target (Callable): シャードのスレッドで実行する関数 (index, num_shards, inbox, outbox)
+    """
+    def __init__(self, num_shards: int, shard_target: Callable[..., Any]):
+        super().__init__(num_shards, shard_target)
+
+    def start(self) -> None:
+        """シャードのスレッドを起動する"""
+        self._loop = asyncio.get_running_loop()
+        self._outbox = _LoopOutbox(self._loop, self._dispatch)
+        for index in range(self.num_workers):
+            inbox = self._new_inbox()
+            self._inboxes.append(inbox)
+            self._workers.append(self._spawn(index, inbox))
+        logger.info(f"Started {self.num_workers} agent loop shards")
+
+    def _spawn(self, index: int, inbox: Any) -> threading.Thread:
+        thread = threading.Thread(
+            target=self._target,
+            args=(index, self.num_workers, inbox, self._outbox),
+            name=f"agent-shard-{index}",
+            daemon=True,
+        )
+        thread.start()
+        return thread
+
+    def _new_inbox(self) -> queue.Queue:
+        return queue.Queue()
+
+    async def _join_workers(self, timeout: float) -> None:
+        for thread in self._workers:
+            await asyncio.to_thread(thread.join, timeout)
+            if thread.is_alive():
+                logger.warning(f"{thread.name} did not stop within {timeout}s")
+
+
+def run_worker(
+    index: int,
+    num_workers: int,
+    inbox: Any,
+    outbox: Any,
+    handler: Callable[[Any, str], Awaitable[Any]],
+    on_start: Optional[Callable[[Callable[[str], bool]], Awaitable[Any]]] = None,
+    on_stop: Optional[Callable[[], Awaitable[Any]]] = None,
+    collect_metrics: Optional[Callable[[], Awaitable[Dict[str, Any]]]] = None,
+) -> None:
+    """ワーカー（プロセスまたはシャードのスレッド）の本体. 自分のイベントループで serve_worker を実行する
+
+    on_start には「このワーカーが担当するユーザーか」を判定する関数を渡すため、
+    再起動時のルームの復元を担当分だけに絞れる。
+    """
+    ring = HashRing(range(num_workers))
+
+    def owns(user_id: str) -> bool:
+        return ring.node_for(user_id) == index
+
+    async def main() -> None:
+        if on_start:
+            await on_start(owns)
+        try:
+            await serve_worker(index, inbox, outbox, handler, collect_metrics)
+        finally:
+            if on_stop:
+                await on_stop()
+
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
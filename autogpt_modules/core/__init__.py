@@ -1,10 +1,31 @@
-from .auto_gpt import AutoGPT
+from .auto_gpt import AutoGPT, DecisionPreempted, get_preemption_stats
 from .autogpt_prompt import AutoGPTPrompt
-from .event_manager import Event, EventManager
+from .event_manager import Event, EventCursor, EventManager
+from .bounded_history import BoundedHistory
+from .hibernation import HibernationScheduler
+from .admission import AdmissionController
+from .warmup import StartupWarmup
+from .session_store import (
+    SessionStore,
+    InMemorySessionStore,
+    SQLiteSessionStore,
+    create_session_store
+)
 
 __all__ = [
+    "AdmissionController",
     "AutoGPT",
+    "DecisionPreempted",
     "AutoGPTPrompt",
+    "BoundedHistory",
     "Event",
-    "EventManager"
+    "EventCursor",
+    "EventManager",
+    "HibernationScheduler",
+    "SessionStore",
+    "InMemorySessionStore",
+    "SQLiteSessionStore",
+    "StartupWarmup",
+    "create_session_store",
+    "get_preemption_stats"
 ]
\ No newline at end of file
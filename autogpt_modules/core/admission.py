@@ -0,0 +1,239 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict, deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional, Set
+
+from .custom_congif import MAX_ACTIVE_HEARINGS, ADMISSION_MAX_LLM_QUEUE, ADMISSION_RECHECK_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# セッションの所要時間の移動平均の重み（待ち時間の見積もりに使う）
+_DURATION_SMOOTHING = 0.2
+# 待ち時間の集計に使う直近の件数
+_WAIT_SAMPLES = 1000
+# 終了を待っているセッションの開始時刻を覚えておく上限（終了を見届けられずに削除されたルームの分を溜め込まない）
+_MAX_OPEN_SESSIONS = 10000
+
+# (順番, 開始までの見積もり秒数) を受け取って、待っているクライアントに通知する関数. 開始するときは順番 0 で呼ぶ
+QueueNotifier = Callable[[int, Optional[float]], Awaitable[Any]]
+
+
+class AdmissionController:
+    """新しいヒアリングの開始を、処理能力に空きがあるときだけ許可するクラス
+
+    実行中のセッションが max_active 件に達しているか、LLMの待ち行列（queue_depth()）が
+    max_llm_queue 件以上ある場合、新しいセッションは到着順の待ち行列に並べ、順番と開始までの
+    見積もり時間を notify で知らせる。実行中のセッションの応答速度を保つため、空きができるまで開始しない。
+
+    休止中（hibernating）のエージェントは枠を使わない。休止から起こすときや、再接続・再起動で
+    途中から再開するときは、既に始まっているセッションなので待たせずに admit_now() で枠を取る
+    （そのため実行中の数が一時的に max_active を超えることがある）。
+    待ち時間の見積もりに使うセッションの所要時間は、最初に枠を取ってから finish() まで
+    （休止をはさむ場合は全区間）で測る。
+
+    Args:
+        max_active (int): 同時に実行するセッション数の上限. 0 の場合は無制限
+        max_llm_queue (int): LLMの待ち行列がこの件数以上の間は新しいセッションを開始しない. 0 の場合は見ない
+        queue_depth (Optional[Callable[[], int]]): 現在のLLMの待ち行列の長さを返す関数
+        recheck_seconds (float): LLMの待ち行列のために待たせている間、開始できるかを確認し直す間隔
+    """
+    def __init__(
+        self,
+        max_active: int = MAX_ACTIVE_HEARINGS,
+        max_llm_queue: int = ADMISSION_MAX_LLM_QUEUE,
+        queue_depth: Optional[Callable[[], int]] = None,
+        recheck_seconds: float = ADMISSION_RECHECK_SECONDS,
+    ):
+        self.max_active = max_active
+        self.max_llm_queue = max_llm_queue
+        self._queue_depth = queue_depth
+        self.recheck_seconds = recheck_seconds
+        # room_id -> 枠を取った時刻
+        self._active: Dict[str, float] = {}
+        # room_id -> セッションが最初に枠を取った時刻（休止して枠を返しても、終了するまで残す）
+        self._sessions: Dict[str, float] = {}
+        # room_id -> 開始を待つFuture・通知する関数・並んだ時刻・最後に通知した順番（到着順）
+        self._waiting: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._avg_duration: Optional[float] = None
+        self._recheck: Optional[asyncio.TimerHandle] = None
+        self._notify_tasks: Set[asyncio.Task] = set()
+        self._waits: Deque[float] = deque(maxlen=_WAIT_SAMPLES)
+        self._stats: Dict[str, int] = {
+            "admitted": 0,
+            "admitted_immediately": 0,
+            "queued": 0,
+            "cancelled": 0,
+        }
+
+    def _has_capacity(self) -> bool:
+        if self.max_active > 0 and len(self._active) >= self.max_active:
+            return False
+        return not (self.max_llm_queue > 0 and self._llm_queue_depth() >= self.max_llm_queue)
+
+    def _llm_queue_depth(self) -> int:
+        return self._queue_depth() if self._queue_depth is not None else 0
+
+    def is_active(self, room_id: str) -> bool:
+        return room_id in self._active
+
+    def is_queued(self, room_id: str) -> bool:
+        return room_id in self._waiting
+
+    async def admit(self, room_id: str, notify: Optional[QueueNotifier] = None) -> bool:
+        """セッションを開始できるまで待つ
+
+        Args:
+            room_id (str): ルームID
+            notify (Optional[QueueNotifier]): 待っている間、順番が変わるたびに呼ぶ関数
+
+        Returns:
+            bool: 開始できた場合True. 待っている間に cancel() された場合False
+        """
+        if room_id in self._active:
+            return True
+        if not self._waiting and self._has_capacity():
+            self._start(room_id)
+            self._stats["admitted_immediately"] += 1
+            return True
+
+        future = asyncio.get_running_loop().create_future()
+        self._waiting[room_id] = {"future": future, "notify": notify, "queued_at": time.monotonic(), "position": None}
+        self._stats["queued"] += 1
+        logger.info(f"Queued session for room {room_id} (position {len(self._waiting)}, active {len(self._active)})")
+        self._notify_positions()
+        self._schedule_recheck()
+        try:
+            return await future
+        except asyncio.CancelledError:
+            # 枠を渡された直後に取り消された場合は、その枠を返す
+            if not self.cancel(room_id) and future.done() and future.result():
+                self.release(room_id)
+            raise
+
+    def admit_now(self, room_id: str) -> None:
+        """待たせずに枠を取る（既に始まっているセッションを再開する場合）"""
+        entry = self._waiting.pop(room_id, None)
+        if room_id not in self._active:
+            self._start(room_id)
+        if entry is not None:
+            if not entry["future"].done():
+                entry["future"].set_result(True)
+            self._notify_positions()
+
+    def _start(self, room_id: str) -> None:
+        now = time.monotonic()
+        self._active[room_id] = now
+        if room_id not in self._sessions:
+            if len(self._sessions) >= _MAX_OPEN_SESSIONS:
+                # 最も古いセッションから捨てる
+                self._sessions.pop(next(iter(self._sessions)))
+            self._sessions[room_id] = now
+        self._stats["admitted"] += 1
+
+    def release(self, room_id: str, finished: bool = True) -> None:
+        """セッションの枠を返し、待っているセッションを開始する
+
+        Args:
+            room_id (str): ルームID
+            finished (bool): セッションが終わった（完了・中止）場合True.
+                休止や切断で一時的に枠を返し、後で再開する場合False
+        """
+        if finished:
+            self.finish(room_id)
+        if self._active.pop(room_id, None) is None:
+            return
+        self._pump()
+
+    def finish(self, room_id: str) -> None:
+        """セッションの終了を記録し、最初に枠を取ってからの所要時間を平均に加える"""
+        started_at = self._sessions.pop(room_id, None)
+        if started_at is None:
+            return
+        duration = time.monotonic() - started_at
+        if self._avg_duration is None:
+            self._avg_duration = duration
+        else:
+            self._avg_duration += _DURATION_SMOOTHING * (duration - self._avg_duration)
+
+    def forget(self, room_id: str) -> None:
+        """終了を見届けられなかったセッション（休止中に削除されたルームなど）を所要時間に数えずに捨てる"""
+        self._sessions.pop(room_id, None)
+
+    def cancel(self, room_id: str) -> bool:
+        """待ち行列から外す（開始前に切断・終了した場合）"""
+        entry = self._waiting.pop(room_id, None)
+        if entry is None:
+            return False
+        self._stats["cancelled"] += 1
+        if not entry["future"].done():
+            entry["future"].set_result(False)
+        self._notify_positions()
+        return True
+
+    def _pump(self) -> None:
+        """空きがある間、待ち行列の先頭から開始させる"""
+        while self._waiting and self._has_capacity():
+            room_id, entry = self._waiting.popitem(last=False)
+            self._start(room_id)
+            self._waits.append(time.monotonic() - entry["queued_at"])
+            if not entry["future"].done():
+                entry["future"].set_result(True)
+            self._notify(entry, 0, 0.0)
+        self._notify_positions()
+        self._schedule_recheck()
+
+    def _schedule_recheck(self) -> None:
+        """LLMの待ち行列が減ったかは通知されないため、待っている間は定期的に確認し直す"""
+        if not self._waiting or self.max_llm_queue <= 0 or self._recheck is not None:
+            return
+
+        def recheck() -> None:
+            self._recheck = None
+            self._pump()
+
+        self._recheck = asyncio.get_running_loop().call_later(self.recheck_seconds, recheck)
+
+    def estimate_wait(self, position: int) -> Optional[float]:
+        """順番 position のセッションが開始するまでの見積もり秒数（所要時間の実績が無い場合None）"""
+        if self._avg_duration is None:
+            return None
+        slots = self.max_active if self.max_active > 0 else max(len(self._active), 1)
+        return self._avg_duration * position / slots
+
+    def position(self, room_id: str) -> Optional[int]:
+        """待ち行列での順番（1から）. 並んでいない場合None"""
+        for position, waiting_room_id in enumerate(self._waiting, start=1):
+            if waiting_room_id == room_id:
+                return position
+        return None
+
+    def _notify_positions(self) -> None:
+        for position, entry in enumerate(self._waiting.values(), start=1):
+            if entry["position"] != position:
+                self._notify(entry, position, self.estimate_wait(position))
+
+    def _notify(self, entry: Dict[str, Any], position: int, eta: Optional[float]) -> None:
+        entry["position"] = position
+        if entry["notify"] is None:
+            return
+        task = asyncio.ensure_future(entry["notify"](position, eta))
+        self._notify_tasks.add(task)
+        task.add_done_callback(self._notify_tasks.discard)
+
+    def stats(self) -> Dict[str, Any]:
+        """実行中・待機中のセッション数と、開始までの待ち時間"""
+        waits = sorted(self._waits)
+        return {
+            "active": len(self._active),
+            "waiting": len(self._waiting),
+            "max_active": self.max_active,
+            "llm_queue_depth": self._llm_queue_depth(),
+            "avg_session_seconds": self._avg_duration,
+            "wait_seconds": {
+                "p50": waits[len(waits) // 2] if waits else 0.0,
+                "p95": waits[min(int(len(waits) * 0.95), len(waits) - 1)] if waits else 0.0,
+                "max": waits[-1] if waits else 0.0,
+            },
+            **self._stats,
+        }
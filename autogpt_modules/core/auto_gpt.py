@@ -1,7 +1,9 @@
 from __future__ import annotations
 
-from typing import List, Optional, Any, Dict, Callable
+from typing import List, Optional, Any, Awaitable, Dict, Callable, Tuple
+import asyncio
 import os
+import uuid
 from datetime import datetime
 import json
 
@@ -19,15 +21,60 @@ from langchain_experimental.autonomous_agents.autogpt.prompt_generator import (
 from langchain_core.runnables import RunnableSequence
 
 from .autogpt_prompt import AutoGPTPrompt
+from .base_prompt import PROMPT_LAYOUT_DEFAULT, validate_prompt_layout
+from .stream_parser import ParsedResponse, StreamingResponseParser
 
 from ..communication import WebSocketManager
 
 
-from .event_manager import Event
+from .event_manager import Event, GOAL_COMPLETED_ACTION
+from .bounded_history import BoundedHistory
+from .custom_congif import MAX_TOKEN_WINDOW, HIBERNATE_MIN_WAIT_MINUTES, DECISION_PREEMPT_POLICY, DECISION_MAX_PREEMPTIONS
+from .hibernation import HibernationScheduler, WAKE_BY_MESSAGE, WAKE_BY_TIMER
+from ..utils.llm.usage import extract_token_usage
+from ..utils.llm.scheduler import llm_scheduler, PRIORITY_INTERACTIVE
 from utils import string_to_bool
 
 load_dotenv()
 
+# reply_message のメッセージ本文が入るJSON上のパス
+_REPLY_MESSAGE_PATH = ("command", "args", "message")
+
+# 決定ステップの取り消しの状況（プロセス全体の累計）
+#   preempted:        新着メッセージで取り消してやり直した回数
+#   ignored:          新着メッセージが届いたがポリシーにより最後まで生成した回数
+#   discarded_chunks: 取り消した呼び出しで生成済みだったチャンク数（無駄になった出力トークンの目安）
+#   cancelled_streams: 送信し始めていた返信を response_cancel で取り消した回数
+#   capped:           1ステップでやり直せる回数を使い切ったため、取り消さずに最後まで生成した回数
+#   discarded_tokens: 取り消した呼び出しで消費したトークン数（LLMScheduler の予算からも差し引く）
+_PREEMPT_STAT_KEYS = ("preempted", "ignored", "discarded_chunks", "cancelled_streams", "capped", "discarded_tokens")
+_preemption_totals: Dict[str, int] = {key: 0 for key in _PREEMPT_STAT_KEYS}
+
+
+def get_preemption_stats() -> Dict[str, int]:
+    """プロセス全体での決定ステップの取り消しの状況を取得"""
+    return dict(_preemption_totals)
+
+
+def parse_preempt_policy(policy: str) -> Tuple[str, Optional[int]]:
+    """DECISION_PREEMPT_POLICY を (種類, max_tokens の上限) に変換する"""
+    name, _, value = policy.strip().partition(":")
+    if name in ("always", "never", "before_reply") and not value:
+        return name, None
+    if name == "max_tokens":
+        try:
+            return name, int(value)
+        except ValueError:
+            pass
+    raise ValueError(
+        f"Unknown preempt policy: {policy} (expected always, never, before_reply or max_tokens:N)"
+    )
+
+
+class DecisionPreempted(Exception):
+    """決定ステップのLLM呼び出しを新着メッセージにより取り消した"""
+
+
 class AutoGPT:
     """Autonomous agent system for chat-based interaction."""
     
@@ -43,6 +90,11 @@ class AutoGPT:
         verbose: bool = True,
         websocket_manager: WebSocketManager = None,
         room_id: str = None,
+        stream_reply: bool = False,
+        prefetch_plans: bool = False,
+        hibernation_scheduler: Optional[HibernationScheduler] = None,
+        preempt_policy: str = DECISION_PREEMPT_POLICY,
+        llm_provider: str = "openai",
     ):
         self.room_id = room_id  
         self.websocket_manager = websocket_manager
@@ -52,12 +104,35 @@ class AutoGPT:
         self.ai_role = ai_role
         self.tools = tools
         self.flag_names = flag_names
-        self.flags_history : List[Dict[str, bool]] = []
+        self.flags_history : BoundedHistory[Dict[str, bool]] = BoundedHistory(
+            self.room.history_path("flags") if self.room else None
+        )
+        # 前のインスタンスが追い出したファイルは引き継がない（再開時のフラグはチェックポイントから戻す）
+        self.flags_history.clear()
         self.llm = llm
         self.output_parser = output_parser or AutoGPTOutputParser()
         self.chain = chain
         self.verbose = verbose
         self.count = 0
+
+        # reply_message の本文を生成途中から response_delta で送信するか
+        self.stream_reply = stream_reply
+        self._command_listeners: List[Callable[[str], Any]] = []
+
+        # 待機中に次のゴールのプランを先読みするか
+        self.prefetch_plans = prefetch_plans
+        self._next_goal: Optional[str] = None
+
+        # 長い wait の間はチェックポイントだけを残してエージェントを解放する
+        self.hibernation_scheduler = hibernation_scheduler
+        self._hibernated = False
+
+        # 決定ステップの生成中に新着メッセージが届いたら、取り消して最新の履歴でやり直す
+        self.preempt_policy, self._preempt_max_tokens = parse_preempt_policy(preempt_policy)
+        self.preemption_stats: Dict[str, int] = {key: 0 for key in _PREEMPT_STAT_KEYS}
+        self.max_preemptions = DECISION_MAX_PREEMPTIONS
+        # 現在の決定ステップで続けてやり直した回数
+        self._step_preemptions = 0
         
         self.disconnect_flag = False
 
@@ -65,6 +140,19 @@ class AutoGPT:
         self._save_result_flag = False
         self.tools_dict = {t.name: t for t in self.tools}
 
+        # 決定ステップの呼び出しは LLMScheduler の返信の優先度で実行する（llm_provider ごとに上限を共有）
+        self.llm_provider = llm_provider
+        self._last_step_tokens = 0
+        self._last_input_tokens = 0
+
+        # 決定ステップごとのトークン使用量（プレフィックスキャッシュの効果確認用）
+        self.token_usage: Dict[str, int] = {
+            "steps": 0,
+            "input_tokens": 0,
+            "cached_input_tokens": 0,
+            "output_tokens": 0,
+        }
+
     @classmethod
     def from_llm_and_tools(
         cls,
@@ -76,9 +164,18 @@ class AutoGPT:
         verbose: bool = True,
         websocket_manager: WebSocketManager = None,
         room_id: str = None,
+        send_token_limit: int = MAX_TOKEN_WINDOW,
+        prompt_layout: str = PROMPT_LAYOUT_DEFAULT,
+        stream_reply: bool = False,
+        prefetch_plans: bool = False,
+        compact_chat: bool = False,
+        hibernation_scheduler: Optional[HibernationScheduler] = None,
+        preempt_policy: str = DECISION_PREEMPT_POLICY,
+        llm_provider: str = "openai",
     ) -> AutoGPT:
         """LLMとツールからAutoGPTインスタンスを作成"""
         output_parser = AutoGPTOutputParser()
+        validate_prompt_layout(prompt_layout)
 
         tools_dict = {t.name: t for t in tools}
 
@@ -94,13 +191,17 @@ class AutoGPT:
             tools=tools,
             input_variables=["goals", "current_goal", "common_rule", "flags"],
             token_counter=llm.get_num_tokens,
+            send_token_limit=send_token_limit,
+            layout=prompt_layout,
 
             # methods
             get_chat_history=room.message_manager.get_chat_history,
+            get_compacted_chat_history=room.chat_compactor.get_compacted_history if compact_chat else None,
             get_event_history=room.event_manager.get_event_history,
+            event_cursor=room.event_manager.cursor(),
             get_consecutive_message_number=room.message_manager.get_consecutive_message_number,
             get_is_new_response_from_user_came=room.message_manager.has_new_messages,
-            get_summaries=room.result_manager.get_goal_result_pairs,
+            get_summaries=lambda: room.result_manager.get_goal_result_pairs(include_pending=True),
             get_plans=room.plan_manager.get_latest_plan,
             get_waiting_info=tools_dict["wait"].get_waiting_info if "wait" in tools_dict else None,
             )
@@ -118,6 +219,11 @@ class AutoGPT:
             verbose=verbose,
             websocket_manager=websocket_manager,
             room_id=room_id,
+            stream_reply=stream_reply,
+            prefetch_plans=prefetch_plans,
+            hibernation_scheduler=hibernation_scheduler,
+            preempt_policy=preempt_policy,
+            llm_provider=llm_provider,
         )
 
     async def _log(self, message: str, data: Any = None) -> None:
@@ -131,8 +237,12 @@ class AutoGPT:
                 else:
                     print(str(data))
 
-    async def _execute_tool(self, tool_name: str, args: Dict[str, Any], purpose: str) -> str:
-        """ツールを実行"""
+    async def _execute_tool(self, tool_name: str, args: Dict[str, Any], purpose: str, background: bool = False) -> str:
+        """ツールを実行
+
+        background=True の場合は、実行時点のゴールの状態（wait の情報や save_result のフラグ）に触れない。
+        バックグラウンドのタスクは次のゴールに進んでから実行されることがあるため。
+        """
 
         tools = {t.name: t for t in self.tools}
         if tool_name not in tools:
@@ -140,12 +250,16 @@ class AutoGPT:
             return error
         
         # waitの情報をリセットする
-        if tool_name != "wait":
+        if tool_name != "wait" and not background:
             self.tools_dict["wait"].reset_waiting_info()
 
         # save_resultの場合は, 実行履歴を保存する
-        if tool_name == "save_result":
+        if tool_name == "save_result" and not background:
             self.set_save_result_flag(True)
+
+        # 待機している間に次のゴールのプランを先読みする
+        if tool_name == "wait":
+            self._prefetch_next_plan()
             
         tool = tools[tool_name]
         try:
@@ -162,48 +276,226 @@ class AutoGPT:
             error = f"Error: {str(e)}"
             return error
 
+    def _prefetch_next_plan(self) -> None:
+        """次のゴールのプランを先読みする（plan_action ツールがある場合のみ）"""
+        plan_tool = self.tools_dict.get("plan_action")
+        if not self.prefetch_plans or self._next_goal is None or not hasattr(plan_tool, "prefetch"):
+            return
+        if plan_tool.prefetch(self._next_goal):
+            print(f"[DEBUG] Prefetching plan for next goal: {self._next_goal}")
+
+    def _prefetch_first_plan(self, goal: str) -> None:
+        """ヒアリングの開始時に、最初の決定ステップと並行して最初のゴールのプランを先読みする
+
+        入力が全セッションで同じになるため、起動時のウォームアップで生成したプランが
+        結果のキャッシュから返る。
+        """
+        plan_tool = self.tools_dict.get("plan_action")
+        if not self.prefetch_plans or not hasattr(plan_tool, "prefetch"):
+            return
+        if plan_tool.prefetch(goal, at_start=True):
+            print(f"[DEBUG] Prefetching plan for first goal: {goal}")
+
+    def _save_result_in_background(self, goal: str) -> str:
+        """save_result をバックグラウンドで実行する
+
+        要約の生成（LLM呼び出し）を待たずに次の決定ステップ・次のゴールへ進む。
+        結果を読む側（plan_action など）は result_manager.wait_for_pending() で合流する。
+
+        Returns:
+            str: ログ用のメッセージ
+        """
+        self.set_save_result_flag(True)
+        self.tools_dict["wait"].reset_waiting_info()
+        task = asyncio.create_task(
+            self._execute_tool("save_result", args={"goal": goal}, purpose="Before go to next, summarize this subgoal and save_result", background=True)
+        )
+        self.room.result_manager.track_pending(goal, task)
+        # 待機中の先読みはこのゴールの結果を知らないため、要約の完了を待って生成し直す
+        self._prefetch_next_plan()
+        return f"save_result started in background for goal: {goal}"
+
     async def run(self, goals: List[str], common_rule: str = "", room_id: str = None) -> str: # room_idを追加
         """Run the agent on a list of goals."""
+        self.room.save_run_config(goals, common_rule)
+        return await self._run_goals(goals, common_rule, room_id)
+
+    async def resume(self, room_id: str = None, woke_by: Optional[str] = None) -> str:
+        """チェックポイントから実行を再開する
+
+        最後に保存したステップのゴール・ステップ数・フラグから続けるため、
+        完了済みのプラン作成や要約はやり直さない。
+        要約の途中で止まったゴールは、結果が保存されていなければ要約し直す。
+
+        Args:
+            room_id (str): ルームID
+            woke_by (Optional[str]): 休止から起こした理由（HibernationScheduler の on_wake から渡す）
+        """
+        run_config = self.room.run_config
+        if run_config is None:
+            raise ValueError("No run to resume in this room")
+
+        checkpoint = self.room.checkpoint or {}
+        if checkpoint.get("status", "running") not in ("running", "hibernating"):
+            return f"Nothing to resume (last run {checkpoint.get('status')})"
+
+        for goal in checkpoint.get("saving_goals", []):
+            if not self.room.result_manager.get_results_for_goal(goal):
+                self._save_result_in_background(goal)
+
+        # 休止していた wait を、通常の wait と同じ結果で終わらせる
+        if checkpoint.get("wait") is not None and "wait" in self.tools_dict:
+            event_action = None if woke_by in (None, WAKE_BY_TIMER) else woke_by
+            result = self.tools_dict["wait"].resume_from_hibernation(checkpoint["wait"], event_action)
+            await self.room.event_manager.add_event(
+                action="tool_execution : wait",
+                purpose=checkpoint["wait"].get("purpose", ""),
+                result=result
+            )
+
+        goal_index = checkpoint.get("goal_index", 1)
+        print(f"=== Resuming from Goal {goal_index}, step {checkpoint.get('count', 0)} ===")
+        return await self._run_goals(run_config["goals"], run_config["common_rule"], room_id, goal_index, checkpoint)
+
+    async def _run_goals(
+        self,
+        goals: List[str],
+        common_rule: str,
+        room_id: str = None,
+        start_goal_index: int = 1,
+        checkpoint: Optional[Dict[str, Any]] = None,
+    ) -> str:
+        """start_goal_index 番目のゴールから順に実行する"""
 
         self._set_disconnect_flag(False)
 
 
         print("\n"*50)
 
+        self._hibernated = False
+
+        if start_goal_index == 1 and checkpoint is None and goals:
+            self._prefetch_first_plan(goals[0])
+
         # 各ゴールに対してサブタスクを実行
         for i, goal in enumerate(goals, 1):
+            if i < start_goal_index:
+                continue
             print(f"=== Processing Goal {i}/{len(goals)} ===")
-
-
-            result = await self._run_subtask(goals, goal, common_rule, i, room_id) # room_idを追加
+            self._next_goal = goals[i] if i < len(goals) else None
+
+            # 再開したゴールだけチェックポイントの状態から始める
+            resume_state = checkpoint if i == start_goal_index and checkpoint and checkpoint.get("flags") is not None else None
+            result = await self._run_subtask(goals, goal, common_rule, i, room_id, resume_state) # room_idを追加
+            if self._hibernated:
+                # 先読み中のプランはルームに残し、起きたあとのエージェントが使う
+                return f"=== Hibernated at Goal {i} until wake up ==="
             if not result:
                 error = f"Failed to complete goal {i}: {goal}"
                 print(error)
+                self._write_checkpoint(i, status="stopped")
+                self.room.plan_manager.cancel_prefetch()
+                await self.room.result_manager.wait_for_pending()
                 return error
             
             await self.room.event_manager.add_event(
-                action="***PREVIOUS_GOAL_COMPLETED***",
+                action=GOAL_COMPLETED_ACTION,
                 purpose="so GOAL were updated already !",
                 result=goal[:max(len(goal), 30)] + "..." + "was completed !"
             )
 
             self.reset_count()
+            # 次のゴールはまだ始まっていない（flags=None）状態として記録する
+            self._write_checkpoint(i + 1, flags=None)
                 
+        # バックグラウンドで要約中の結果を保存し終えてから終了する
+        self.room.plan_manager.cancel_prefetch()
+        await self.room.result_manager.wait_for_pending()
+        self._write_checkpoint(len(goals) + 1, flags=None, status="completed")
         success = "=== All goals completed successfully! ==="
         return success
 
-    async def _run_subtask(self, goals: List[str], current_goal: str, common_rule: str, goal_index: int, room_id: str = None) -> str:
+    def _should_hibernate(self, args: Dict[str, Any]) -> bool:
+        """この wait の間エージェントを解放するか"""
+        if self.hibernation_scheduler is None or "wait" not in self.tools_dict:
+            return False
+        try:
+            return float(args.get("minutes", 1.0)) >= HIBERNATE_MIN_WAIT_MINUTES
+        except (TypeError, ValueError):
+            return False
+
+    async def _hibernate(self, goal_index: int, args: Dict[str, Any], purpose: str) -> None:
+        """wait の状態をチェックポイントに保存し、エージェントをルームから外して起床を登録する
+
+        wait を実行した後のステップ（フラグ na, ステップ数+1）として保存するため、
+        起きたあとは resume() で wait の結果を記録して次の決定ステップから続ける。
+        """
+        # 解放するまでの間（要約の完了待ちなど）に届いたメッセージは wake() で起こせないため、後で確認する
+        started_seq = self.room.event_manager.last_seq
+        # 要約中のタスクはこのインスタンスを参照しているため、保存し終えてから解放する
+        await self.room.result_manager.wait_for_pending()
+        state = await self.tools_dict["wait"].begin_hibernation(args.get("minutes", 1.0))
+        state["purpose"] = purpose
+        self._prefetch_next_plan()
+
+        self.set_flag("na")
+        self.add_count()
+        self._write_checkpoint(goal_index, status="hibernating", wait=state)
+
+        self._hibernated = True
+        if self.room.autogpt is self:
+            self.room.autogpt = None
+        self.hibernation_scheduler.hibernate(self.room.id, state["wake_at"])
+        print(f"=== Hibernating for {state['minutes']} min ===")
+
+        if any(event.action == WAKE_BY_MESSAGE for event in self.room.event_manager.events_since(started_seq)):
+            print("=== New message arrived while hibernating. Waking up ===")
+            self.hibernation_scheduler.wake(self.room.id, WAKE_BY_MESSAGE)
+
+    def is_hibernated(self) -> bool:
+        return self._hibernated
+
+    def _write_checkpoint(self, goal_index: int, status: str = "running", **overrides: Any) -> None:
+        """現在のゴールとステップの状態を小さなレコードとして保存する"""
+        checkpoint = {
+            "goal_index": goal_index,
+            "count": self.count,
+            "flags": self.get_flag_history(1),
+            "save_result_flag": self._save_result_flag,
+            "saving_goals": self.room.result_manager.get_pending_goals(),
+            "status": status,
+        }
+        checkpoint.update(overrides)
+        self.room.save_checkpoint(checkpoint)
+
+    async def _run_subtask(
+        self,
+        goals: List[str],
+        current_goal: str,
+        common_rule: str,
+        goal_index: int,
+        room_id: str = None,
+        resume_state: Optional[Dict[str, Any]] = None,
+    ) -> str:
         """Run a subtask for the agent."""
         room = self.websocket_manager.get_room(room_id)
         print(f"\n[DEBUG] Room ID: {room_id}")
         print(f"[DEBUG] Room found: {room is not None}")
 
-        # set flag as init planning mode
-        self.set_flag("plan_action")
-        print(f"\n[DEBUG] Initial flag set: plan_action{self.flags_history[-1]}")
-
-        # set flag as save_result flag to False (yet not executed)
-        self.set_save_result_flag(False)
+        if resume_state:
+            # チェックポイントのステップから続ける
+            self.count = resume_state.get("count", 0)
+            self.flags_history.append(resume_state["flags"])
+            self.set_save_result_flag(resume_state.get("save_result_flag", False))
+            print(f"\n[DEBUG] Resumed flag: {self.flags_history[-1]}")
+        else:
+            # set flag as init planning mode
+            self.set_flag("plan_action")
+            print(f"\n[DEBUG] Initial flag set: plan_action{self.flags_history[-1]}")
+
+            # set flag as save_result flag to False (yet not executed)
+            self.set_save_result_flag(False)
+        self._write_checkpoint(goal_index)
 
         while not self.is_finish():
             try:
@@ -224,27 +516,25 @@ class AutoGPT:
 
 
                 # Get AI response using the new chain format
-                assistant_reply = await self.chain.ainvoke(input_dict)
+                # 応答はトークンストリームのまま1回だけ解析する（command / args / thoughts のフラグ）
+                try:
+                    assistant_reply, parsed, stream_id = await self._invoke_chain(input_dict)
+                except DecisionPreempted as e:
+                    # フラグとステップ数はそのままで、新着メッセージを含めた履歴でやり直す
+                    print(f"\n[DEBUG] {e}. Restarting step {goal_index}-{self.count}")
+                    continue
+                self._step_preemptions = 0
                 print("\n[DEBUG] Assistant Reply received successfully")
+                self._record_token_usage(assistant_reply)
+                print(f"[DEBUG] response_text: \n{parsed.raw}")
 
-                # 応答形式の変更に対応
-                response_text = (
-                    assistant_reply.content 
-                    if hasattr(assistant_reply, 'content') 
-                    else assistant_reply
-                )
-
-                print(f"\n[DEBUG] Response Text Type: {type(response_text)}")
-                print(f"[DEBUG] response_text: \n{response_text}")
-
-                # Parse response
-                action = self.output_parser.parse(response_text)
+                action = parsed.action
                 print(f"\n[DEBUG] Parsed Action: {action.name}")
 
                 # Check for task completion
                 if action.name == FINISH_NAME or action.name == "go_next":
-                    if self._save_result_flag:
-                        result = await self._execute_tool("save_result", {"goal": current_goal}, purpose="Before go to next, summarize this subgoal and save_result")
+                    if not self._save_result_flag:
+                        result = self._save_result_in_background(current_goal)
                         await self._log("Task Completed (automatically save_result, finished current task andgo to next):", result)
                     else:
                         result = action.args.get("response", "Task completed, finished current task and go to next")
@@ -253,34 +543,38 @@ class AutoGPT:
                     
                     
                 # 応答時の内部FLAGを参照して行動を強制する
-                try:
-                        # assistant_reply.content は JSON文字列として返ってくるためパースが必要
-                    parsed_response = json.loads(response_text)
-                    purpose = parsed_response.get("thoughts", {}).get("text", "")
+                purpose = parsed.purpose
+                is_finish = parsed.is_finish
+                is_go_next = parsed.is_go_next
 
-                    is_finish = string_to_bool(parsed_response.get("thoughts", {}).get("is_finish", "false"))
-                    is_go_next = string_to_bool(parsed_response.get("thoughts", {}).get("is_go_next", "false"))
-                except:
-                    purpose = ""
-                    is_finish = False
-                    is_go_next = False
+                # 途中まで送信したメッセージが実行されない場合は取り消しを通知
+                if stream_id and (is_finish or is_go_next or action.name != "reply_message"):
+                    await self.tools_dict["reply_message"].cancel_stream(stream_id)
 
                 # Return 
                 if is_finish:
-                    result = await self._execute_tool("save_result", args={"goal": current_goal}, purpose="Before go to next, summarize this subgoal and save_result")
+                    result = self._save_result_in_background(current_goal)
                     await self._log("Task Completed (automatically save_result):", result)
                     self.set_flag("finish")
 
                 elif is_go_next:
-                    result = await self._execute_tool("save_result", args={"goal": current_goal}, purpose="Before go to next, summarize this subgoal and save_result")
+                    result = self._save_result_in_background(current_goal)
                     await self._log("Task Completed (automatically save_result):", result)
                     self.set_flag("go_next")
 
+                elif action.name == "wait" and self._should_hibernate(action.args):
+                    await self._hibernate(goal_index, action.args, purpose)
+                    return None
+
                 else:
                     print(f"[DEBUG] action.name: {action.name}")
                     print(f"[DEBUG] action.args: {action.args}")
 
-                    result = await self._execute_tool(action.name, action.args, purpose)
+                    args = action.args
+                    if stream_id:
+                        # 送信済みの response_delta と最終の response を、このステップの引数でだけ対応付ける
+                        args = {**args, "stream_id": stream_id}
+                    result = await self._execute_tool(action.name, args, purpose)
                     print(f"[DEBUG] result: {result}")
 
                     # set flag as all false
@@ -291,6 +585,7 @@ class AutoGPT:
                         self.set_flag("na")
 
                 self.add_count()
+                self._write_checkpoint(goal_index)
                 
                     
             except Exception as e:
@@ -302,6 +597,170 @@ class AutoGPT:
                 traceback.print_exc()
                 raise
             
+    async def _invoke_chain(self, input_dict: Dict[str, Any]) -> Tuple[Any, ParsedResponse, Optional[str]]:
+        """決定ステップのLLMを呼び出し、応答を解析する
+
+        ストリームを受け取りながら StreamingResponseParser で解析し、command.name が確定した時点
+        （生成完了前）で on_command_decided が呼ばれる。
+        stream_reply が有効な場合は、commandが reply_message と確定し、thoughts で
+        is_finish / is_go_next が立っていない間だけ、本文の差分を response_delta として送る。
+
+        生成中に new_message_come が届き、preempt_policy が許す場合は呼び出しを取り消して
+        DecisionPreempted を送出する（送信し始めていた返信は response_cancel で取り消す）。
+
+        Returns:
+            Tuple[Any, ParsedResponse, Optional[str]]:
+                (LLMの応答, 解析結果, response_delta を送信した場合のストリームID)
+        """
+        reply_tool = self.tools_dict.get("reply_message") if self.stream_reply else None
+        parser = StreamingResponseParser(on_command=self.on_command_decided)
+        stream_id = f"stream_{uuid.uuid4().hex}"
+        # 生成したチャンク数と、response_delta を送信したか（取り消せるかの判定に使う）
+        progress = {"chunks": 0, "streamed": False}
+
+        async def consume() -> Any:
+            pending: List[str] = []
+            assistant_reply = None
+            # 見積もりには前のステップの使用量を使う（プロンプトの大きさはステップ間でほぼ変わらない）
+            async with llm_scheduler.slot(
+                self.llm_provider, self.room_id, PRIORITY_INTERACTIVE, estimated_tokens=self._last_step_tokens
+            ) as ticket:
+                if ticket.wait_seconds > 0.1:
+                    print(f"[DEBUG] Waited {ticket.wait_seconds:.2f}s for an LLM slot")
+                try:
+                    async for chunk in self.chain.astream(input_dict):
+                        assistant_reply = chunk if assistant_reply is None else assistant_reply + chunk
+                        progress["chunks"] += 1
+                        text = chunk.content if hasattr(chunk, "content") else str(chunk)
+
+                        deltas = parser.feed(text)
+                        if reply_tool is None:
+                            continue
+
+                        pending.extend(delta for path, delta in deltas if path == _REPLY_MESSAGE_PATH)
+                        if pending and self._should_stream_reply(parser):
+                            await reply_tool.send_delta(stream_id, "".join(pending))
+                            pending.clear()
+                            progress["streamed"] = True
+
+                    usage = extract_token_usage(assistant_reply)
+                    self._last_input_tokens = usage["input_tokens"]
+                    self._last_step_tokens = usage["input_tokens"] + usage["output_tokens"]
+                    ticket.record_tokens(self._last_step_tokens)
+                except asyncio.CancelledError:
+                    # 取り消した呼び出しも、送ったプロンプトと生成済みの出力の分は消費している
+                    ticket.record_tokens(self._discarded_tokens(assistant_reply, progress["chunks"]))
+                    raise
+            return assistant_reply
+
+        try:
+            assistant_reply = await self._run_preemptible(consume(), progress)
+        except DecisionPreempted:
+            if progress["streamed"]:
+                await reply_tool.cancel_stream(stream_id)
+                self._count_preemption("cancelled_streams")
+            raise
+
+        parsed = parser.to_response(self.output_parser)
+        if not progress["streamed"]:
+            return assistant_reply, parsed, None
+        return assistant_reply, parsed, stream_id
+
+    async def _run_preemptible(self, decision: Awaitable[Any], progress: Dict[str, Any]) -> Any:
+        """決定ステップの呼び出しを、新着メッセージを待ちながら実行する
+
+        Raises:
+            DecisionPreempted: 新着メッセージが届き、ポリシーにより呼び出しを取り消した場合
+        """
+        decision = asyncio.ensure_future(decision)
+        if self.preempt_policy == "never" or self.room is None:
+            return await decision
+
+        new_message = asyncio.ensure_future(
+            self.room.event_manager.wait_for_event(["new_message_come"])
+        )
+        try:
+            done, _ = await asyncio.wait({decision, new_message}, return_when=asyncio.FIRST_COMPLETED)
+            if decision in done:
+                return decision.result()
+
+            if not self._can_preempt(progress):
+                self._count_preemption("ignored")
+                return await decision
+
+            decision.cancel()
+            await asyncio.gather(decision, return_exceptions=True)
+            self._step_preemptions += 1
+            self._count_preemption("preempted")
+            self._count_preemption("discarded_chunks", progress["chunks"])
+            raise DecisionPreempted(f"Decision preempted by new message after {progress['chunks']} chunks")
+        finally:
+            new_message.cancel()
+            if not decision.done():
+                decision.cancel()
+
+    def _can_preempt(self, progress: Dict[str, Any]) -> bool:
+        if self._step_preemptions >= self.max_preemptions:
+            self._count_preemption("capped")
+            return False
+        if self.preempt_policy == "always":
+            return True
+        if self.preempt_policy == "before_reply":
+            return not progress["streamed"]
+        return progress["chunks"] < self._preempt_max_tokens
+
+    def _discarded_tokens(self, assistant_reply: Any, chunks: int) -> int:
+        """取り消した呼び出しで消費したトークン数
+
+        使用量は通常ストリームの最後に届くため、届いていなければ前のステップの入力トークン数と
+        生成済みのチャンク数から見積もる。
+        """
+        usage = extract_token_usage(assistant_reply)
+        tokens = usage["input_tokens"] + usage["output_tokens"]
+        if not tokens:
+            tokens = self._last_input_tokens + chunks
+        self._count_preemption("discarded_tokens", tokens)
+        return tokens
+
+    def _count_preemption(self, key: str, amount: int = 1) -> None:
+        self.preemption_stats[key] += amount
+        _preemption_totals[key] += amount
+
+    def add_command_listener(self, listener: Callable[[str], Any]) -> None:
+        """command.name が確定した時点（生成完了前）に呼ばれるリスナーを登録"""
+        self._command_listeners.append(listener)
+
+    def on_command_decided(self, command_name: str) -> None:
+        """応答の生成途中で command.name が確定したときの処理"""
+        print(f"[DEBUG] Command decided before generation finished: {command_name}")
+        for listener in self._command_listeners:
+            listener(command_name)
+
+    def _should_stream_reply(self, parser: StreamingResponseParser) -> bool:
+        if parser.command_name != "reply_message":
+            return False
+        return not (
+            string_to_bool(parser.get("thoughts", "is_finish", default="false"))
+            or string_to_bool(parser.get("thoughts", "is_go_next", default="false"))
+        )
+
+    def _record_token_usage(self, assistant_reply: Any) -> None:
+        """応答のトークン使用量（キャッシュヒット分を含む）を集計"""
+        usage = extract_token_usage(assistant_reply)
+        self.token_usage["steps"] += 1
+        for key, value in usage.items():
+            self.token_usage[key] += value
+        print(f"[DEBUG] Token usage: {usage} (cached ratio: {self.get_cached_token_ratio():.2f})")
+
+    def get_token_usage(self) -> Dict[str, int]:
+        return dict(self.token_usage)
+
+    def get_cached_token_ratio(self) -> float:
+        """入力トークンのうちプロバイダのキャッシュにヒットした割合"""
+        if not self.token_usage["input_tokens"]:
+            return 0.0
+        return self.token_usage["cached_input_tokens"] / self.token_usage["input_tokens"]
+
     def add_count(self):
         self.count += 1
 
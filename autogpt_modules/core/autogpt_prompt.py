@@ -12,15 +12,114 @@ from pydantic import BaseModel
 
 
 
-from typing import List, Callable, Any, Dict, Optional
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from typing import List, Callable, Any, Dict, Optional, Tuple
 from datetime import datetime
 import json
 from langchain.tools.base import BaseTool
 from langchain_core.prompts import BaseChatPromptTemplate
 from langchain_core.messages import BaseMessage, SystemMessage
 from ..communication import MessageManager
-from .base_prompt import SYSTEM_PROMPT, RESPONSE_FORMAT, construct_base_prompt
-from pydantic import Field, BaseModel
+from .base_prompt import SYSTEM_PROMPT, RESPONSE_FORMAT, PROMPT_LAYOUT_DEFAULT, CompiledBasePrompt, construct_base_prompt
+from .event_manager import EventCursor, GOAL_COMPLETED_ACTION
+from .prompt_budget import BudgetSection, TokenBudgeter
+from .custom_congif import MIN_RECENT_EVENTS, MIN_RECENT_MESSAGES, HISTORY_HOT_WINDOW, HISTORY_TRIM_BLOCK
+from pydantic import Field, BaseModel, PrivateAttr
+
+# ツール構成が同じエージェント間でツール一覧のフォーマット結果を共有する
+_FORMATTED_TOOLS_CACHE: "OrderedDict[Tuple, str]" = OrderedDict()
+# ツール構成・ゴール・共通ルール・レイアウトが同じエージェント間でコンパイル済みのベースプロンプトを共有する
+_COMPILED_PROMPT_CACHE: "OrderedDict[Tuple, CompiledBasePrompt]" = OrderedDict()
+# 共有する件数の上限（ヒアリングの構成ごとに増え続けないよう、最近使っていないものから捨てる）
+_MAX_SHARED_PROMPTS = 32
+
+
+# ループのシャード（スレッド）間でも共有するため、更新はロックの中で行う
+_SHARED_PROMPTS_LOCK = threading.Lock()
+
+
+def _cached(cache: "OrderedDict[Tuple, Any]", key: Tuple, create: Callable[[], Any]) -> Any:
+    """件数に上限のあるキャッシュから取得し、無ければ作成して追加する"""
+    with _SHARED_PROMPTS_LOCK:
+        if key in cache:
+            cache.move_to_end(key)
+            return cache[key]
+    value = create()
+    with _SHARED_PROMPTS_LOCK:
+        value = cache.setdefault(key, value)
+        cache.move_to_end(key)
+        if len(cache) > _MAX_SHARED_PROMPTS:
+            cache.popitem(last=False)
+    return value
+
+
+def _tools_cache_key(tools: List[BaseTool]) -> Tuple:
+    return tuple((type(tool), tool.name, str(tool.description)) for tool in tools)
+
+
+def _format_tools_with_number(tools: List[BaseTool]) -> str:
+    tool_strings = []
+    for i, tool in enumerate(tools, 1):
+        args_str = ", ".join(f"{name}: {typ}" for name, typ in tool.args.items())
+        tool_strings.append(f"*{i}. {tool.name}: {tool.description}, Args: {args_str}")
+    return "\n".join(tool_strings)
+
+
+def _format_goals(goals: List[str]) -> str:
+    return "\n".join(f"{i+1}. {goal}" for i, goal in enumerate(goals))
+
+
+def get_formatted_tools(tools: List[BaseTool]) -> str:
+    """ツール一覧のフォーマット結果を取得（プロセス単位で、件数に上限を設けてキャッシュ）"""
+    return _cached(_FORMATTED_TOOLS_CACHE, _tools_cache_key(tools), lambda: _format_tools_with_number(tools))
+
+
+def precompile_base_prompt(
+    tools: List[BaseTool],
+    goals: List[str],
+    common_rule: str,
+    layout: str = PROMPT_LAYOUT_DEFAULT,
+) -> CompiledBasePrompt:
+    """不変セクションを埋め込んだベースプロンプトを取得（プロセス単位で、件数に上限を設けてキャッシュ）
+
+    起動時のウォームアップで呼んでおくと、最初のセッションではコンパイル済みのものを使う。
+    エージェントはコンパイル済みのものを自分でも保持するため、キャッシュから捨てられても作り直さない。
+    """
+    key = (_tools_cache_key(tools), tuple(goals), common_rule, layout)
+    return _cached(_COMPILED_PROMPT_CACHE, key, lambda: CompiledBasePrompt(
+        formatted_goals=_format_goals(goals),
+        common_rule=common_rule,
+        formatted_tools=get_formatted_tools(tools),
+        response_format=RESPONSE_FORMAT,
+        layout=layout,
+    ))
+
+
+@lru_cache(maxsize=64)
+def _format_flags(flag_items: Tuple[Tuple[str, bool], ...]) -> str:
+    """フラグの組み合わせは少数なので、フォーマット結果をキャッシュする"""
+    flags = dict(flag_items)
+
+    def _create_flag_entry(flag_name: str, flags: Dict[str, bool]) -> Dict[str, Any]:
+        return {
+            "description": f"true or false, if true, you should choose `{flag_name}` command.",
+            "value": "true" if flags.get(flag_name, False) else "false"
+        }
+
+    # ex) flag_names = ["finish", "go_next", "plan_action"]
+    flag_names = flags.keys()
+
+    flag_dict = {
+        f"{flag_name}_flag": _create_flag_entry(flag_name,
+            flags)
+        for flag_name in flag_names
+    }
+
+    flag_format = json.dumps(flag_dict, indent=2, ensure_ascii=False)
+    return flag_format
+
 
 class AutoGPTPrompt(BaseChatPromptTemplate, BaseModel):
     ai_name: str
@@ -30,47 +129,124 @@ class AutoGPTPrompt(BaseChatPromptTemplate, BaseModel):
     token_counter: Callable[[str], int]
     send_token_limit: int = 4096
     get_chat_history: Optional[Callable[[], List[str]]] = None
+    # (古い対話の要約, 原文の先頭位置, 原文のメッセージ) を返す。指定された場合は get_chat_history より優先する
+    get_compacted_chat_history: Optional[Callable[[], Tuple[str, int, List[Dict[str, str]]]]] = None
     get_event_history: Optional[Callable[[], List[Dict[str, str]]]] = None
     get_summaries: Optional[Callable[[], List[str]]] = None
     get_action_plan: Optional[Callable[[], str]] = None
     get_is_new_response_from_user_came: Optional[Callable[[], bool]] = None
     get_consecutive_message_number: Optional[Callable[[], int]] = None
     get_waiting_info: Optional[Callable[[], Dict[str, Any]]] = None
+    event_cursor: Optional[EventCursor] = None
+    layout: str = PROMPT_LAYOUT_DEFAULT
 
+    # event_cursorから読み出したイベントのフォーマット済み行（ステップ間で使い回す）
+    _event_lines: List[str] = PrivateAttr(default_factory=list)
+    _event_pinned: List[bool] = PrivateAttr(default_factory=list)
+    _budgeter: Optional[TokenBudgeter] = PrivateAttr(default=None)
+    _compiled_prompt: Optional[CompiledBasePrompt] = PrivateAttr(default=None)
+    _compiled_key: Optional[Tuple] = PrivateAttr(default=None)
+    _formatted_tools: Optional[str] = PrivateAttr(default=None)
 
     class Config:
         arbitrary_types_allowed = True
 
     def _format_tools_with_number(self) -> str:
-        tool_strings = []
-        for i, tool in enumerate(self.tools, 1):
-            args_str = ", ".join(f"{name}: {typ}" for name, typ in tool.args.items())
-            tool_strings.append(f"*{i}. {tool.name}: {tool.description}, Args: {args_str}")
-        return "\n".join(tool_strings)
+        return _format_tools_with_number(self.tools)
+
+    def _get_formatted_tools(self) -> str:
+        """ツール一覧のフォーマット結果を取得（インスタンス・プロセス単位でキャッシュ）"""
+        if self._formatted_tools is None:
+            self._formatted_tools = get_formatted_tools(self.tools)
+        return self._formatted_tools
+
+    def _get_compiled_prompt(self, goals: List[str], common_rule: str) -> CompiledBasePrompt:
+        """不変セクションを埋め込んだベースプロンプトを取得
+
+        goals と common_rule が変わらない限り、前回コンパイルしたものを使い回す
+        （同じ構成の他のエージェントや起動時のウォームアップでコンパイルしたものも使う）。
+        """
+        key = (tuple(goals), common_rule, self.layout)
+        if self._compiled_prompt is None or self._compiled_key != key:
+            self._compiled_prompt = precompile_base_prompt(self.tools, goals, common_rule, self.layout)
+            self._compiled_key = key
+        return self._compiled_prompt
 
     def _format_goals(self, goals: List[str]) -> str:
-        return "\n".join(f"{i+1}. {goal}" for i, goal in enumerate(goals))
+        return _format_goals(goals)
     
     def _format_list_with_order_number(self, list: List[str], prefix: str = "") -> str:
-        return "\n".join(f"{prefix}{i+1}. {item}" for i, item in enumerate(list))
-    
+        return "\n".join(self._number_lines(list, prefix))
+
+    def _number_lines(self, list: List[Any], prefix: str = "") -> List[str]:
+        return [f"{prefix}{i+1}. {item}" for i, item in enumerate(list)]
+
     def _format_dicts_with_order_number(self, dicts: List[Dict[str, Any]], prefix: str = "") -> str:
+        return "\n".join(self._number_dict_lines(dicts, prefix))
+
+    def _number_dict_lines(self, dicts: List[Dict[str, Any]], prefix: str = "") -> List[str]:
         try:
-            return "\n".join(f"{prefix}{i+1}. {json.dumps(dict)}" for i, dict in enumerate(dicts))
+            return [f"{prefix}{i+1}. {json.dumps(dict)}" for i, dict in enumerate(dicts)]
         except Exception as e:
             print(f"Error occurred while formatting dicts: {str(e)}")
             print(f"Error type: {type(e).__name__}")
             print(f"Error details: {e.__dict__}")
             print(f"Error traceback: {traceback.format_exc()}")
-            return ""
+            return []
+
+    def _event_history_lines(self) -> Tuple[List[str], List[bool]]:
+        """イベント履歴の行と、予算調整で削ってはいけない行のフラグを取得
+
+        event_cursorがある場合は新しく追加されたイベントだけを整形して追記する。
+        """
+        if self.event_cursor is None:
+            events = self.get_event_history() if self.get_event_history else []
+            pinned = [event.get("action") == GOAL_COMPLETED_ACTION for event in events]
+            return self._number_lines(events, prefix="a"), pinned
+
+        for event in self.event_cursor.read():
+            self._event_lines.append(f"a{event.seq}. {event.to_dict()}")
+            self._event_pinned.append(event.action == GOAL_COMPLETED_ACTION)
+
+        # 整形済みの行も履歴と同じ件数までに抑える（それより古い行は予算調整でも残らない）
+        if len(self._event_lines) > HISTORY_HOT_WINDOW + HISTORY_HOT_WINDOW // 4:
+            keep = set(range(len(self._event_lines) - HISTORY_HOT_WINDOW, len(self._event_lines)))
+            keep.update(i for i, pinned in enumerate(self._event_pinned) if pinned)
+            self._event_lines = [line for i, line in enumerate(self._event_lines) if i in keep]
+            self._event_pinned = [pinned for i, pinned in enumerate(self._event_pinned) if i in keep]
+        return self._event_lines, self._event_pinned
+
+    def _chat_history_lines(self) -> Tuple[List[str], List[bool]]:
+        """チャット履歴の行と、予算調整で削ってはいけない行のフラグを取得
+
+        圧縮済みの履歴がある場合は、古い対話の要約を先頭の行に置き、
+        原文のメッセージは元の通し番号のまま並べる。
+        """
+        if self.get_compacted_chat_history is None:
+            chat_lines = self._number_lines(self.get_chat_history() if self.get_chat_history else [], prefix="b")
+            return chat_lines, [False] * len(chat_lines)
+
+        summary, offset, messages = self.get_compacted_chat_history()
+        chat_lines = [f"b{offset + i + 1}. {message}" for i, message in enumerate(messages)]
+        if not summary:
+            return chat_lines, [False] * len(chat_lines)
+        summary_line = f"b1-b{offset}. (summary of earlier messages) {summary}"
+        return [summary_line] + chat_lines, [True] + [False] * len(chat_lines)
+
+    def _format_event_history(self) -> str:
+        """イベント履歴をフォーマット"""
+        return "\n".join(self._event_history_lines()[0])
+
+    def _get_budgeter(self) -> TokenBudgeter:
+        if self._budgeter is None or self._budgeter.send_token_limit != self.send_token_limit:
+            self._budgeter = TokenBudgeter(self.token_counter, self.send_token_limit)
+        return self._budgeter
 
     def construct_full_prompt(self, goals: List[str], current_goal: str, common_rule: str, flags: Dict[str, bool]) -> str:
-        formatted_goals = self._format_goals(goals)
-        formatted_tools = self._format_tools_with_number()
-        response_format = self._construct_response_format()
-        chat_history = self._format_list_with_order_number(self.get_chat_history() if self.get_chat_history else [], prefix="b")
-        event_history = self._format_list_with_order_number(self.get_event_history() if self.get_event_history else [], prefix="a")
-        summaries = self._format_dicts_with_order_number(self.get_summaries() if self.get_summaries else [], prefix="c")
+        compiled_prompt = self._get_compiled_prompt(goals, common_rule)
+        chat_lines, chat_pinned = self._chat_history_lines()
+        event_lines, event_pinned = self._event_history_lines()
+        summary_lines = self._number_dict_lines(self.get_summaries() if self.get_summaries else [], prefix="c")
         action_plan = self.get_action_plan() if self.get_action_plan else ""
         flags_format = self._construct_flags_format(flags)
         waiting_info = self.get_waiting_info()
@@ -86,30 +262,39 @@ class AutoGPTPrompt(BaseChatPromptTemplate, BaseModel):
             is_new_response_from_user_came = False
             consecutive_message_number = 0
 
-
-        full_prompt = construct_base_prompt(
-            # 目標と規則に関する情報
-            formatted_goals=formatted_goals,
+        dynamic_sections = dict(
+            # 目標に関する情報
             current_goal=current_goal, 
-            common_rule=common_rule,
             action_plan=action_plan,
 
-            # 履歴情報
-            event_history=event_history,
-            chat_history=chat_history,
-            summaries=summaries,
-
             # メッセージング制御情報
             is_new_response_from_user_came=is_new_response_from_user_came,
             consecutive_message_number=consecutive_message_number,
             waiting_info=json.dumps(waiting_info),
 
             # システム設定情報
-            formatted_tools=formatted_tools,
-            response_format=response_format,
             flags_format=flags_format
         )
 
+        # 履歴情報はトークン予算に収まるように古いものから間引く
+        fixed_chunks = compiled_prompt.chunks(event_history="", chat_history="", summaries="", **dynamic_sections)
+        fitted = self._get_budgeter().fit(fixed_chunks, [
+            BudgetSection(
+                "event_history", event_lines, pinned=event_pinned, min_keep=MIN_RECENT_EVENTS, trim_block=HISTORY_TRIM_BLOCK
+            ),
+            BudgetSection(
+                "chat_history", chat_lines, pinned=chat_pinned, min_keep=MIN_RECENT_MESSAGES, trim_block=HISTORY_TRIM_BLOCK
+            ),
+            BudgetSection("summaries", summary_lines),
+        ])
+
+        full_prompt = compiled_prompt.render(
+            event_history="\n".join(fitted["event_history"]),
+            chat_history="\n".join(fitted["chat_history"]),
+            summaries="\n".join(fitted["summaries"]),
+            **dynamic_sections
+        )
+
         print(f"\n\n +++++++++++++++++++++++++++++ \n\n[debug] full_prompt: {full_prompt} \n\n +++++++++++++++++++++++++++++")
 
         return full_prompt
@@ -129,24 +314,7 @@ class AutoGPTPrompt(BaseChatPromptTemplate, BaseModel):
         return RESPONSE_FORMAT
     
     def _construct_flags_format(self, flags: Dict[str, bool]) -> str:
-        def _create_flag_entry(flag_name: str, flags: Dict[str, bool]) -> Dict[str, Any]:
-            return {
-                "description": f"true or false, if true, you should choose `{flag_name}` command.",
-                "value": "true" if flags.get(flag_name, False) else "false"
-            }
-        
-        # ex) flag_names = ["finish", "go_next", "plan_action"]
-        flag_names = flags.keys()
-
-        flag_dict = {
-            f"{flag_name}_flag": _create_flag_entry(flag_name,
-                flags)
-            for flag_name in flag_names
-        }
-
-        flag_format = json.dumps(flag_dict, indent=2, ensure_ascii=False)
-        return flag_format
-
+        return _format_flags(tuple(flags.items()))
 
     @property
     def _prompt_type(self) -> str:
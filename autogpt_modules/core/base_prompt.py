@@ -1,5 +1,6 @@
 import time
 import json
+from typing import Any, List
 
 
 RESPONSE_FORMAT = """
@@ -121,69 +122,211 @@ def construct_base_prompt(
     Returns:
         str: 構造化された完全なプロンプト文字列
     """
-    return f"""
+    return CompiledBasePrompt(
+        formatted_goals=formatted_goals,
+        common_rule=common_rule,
+        formatted_tools=formatted_tools,
+        response_format=response_format,
+    ).render(
+        current_goal=current_goal,
+        action_plan=action_plan,
+        event_history=event_history,
+        chat_history=chat_history,
+        summaries=summaries,
+        is_new_response_from_user_came=is_new_response_from_user_came,
+        consecutive_message_number=consecutive_message_number,
+        waiting_info=waiting_info,
+        flags_format=flags_format,
+    )
+
+
+# プロンプトのレイアウト
+# default: 従来の並び順
+# prefix_cache: 不変セクションを先頭にまとめ、変化するセクションを追記順に後ろへ並べる.
+#   DeepSeek / OpenAI が自動で行うプロンプトのプレフィックスキャッシュが効きやすくなる
+PROMPT_LAYOUT_DEFAULT = "default"
+PROMPT_LAYOUT_PREFIX_CACHE = "prefix_cache"
+PROMPT_LAYOUTS = (PROMPT_LAYOUT_DEFAULT, PROMPT_LAYOUT_PREFIX_CACHE)
+
+
+def validate_prompt_layout(layout: str) -> str:
+    """プロンプトのレイアウト名を確認する（最初のプロンプトを作るまで待たずに設定の誤りを知らせる）"""
+    if layout not in PROMPT_LAYOUTS:
+        raise ValueError(f"Unknown prompt layout: {layout} (expected one of {', '.join(PROMPT_LAYOUTS)})")
+    return layout
+
+
+class CompiledBasePrompt:
+    """セッション中に変化しないセクションを埋め込み済みのベースプロンプト
+
+    SYSTEM_PROMPT・GOALS・COMMON RULE・TOOLS・OUTPUT FORMAT をあらかじめ連結しておき、
+    各ステップでは履歴やフラグなどの動的な部分だけを差し込む。
+    """
+    def __init__(
+        self,
+        formatted_goals: str,
+        common_rule: str,
+        formatted_tools: str,
+        response_format: str,
+        layout: str = PROMPT_LAYOUT_DEFAULT,
+    ):
+        self.layout = validate_prompt_layout(layout)
+
+        goals_section = f"### GOALS (FOR OVERVIEW){formatted_goals}" if formatted_goals else ""
+        system_section = f"""
 ### SYSTEM PROMPT
 {SYSTEM_PROMPT}
 
 
-{f"### GOALS (FOR OVERVIEW){formatted_goals}" if formatted_goals else ""}
+{goals_section}"""
+        common_rule_section = f"""
 
 
-### CURRENT GOAL : You must focus on this goal.
-{current_goal}
+### COMMON RULE : You must follow this rule.
+{common_rule}"""
+        tools_section = f"""
 
 
-### COMMON RULE : You must follow this rule.
-{common_rule}
+### TOOLS
+{formatted_tools}
+
+
+### OUTPUT FORMAT & RULE
+Your decisions must always be made independently without seeking user assistance.
+Play to your strengths as an LLM and pursue simple strategies with no legal complications.
+{response_format}"""
+
+        if layout == PROMPT_LAYOUT_PREFIX_CACHE:
+            # 全ステップで共通の部分だけで先頭を構成する
+            self.head = system_section + common_rule_section + tools_section + _CURRENT_GOAL_HEADER
+        else:
+            self.head = system_section + _CURRENT_GOAL_HEADER
+            self.common_rule = common_rule_section + _EVENT_HISTORY_HEADER
+            self.tail = tools_section + _OTHER_CONTEXT_HEADER
+
+    def chunks(
+        self,
+        current_goal: str,
+        action_plan: str,
+        event_history: str,
+        chat_history: str,
+        summaries: str,
+        is_new_response_from_user_came: bool,
+        consecutive_message_number: int,
+        waiting_info: str,
+        flags_format: str,
+    ) -> List[str]:
+        """プロンプトを構成する断片を順番に返す
+
+        不変の断片は毎回同じ文字列オブジェクトなので、トークン数のキャッシュなどに使える。
+        """
+        chat_status = json.dumps({
+            "is_new_response_from_user_came": is_new_response_from_user_came,
+            "consecuentive_message_number": consecutive_message_number,
+            "waiting_info": waiting_info
+        }, indent=4)
+
+        if self.layout == PROMPT_LAYOUT_PREFIX_CACHE:
+            # ゴール単位で変わるもの -> 追記のみの履歴 -> 毎ステップ変わるもの の順に並べる
+            return [
+                self.head,
+                current_goal,
+                _SUMMARIES_HEADER,
+                summaries,
+                _ACTION_PLAN_HEADER,
+                action_plan,
+                _EVENT_HISTORY_HEADER,
+                event_history,
+                _CHAT_HISTORY_HEADER,
+                chat_history,
+                _CHAT_STATUS_HEADER,
+                chat_status,
+                _FLAGS_HEADER,
+                flags_format,
+                _OTHER_CONTEXT_HEADER,
+                time.strftime('%c'),
+                _MASTER_INPUT,
+            ]
+
+        return [
+            self.head,
+            current_goal,
+            self.common_rule,
+            event_history,
+            _CHAT_HISTORY_HEADER,
+            chat_history,
+            _CHAT_STATUS_HEADER,
+            chat_status,
+            _FLAGS_HEADER,
+            flags_format,
+            _ACTION_PLAN_HEADER,
+            action_plan,
+            _SUMMARIES_HEADER,
+            summaries,
+            self.tail,
+            time.strftime('%c'),
+            _MASTER_INPUT,
+        ]
+
+    def render(self, **kwargs: Any) -> str:
+        """動的な部分を差し込んでプロンプトを完成させる"""
+        return "".join(self.chunks(**kwargs))
+
+
+_CURRENT_GOAL_HEADER = """
+
+
+### CURRENT GOAL : You must focus on this goal.
+"""
+
+_EVENT_HISTORY_HEADER = """
 
 
 ### (IMPORTANT!) EVENT HISTORY : You can reference this to understand the context of the whole process, the lager number means the latest event.
-{event_history}
+"""
+
+_OTHER_CONTEXT_HEADER = """
+
+
+### OTHER CONTEXT
+・The current time and date is """
+
+_CHAT_HISTORY_HEADER = """
 
 
 ### CHAT HISTORY : You can reference this to understand the context of the dialog between you and END_USER.
-{chat_history}
+"""
+
+_CHAT_STATUS_HEADER = """
 
 
 ### CHAT_STATUS : You should be mindful of sending too many consecutive messages without user input, as this can be frustrating. 
     A large negative number means you are not responding enough, and a large positive number means you are responding too much.
     you had not better to choose wait sequencily under minas condition, because that mean YOU ARE IGNORE YOUSER!!
-{
-    json.dumps({
-    "is_new_response_from_user_came": is_new_response_from_user_came,
-    "consecuentive_message_number": consecutive_message_number,
-    "waiting_info": waiting_info
-    }, indent=4)
-}
+"""
+
+_FLAGS_HEADER = """
 
 
 ### FLAGS
 Since the flags only remains active for one step, I strongly recommend taking action the moment it’s observed.
-{flags_format}
-
-
-### ACTION PLAN : Detail plan for the current goal, projected by master system.
-{action_plan}
+"""
 
+_ACTION_PLAN_HEADER = """
 
-### SUMMARYS : Summarys of whole dialogs. You can check the pairs of previous (goal ,result).
-{summaries}
 
+### ACTION PLAN : Detail plan for the current goal, projected by master system.
+"""
 
-### TOOLS
-{formatted_tools}
-
+_SUMMARIES_HEADER = """
 
-### OUTPUT FORMAT & RULE
-Your decisions must always be made independently without seeking user assistance.
-Play to your strengths as an LLM and pursue simple strategies with no legal complications.
-{response_format}
 
+### SUMMARYS : Summarys of whole dialogs. You can check the pairs of previous (goal ,result).
+"""
 
-### OTHER CONTEXT
-・The current time and date is {time.strftime('%c')}
+_MASTER_INPUT = """
 
 ### MASTER INPUT
 Determine which next command to use, 
 and respond using the format specified above:
-"""
\ No newline at end of file
+"""
@@ -0,0 +1,199 @@
+import asyncio
+import json
+import logging
+import os
+import threading
+from itertools import islice
+from typing import Any, Callable, Generic, Iterator, List, Optional, TypeVar, Union
+
+from .custom_congif import HISTORY_HOT_WINDOW
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class BoundedHistory(Generic[T]):
+    """最新の一定件数だけをメモリに置き、古い要素をファイルに追い出す履歴
+
+    追い出した要素はルームごとの追記専用のJSONLファイルに書き、
+    インデックスやスライスでそこを参照したときだけファイルから読み戻す。
+    append / len / インデックス / スライス / 反復はリストと同じように使える。
+    spill_path を指定しない場合は追い出さず、通常のリストと同じく全件をメモリに置く。
+
+    イベントループの中ではファイルへの書き込みをスレッドで行い、書き終わるまでは
+    追い出す要素もメモリに残す（読み出しは常に書き終わった範囲だけをファイルから読む）。
+
+    Args:
+        spill_path (Optional[str]): 追い出し先のファイル
+        max_in_memory (int): メモリに置く最大件数
+        serialize (Callable[[T], Any]): 要素をJSONに変換する関数
+        deserialize (Callable[[Any], T]): JSONから要素を復元する関数
+        sizeof (Optional[Callable[[T], int]]): 要素のおおよそのバイト数（メモリにある分の合計を hot_bytes で数える）
+    """
+    def __init__(
+        self,
+        spill_path: Optional[str] = None,
+        max_in_memory: int = HISTORY_HOT_WINDOW,
+        serialize: Callable[[T], Any] = lambda item: item,
+        deserialize: Callable[[Any], T] = lambda data: data,
+        sizeof: Optional[Callable[[T], int]] = None,
+    ):
+        self.spill_path = spill_path
+        self.max_in_memory = max(max_in_memory, 1)
+        self._serialize = serialize
+        self._deserialize = deserialize
+        self._sizeof = sizeof
+        self._hot: List[T] = []
+        self._hot_bytes = 0
+        self._spilled = 0
+        self._spill_task: Optional[asyncio.Task] = None
+        # clear() で増やし、クリア前に始まった書き込みを捨てる
+        self._generation = 0
+        self._file_lock = threading.Lock()
+
+    @property
+    def spilled_count(self) -> int:
+        """ファイルに追い出した件数"""
+        return self._spilled
+
+    @property
+    def hot(self) -> List[T]:
+        """メモリにある最新の要素"""
+        return self._hot
+
+    @property
+    def hot_bytes(self) -> int:
+        """メモリにある要素のおおよそのバイト数（sizeof を指定しない場合は0）"""
+        return self._hot_bytes
+
+    def append(self, item: T) -> None:
+        """要素を追加し、メモリの上限を超えたら古い要素をまとめて追い出す"""
+        self._hot.append(item)
+        if self._sizeof is not None:
+            self._hot_bytes += self._sizeof(item)
+        if not self.spill_path or len(self._hot) <= self.max_in_memory:
+            return
+        if self._spill_task is not None and not self._spill_task.done():
+            # 書き込み中の分が終わってから、たまった分をまとめて追い出す
+            return
+        # 1件ずつ書くとファイルを開く回数が増えるため、上限の1/4ずつまとめて追い出す
+        count = len(self._hot) - self.max_in_memory + self.max_in_memory // 4
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self._spill(count)
+            return
+        self._spill_task = loop.create_task(self._spill_in_background(count, self._generation))
+
+    def _serialize_lines(self, count: int) -> Optional[List[str]]:
+        try:
+            return [json.dumps(self._serialize(item), ensure_ascii=False) + "\n" for item in self._hot[:count]]
+        except (TypeError, ValueError) as e:
+            logger.warning(f"Failed to serialize history for {self.spill_path}: {e}")
+            return None
+
+    def _write_lines(self, lines: List[str], generation: int) -> bool:
+        """追い出し先のファイルに追記する（スレッドから呼ばれる）"""
+        with self._file_lock:
+            if generation != self._generation:
+                return False
+            try:
+                os.makedirs(os.path.dirname(self.spill_path) or ".", exist_ok=True)
+                with open(self.spill_path, "a", encoding="utf-8") as f:
+                    f.writelines(lines)
+            except OSError as e:
+                # 書き出せない場合はメモリに置いたままにする
+                logger.warning(f"Failed to spill history to {self.spill_path}: {e}")
+                return False
+            return True
+
+    def _spill(self, count: int) -> None:
+        lines = self._serialize_lines(count)
+        if lines is not None and self._write_lines(lines, self._generation):
+            self._drop_spilled(count)
+
+    async def _spill_in_background(self, count: int, generation: int) -> None:
+        while generation == self._generation:
+            lines = self._serialize_lines(count)
+            if lines is None:
+                return
+            written = await asyncio.to_thread(self._write_lines, lines, generation)
+            if not written or generation != self._generation:
+                return
+            self._drop_spilled(count)
+            # 書いている間に上限を超えた分があれば続けて追い出す
+            if len(self._hot) <= self.max_in_memory:
+                return
+            count = len(self._hot) - self.max_in_memory + self.max_in_memory // 4
+
+    def _drop_spilled(self, count: int) -> None:
+        """ファイルに書き終えた先頭の count 件をメモリから外す"""
+        if self._sizeof is not None:
+            self._hot_bytes -= sum(self._sizeof(item) for item in self._hot[:count])
+        del self._hot[:count]
+        self._spilled += count
+
+    async def wait_for_spill(self) -> None:
+        """実行中の追い出しが終わるまで待つ"""
+        if self._spill_task is not None:
+            await asyncio.gather(self._spill_task, return_exceptions=True)
+
+    def iter_spilled(self, start: int = 0, stop: Optional[int] = None) -> Iterator[T]:
+        """ファイルに追い出した要素を古い順に遅延で読み出す"""
+        stop = self._spilled if stop is None else min(stop, self._spilled)
+        if not self.spill_path or start >= stop:
+            return
+        with open(self.spill_path, encoding="utf-8") as f:
+            for line in islice(f, start, stop):
+                yield self._deserialize(json.loads(line))
+
+    def __len__(self) -> int:
+        return self._spilled + len(self._hot)
+
+    def __bool__(self) -> bool:
+        return len(self) > 0
+
+    def __iter__(self) -> Iterator[T]:
+        yield from self.iter_spilled()
+        yield from self._hot
+
+    def __reversed__(self) -> Iterator[T]:
+        yield from reversed(self._hot)
+        if self._spilled:
+            yield from reversed(list(self.iter_spilled()))
+
+    def __getitem__(self, index: Union[int, slice]) -> Union[T, List[T]]:
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step != 1:
+                return list(self)[index]
+            if start >= self._spilled:
+                return self._hot[start - self._spilled:stop - self._spilled]
+            items = list(self.iter_spilled(start, stop))
+            return items + self._hot[:max(stop - self._spilled, 0)]
+
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("history index out of range")
+        if index >= self._spilled:
+            return self._hot[index - self._spilled]
+        return next(self.iter_spilled(index, index + 1))
+
+    def clear(self) -> None:
+        """全件を削除し、追い出し先のファイルも消す"""
+        self._generation += 1
+        self._spill_task = None
+        self._hot.clear()
+        self._hot_bytes = 0
+        self._spilled = 0
+        if not self.spill_path:
+            return
+        # 書き込み中のスレッドが終わるのを待ってから消す（以降の古い書き込みは generation で捨てられる）
+        with self._file_lock:
+            if os.path.exists(self.spill_path):
+                try:
+                    os.remove(self.spill_path)
+                except OSError as e:
+                    logger.warning(f"Failed to remove history file {self.spill_path}: {e}")
@@ -1,3 +1,49 @@
+import os
+import tempfile
+
 MODEL = "gpt-4o-mini-2024-07-18"
 #MODEL="gpt-3.5-turbo-1106"
-MAX_TOKEN_WINDOW = 10000
\ No newline at end of file
+MAX_TOKEN_WINDOW = 10000
+# MAX_TOKEN_WINDOW を超える場合でもプロンプトに必ず残す最新の履歴件数
+MIN_RECENT_EVENTS = 10
+MIN_RECENT_MESSAGES = 6
+# 履歴を削るときの単位（行数）. 削る位置がこの件数ごとにしか変わらないため、その間はプロンプトの先頭が変わらない
+HISTORY_TRIM_BLOCK = int(os.getenv("HISTORY_TRIM_BLOCK", "16"))
+# 先読みしたプランを使えるのは、先読み後に届いたユーザーメッセージがこの件数未満の間だけ
+PLAN_PREFETCH_MAX_NEW_MESSAGES = 2
+# チャット履歴の圧縮: 最新のこの件数はそのまま残し、それより古いメッセージは要約に畳み込む
+CHAT_KEEP_RECENT_MESSAGES = 20
+# 未圧縮のメッセージがこの件数たまるごとにバックグラウンドで要約を更新する
+CHAT_COMPACTION_BATCH = 10
+# ルームごとの履歴（メッセージ・イベントなど）をメモリに置く最大件数. 古いものは HISTORY_SPILL_DIR のファイルに追い出す
+HISTORY_HOT_WINDOW = int(os.getenv("HISTORY_HOT_WINDOW", "200"))
+HISTORY_SPILL_DIR = os.getenv("HISTORY_SPILL_DIR", os.path.join(tempfile.gettempdir(), "autogpt_history"))
+# ルームの最終アクティブ時刻をストアに保存する最短間隔（秒）. それより短い間の更新はメモリだけで行う
+ROOM_ACTIVITY_SAVE_INTERVAL = float(os.getenv("ROOM_ACTIVITY_SAVE_INTERVAL", "60"))
+# この分数以上の wait を選んだエージェントは、待機中はメモリから解放して HibernationScheduler から起こす
+HIBERNATE_MIN_WAIT_MINUTES = float(os.getenv("HIBERNATE_MIN_WAIT_MINUTES", "2"))
+# ルームごとの送信キューに保持する未送信メッセージの上限と、あふれたときの動作（block / drop_oldest / drop_newest / close）
+OUTBOUND_QUEUE_SIZE = int(os.getenv("OUTBOUND_QUEUE_SIZE", "256"))
+OUTBOUND_OVERFLOW_POLICY = os.getenv("OUTBOUND_OVERFLOW_POLICY", "block")
+# 連投されたユーザーメッセージをまとめる待ち時間（秒）. 連投の間隔 × INPUT_COALESCE_GAP_FACTOR を MIN〜MAX に収める
+# INPUT_COALESCE_MIN_WINDOW=0 にするとまとめずに1通ごとにエージェントを動かす
+INPUT_COALESCE_MIN_WINDOW = float(os.getenv("INPUT_COALESCE_MIN_WINDOW", "0.8"))
+INPUT_COALESCE_MAX_WINDOW = float(os.getenv("INPUT_COALESCE_MAX_WINDOW", "4"))
+INPUT_COALESCE_GAP_FACTOR = float(os.getenv("INPUT_COALESCE_GAP_FACTOR", "1.5"))
+# 連投が続いていても、最初のメッセージからこの秒数たったら1回の発言として確定させる
+INPUT_COALESCE_MAX_HOLD = float(os.getenv("INPUT_COALESCE_MAX_HOLD", "10"))
+# 決定ステップのLLM呼び出し中に new_message_come が届いたときに、呼び出しを取り消して最新の履歴でやり直すか
+#   always:        常にやり直す
+#   never:         やり直さない
+#   max_tokens:N:  生成したトークン（ストリームのチャンク）が N 未満の場合だけやり直す
+#   before_reply:  返信の本文をまだ送信し始めていない場合だけやり直す
+DECISION_PREEMPT_POLICY = os.getenv("DECISION_PREEMPT_POLICY", "before_reply")
+# 1つの決定ステップでやり直す最大回数. 超えたら新着メッセージが届いても最後まで生成する（メッセージが続いても進むように）
+DECISION_MAX_PREEMPTIONS = int(os.getenv("DECISION_MAX_PREEMPTIONS", "3"))
+# 同時に実行するヒアリングの上限（0 は無制限）. 超えた分は到着順に待たせ、queued フレームで順番を知らせる
+MAX_ACTIVE_HEARINGS = int(os.getenv("MAX_ACTIVE_HEARINGS", "50"))
+# 返信のLLM呼び出しがこの件数以上待っている間は、新しいヒアリングを開始しない（0 は見ない）
+ADMISSION_MAX_LLM_QUEUE = int(os.getenv("ADMISSION_MAX_LLM_QUEUE", "16"))
+ADMISSION_RECHECK_SECONDS = float(os.getenv("ADMISSION_RECHECK_SECONDS", "1"))
+# 起動時のウォームアップ（LLMへの接続・プロンプト・最初のゴールのプラン）を待つ最大秒数
+WARMUP_TIMEOUT_SECONDS = float(os.getenv("WARMUP_TIMEOUT_SECONDS", "60"))
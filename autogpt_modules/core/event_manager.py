@@ -1,9 +1,20 @@
+import asyncio
+import sys
 from datetime import datetime
-from typing import Dict, List, Any
+from typing import Dict, List, Any, Iterable, Optional
+
+from .bounded_history import BoundedHistory
+from .custom_congif import HISTORY_HOT_WINDOW
+from .session_store import RoomSession, RECORD_EVENT
+
+# ゴール完了を示すイベントのaction名（プロンプトの予算調整でも削らない）
+GOAL_COMPLETED_ACTION = "***PREVIOUS_GOAL_COMPLETED***"
+
 
 class Event:
     """単一のイベントを表現するクラス"""
-    def __init__(self, action: str, purpose: str=None, result: str=None):
+    def __init__(self, action: str, purpose: str=None, result: str=None, seq: int=0):
+        self.seq = seq
         self.time = datetime.now().strftime("%H:%M:%S")
         self.action = action
         self.purpose = purpose if purpose else ""
@@ -18,12 +29,55 @@ class Event:
             "result": self.result
         }
 
+    def to_record(self) -> Dict[str, Any]:
+        """保存用にシーケンス番号を含めた辞書に変換"""
+        return {**self.to_dict(), "seq": self.seq}
+
+    @classmethod
+    def from_record(cls, data: Dict[str, Any]) -> "Event":
+        """to_record の結果からイベントを復元"""
+        event = cls(data["action"], data.get("purpose"), data.get("result"), seq=data.get("seq", 0))
+        event.time = data.get("time", event.time)
+        return event
+
+class EventCursor:
+    """EventManagerの差分読み出し用カーソル
+
+    前回読み出した位置を保持し、それ以降に追加されたイベントだけを返す。
+    """
+    def __init__(self, event_manager: "EventManager", seq: int = 0):
+        self._event_manager = event_manager
+        self.seq = seq
+
+    def read(self) -> List[Event]:
+        """前回の読み出し以降に追加されたイベントを取得して位置を進める"""
+        events = self._event_manager.events_since(self.seq)
+        if events:
+            self.seq = events[-1].seq
+        return events
+
+
 class EventManager:
     """イベント履歴を管理するクラス"""
-    def __init__(self):
-        self._event_history: List[Event] = []
+    def __init__(
+        self,
+        spill_path: Optional[str] = None,
+        max_in_memory: int = HISTORY_HOT_WINDOW,
+        session: Optional[RoomSession] = None,
+    ):
+        self._session = session
+        # 古いイベントは spill_path に追い出し、参照されたときだけ読み戻す
+        self._event_history: BoundedHistory[Event] = BoundedHistory(
+            spill_path, max_in_memory, serialize=Event.to_record, deserialize=Event.from_record,
+            sizeof=lambda event: sys.getsizeof(event.action) + sys.getsizeof(event.purpose) + sys.getsizeof(event.result),
+        )
+        self._last_seq = 0
+        # 履歴の先頭より前のシーケンス番号（clear 後もシーケンス番号は連番のまま続ける）
+        self._first_seq = 0
         self._listeners = {}
         self._new_messages = False
+        # action名 -> そのactionを待っているFutureのリスト
+        self._waiters: Dict[str, List[asyncio.Future]] = {}
         
     async def add_event(self, action: str, purpose: str=None, result: str=None) -> None:
         """イベント履歴に新しいイベントを追加
@@ -33,8 +87,62 @@ class EventManager:
             purpose (str): アクションの目的
             result (str): アクションの結果
         """
-        event = Event(action, purpose, result)
+        self._last_seq += 1
+        event = Event(action, purpose, result, seq=self._last_seq)
         self._event_history.append(event)
+        if self._session:
+            self._session.record(RECORD_EVENT, event.to_record())
+        self._notify_waiters(event)
+
+    def restore(self, records: List[Dict[str, Any]]) -> None:
+        """保存されていたイベントを復元（ストアには記録し直さない）
+
+        履歴が空の状態で復元する場合は、先頭のイベントのシーケンス番号から events_since の位置を合わせる
+        （clear 後に記録されたイベントは 1 から始まらない）。
+        """
+        if records and len(self._event_history) == 0:
+            self._first_seq = Event.from_record(records[0]).seq - 1
+        for data in records:
+            event = Event.from_record(data)
+            self._event_history.append(event)
+            self._last_seq = max(self._last_seq, event.seq)
+
+    def _notify_waiters(self, event: Event) -> None:
+        """このactionを待っているwait_for_eventを起こす"""
+        waiters = self._waiters.pop(event.action, None)
+        if not waiters:
+            return
+        for future in waiters:
+            if not future.done():
+                future.set_result(event)
+
+    async def wait_for_event(self, actions: Iterable[str], timeout: Optional[float] = None) -> Optional[Event]:
+        """指定したactionのイベントが追加されるまで待機する
+
+        ポーリングせずにadd_eventから直接起こされるため、待機中はCPUを消費しない。
+
+        Args:
+            actions (Iterable[str]): 待機対象のaction名
+            timeout (Optional[float]): 最大待機秒数. Noneの場合は無期限
+
+        Returns:
+            Optional[Event]: 発生したイベント. タイムアウトした場合はNone
+        """
+        actions = list(actions)
+        future = asyncio.get_running_loop().create_future()
+        for action in actions:
+            self._waiters.setdefault(action, []).append(future)
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            return None
+        finally:
+            for action in actions:
+                waiters = self._waiters.get(action)
+                if waiters and future in waiters:
+                    waiters.remove(future)
+                    if not waiters:
+                        del self._waiters[action]
     
     def get_event_history(self) -> List[Dict[str, str]]:
         """イベント履歴を取得
@@ -44,6 +152,38 @@ class EventManager:
         """
         return [event.to_dict() for event in self._event_history]
     
+    @property
+    def last_seq(self) -> int:
+        """最後に追加されたイベントのシーケンス番号（未追加なら0）"""
+        return self._last_seq
+
+    def events_since(self, seq: int) -> List[Event]:
+        """指定したシーケンス番号より後のイベントを取得
+
+        シーケンス番号は1から連番で振られるため、古いイベントを変換・コピーせずに
+        新しいイベントだけを取り出せる。
+
+        Args:
+            seq (int): 最後に読み出したイベントのシーケンス番号
+
+        Returns:
+            List[Event]: seqより後に追加されたイベントのリスト
+        """
+        return self._event_history[max(seq - self._first_seq, 0):]
+
+    def memory_bytes(self) -> int:
+        """メモリに置いているイベントのおおよそのバイト数（ファイルに追い出した分は含まない）"""
+        return self._event_history.hot_bytes
+
+    def clear(self) -> None:
+        """イベント履歴を削除（追い出したファイルも消す）"""
+        self._event_history.clear()
+        self._first_seq = self._last_seq
+
+    def cursor(self, seq: int = 0) -> EventCursor:
+        """差分読み出し用のカーソルを作成"""
+        return EventCursor(self, seq)
+
     async def emit(self, event_name: str, data: Any = None) -> None:
         if event_name == "new_message":
             self._new_messages = True
@@ -0,0 +1,148 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 起こした理由
+WAKE_BY_TIMER = "timer"
+WAKE_BY_MESSAGE = "new_message_come"
+
+
+class HibernationScheduler:
+    """待機中のエージェントの起床時刻をまとめて管理するスケジューラ
+
+    長い wait を選んだエージェントはチェックポイントを保存してメモリから解放され、
+    ここに起床時刻だけを登録する。1つのタイマータスクが最も早い起床時刻まで眠り、
+    時刻になるか wake() で新着メッセージを通知されると、on_wake(room_id, reason) を呼んで
+    エージェントを作り直させる。
+
+    起床時刻は壁時計（time.time()）で持つため、チェックポイントに保存しておけば
+    再起動後も同じ時刻に起こせる。
+
+    Args:
+        on_wake (Optional[Callable[[str, str], Any]]): 起床時に呼ぶ関数 (room_id, 理由)
+    """
+    def __init__(self, on_wake: Optional[Callable[[str, str], Any]] = None):
+        self._on_wake = on_wake
+        # (起床時刻, 登録番号, room_id). 登録し直した古い要素は取り出したときに読み捨てる
+        self._heap: List[Tuple[float, int, str]] = []
+        self._entries: Dict[str, Tuple[float, int]] = {}
+        self._counter = itertools.count()
+        self._changed = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._stats: Dict[str, int] = {
+            "hibernated": 0,
+            "woken_by_timer": 0,
+            "woken_by_message": 0,
+            "cancelled": 0,
+            "wake_failures": 0,
+        }
+
+    def set_wake_handler(self, on_wake: Callable[[str, str], Any]) -> None:
+        """起床時に呼ぶ関数を設定"""
+        self._on_wake = on_wake
+
+    def hibernate(self, room_id: str, wake_at: float) -> None:
+        """ルームのエージェントを起床時刻まで眠らせる
+
+        Args:
+            room_id (str): ルームID
+            wake_at (float): 起床時刻（time.time() の値）
+        """
+        token = next(self._counter)
+        self._entries[room_id] = (wake_at, token)
+        heapq.heappush(self._heap, (wake_at, token, room_id))
+        self._stats["hibernated"] += 1
+        # 先頭が変わった場合に備えてタイマーを張り直す
+        self._changed.set()
+
+    def is_hibernating(self, room_id: str) -> bool:
+        """ルームのエージェントが眠っているか"""
+        return room_id in self._entries
+
+    def wake(self, room_id: str, reason: str = WAKE_BY_MESSAGE) -> bool:
+        """眠っているエージェントをすぐに起こす
+
+        Returns:
+            bool: 眠っていたエージェントを起こした場合True
+        """
+        if self._entries.pop(room_id, None) is None:
+            return False
+        self._stats["woken_by_timer" if reason == WAKE_BY_TIMER else "woken_by_message"] += 1
+        if self._on_wake is None:
+            return True
+        try:
+            self._on_wake(room_id, reason)
+        except Exception as e:
+            self._stats["wake_failures"] += 1
+            logger.error(f"Failed to wake agent for room {room_id}: {e}")
+        return True
+
+    def cancel(self, room_id: str) -> bool:
+        """起こさずに登録を取り消す（セッションが終了した場合など）"""
+        if self._entries.pop(room_id, None) is None:
+            return False
+        self._stats["cancelled"] += 1
+        return True
+
+    def _next_deadline(self) -> Optional[float]:
+        """登録し直された古い要素を読み捨て、最も早い起床時刻を返す"""
+        while self._heap:
+            wake_at, token, room_id = self._heap[0]
+            if self._entries.get(room_id) == (wake_at, token):
+                return wake_at
+            heapq.heappop(self._heap)
+        return None
+
+    def wake_due(self, now: Optional[float] = None) -> int:
+        """起床時刻を過ぎたエージェントを起こす
+
+        Returns:
+            int: 起こしたエージェント数
+        """
+        now = time.time() if now is None else now
+        woken = 0
+        while True:
+            deadline = self._next_deadline()
+            if deadline is None or deadline > now:
+                return woken
+            _, _, room_id = heapq.heappop(self._heap)
+            if self.wake(room_id, WAKE_BY_TIMER):
+                woken += 1
+
+    async def _run(self) -> None:
+        while True:
+            self._changed.clear()
+            deadline = self._next_deadline()
+            timeout = None if deadline is None else max(deadline - time.time(), 0)
+            try:
+                await asyncio.wait_for(self._changed.wait(), timeout=timeout)
+                continue
+            except asyncio.TimeoutError:
+                pass
+            self.wake_due()
+
+    def start(self) -> None:
+        """タイマーのタスクを開始する"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """タイマーのタスクを止める（登録は残す）"""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def stats(self) -> Dict[str, Any]:
+        """眠っているエージェント数と起床の累計を取得"""
+        deadline = self._next_deadline()
+        return {
+            "hibernating": len(self._entries),
+            "next_wake_in": None if deadline is None else max(deadline - time.time(), 0),
+            **self._stats,
+        }
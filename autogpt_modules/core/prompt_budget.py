@@ -0,0 +1,119 @@
+from typing import Callable, Dict, List, Optional, Union
+import logging
+
+logger = logging.getLogger(__name__)
+
+# 削った行の代わりに入れる行. 件数を含めず、削る量が変わってもプロンプトの先頭が変わらないようにする
+OMITTED_MARKER = "(... older entries omitted to fit the token budget ...)"
+
+
+class BudgetSection:
+    """トークン予算に合わせて削ることのできる可変セクション
+
+    Args:
+        name (str): セクション名
+        lines (List[str]): 古い順に並んだ行
+        pinned (Optional[List[bool]]): Trueの行は削らない
+        min_keep (int): 末尾（最新）から必ず残す行数
+        trim_block (int): 削る行数をこの単位に切り上げる. 追記されていく履歴では、
+            1ステップごとに1行ずつ削ると毎回先頭が変わりプレフィックスキャッシュが効かないため、
+            まとめて削って次の trim_block 行が追加されるまで先頭を変えない
+    """
+    def __init__(
+        self,
+        name: str,
+        lines: List[str],
+        pinned: Optional[List[bool]] = None,
+        min_keep: int = 0,
+        trim_block: int = 1,
+    ):
+        self.name = name
+        self.lines = lines
+        self.pinned = pinned if pinned is not None else [False] * len(lines)
+        self.min_keep = min_keep
+        self.trim_block = max(trim_block, 1)
+
+
+class TokenBudgeter:
+    """プロンプト全体がsend_token_limitに収まるように可変セクションを間引くクラス
+
+    固定部分のトークン数を差し引いた残りを可変セクションに割り当て、
+    超過した場合は渡された順にセクションの古い行から、セクションの trim_block 単位で削る。
+    行ごとのトークン数はキャッシュされるため、追記されていくだけの履歴は
+    新しい行だけを数えればよい。
+    """
+    _MAX_CACHE_SIZE = 8192
+
+    def __init__(self, token_counter: Callable[[str], int], send_token_limit: int):
+        self._token_counter = token_counter
+        self.send_token_limit = send_token_limit
+        self._cache: Dict[str, int] = {}
+        self._counter_failed = False
+
+    def count(self, text: str) -> int:
+        """テキストのトークン数を取得（キャッシュ付き）"""
+        tokens = self._cache.get(text)
+        if tokens is not None:
+            return tokens
+
+        try:
+            tokens = self._token_counter(text) if not self._counter_failed else len(text) // 2 + 1
+        except Exception as e:
+            # トークナイザが使えない場合は文字数からおおよその値を見積もる
+            logger.warning(f"Token counter failed, falling back to length estimate: {e}")
+            self._counter_failed = True
+            tokens = len(text) // 2 + 1
+
+        if len(self._cache) >= self._MAX_CACHE_SIZE:
+            self._cache.clear()
+        self._cache[text] = tokens
+        return tokens
+
+    def fit(self, fixed_text: Union[str, List[str]], sections: List[BudgetSection]) -> Dict[str, List[str]]:
+        """可変セクションを予算内に収める
+
+        Args:
+            fixed_text (Union[str, List[str]]): 可変セクションを空にしたときのプロンプト.
+                断片のリストを渡した場合は断片ごとにトークン数を数える
+            sections (List[BudgetSection]): 削る優先度の高い順に並んだ可変セクション
+
+        Returns:
+            Dict[str, List[str]]: セクション名 -> 予算内に収めた行
+        """
+        if isinstance(fixed_text, str):
+            fixed_tokens = self.count(fixed_text)
+        else:
+            fixed_tokens = sum(self.count(chunk) for chunk in fixed_text)
+        available = self.send_token_limit - fixed_tokens
+        line_tokens = {
+            section.name: [self.count(line) for line in section.lines]
+            for section in sections
+        }
+        total = sum(sum(tokens) for tokens in line_tokens.values())
+
+        fitted: Dict[str, List[str]] = {}
+        for section in sections:
+            tokens = line_tokens[section.name]
+            droppable_until = max(len(section.lines) - section.min_keep, 0)
+            candidates = [i for i in range(droppable_until) if not section.pinned[i]]
+            dropped = set()
+            for i in candidates:
+                # 予算に収まっても、削った行数が trim_block の倍数になるまでは削り続ける
+                if total <= available and len(dropped) % section.trim_block == 0:
+                    break
+                dropped.add(i)
+                total -= tokens[i]
+
+            if dropped:
+                kept = [line for i, line in enumerate(section.lines) if i not in dropped]
+                kept.insert(0, OMITTED_MARKER)
+                fitted[section.name] = kept
+            else:
+                fitted[section.name] = section.lines
+
+        if total > available:
+            logger.warning(
+                f"Prompt exceeds send_token_limit even after trimming: "
+                f"{self.send_token_limit - available + total} > {self.send_token_limit}"
+            )
+        return fitted
@@ -1,25 +1,208 @@
+import asyncio
+import os
+import re
+import sys
 from datetime import datetime, timedelta
-from typing import Dict, Optional
+from typing import Any, Callable, Dict, List, Optional
 
 from autogpt_modules.core.event_manager import EventManager
+from autogpt_modules.core.custom_congif import HISTORY_SPILL_DIR, ROOM_ACTIVITY_SAVE_INTERVAL
+from autogpt_modules.core.session_store import (
+    SessionStore,
+    RECORD_MESSAGE,
+    RECORD_EVENT,
+    RECORD_PLAN,
+    RECORD_RESULT,
+    RECORD_RUN,
+    RECORD_CHECKPOINT,
+)
 
 from autogpt_modules.communication.message_manager import MessageManager
 from autogpt_modules.communication.plan_manager import ActionPlanManager
 from autogpt_modules.communication.result_manager import ResultManager
+from autogpt_modules.communication.chat_compactor import ChatCompactor
+from autogpt_modules.communication.outbound_queue import OutboundQueue
+from autogpt_modules.communication.input_coalescer import InputCoalescer
 
 
 class Room:
-    def __init__(self, user_id: str):
-        self.id = f"room_{user_id}_{datetime.now().timestamp()}"
+    def __init__(
+        self,
+        user_id: str,
+        room_id: Optional[str] = None,
+        session_store: Optional[SessionStore] = None,
+        last_active: Optional[datetime] = None,
+    ):
+        self.id = room_id or f"room_{user_id}_{datetime.now().timestamp()}"
         self.user_id = user_id
-        self.message_manager = MessageManager()
-        self.event_manager = EventManager()
+        # 履歴はストアにも記録し、プロセスが再起動しても復元できるようにする
+        self.session_store = session_store
+        session = session_store.session(self.id) if session_store else None
+        # 長いセッションでも履歴がメモリに残り続けないよう、古い要素はルームごとのファイルに追い出す
+        self.message_manager = MessageManager(spill_path=self.history_path("messages"), session=session)
+        self.event_manager = EventManager(spill_path=self.history_path("events"), session=session)
         self.autogpt : Optional["AutoGPT"] = None
-        self.last_active = datetime.now()
+        self.last_active = last_active or datetime.now()
+        # 最後にストアへ保存した last_active（update_activity の保存を間引くのに使う）
+        self._saved_active = self.last_active
         self.new_message_flag = False
-        self.plan_manager = ActionPlanManager()
-        self.result_manager = ResultManager()
+        self.plan_manager = ActionPlanManager(spill_path=self.history_path("plans"), session=session)
+        self.result_manager = ResultManager(spill_path=self.history_path("results"), session=session)
+        self.chat_compactor = ChatCompactor(self.message_manager, room_id=self.id)
+        self.websocket: Optional[Any] = None
+        # ツールからの送信は送信キューに積み、専用のタスクが websocket に書き込む
+        self.outbound = OutboundQueue(self._send_to_socket, on_close=self._close_slow_socket)
+        # 連投されたメッセージは1回の発言にまとめてから履歴に追加し、new_message_come を発火する
+        self.input_coalescer = InputCoalescer(self._commit_user_turn)
+        # 発言を確定したときに呼ぶ関数（休止中のエージェントを起こすなど）
+        self.on_user_turn: Optional[Callable[[], Any]] = None
+        # AutoGPT.run を実行しているタスク（ルームを破棄するときに取り消す）
+        self.agent_task: Optional[asyncio.Task] = None
+        # 実行中のゴール一覧と、最後のステップのチェックポイント（AutoGPT.resume で使う）
+        self.run_config: Optional[Dict[str, Any]] = None
+        self.checkpoint: Optional[Dict[str, Any]] = None
+        # 復元したルーム（last_active を指定した場合）は保存済みのため、保存し直さない
+        if last_active is None:
+            self.save()
+
+    @classmethod
+    async def restore(cls, session_store: SessionStore, meta: Dict[str, Any]) -> "Room":
+        """ストアに保存されていたルームを復元する
+
+        Args:
+            session_store (SessionStore): 保存先のストア
+            meta (Dict[str, Any]): load_room / find_latest_room で読み出したメタデータ
+        """
+        # 最後に使われた時刻を引き継ぎ、再起動のたびに有効期限が延びないようにする
+        room = cls(
+            meta["user_id"],
+            room_id=meta["room_id"],
+            session_store=session_store,
+            last_active=datetime.fromtimestamp(meta["last_active"]),
+        )
+        # 前のプロセスが追い出したファイルは使わず、ストアの内容から作り直す
+        room.message_manager.clear()
+        room.event_manager.clear()
+        room.plan_manager.clear()
+        room.result_manager.clear()
+
+        records = await session_store.load_records(room.id)
+        room.message_manager.restore(records.get(RECORD_MESSAGE, []))
+        room.event_manager.restore(records.get(RECORD_EVENT, []))
+        room.plan_manager.restore(records.get(RECORD_PLAN, []))
+        room.result_manager.restore(records.get(RECORD_RESULT, []))
+        if records.get(RECORD_RUN):
+            room.run_config = records[RECORD_RUN][-1]
+        data = meta.get("data") or {}
+        if "checkpoint" in data:
+            room.checkpoint = data["checkpoint"]
+        elif records.get(RECORD_CHECKPOINT):
+            # 以前の形式（チェックポイントを履歴に追記していたストア）
+            room.checkpoint = records[RECORD_CHECKPOINT][-1]
+        return room
+
+    def save(self) -> None:
+        """ルームのメタデータをストアに保存する"""
+        if self.session_store:
+            self.session_store.save_room(
+                self.id, self.user_id, self.last_active.timestamp(), data={"checkpoint": self.checkpoint}
+            )
+        self._saved_active = self.last_active
+
+    def save_run_config(self, goals: List[str], common_rule: str) -> None:
+        """実行を開始したゴール一覧を保存する"""
+        self.run_config = {"goals": goals, "common_rule": common_rule}
+        self.checkpoint = None
+        if self.session_store:
+            self.session_store.record(self.id, RECORD_RUN, self.run_config)
+            self.save()
+
+    def save_checkpoint(self, checkpoint: Dict[str, Any]) -> None:
+        """エージェントのステップごとのチェックポイントを保存する
+
+        履歴には追記せず、ルームのメタデータ（data 列）の最新の1件を上書きする。
+        """
+        self.checkpoint = checkpoint
+        self.save()
+
+    def has_resumable_run(self) -> bool:
+        """途中で止まった実行があるか"""
+        return (
+            self.run_config is not None
+            and (self.checkpoint is None or self.checkpoint.get("status") == "running")
+            and (self.agent_task is None or self.agent_task.done())
+        )
+
+    async def add_user_message(self, content: str) -> None:
+        """ユーザーのメッセージを受け取る（連投は InputCoalescer でまとめてから確定させる）"""
+        await self.input_coalescer.add(content)
+
+    async def _commit_user_turn(self, content: str, fragments: int) -> None:
+        await self.message_manager.add_message(content, "user")
+        await self.event_manager.add_event("new_message_come", result=content)
+        if self.on_user_turn is not None:
+            self.on_user_turn()
+
+    async def _send_to_socket(self, message: str) -> None:
+        websocket = self.websocket
+        if websocket is None:
+            raise ConnectionError(f"WebSocket is not connected for room {self.id}")
+        await websocket.send_text(message)
+
+    def _close_slow_socket(self) -> None:
+        """送信キューがあふれたクライアントとの接続を閉じる（再接続すれば同じルームを使える）"""
+        websocket, self.websocket = self.websocket, None
+        if websocket is not None:
+            asyncio.create_task(websocket.close())
 
     def update_activity(self):
+        """最終アクティブ時刻を更新する
+
+        ツールの呼び出しごとに呼ばれるため、ストアへの保存は ROOM_ACTIVITY_SAVE_INTERVAL 秒に1回に間引く
+        （切断時・チェックポイントの保存時には save() で最新の値を保存する）。
+        """
         self.last_active = datetime.now()
+        if (self.last_active - self._saved_active).total_seconds() >= ROOM_ACTIVITY_SAVE_INTERVAL:
+            self.save()
+
+    def history_path(self, name: str) -> str:
+        """履歴を追い出すファイルのパス"""
+        safe_id = re.sub(r"[^\w.-]", "_", self.id)
+        return os.path.join(HISTORY_SPILL_DIR, f"{safe_id}_{name}.jsonl")
+
+    def close(self) -> None:
+        """エージェントとバックグラウンド処理を止める"""
+        if self.agent_task is not None and not self.agent_task.done():
+            self.agent_task.cancel()
+        self.plan_manager.cancel_prefetch()
+        self.chat_compactor.reset()
+        self.outbound.close()
+        self.input_coalescer.close()
+        self.websocket = None
+
+        # 追い出した履歴のファイルを削除する
+        self.message_manager.clear()
+        self.event_manager.clear()
+        self.plan_manager.clear()
+        self.result_manager.clear()
+        if self.autogpt is not None:
+            self.autogpt.flags_history.clear()
+
+    def discard(self) -> None:
+        """ルームを止め、ストアからも削除する"""
+        self.close()
+        if self.session_store:
+            self.session_store.delete_room(self.id)
+
+    def estimate_memory(self) -> int:
+        """ルームがメモリに保持している履歴のおおよそのバイト数
+
+        各マネージャーが追加・追い出しのたびに数えている値を合計する（追い出したファイルは読まない）。
+        """
+        size = self.message_manager.memory_bytes()
+        size += self.event_manager.memory_bytes()
+        size += self.plan_manager.memory_bytes()
+        size += self.result_manager.memory_bytes()
+        size += sys.getsizeof(self.chat_compactor.summary)
+        return size
 
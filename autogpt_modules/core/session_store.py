@@ -0,0 +1,342 @@
+import asyncio
+import json
+import logging
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 保存するレコードの種類
+RECORD_MESSAGE = "message"
+RECORD_EVENT = "event"
+RECORD_PLAN = "plan"
+RECORD_RESULT = "result"
+RECORD_RUN = "run"
+RECORD_CHECKPOINT = "checkpoint"
+
+# 書き込みに失敗し続けた場合に、やり直すまで待つ最大秒数
+_MAX_RETRY_DELAY = 5.0
+
+
+class SessionStore(ABC):
+    """ルームの状態を保存するストアの基底クラス
+
+    ホットパス（メッセージやイベントの追加）から呼ばれる record / save_room は
+    ディスクに触れずにすぐ返る。永続化はバックエンドごとに非同期で行う。
+    """
+    @abstractmethod
+    def record(self, room_id: str, kind: str, payload: Dict[str, Any]) -> None:
+        """ルームの履歴にレコードを追加する"""
+
+    @abstractmethod
+    def save_room(self, room_id: str, user_id: str, last_active: float, data: Optional[Dict[str, Any]] = None) -> None:
+        """ルームのメタデータを保存する（同じルームへの連続した保存はまとめてよい）"""
+
+    @abstractmethod
+    def delete_room(self, room_id: str) -> None:
+        """ルームと履歴を削除する"""
+
+    @abstractmethod
+    async def load_room(self, room_id: str) -> Optional[Dict[str, Any]]:
+        """ルームのメタデータを読み出す"""
+
+    @abstractmethod
+    async def find_latest_room(self, user_id: str) -> Optional[Dict[str, Any]]:
+        """ユーザーの最後に使われたルームのメタデータを読み出す"""
+
+    @abstractmethod
+    async def list_rooms(self, active_since: float = 0) -> List[Dict[str, Any]]:
+        """active_since 以降に使われたルームのメタデータを読み出す"""
+
+    @abstractmethod
+    async def load_records(self, room_id: str) -> Dict[str, List[Dict[str, Any]]]:
+        """ルームの履歴を種類ごとに追加順で読み出す"""
+
+    async def start(self) -> None:
+        """バックグラウンドの書き込みを開始する"""
+
+    async def flush(self) -> None:
+        """未書き込みのレコードをすべて書き込む"""
+
+    async def close(self) -> None:
+        """未書き込みのレコードを書き込んで終了する"""
+
+    def stats(self) -> Dict[str, Any]:
+        """書き込みの状況を取得"""
+        return {}
+
+    def session(self, room_id: str) -> "RoomSession":
+        """ルームに束縛したハンドルを作成"""
+        return RoomSession(self, room_id)
+
+
+class RoomSession:
+    """1つのルームに束縛した SessionStore のハンドル
+
+    各マネージャーはこれを通して自分の履歴を記録する。
+    """
+    def __init__(self, store: SessionStore, room_id: str):
+        self.store = store
+        self.room_id = room_id
+
+    def record(self, kind: str, payload: Dict[str, Any]) -> None:
+        self.store.record(self.room_id, kind, payload)
+
+
+class InMemorySessionStore(SessionStore):
+    """プロセス内のメモリに保存するストア（プロセスが終了すると消える）"""
+    def __init__(self):
+        self._rooms: Dict[str, Dict[str, Any]] = {}
+        self._records: Dict[str, Dict[str, List[Dict[str, Any]]]] = {}
+        self._written = 0
+
+    def record(self, room_id: str, kind: str, payload: Dict[str, Any]) -> None:
+        self._records.setdefault(room_id, {}).setdefault(kind, []).append(payload)
+        self._written += 1
+
+    def save_room(self, room_id: str, user_id: str, last_active: float, data: Optional[Dict[str, Any]] = None) -> None:
+        self._rooms[room_id] = {"room_id": room_id, "user_id": user_id, "last_active": last_active, "data": data or {}}
+
+    def delete_room(self, room_id: str) -> None:
+        self._rooms.pop(room_id, None)
+        self._records.pop(room_id, None)
+
+    async def load_room(self, room_id: str) -> Optional[Dict[str, Any]]:
+        return self._rooms.get(room_id)
+
+    async def find_latest_room(self, user_id: str) -> Optional[Dict[str, Any]]:
+        rooms = [room for room in self._rooms.values() if room["user_id"] == user_id]
+        return max(rooms, key=lambda room: room["last_active"]) if rooms else None
+
+    async def list_rooms(self, active_since: float = 0) -> List[Dict[str, Any]]:
+        return [room for room in self._rooms.values() if room["last_active"] >= active_since]
+
+    async def load_records(self, room_id: str) -> Dict[str, List[Dict[str, Any]]]:
+        return {kind: list(records) for kind, records in self._records.get(room_id, {}).items()}
+
+    def stats(self) -> Dict[str, Any]:
+        return {"backend": "memory", "rooms": len(self._rooms), "records_written": self._written}
+
+
+class SQLiteSessionStore(SessionStore):
+    """SQLiteに保存するストア（書き込みはまとめて非同期に行う）
+
+    record / save_room はキューに積むだけで、バックグラウンドのタスクが
+    最初に積まれてから flush_interval 後、または max_batch 件たまった時点で1トランザクションにまとめて書き込む
+    （グループコミット）。書き込むものがない間はタスクは起きない。SQLiteへの書き込みはスレッドで行うため、イベントループは止まらない。
+    読み出しの前には未書き込みのレコードを書き込み、書いた内容が必ず読めるようにする。
+
+    Args:
+        path (str): データベースファイルのパス
+        flush_interval (float): 書き込みの間隔（秒）
+        max_batch (int): この件数たまったら間隔を待たずに書き込む
+    """
+    def __init__(self, path: str, flush_interval: float = 0.05, max_batch: int = 500):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn_lock = threading.Lock()
+        self._init_schema()
+
+        self._pending_records: List[Tuple[str, str, str]] = []
+        self._pending_rooms: Dict[str, Tuple[str, str, float, str]] = {}
+        self._pending_deletes: List[str] = []
+        self._flush_lock: Optional[asyncio.Lock] = None
+        # 書き込むものが積まれたとき / max_batch 件たまったときにセットする
+        self._wakeup: Optional[asyncio.Event] = None
+        self._urgent: Optional[asyncio.Event] = None
+        self._writer_task: Optional[asyncio.Task] = None
+        self._stats: Dict[str, Any] = {
+            "batches": 0,
+            "records_written": 0,
+            "largest_batch": 0,
+            "last_flush_ms": 0.0,
+            "errors": 0,
+            "retried_records": 0,
+        }
+        # 書き込みに失敗したときに、次に書き込むまで待つ秒数（失敗が続くほど延ばす）
+        self._retry_delay = 0.0
+
+    def _init_schema(self) -> None:
+        with self._conn_lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS rooms ("
+                "room_id TEXT PRIMARY KEY, user_id TEXT NOT NULL, last_active REAL NOT NULL, data TEXT NOT NULL)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS records ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, room_id TEXT NOT NULL, kind TEXT NOT NULL, payload TEXT NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_rooms_user ON rooms (user_id, last_active)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_records_room ON records (room_id, id)")
+
+    def record(self, room_id: str, kind: str, payload: Dict[str, Any]) -> None:
+        self._pending_records.append((room_id, kind, json.dumps(payload, ensure_ascii=False)))
+        self._schedule(len(self._pending_records) >= self.max_batch)
+
+    def save_room(self, room_id: str, user_id: str, last_active: float, data: Optional[Dict[str, Any]] = None) -> None:
+        # 同じルームへの保存は最後のものだけを書けばよい
+        self._pending_rooms[room_id] = (room_id, user_id, last_active, json.dumps(data or {}, ensure_ascii=False))
+        self._schedule(False)
+
+    def delete_room(self, room_id: str) -> None:
+        self._pending_deletes.append(room_id)
+        self._schedule(False)
+
+    def _schedule(self, urgent: bool) -> None:
+        """書き込みタスクを起動し、urgentなら間隔を待たずに書き込ませる"""
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        if self._writer_task is None or self._writer_task.done():
+            self._wakeup, self._urgent = asyncio.Event(), asyncio.Event()
+            self._writer_task = asyncio.create_task(self._run_writer())
+        if self._has_pending():
+            self._wakeup.set()
+        if urgent:
+            self._urgent.set()
+
+    def _has_pending(self) -> bool:
+        return bool(self._pending_records or self._pending_rooms or self._pending_deletes)
+
+    async def start(self) -> None:
+        self._schedule(False)
+
+    async def _run_writer(self) -> None:
+        while True:
+            # 書き込むものがない間はタイマーを使わずに待つ
+            if not self._has_pending():
+                await self._wakeup.wait()
+            self._wakeup.clear()
+            # 最初の書き込みから flush_interval の間に積まれたものを、まとめて書き込む
+            if not self._urgent.is_set():
+                try:
+                    await asyncio.wait_for(self._urgent.wait(), timeout=self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+            self._urgent.clear()
+            try:
+                await self.flush()
+                self._retry_delay = 0.0
+            except Exception as e:
+                self._stats["errors"] += 1
+                self._retry_delay = min(max(self._retry_delay * 2, self.flush_interval), _MAX_RETRY_DELAY)
+                logger.error(f"Session store flush failed (retrying in {self._retry_delay:.2f}s): {e}")
+                await asyncio.sleep(self._retry_delay)
+
+    async def flush(self) -> None:
+        if self._flush_lock is None:
+            self._flush_lock = asyncio.Lock()
+        async with self._flush_lock:
+            if not self._has_pending():
+                return
+            records, self._pending_records = self._pending_records, []
+            rooms, self._pending_rooms = list(self._pending_rooms.values()), {}
+            deletes, self._pending_deletes = self._pending_deletes, []
+
+            started = time.perf_counter()
+            try:
+                await asyncio.to_thread(self._write_batch, records, rooms, deletes)
+            except Exception:
+                self._requeue(records, rooms, deletes)
+                raise
+            self._stats["batches"] += 1
+            self._stats["records_written"] += len(records)
+            self._stats["largest_batch"] = max(self._stats["largest_batch"], len(records))
+            self._stats["last_flush_ms"] = (time.perf_counter() - started) * 1000
+
+    def _requeue(self, records: List[Tuple[str, str, str]], rooms: List[Tuple[str, str, float, str]], deletes: List[str]) -> None:
+        """書き込めなかったバッチを、その後に積まれたものより前に戻す（次の書き込みでやり直す）"""
+        self._pending_records = records + self._pending_records
+        # 同じルームの保存がその後に積まれていれば、新しい方を残す
+        self._pending_rooms = {**{row[0]: row for row in rooms}, **self._pending_rooms}
+        self._pending_deletes = deletes + self._pending_deletes
+        self._stats["retried_records"] += len(records)
+
+    def _write_batch(self, records: List[Tuple[str, str, str]], rooms: List[Tuple[str, str, float, str]], deletes: List[str]) -> None:
+        with self._conn_lock, self._conn:
+            if rooms:
+                self._conn.executemany(
+                    "INSERT INTO rooms (room_id, user_id, last_active, data) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT(room_id) DO UPDATE SET last_active=excluded.last_active, data=excluded.data",
+                    rooms,
+                )
+            if records:
+                self._conn.executemany("INSERT INTO records (room_id, kind, payload) VALUES (?, ?, ?)", records)
+            for room_id in deletes:
+                self._conn.execute("DELETE FROM rooms WHERE room_id = ?", (room_id,))
+                self._conn.execute("DELETE FROM records WHERE room_id = ?", (room_id,))
+
+    async def _query(self, sql: str, params: Tuple = ()) -> List[Tuple]:
+        await self.flush()
+
+        def run() -> List[Tuple]:
+            with self._conn_lock:
+                return self._conn.execute(sql, params).fetchall()
+        return await asyncio.to_thread(run)
+
+    @staticmethod
+    def _room_row(row: Tuple) -> Dict[str, Any]:
+        return {"room_id": row[0], "user_id": row[1], "last_active": row[2], "data": json.loads(row[3])}
+
+    async def load_room(self, room_id: str) -> Optional[Dict[str, Any]]:
+        rows = await self._query("SELECT room_id, user_id, last_active, data FROM rooms WHERE room_id = ?", (room_id,))
+        return self._room_row(rows[0]) if rows else None
+
+    async def find_latest_room(self, user_id: str) -> Optional[Dict[str, Any]]:
+        rows = await self._query(
+            "SELECT room_id, user_id, last_active, data FROM rooms WHERE user_id = ? ORDER BY last_active DESC LIMIT 1",
+            (user_id,),
+        )
+        return self._room_row(rows[0]) if rows else None
+
+    async def list_rooms(self, active_since: float = 0) -> List[Dict[str, Any]]:
+        rows = await self._query(
+            "SELECT room_id, user_id, last_active, data FROM rooms WHERE last_active >= ?", (active_since,)
+        )
+        return [self._room_row(row) for row in rows]
+
+    async def load_records(self, room_id: str) -> Dict[str, List[Dict[str, Any]]]:
+        rows = await self._query("SELECT kind, payload FROM records WHERE room_id = ? ORDER BY id", (room_id,))
+        records: Dict[str, List[Dict[str, Any]]] = {}
+        for kind, payload in rows:
+            records.setdefault(kind, []).append(json.loads(payload))
+        return records
+
+    async def close(self) -> None:
+        if self._writer_task is not None:
+            self._writer_task.cancel()
+            await asyncio.gather(self._writer_task, return_exceptions=True)
+            self._writer_task = None
+        await self.flush()
+        with self._conn_lock:
+            self._conn.close()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "backend": "sqlite",
+            "pending_records": len(self._pending_records),
+            "pending_rooms": len(self._pending_rooms),
+            **self._stats,
+        }
+
+
+def create_session_store(backend: str = "memory", path: str = "sessions.db", **kwargs: Any) -> SessionStore:
+    """名前からストアを作成する
+
+    Args:
+        backend (str): "memory" または "sqlite"
+        path (str): sqlite のデータベースファイル
+    """
+    if backend == "sqlite":
+        return SQLiteSessionStore(path, **kwargs)
+    if backend == "memory":
+        return InMemorySessionStore()
+    raise ValueError(f"Unknown session store backend: {backend}")
@@ -0,0 +1,290 @@
+import json
+import re
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from langchain_experimental.autonomous_agents.autogpt.output_parser import (
+    AutoGPTAction,
+    BaseAutoGPTOutputParser,
+)
+from utils import string_to_bool
+
+# 文字列の中で特別扱いが必要な文字（終端と エスケープ）
+_STRING_SPECIAL = re.compile(r'["\\]')
+_ESCAPES = {'"': '"', '\\': '\\', '/': '/', 'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t'}
+_STRUCTURAL = set('{}[]:,"')
+_WHITESPACE = set(' \t\r\n')
+
+Path = Tuple[Any, ...]
+
+
+class StreamingResponseParser:
+    """AutoGPTの応答JSONをトークンストリームのまま解析するパーサ
+
+    feed() に届いたテキストを順に渡すと、JSON中の位置（キーのパス）を追跡しながら
+    文字列の値をデコードし、値の文字列が伸びた分を差分として返す。
+    完了したスカラー値は values にパスをキーとして保存され、同時に
+    JSON全体のオブジェクトも組み立てるため、生成完了後に改めて json.loads する必要はない。
+    command.name が確定した時点（生成完了前）で on_command が呼ばれる。
+    生成と並行して解析するため、生成完了後に残る処理はない。
+    完成済みの応答を後から解析する場合は、速い parse_response（json.loads）を使う。
+
+    例: {"command": {"name": "reply_message", "args": {"message": "こんにちは"}}}
+        -> ("command", "name") = "reply_message"
+           ("command", "args", "message") = "こんにちは"
+    """
+    def __init__(self, on_command: Optional[Callable[[str], None]] = None):
+        self._on_command = on_command
+        # 各フレームは [種類("obj" | "arr"), キーまたはインデックス, 次に期待するトークン, コンテナ]
+        self._stack: List[list] = []
+        self._root: Any = None
+        self._has_root = False
+        self._in_string = False
+        self._string_is_key = False
+        self._string_parts: List[str] = []
+        self._escape = ""
+        self._high_surrogate: Optional[int] = None
+        self._literal = ""
+        self._text_parts: List[str] = []
+        self.values: Dict[Path, Any] = {}
+
+    @property
+    def text(self) -> str:
+        """これまでに受け取った全テキスト"""
+        return "".join(self._text_parts)
+
+    def get(self, *path: Any, default: Any = None) -> Any:
+        """完了した値をパスで取得"""
+        return self.values.get(tuple(path), default)
+
+    @property
+    def command_name(self) -> Optional[str]:
+        """command.name が確定していればその値"""
+        return self.get("command", "name")
+
+    @property
+    def is_complete(self) -> bool:
+        """トップレベルのJSONが閉じているか"""
+        return self._has_root and not self._stack and not self._in_string
+
+    def current_path(self) -> Path:
+        """現在解析中の値のパス"""
+        return tuple(frame[1] for frame in self._stack)
+
+    def feed(self, text: str) -> List[Tuple[Path, str]]:
+        """テキストの断片を解析する
+
+        Args:
+            text (str): LLMから届いたテキストの断片
+
+        Returns:
+            List[Tuple[Path, str]]: (値のパス, デコード済みの追加文字列) のリスト
+        """
+        self._text_parts.append(text)
+        deltas: List[Tuple[Path, str]] = []
+        i, n = 0, len(text)
+
+        while i < n:
+            if self._in_string:
+                i = self._consume_string(text, i, deltas)
+                continue
+
+            ch = text[i]
+            if self._literal and (ch in _STRUCTURAL or ch in _WHITESPACE):
+                self._finish_literal()
+
+            if ch in _WHITESPACE:
+                pass
+            elif ch == '"':
+                top = self._stack[-1] if self._stack else None
+                self._string_is_key = top is not None and top[0] == "obj" and top[2] == "key"
+                self._string_parts = []
+                self._in_string = True
+            elif ch == '{':
+                container: Any = {}
+                self._attach(container)
+                self._stack.append(["obj", None, "key", container])
+            elif ch == '[':
+                container = []
+                self._attach(container)
+                self._stack.append(["arr", 0, "value", container])
+            elif ch in '}]':
+                if self._stack:
+                    self._stack.pop()
+                self._end_value()
+            elif ch == ':':
+                if self._stack:
+                    self._stack[-1][2] = "value"
+            elif ch == ',':
+                if self._stack:
+                    top = self._stack[-1]
+                    if top[0] == "obj":
+                        top[1], top[2] = None, "key"
+                    else:
+                        top[1], top[2] = top[1] + 1, "value"
+            else:
+                self._literal += ch
+            i += 1
+
+        return deltas
+
+    def _consume_string(self, text: str, i: int, deltas: List[Tuple[Path, str]]) -> int:
+        """文字列の中身を読み進め、次に読む位置を返す"""
+        if self._escape:
+            return self._consume_escape(text, i, deltas)
+
+        match = _STRING_SPECIAL.search(text, i)
+        end = match.start() if match else len(text)
+        if end > i:
+            self._append_string(text[i:end], deltas)
+        if not match:
+            return end
+
+        if text[end] == '"':
+            self._finish_string()
+        else:
+            self._escape = "\\"
+        return end + 1
+
+    def _consume_escape(self, text: str, i: int, deltas: List[Tuple[Path, str]]) -> int:
+        ch = text[i]
+        if self._escape == "\\":
+            if ch == "u":
+                self._escape = "\\u"
+            else:
+                self._escape = ""
+                self._append_string(_ESCAPES.get(ch, ch), deltas)
+            return i + 1
+
+        # \uXXXX の16進部分を集める
+        self._escape += ch
+        if len(self._escape) < 6:
+            return i + 1
+
+        code = int(self._escape[2:], 16)
+        self._escape = ""
+        if 0xD800 <= code < 0xDC00:
+            self._high_surrogate = code
+        elif 0xDC00 <= code < 0xE000 and self._high_surrogate is not None:
+            combined = 0x10000 + ((self._high_surrogate - 0xD800) << 10) + (code - 0xDC00)
+            self._high_surrogate = None
+            self._append_string(chr(combined), deltas)
+        else:
+            self._append_string(chr(code), deltas)
+        return i + 1
+
+    def _append_string(self, chunk: str, deltas: List[Tuple[Path, str]]) -> None:
+        self._string_parts.append(chunk)
+        if not self._string_is_key:
+            deltas.append((self.current_path(), chunk))
+
+    def _finish_string(self) -> None:
+        self._in_string = False
+        value = "".join(self._string_parts)
+        self._string_parts = []
+        if self._string_is_key:
+            top = self._stack[-1]
+            top[1], top[2] = value, "colon"
+        else:
+            path = self.current_path()
+            self.values[path] = value
+            self._attach(value)
+            self._end_value()
+            if path == ("command", "name") and self._on_command:
+                self._on_command(value)
+
+    def _finish_literal(self) -> None:
+        literal, self._literal = self._literal, ""
+        try:
+            value = json.loads(literal)
+        except ValueError:
+            value = literal
+        self.values[self.current_path()] = value
+        self._attach(value)
+        self._end_value()
+
+    def _attach(self, value: Any) -> None:
+        """値を親のコンテナ（無ければルート）に追加する"""
+        if not self._stack:
+            if not self._has_root and isinstance(value, (dict, list)):
+                self._root, self._has_root = value, True
+            return
+        top = self._stack[-1]
+        if top[0] == "obj":
+            top[3][top[1]] = value
+        else:
+            top[3].append(value)
+
+    def close(self) -> None:
+        """ストリーム終端で、未確定のリテラル（末尾の数値など）を確定させる"""
+        if self._literal and not self._in_string:
+            self._finish_literal()
+
+    def to_response(self, fallback_parser: BaseAutoGPTOutputParser) -> "ParsedResponse":
+        """解析結果を ParsedResponse にまとめる
+
+        JSONとして完結していない応答は fallback_parser に任せる（その場合 thoughts は空）。
+        """
+        self.close()
+        if not (self.is_complete and isinstance(self._root, dict)):
+            return ParsedResponse(fallback_parser.parse(self.text), {}, self.text)
+
+        return ParsedResponse.from_dict(self._root, self.text)
+
+    def _end_value(self) -> None:
+        if self._stack:
+            self._stack[-1][2] = "comma"
+
+
+class ParsedResponse:
+    """決定ステップの応答を1回の解析でまとめた結果
+
+    Args:
+        action (AutoGPTAction): 実行するコマンド名と引数
+        thoughts (Dict[str, Any]): 応答の thoughts
+        raw (str): 応答の全文
+    """
+    def __init__(self, action: AutoGPTAction, thoughts: Dict[str, Any], raw: str):
+        self.action = action
+        self.thoughts = thoughts
+        self.raw = raw
+
+    @classmethod
+    def from_dict(cls, response: Dict[str, Any], raw: str) -> "ParsedResponse":
+        """JSONとして読み込んだ応答から作成する"""
+        command = response.get("command")
+        try:
+            action = AutoGPTAction(name=command["name"], args=command["args"])
+        except (KeyError, TypeError):
+            action = AutoGPTAction(name="ERROR", args={"error": f"Incomplete command args: {response}"})
+
+        thoughts = response.get("thoughts")
+        return cls(action, thoughts if isinstance(thoughts, dict) else {}, raw)
+
+    @property
+    def purpose(self) -> str:
+        return str(self.thoughts.get("text", ""))
+
+    @property
+    def is_finish(self) -> bool:
+        return self._flag("is_finish")
+
+    @property
+    def is_go_next(self) -> bool:
+        return self._flag("is_go_next")
+
+    def _flag(self, name: str) -> bool:
+        return string_to_bool(self.thoughts.get(name, "false"))
+
+
+def parse_response(text: str, fallback_parser: BaseAutoGPTOutputParser) -> ParsedResponse:
+    """完成済みの応答テキストを json.loads で1回だけ解析する
+
+    JSONとして読めない応答は fallback_parser に任せる（その場合 thoughts は空）。
+    """
+    try:
+        response = json.loads(text)
+    except ValueError:
+        response = None
+    if not isinstance(response, dict):
+        return ParsedResponse(fallback_parser.parse(text), {}, text)
+    return ParsedResponse.from_dict(response, text)
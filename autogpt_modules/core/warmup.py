@@ -0,0 +1,111 @@
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from .custom_congif import WARMUP_TIMEOUT_SECONDS
+
+logger = logging.getLogger(__name__)
+
+WARMUP_PENDING = "pending"
+WARMUP_RUNNING = "running"
+WARMUP_DONE = "done"
+WARMUP_FAILED = "failed"
+WARMUP_TIMEOUT = "timeout"
+
+
+class StartupWarmup:
+    """起動直後に、最初のユーザーが待たされる準備をまとめて済ませておくクラス
+
+    LLMクライアントの生成とTLS接続、プロンプトの不変セクションのコンパイル、最初のゴールの
+    プランの生成（結果のキャッシュに入る）などを steps として並行に実行する。
+    すべてのステップが終わる（失敗・タイムアウトを含む）と ready になる。ウォームアップは
+    最適化なので、失敗したステップは記録するだけで、リクエストの受け付けは止めない。
+
+    Args:
+        steps (Dict[str, Callable[[], Awaitable[Any]]]): ステップ名と、準備を行う関数
+        timeout (float): 各ステップを待つ最大秒数
+    """
+    def __init__(
+        self,
+        steps: Dict[str, Callable[[], Awaitable[Any]]],
+        timeout: float = WARMUP_TIMEOUT_SECONDS,
+    ):
+        self._steps = steps
+        self.timeout = timeout
+        self._status: Dict[str, Dict[str, Any]] = {
+            name: {"status": WARMUP_PENDING, "seconds": None, "error": None} for name in steps
+        }
+        self._ready = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._started_at: Optional[float] = None
+        self._duration: Optional[float] = None
+
+    @property
+    def ready(self) -> bool:
+        return self._ready.is_set()
+
+    def start(self) -> None:
+        """バックグラウンドでウォームアップを始める"""
+        if self._task is None:
+            self._task = asyncio.create_task(self.run())
+
+    async def run(self) -> None:
+        """すべてのステップを並行に実行し、終わったら ready にする"""
+        self._started_at = time.monotonic()
+        try:
+            await asyncio.gather(*(self._run_step(name, step) for name, step in self._steps.items()))
+        finally:
+            self._duration = time.monotonic() - self._started_at
+            self._ready.set()
+        failed = [name for name, status in self._status.items() if status["status"] != WARMUP_DONE]
+        if failed:
+            logger.warning(f"Warm-up finished in {self._duration:.1f}s with incomplete steps: {failed}")
+        else:
+            logger.info(f"Warm-up finished in {self._duration:.1f}s")
+
+    async def _run_step(self, name: str, step: Callable[[], Awaitable[Any]]) -> None:
+        status = self._status[name]
+        status["status"] = WARMUP_RUNNING
+        started = time.monotonic()
+        try:
+            await asyncio.wait_for(step(), timeout=self.timeout)
+            status["status"] = WARMUP_DONE
+        except asyncio.TimeoutError:
+            status["status"] = WARMUP_TIMEOUT
+            logger.warning(f"Warm-up step {name} timed out after {self.timeout}s")
+        except Exception as e:
+            status["status"] = WARMUP_FAILED
+            status["error"] = str(e)
+            logger.warning(f"Warm-up step {name} failed: {e}")
+        finally:
+            status["seconds"] = time.monotonic() - started
+
+    async def wait_ready(self, timeout: Optional[float] = None) -> bool:
+        """ウォームアップが終わるまで待つ
+
+        Returns:
+            bool: 時間内に終わった場合True
+        """
+        try:
+            await asyncio.wait_for(self._ready.wait(), timeout=timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    async def stop(self) -> None:
+        """実行中のウォームアップを取り消す"""
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    def stats(self) -> Dict[str, Any]:
+        """ready かどうかと、ステップごとの状態・所要時間"""
+        return {
+            "ready": self.ready,
+            "seconds": self._duration,
+            "steps": {name: dict(status) for name, status in self._status.items()},
+        }
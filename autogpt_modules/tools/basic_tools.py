@@ -48,8 +48,11 @@ class ReplyMessage(BaseWebSocketTool):
         print("[DEBUG] ReplyMessage._run called (sync method not supported)")
         return "同期実行はサポートされていません。async を使用してください。"
 
-    async def _arun(self, message: str) -> str:
-        """Send a text message through WebSocket (Async)"""
+    async def _arun(self, message: str, stream_id: Optional[str] = None) -> str:
+        """Send a text message through WebSocket (Async)
+
+        stream_id は生成途中に response_delta で送信済みのストリームID（最終の response と対応付ける）
+        """
         logger.debug("=" * 50)
         logger.debug("ReplyMessage Tool Execution")
         logger.debug("=" * 50)
@@ -65,19 +68,26 @@ class ReplyMessage(BaseWebSocketTool):
 
         if self._websocket_manager and self.room_id:
             try:
+                data = {"content": message}
+                if stream_id:
+                    data["stream_id"] = stream_id
                 json_data = {
                     "type": "response",
                     "room_id": self.room_id,
                     "user_id": self._get_user_id(),
                     "timestamp": datetime.now().isoformat(),
-                    "data": {"content": message},
+                    "data": data,
                 }
                 logger.debug(f"Sending: {json_data}")
                 
-                await self._websocket_manager.send_message(
+                queued = await self._websocket_manager.send_message(
                     self.room_id,
                     json.dumps(json_data)
                 )
+                if not queued:
+                    # 届いていないメッセージは送信済みとして履歴に残さない
+                    logger.warning(f"Message was not delivered to room {self.room_id}")
+                    return "Error: message was not delivered (the user is disconnected or the send queue is full)"
                 logger.debug("Message sent successfully")
                 if self._message_manager:
                     await self._message_manager.add_message(message, "assistant")
@@ -92,6 +102,28 @@ class ReplyMessage(BaseWebSocketTool):
         logger.debug("=" * 50)
         return message
 
+    async def send_delta(self, stream_id: str, delta: str) -> None:
+        """生成途中のメッセージの差分を response_delta として送信"""
+        await self._send_stream_frame("response_delta", {"stream_id": stream_id, "content": delta})
+
+    async def cancel_stream(self, stream_id: str) -> None:
+        """送信途中のメッセージが最終的に送られないことを通知"""
+        await self._send_stream_frame("response_cancel", {"stream_id": stream_id})
+
+    async def _send_stream_frame(self, frame_type: str, data: dict) -> None:
+        if not (self._websocket_manager and self.room_id):
+            return
+        await self._websocket_manager.send_message(
+            self.room_id,
+            json.dumps({
+                "type": frame_type,
+                "room_id": self.room_id,
+                "user_id": self._get_user_id(),
+                "timestamp": datetime.now().isoformat(),
+                "data": data,
+            })
+        )
+
     def _get_user_id(self) -> Optional[str]:
         """Get user ID from room"""
         if self._websocket_manager and self.room_id:
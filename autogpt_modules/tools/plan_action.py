@@ -22,9 +22,20 @@ from langchain.tools.base import BaseTool
 from ..communication import WebSocketManager
 from .basic_tools import BaseWebSocketTool
 from ..utils.llm.llm_chains import generate_plan
+from ..core.custom_congif import PLAN_PREFETCH_MAX_NEW_MESSAGES
 
 logger = logging.getLogger(__name__)
 
+# 先読みするプランのコンテキスト（generate_plan は context を必須とするため、先読みであることを伝える）
+PREFETCH_CONTEXT = "前のゴールの対話中に先読みしたプランです。チャット履歴の最新の状況を踏まえてください。"
+# ヒアリングの開始時に先読みする最初のゴールのプランのコンテキスト
+START_CONTEXT = "ヒアリングの開始時に先読みしたプランです。まだ対話は始まっていません。"
+
+
+async def warm_up_plan(goal: str) -> str:
+    """開始直後のルーム（過去の結果もチャット履歴も無い状態）で最初のゴールを先読みした場合と
+    同じ入力でプランを生成し、結果のキャッシュに入れておく（起動時のウォームアップ用）"""
+    return await generate_plan(goal=goal, context=START_CONTEXT, past_results=[], history=[])
 
 
 class PlanActionInput(BaseModel):
@@ -83,22 +94,25 @@ class PlanAction(BaseWebSocketTool):
                 if not room:
                     return "Error: Room not found"
 
-                # 過去の結果を取得
-                past_results = room.result_manager.get_goal_result_pairs()
-
-                # チャット履歴を取得
-                chat_history = room.message_manager.get_chat_history()
-
-                # LLM を使用してプランを生成
-                plan = await generate_plan(
-                    goal=goal,
-                    context=context,
-                    past_results=past_results,
-                    history=chat_history
-                )
+                if context and context.strip():
+                    # 先読みのプランはこのコンテキストを知らないため、コンテキストを渡して生成し直す
+                    room.plan_manager.discard_prefetched(goal)
+                    plan = None
+                else:
+                    # 待機中に先読みしたプランが新鮮であればそれを使う
+                    plan = await room.plan_manager.take_prefetched(
+                        goal,
+                        room.message_manager.count_messages("user"),
+                        PLAN_PREFETCH_MAX_NEW_MESSAGES,
+                        room.result_manager.count_results(include_pending=True),
+                    )
+                if plan is None:
+                    plan = await self._generate_plan(room, goal, context)
+                else:
+                    logger.debug("Using prefetched plan")
 
                 # プランを保存
-                await room.plan_manager.add_plan(goal, plan)
+                await room.plan_manager.add_plan(plan, goal=goal)
 
                 # WebSocket経由で通知
                 json_data = {
@@ -126,6 +140,51 @@ class PlanAction(BaseWebSocketTool):
             logger.warning("WebSocket connection not available")
             return "WebSocket connection not available"
 
+    async def _generate_plan(self, room, goal: str, context: Optional[str] = None) -> str:
+        """過去の結果とチャット履歴からプランを生成する"""
+        # 過去の結果を取得（バックグラウンドで要約中の結果があれば合流してから読む）
+        await room.result_manager.wait_for_pending()
+        past_results = room.result_manager.get_goal_result_pairs()
+
+        # チャット履歴を取得
+        chat_history = room.message_manager.get_chat_history()
+
+        # LLM を使用してプランを生成
+        return await generate_plan(
+            goal=goal,
+            context=context,
+            past_results=past_results,
+            history=chat_history,
+            room_id=room.id
+        )
+
+    def prefetch(self, goal: str, at_start: bool = False) -> bool:
+        """ゴールのプランをバックグラウンドで先読みする
+
+        既に新鮮な先読みがある場合は何もしない。
+
+        Args:
+            goal (str): 対象のゴール
+            at_start (bool): ヒアリングの開始時に最初のゴールを先読みする場合True
+
+        Returns:
+            bool: 先読みを開始した場合True
+        """
+        room = self._websocket_manager._rooms.get(self.room_id) if self._websocket_manager else None
+        if not room or not goal:
+            return False
+
+        user_message_count = room.message_manager.count_messages("user")
+        # 生成中の要約も数える（生成は要約の完了を待ってから結果を読む）
+        result_count = room.result_manager.count_results(include_pending=True)
+        if not room.plan_manager.needs_prefetch(goal, user_message_count, PLAN_PREFETCH_MAX_NEW_MESSAGES, result_count):
+            return False
+
+        logger.debug(f"Prefetching plan for goal: {goal}")
+        context = START_CONTEXT if at_start else PREFETCH_CONTEXT
+        room.plan_manager.prefetch(goal, user_message_count, self._generate_plan(room, goal, context), result_count)
+        return True
+
     def _get_user_id(self) -> Optional[str]:
         """Get user ID from room"""
         if self._websocket_manager and self.room_id:
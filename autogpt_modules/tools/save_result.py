@@ -1,7 +1,7 @@
 import json
-from typing import Optional, Dict
+from typing import Optional, Dict, Type
 from langchain.tools.base import BaseTool
-from pydantic import Field
+from pydantic import BaseModel, Field
 from datetime import datetime
 from ..communication import WebSocketManager
 from .basic_tools import BaseWebSocketTool
@@ -10,6 +10,12 @@ import logging
 
 logger = logging.getLogger(__name__)
 
+class SaveResultInput(BaseModel):
+    """SaveResult に必要な引数スキーマ"""
+    goal: str = Field(..., description="結果を保存するゴール（必須）")
+    metadata: Optional[Dict] = Field(None, description="追加のメタデータ（任意）")
+
+
 class SaveResult(BaseWebSocketTool):
     """Tool for saving and managing task results."""
     name: str = Field(default="save_result")
@@ -20,25 +26,20 @@ class SaveResult(BaseWebSocketTool):
         "保存された結果は後続のプラン生成時に参照されます。"
     ))
 
-    def _run(self, tool_input: str) -> str:
+    args_schema: Type[SaveResultInput] = SaveResultInput
+
+    def _run(self, goal: str, metadata: Optional[Dict] = None) -> str:
         """同期的に結果を保存（非推奨）"""
         return "同期実行はサポートされていません。async を使用してください。"
 
-    async def _arun(self, tool_input: str) -> str:
+    async def _arun(self, goal: str, metadata: Optional[Dict] = None) -> str:
         """Save a result summary (Async)"""
         logger.debug("=" * 50)
         logger.debug("SaveResult Tool Execution")
         logger.debug("=" * 50)
-        logger.debug(f"Input: {tool_input}")
-
-        try:
-            data = json.loads(tool_input)
-            goal = data.get("goal", "")
-            metadata = data.get("metadata", {})
-        except json.JSONDecodeError:
-            logger.error("Invalid JSON input")
-            return "Error: Invalid input format. Expected JSON with 'goal' field."
+        logger.debug(f"Goal: {goal}")
 
+        metadata = metadata or {}
         if not goal:
             return "Error: Goal is required."
 
@@ -56,11 +57,12 @@ class SaveResult(BaseWebSocketTool):
                 summary = await generate_summary(
                     goal=goal,
                     chat_history=chat_history,
-                    history=chat_history_for_llm
+                    history=chat_history_for_llm,
+                    room_id=self.room_id
                 )
                 
                 # 結果を保存
-                await room.result_manager.add_result(goal, summary, metadata)
+                await room.result_manager.add_result(summary, metadata, goal=goal)
                 
                 # WebSocket経由で通知
                 json_data = {
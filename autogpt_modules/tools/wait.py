@@ -5,6 +5,7 @@ from ..communication import WebSocketManager
 from ..core.event_manager import EventManager
 
 import asyncio
+import time
 from pydantic import Field, PrivateAttr
 from .basic_tools import BaseWebSocketTool
 
@@ -65,50 +66,90 @@ class Wait(BaseWebSocketTool):
         """メッセージチェック付きの待機処理"""
         self._waiting = True
         total_seconds = minutes * 60
-        check_interval = 0.1  # 0.1秒ごとにチェック
-
-        elapsed_time = 0
-        initial_event_count = len(self._event_manager.get_event_history())
-
-        while elapsed_time < total_seconds and self._waiting:
-            await asyncio.sleep(check_interval)
-            elapsed_time += check_interval
-
-            # event_historyを取得して、wait開始後に発生したイベントを確認
-            event_history = self._event_manager.get_event_history()
-            current_events = event_history[initial_event_count:]
-
-            # new_message_come イベントがあるかチェック
-            for ev in current_events:
-                if ev.get('action') == 'new_message_come':
-                    # 新規メッセージイベントが確認されたため待機終了
-                    self._waiting = False
-                    print("BREAK WAIT due to new_message_come event")
-                    self._update_waiting_info(
-                        consecutive_waiting_duration=self.get_waiting_info()["consecutive_waiting_duration"] + elapsed_time/60,
-                        prev_waiting_info=elapsed_time/60
-                    )
-                    return f"{elapsed_time/60:.1f}分経過。new_message_comeイベントにより待機を終了しました。"
-                
-                if ev.get('action') == 'finish_session':
-                    # セッション終了イベントが確認されたため待機終了
-                    self._waiting = False
-                    print("BREAK WAIT due to finish_session event")
-                    self._update_waiting_info(
-                        consecutive_waiting_duration=self.get_waiting_info()["consecutive_waiting_duration"] + elapsed_time/60,
-                        prev_waiting_info=elapsed_time/60
-                    )
-                    return f"{elapsed_time/60:.1f}分経過。finish_sessionイベントにより待機を終了しました。"
-
-
-        # ループを抜けた場合は、待機時間終了または_waitingがFalseになった状態
+
+        # new_message_come / finish_session が追加された瞬間に起こされるまで待機する
+        loop = asyncio.get_running_loop()
+        started_at = loop.time()
+        event = await self._event_manager.wait_for_event(
+            ["new_message_come", "finish_session"],
+            timeout=total_seconds
+        )
+        elapsed_time = loop.time() - started_at
         self._waiting = False
+
+        if event is not None:
+            print(f"BREAK WAIT due to {event.action} event")
+        return self._finish_wait(minutes, elapsed_time, event.action if event is not None else None)
+
+    def _finish_wait(self, minutes: float, elapsed_seconds: float, event_action: Optional[str] = None) -> str:
+        """待機の終了を待機情報に反映し、結果のメッセージを返す"""
+        if event_action is not None:
+            elapsed_minutes = min(elapsed_seconds / 60, minutes)
+            self._update_waiting_info(
+                consecutive_waiting_duration=self.get_waiting_info()["consecutive_waiting_duration"] + elapsed_minutes,
+                prev_waiting_info=elapsed_minutes
+            )
+            return f"{elapsed_minutes:.1f}分経過。{event_action}イベントにより待機を終了しました。"
+
+        # タイムアウトした場合は、待機時間が終了した状態
         self._update_waiting_info(
             consecutive_waiting_duration=self.get_waiting_info()["consecutive_waiting_duration"] + minutes,
             prev_waiting_info=minutes
         )
         return f"{minutes}分間の待機が完了しました。"
 
+    @staticmethod
+    def _parse_minutes(minutes: Any) -> float:
+        """待機時間を検証し、60分を上限に丸める"""
+        try:
+            wait_time = float(minutes)
+        except (TypeError, ValueError):
+            raise ValueError("待機時間は数値で指定してください。")
+        if wait_time < 0:
+            raise ValueError("待機時間は0以上の値を指定してください。")
+        return min(wait_time, 60)  # 最大待機時間を60分に制限
+
+    async def _start_wait(self, wait_time: float) -> None:
+        await self._event_manager.add_event(
+            action="wait",
+            purpose=f"{wait_time}分間待機開始",
+            result=None
+        )
+        print(f"=== wait start {wait_time} min===")
+
+    async def begin_hibernation(self, minutes: Any = 1.0) -> Dict[str, Any]:
+        """待機を開始し、エージェントを解放している間に保持する状態を返す
+
+        待機そのものは行わない。起床後に resume_from_hibernation() へ渡すと、
+        _arun() と同じ結果のメッセージと待機情報になる。
+
+        Returns:
+            Dict[str, Any]: 待機分数・開始時刻・起床時刻・待機情報（JSONに変換できる値のみ）
+        """
+        wait_time = self._parse_minutes(minutes)
+        await self._start_wait(wait_time)
+        started_at = time.time()
+        return {
+            "minutes": wait_time,
+            "started_at": started_at,
+            "wake_at": started_at + wait_time * 60,
+            "waiting_info": self.get_waiting_info(),
+        }
+
+    def resume_from_hibernation(self, state: Dict[str, Any], event_action: Optional[str] = None) -> str:
+        """解放している間の待機を終了する
+
+        Args:
+            state (Dict[str, Any]): begin_hibernation() が返した状態
+            event_action (Optional[str]): 待機を打ち切ったイベント. 時間どおりに起きた場合はNone
+
+        Returns:
+            str: 待機完了メッセージ
+        """
+        self._waiting_info = dict(state["waiting_info"])
+        print("=== wait end (hibernation) ===")
+        return self._finish_wait(state["minutes"], time.time() - state["started_at"], event_action)
+
     async def _arun(self, minutes: float = 1.0) -> str:
         """
         Args:
@@ -117,22 +158,11 @@ class Wait(BaseWebSocketTool):
             str: 待機完了メッセージ
         """
         try:
-            wait_time = float(minutes)
-            if wait_time < 0:
-                return "待機時間は0以上の値を指定してください。"
-            if wait_time > 60:  # 最大待機時間を60分に制限
-                wait_time = 60
-        except ValueError:
-            return "待機時間は数値で指定してください。"
-
-            
-        await self._event_manager.add_event(
-            action="wait",
-            purpose=f"{wait_time}分間待機開始",
-            result=None
-        )
+            wait_time = self._parse_minutes(minutes)
+        except ValueError as e:
+            return str(e)
 
-        print(f"=== wait start {wait_time} min===")
+        await self._start_wait(wait_time)
         result = await self._wait_with_check(wait_time)
 
 
@@ -2,29 +2,70 @@ from .llm_chains import (
     get_llm,
     get_plan_chain,
     get_summary_chain,
+    get_chat_compaction_chain,
     generate_plan,
-    generate_summary
+    generate_summary,
+    generate_chat_compaction
+)
+
+from .client_pool import (
+    LLMClientRegistry,
+    llm_client_registry
+)
+
+from .scheduler import (
+    LLMScheduler,
+    LLMTicket,
+    llm_scheduler,
+    PRIORITY_INTERACTIVE,
+    PRIORITY_PLANNING,
+    PRIORITY_SUMMARY
+)
+
+from .result_cache import (
+    LLMResultCache,
+    llm_result_cache,
+    make_cache_key
 )
 
 from .prompt import (
     plan_prompt,
     summary_prompt,
+    chat_compaction_prompt,
     PLAN_SYSTEM_TEMPLATE,
     SUMMARY_SYSTEM_TEMPLATE,
     PLAN_HUMAN_TEMPLATE,
-    SUMMARY_HUMAN_TEMPLATE
+    SUMMARY_HUMAN_TEMPLATE,
+    CHAT_COMPACTION_SYSTEM_TEMPLATE,
+    CHAT_COMPACTION_HUMAN_TEMPLATE
 )
 
 __all__ = [
     "get_llm",
     "get_plan_chain",
     "get_summary_chain",
+    "get_chat_compaction_chain",
     "generate_plan",
     "generate_summary",
+    "generate_chat_compaction",
+    "LLMClientRegistry",
+    "llm_client_registry",
+    "LLMScheduler",
+    "LLMTicket",
+    "llm_scheduler",
+    "PRIORITY_INTERACTIVE",
+    "PRIORITY_PLANNING",
+    "PRIORITY_SUMMARY",
+    "LLMResultCache",
+    "llm_result_cache",
+    "make_cache_key",
     "plan_prompt",
     "summary_prompt",
+    "chat_compaction_prompt",
     "PLAN_SYSTEM_TEMPLATE",
     "SUMMARY_SYSTEM_TEMPLATE",
     "PLAN_HUMAN_TEMPLATE",
-    "SUMMARY_HUMAN_TEMPLATE"
+    "SUMMARY_HUMAN_TEMPLATE",
+    "CHAT_COMPACTION_SYSTEM_TEMPLATE",
+    "CHAT_COMPACTION_HUMAN_TEMPLATE"
 ]
@@ -0,0 +1,180 @@
+import os
+import asyncio
+import logging
+from typing import Any, Callable, Dict, Optional, Tuple
+
+import httpx
+from langchain_core.language_models import BaseChatModel
+
+logger = logging.getLogger(__name__)
+
+
+def _freeze(value: Any) -> Any:
+    """キーに使えるように値をハッシュ可能な形に変換する"""
+    if isinstance(value, dict):
+        return tuple(sorted((k, _freeze(v)) for k, v in value.items()))
+    if isinstance(value, (list, tuple, set)):
+        return tuple(_freeze(v) for v in value)
+    try:
+        hash(value)
+        return value
+    except TypeError:
+        return repr(value)
+
+
+def _running_loop() -> Optional[asyncio.AbstractEventLoop]:
+    try:
+        return asyncio.get_running_loop()
+    except RuntimeError:
+        return None
+
+
+def _close_sync_clients(client: BaseChatModel) -> None:
+    """クライアントが持つ同期の HTTP クライアント（openai の root_client など）を閉じる"""
+    for name in ("root_client", "http_client"):
+        close = getattr(getattr(client, name, None), "close", None)
+        if not callable(close) or asyncio.iscoroutinefunction(close):
+            continue
+        try:
+            close()
+        except Exception as e:
+            logger.debug(f"Failed to close {name} of {type(client).__name__}: {e}")
+
+
+class LLMClientRegistry:
+    """プロセス全体で共有するLLMクライアントのレジストリ
+
+    (provider, model, base_url, パラメータ) が同じクライアントは1つだけ生成して使い回す。
+    OpenAI互換のクライアント（OpenAI / DeepSeek）は base_url ごとに共有の
+    httpx.AsyncClient を持たせ、keep-alive 接続をルームや呼び出しをまたいで再利用する。
+    httpx.AsyncClient は作成したイベントループでしか使えないため、ルームを複数のイベントループに
+    分けて動かす場合（LoopShardPool）は、イベントループごとに別のクライアントを持つ。
+
+    Args:
+        max_connections (Optional[int]): base_url ごとの最大同時接続数
+        max_keepalive_connections (Optional[int]): 保持しておく keep-alive 接続数
+        keepalive_expiry (Optional[float]): アイドル接続を保持する秒数
+    """
+    def __init__(
+        self,
+        max_connections: Optional[int] = None,
+        max_keepalive_connections: Optional[int] = None,
+        keepalive_expiry: Optional[float] = None,
+    ):
+        if max_connections is None:
+            max_connections = int(os.getenv("LLM_POOL_MAX_CONNECTIONS", "100"))
+        if max_keepalive_connections is None:
+            max_keepalive_connections = int(os.getenv("LLM_POOL_MAX_KEEPALIVE", "20"))
+        if keepalive_expiry is None:
+            keepalive_expiry = float(os.getenv("LLM_POOL_KEEPALIVE_EXPIRY", "60"))
+        self._limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self._clients: Dict[Tuple, BaseChatModel] = {}
+        self._http_clients: Dict[Tuple[Optional[asyncio.AbstractEventLoop], Optional[str]], httpx.AsyncClient] = {}
+        self._created = 0
+        self._reused = 0
+
+    def get_or_create(self, provider: str, factory: Callable[..., BaseChatModel], **params: Any) -> BaseChatModel:
+        """共有クライアントを取得し、無ければ生成する
+
+        Args:
+            provider (str): "openai"（OpenAI互換API）または "google"
+            factory (Callable[..., BaseChatModel]): クライアントのクラス
+            **params: クライアントの生成パラメータ
+
+        Returns:
+            BaseChatModel: 共有クライアント
+        """
+        loop = _running_loop() if provider == "openai" else None
+        key = (provider, loop, _freeze(params))
+        client = self._clients.get(key)
+        if client is not None:
+            self._reused += 1
+            return client
+
+        if provider == "openai":
+            params = {**params, "http_async_client": self._get_http_client(loop, params.get("base_url"))}
+
+        client = factory(**params)
+        self._clients[key] = client
+        self._created += 1
+        logger.debug(f"Created shared LLM client: provider={provider}, model={params.get('model') or params.get('model_name')}")
+        return client
+
+    def _get_http_client(self, loop: Optional[asyncio.AbstractEventLoop], base_url: Optional[str]) -> httpx.AsyncClient:
+        """イベントループ・base_url ごとの共有 httpx.AsyncClient を取得"""
+        http_client = self._http_clients.get((loop, base_url))
+        if http_client is None or http_client.is_closed:
+            http_client = httpx.AsyncClient(limits=self._limits, timeout=httpx.Timeout(120.0, connect=10.0))
+            self._http_clients[(loop, base_url)] = http_client
+        return http_client
+
+    def stats(self) -> Dict[str, Any]:
+        """クライアント数と接続プールの状態を取得"""
+        pools = {}
+        loops = {loop for loop, _ in self._http_clients}
+        for (loop, base_url), http_client in self._http_clients.items():
+            # httpx は接続プールの状態を公開していないため、取得できる範囲で参照する
+            pool = getattr(getattr(http_client, "_transport", None), "_pool", None)
+            connections = list(getattr(pool, "connections", []) or [])
+            name = base_url or "default"
+            if len(loops) > 1:
+                name = f"{name}@loop{id(loop):x}"
+            pools[name] = {
+                "connections": len(connections),
+                "idle_connections": sum(1 for c in connections if getattr(c, "is_idle", lambda: False)()),
+                "max_connections": self._limits.max_connections,
+                "max_keepalive_connections": self._limits.max_keepalive_connections,
+                "closed": http_client.is_closed,
+            }
+        return {
+            "clients": len(self._clients),
+            "created": self._created,
+            "reused": self._reused,
+            "http_pools": pools,
+        }
+
+    def clear(self) -> None:
+        """登録済みのクライアントを破棄し、接続プールを閉じる
+
+        共有の httpx.AsyncClient は作成したイベントループが動いていればそのループで閉じ、
+        止まっている場合はここで閉じる。
+        """
+        clients, self._clients = list(self._clients.values()), {}
+        http_clients, self._http_clients = self._http_clients, {}
+        for client in clients:
+            _close_sync_clients(client)
+        running = _running_loop()
+        for (loop, base_url), http_client in http_clients.items():
+            if http_client.is_closed:
+                continue
+            if loop is not None and loop is running:
+                loop.create_task(http_client.aclose())
+            elif loop is not None and loop.is_running():
+                asyncio.run_coroutine_threadsafe(http_client.aclose(), loop)
+            elif running is not None:
+                running.create_task(http_client.aclose())
+            else:
+                try:
+                    asyncio.run(http_client.aclose())
+                except Exception as e:
+                    logger.debug(f"Failed to close HTTP pool for {base_url or 'default'}: {e}")
+
+    async def aclose(self) -> None:
+        """このイベントループの共有の HTTP 接続を閉じる
+
+        他のイベントループのクライアントはそのループで閉じる必要があるため残す。
+        """
+        loop = _running_loop()
+        keys = [key for key in self._http_clients if key[0] in (loop, None)]
+        http_clients = [self._http_clients.pop(key) for key in keys]
+        for key in [key for key in self._clients if key[1] in (loop, None)]:
+            _close_sync_clients(self._clients.pop(key))
+        await asyncio.gather(*(c.aclose() for c in http_clients), return_exceptions=True)
+
+
+# プロセス全体で共有するレジストリ
+llm_client_registry = LLMClientRegistry()
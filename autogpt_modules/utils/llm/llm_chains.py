@@ -1,5 +1,5 @@
 import os
-from typing import Optional, List, TypeVar, Generic, Union
+from typing import Any, Dict, Optional, List, TypeVar, Generic, Union
 from langchain_core.messages import BaseMessage
 from langchain_core.language_models import BaseChatModel
 from langchain_core.output_parsers import StrOutputParser
@@ -9,13 +9,21 @@ from langchain_google_genai import ChatGoogleGenerativeAI
 from .prompt import (
     plan_prompt,
     summary_prompt,
+    chat_compaction_prompt,
 )
+from .client_pool import llm_client_registry
+from .scheduler import llm_scheduler, PRIORITY_PLANNING, PRIORITY_SUMMARY
+from .result_cache import llm_result_cache
+from .usage import collect_token_usage
 from dotenv import load_dotenv
 
 load_dotenv()
 
 T = TypeVar('T')
 
+# スケジューラに予約するトークン数の見積もりに足す出力トークン数
+_OUTPUT_TOKEN_ALLOWANCE = 1000
+
 class LLMResponse(Generic[T]):
     """LLMの応答を表す型"""
     def __init__(self, content: T):
@@ -24,6 +32,9 @@ class LLMResponse(Generic[T]):
 def get_llm(model_name: str) -> BaseChatModel:
     """LLMモデルを取得する
 
+    クライアントはプロセス全体で共有され、同じモデルへの呼び出しでは
+    HTTP接続（keep-alive）が再利用される。
+
     Args:
         model_name (str): モデル名
 
@@ -31,18 +42,60 @@ def get_llm(model_name: str) -> BaseChatModel:
         BaseChatModel: LLMモデル
     """
     if model_name.startswith(("gpt", "chatgpt")):
-        return ChatOpenAI(
+        return llm_client_registry.get_or_create(
+            "openai",
+            ChatOpenAI,
             model_name=model_name,
             temperature=0.7,
             streaming=True
         )
     else:
-        return ChatGoogleGenerativeAI(
+        return llm_client_registry.get_or_create(
+            "google",
+            ChatGoogleGenerativeAI,
             model=model_name,
             temperature=0.7,
             convert_system_message_to_human=True
         )
 
+def get_provider(model_name: str) -> str:
+    """モデル名から、スケジューラで上限を共有するプロバイダ名を求める（get_llm と同じ判定）"""
+    return "openai" if model_name.startswith(("gpt", "chatgpt")) else "google"
+
+def _estimate_tokens(*texts: str) -> int:
+    """入力の文字数からトークン数を見積もる（日本語はおおよそ1文字1トークン）"""
+    return sum(len(str(text)) for text in texts) + _OUTPUT_TOKEN_ALLOWANCE
+
+async def _ainvoke_in_slot(
+    chain: Any,
+    inputs: Dict[str, Any],
+    model_name: Optional[str],
+    room_id: Optional[str],
+    priority: int,
+    *texts: str,
+) -> Any:
+    """スケジューラの枠を取ってチェーンを呼び出し、予約したトークン数を実際の使用量で精算する
+
+    Args:
+        chain (Any): 呼び出すチェーン
+        inputs (Dict[str, Any]): チェーンへの入力
+        model_name (Optional[str]): モデル名（プロバイダの判定に使う）
+        room_id (Optional[str]): スケジューラで公平に割り当てる単位のルームID
+        priority (int): スケジューラの優先度
+        *texts (str): 見積もりに使う入力のテキスト
+    """
+    async with llm_scheduler.slot(
+        get_provider(model_name), room_id, priority, estimated_tokens=_estimate_tokens(*texts)
+    ) as ticket:
+        with collect_token_usage() as usage:
+            result = await chain.ainvoke(inputs)
+        tokens = usage.total_tokens
+        if not tokens:
+            # 使用量を返さないプロバイダは、入力と出力の文字数で数える
+            tokens = sum(len(str(text)) for text in texts) + len(str(result))
+        ticket.record_tokens(tokens)
+    return result
+
 def get_plan_chain():
     """プラン生成チェーンを取得する
     
@@ -71,6 +124,17 @@ def get_summary_chain():
     model = get_llm(os.getenv("SUMMARY_MODEL"))
     return summary_prompt | model | StrOutputParser()
 
+def get_chat_compaction_chain():
+    """チャット履歴の圧縮チェーンを取得する
+
+    要約と同じモデル（SUMMARY_MODEL）を使う。
+
+    Returns:
+        Chain: チャット履歴の圧縮チェーン
+    """
+    model = get_llm(os.getenv("SUMMARY_MODEL"))
+    return chat_compaction_prompt | model | StrOutputParser()
+
 def _extract_text_from_llm_response(response: Union[str, LLMResult, Generation]) -> str:
     """LLMの応答から文字列を抽出する
 
@@ -93,7 +157,8 @@ async def generate_plan(
     goal: str,
     context: str,
     past_results: str,
-    history: Optional[List[BaseMessage]] = None
+    history: Optional[List[BaseMessage]] = None,
+    room_id: Optional[str] = None
 ) -> str:
     """プランを生成する
 
@@ -102,6 +167,7 @@ async def generate_plan(
         context (str): コンテキスト
         past_results (str): 過去の実行結果
         history (Optional[List[BaseMessage]], optional): チャット履歴. Defaults to None.
+        room_id (Optional[str], optional): スケジューラで公平に割り当てる単位のルームID. Defaults to None.
 
     Returns:
         str: 生成されたプラン
@@ -113,23 +179,32 @@ async def generate_plan(
     if not goal or not context:
         raise ValueError("goal と context は必須です")
 
-    try:
+    inputs = {
+        "goal": goal,
+        "context": context,
+        "past_results": past_results,
+        "history": history or []
+    }
+
+    async def compute() -> str:
         chain = get_plan_chain()
-        result = await chain.ainvoke({
-            "goal": goal,
-            "context": context,
-            "past_results": past_results,
-            "history": history or []
-        })
+        result = await _ainvoke_in_slot(
+            chain, inputs, os.getenv("PLAN_ACTION_MODEL"), room_id, PRIORITY_PLANNING, goal, context, past_results
+        )
         print(f"[debug] action plan: {result}")
         return _extract_text_from_llm_response(result)
+
+    try:
+        # 同じゴール・状況のプランは、どのセッションでも同じ結果を使う
+        return await llm_result_cache.get_or_compute("plan", os.getenv("PLAN_ACTION_MODEL"), inputs, compute)
     except Exception as e:
         raise RuntimeError(f"プラン生成に失敗しました: {str(e)}") from e
 
 async def generate_summary(
     goal: str,
     chat_history: str,
-    history: Optional[List[BaseMessage]] = None
+    history: Optional[List[BaseMessage]] = None,
+    room_id: Optional[str] = None
 ) -> str:
     """要約を生成する
 
@@ -137,6 +212,7 @@ async def generate_summary(
         goal (str): 目標
         chat_history (str): チャット履歴
         history (Optional[List[BaseMessage]], optional): チャット履歴. Defaults to None.
+        room_id (Optional[str], optional): スケジューラで公平に割り当てる単位のルームID. Defaults to None.
 
     Returns:
         str: 生成された要約
@@ -148,15 +224,59 @@ async def generate_summary(
     if not goal or not chat_history:
         raise ValueError("goal と chat_history は必須です")
 
-    try:
+    inputs = {
+        "goal": goal,
+        "chat_history": chat_history,
+        "history": history or []
+    }
+
+    async def compute() -> str:
         chain = get_summary_chain()
-        result = await chain.ainvoke({
-            "goal": goal,
-            "chat_history": chat_history,
-            "history": history or []
-        })
+        result = await _ainvoke_in_slot(
+            chain, inputs, os.getenv("SUMMARY_MODEL"), room_id, PRIORITY_SUMMARY, goal, chat_history
+        )
 
         print(f"[debug] result: {result}")
         return _extract_text_from_llm_response(result)
+
+    try:
+        return await llm_result_cache.get_or_compute("summary", os.getenv("SUMMARY_MODEL"), inputs, compute)
     except Exception as e:
         raise RuntimeError(f"要約生成に失敗しました: {str(e)}") from e
+
+
+async def generate_chat_compaction(
+    summary: str,
+    messages: List[dict],
+    room_id: Optional[str] = None
+) -> str:
+    """これまでの要約に続きの対話を統合した要約を生成する
+
+    Args:
+        summary (str): これまでの対話の要約（初回は空文字）
+        messages (List[dict]): まだ要約に含まれていないメッセージ（role / content）
+        room_id (Optional[str], optional): スケジューラで公平に割り当てる単位のルームID. Defaults to None.
+
+    Returns:
+        str: 更新した要約
+
+    Raises:
+        ValueError: 入力が不正な場合
+        RuntimeError: LLM呼び出しに失敗した場合
+    """
+    if not messages:
+        raise ValueError("messages は必須です")
+
+    try:
+        chain = get_chat_compaction_chain()
+        transcript = "\n".join(f"{m['role']}: {m['content']}" for m in messages)
+        inputs = {
+            "summary": summary or "(まだありません)",
+            "messages": transcript,
+        }
+        result = await _ainvoke_in_slot(
+            chain, inputs, os.getenv("SUMMARY_MODEL"), room_id, PRIORITY_SUMMARY, summary, transcript
+        )
+        return _extract_text_from_llm_response(result)
+    except Exception as e:
+        raise RuntimeError(f"チャット履歴の圧縮に失敗しました: {str(e)}") from e
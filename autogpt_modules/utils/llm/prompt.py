@@ -44,6 +44,23 @@ SUMMARY_HUMAN_TEMPLATE = """目標: {goal}
 
 このゴールの実行結果を要約してください。"""
 
+# チャット履歴の圧縮用のプロンプトテンプレート
+CHAT_COMPACTION_SYSTEM_TEMPLATE = """あなたは対話ログを圧縮するAIアシスタントです。
+これまでの対話の要約と、まだ要約に含まれていない続きの対話が与えられます。
+続きの対話の内容を要約に統合し、更新した要約だけを出力してください。
+
+- ユーザーが話した事実・希望・感情・固有名詞・数値は省略せずに残してください
+- 既に聞いた質問と、その回答を対応づけて残してください
+- 要約は時系列に沿った箇条書きで、簡潔に書いてください"""
+
+CHAT_COMPACTION_HUMAN_TEMPLATE = """これまでの要約:
+{summary}
+
+続きの対話:
+{messages}
+
+更新した要約を出力してください。"""
+
 # プロンプトテンプレートの作成
 plan_prompt = ChatPromptTemplate.from_messages([
     SystemMessage(content=PLAN_SYSTEM_TEMPLATE),
@@ -57,11 +74,19 @@ summary_prompt = ChatPromptTemplate.from_messages([
     HumanMessagePromptTemplate.from_template(SUMMARY_HUMAN_TEMPLATE)
 ])
 
+chat_compaction_prompt = ChatPromptTemplate.from_messages([
+    SystemMessage(content=CHAT_COMPACTION_SYSTEM_TEMPLATE),
+    HumanMessagePromptTemplate.from_template(CHAT_COMPACTION_HUMAN_TEMPLATE)
+])
+
 __all__ = [
     "plan_prompt",
     "summary_prompt",
+    "chat_compaction_prompt",
     "PLAN_SYSTEM_TEMPLATE",
     "SUMMARY_SYSTEM_TEMPLATE",
     "PLAN_HUMAN_TEMPLATE",
-    "SUMMARY_HUMAN_TEMPLATE"
+    "SUMMARY_HUMAN_TEMPLATE",
+    "CHAT_COMPACTION_SYSTEM_TEMPLATE",
+    "CHAT_COMPACTION_HUMAN_TEMPLATE"
 ]
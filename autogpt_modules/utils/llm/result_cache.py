@@ -0,0 +1,277 @@
+import os
+import re
+import json
+import time
+import asyncio
+import hashlib
+import logging
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# メッセージの記録のうち、内容が同じでも毎回変わるためキーに含めない項目
+_VOLATILE_FIELDS = ("id", "timestamp")
+# ディスクのキャッシュから期限切れの行を消す間隔（秒）
+_PURGE_INTERVAL = 60.0
+
+
+def _normalize(value: Any) -> Any:
+    """キーに使うために入力を正規化する（空白の揺れとメッセージのID・時刻を無視する）"""
+    if isinstance(value, str):
+        return re.sub(r"\s+", " ", value).strip()
+    if isinstance(value, dict):
+        return {k: _normalize(v) for k, v in sorted(value.items()) if k not in _VOLATILE_FIELDS}
+    if isinstance(value, (list, tuple)):
+        return [_normalize(v) for v in value]
+    if hasattr(value, "content") and hasattr(value, "type"):
+        # langchain の BaseMessage
+        return {"role": value.type, "content": _normalize(value.content)}
+    if value is None or isinstance(value, (int, float, bool)):
+        return value
+    return _normalize(str(value))
+
+
+def make_cache_key(chain: str, model: Optional[str], inputs: Dict[str, Any]) -> str:
+    """チェーン名・モデル・入力から、内容で決まるキー（SHA-256）を作る"""
+    payload = json.dumps(
+        {"chain": chain, "model": model or "", "inputs": _normalize(inputs)},
+        ensure_ascii=False,
+        sort_keys=True,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class LLMResultCache:
+    """generate_plan / generate_summary の結果のキャッシュ
+
+    同じチェーン・モデル・入力（空白の揺れやメッセージのID・時刻は無視）の呼び出しには、
+    LLMを呼ばずに前回の結果を返す。新しいヒアリングの最初のプランのように、
+    どのセッションでもほぼ同じ入力になる呼び出しをすぐに返すためのもの。
+
+    - メモリ: max_entries 件までのLRU. ttl 秒を過ぎた結果は使わない
+    - ディスク: path を指定した場合はSQLiteにも保存し、ワーカープロセス間や再起動後も共有する
+      （読み書きはスレッドで行うため、イベントループは止まらない）
+    - 同じキーの呼び出しが同時に来た場合は、1回だけLLMを呼んで結果を共有する
+
+    ヒットした場合は、その結果を作ったときにLLMの呼び出しにかかった時間を saved_seconds に加算する。
+
+    Args:
+        max_entries (Optional[int]): メモリに置く件数の上限. 0 の場合はキャッシュしない（LLM_CACHE_MAX_ENTRIES）
+        ttl (Optional[float]): 結果を使う秒数（LLM_CACHE_TTL_SECONDS）
+        path (Optional[str]): ディスクのキャッシュのパス. 空の場合はメモリのみ（LLM_CACHE_PATH）
+    """
+    def __init__(
+        self,
+        max_entries: Optional[int] = None,
+        ttl: Optional[float] = None,
+        path: Optional[str] = None,
+    ):
+        self.max_entries = max_entries if max_entries is not None else int(os.getenv("LLM_CACHE_MAX_ENTRIES", "1024"))
+        self.ttl = ttl if ttl is not None else float(os.getenv("LLM_CACHE_TTL_SECONDS", "3600"))
+        self.path = path if path is not None else os.getenv("LLM_CACHE_PATH", "")
+        # key -> (結果, 期限, LLMの呼び出しにかかった秒数)
+        self._entries: "OrderedDict[str, Tuple[str, float, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        # 同じキーで実行中の呼び出し（イベントループごと）
+        self._inflight: Dict[Tuple[asyncio.AbstractEventLoop, str], asyncio.Future] = {}
+        self._conn: Optional[sqlite3.Connection] = None
+        self._conn_lock = threading.Lock()
+        # 期限切れの行を最後に消した時刻（書き込みのたびには消さない）
+        self._purged_at = 0.0
+        self._stats: Dict[str, Any] = {
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "joined": 0,
+            "misses": 0,
+            "stores": 0,
+            "evictions": 0,
+            "expired": 0,
+            "disk_errors": 0,
+            "saved_seconds": 0.0,
+        }
+        if self.enabled and self.path:
+            self._open_disk()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    def _open_disk(self) -> None:
+        try:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            with self._conn_lock, self._conn:
+                self._conn.execute("PRAGMA journal_mode=WAL")
+                self._conn.execute(
+                    "CREATE TABLE IF NOT EXISTS llm_cache ("
+                    "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL, latency REAL NOT NULL)"
+                )
+                self._conn.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_expires_at ON llm_cache (expires_at)")
+        except sqlite3.Error as e:
+            logger.warning(f"LLM result cache on disk is disabled ({self.path}): {e}")
+            self._conn = None
+
+    async def get_or_compute(
+        self,
+        chain: str,
+        model: Optional[str],
+        inputs: Dict[str, Any],
+        compute: Callable[[], Awaitable[str]],
+    ) -> str:
+        """キャッシュにあれば返し、無ければ compute() を呼んで保存する
+
+        Args:
+            chain (str): チェーン名（"plan" / "summary" など）
+            model (Optional[str]): モデル名
+            inputs (Dict[str, Any]): チェーンへの入力
+            compute (Callable[[], Awaitable[str]]): LLMを呼び出して結果を返す関数
+
+        Returns:
+            str: 結果
+        """
+        if not self.enabled:
+            return await compute()
+
+        key = make_cache_key(chain, model, inputs)
+        cached = self._get_memory(key)
+        if cached is not None:
+            return cached
+
+        loop = asyncio.get_running_loop()
+        inflight = self._inflight.get((loop, key))
+        while inflight is not None:
+            try:
+                result = await asyncio.shield(inflight)
+                self._count("joined")
+                return result
+            except asyncio.CancelledError:
+                if not inflight.cancelled():
+                    raise
+            # 先に実行していた呼び出しが取り消された場合は、自分で呼び出す
+            inflight = self._inflight.get((loop, key))
+
+        future = loop.create_future()
+        self._inflight[(loop, key)] = future
+        try:
+            cached = await self._get_disk(key)
+            if cached is not None:
+                result = cached
+            else:
+                self._count("misses")
+                started = time.monotonic()
+                result = await compute()
+                await self._put(key, result, time.monotonic() - started)
+            future.set_result(result)
+            return result
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            # 失敗した結果は保存せず、待っている呼び出しにも同じ例外を返す
+            future.set_exception(e)
+            future.exception()
+            raise
+        finally:
+            self._inflight.pop((loop, key), None)
+
+    def _count(self, key: str, amount: Any = 1) -> None:
+        with self._lock:
+            self._stats[key] += amount
+
+    def _get_memory(self, key: str) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at, latency = entry
+            if expires_at <= time.time():
+                del self._entries[key]
+                self._stats["expired"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats["memory_hits"] += 1
+            self._stats["saved_seconds"] += latency
+            return value
+
+    def _set_memory(self, key: str, value: str, expires_at: float, latency: float) -> None:
+        with self._lock:
+            self._entries[key] = (value, expires_at, latency)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats["evictions"] += 1
+
+    async def _get_disk(self, key: str) -> Optional[str]:
+        if self._conn is None:
+            return None
+
+        def read() -> Optional[Tuple[str, float, float]]:
+            with self._conn_lock:
+                return self._conn.execute(
+                    "SELECT value, expires_at, latency FROM llm_cache WHERE key = ?", (key,)
+                ).fetchone()
+
+        try:
+            row = await asyncio.to_thread(read)
+        except sqlite3.Error as e:
+            self._count("disk_errors")
+            logger.warning(f"Failed to read LLM result cache: {e}")
+            return None
+        if row is None:
+            return None
+        value, expires_at, latency = row
+        if expires_at <= time.time():
+            self._count("expired")
+            return None
+        # 他のワーカーが保存した結果も、次からはメモリから返す
+        self._set_memory(key, value, expires_at, latency)
+        with self._lock:
+            self._stats["disk_hits"] += 1
+            self._stats["saved_seconds"] += latency
+        return value
+
+    async def _put(self, key: str, value: str, latency: float) -> None:
+        expires_at = time.time() + self.ttl
+        self._set_memory(key, value, expires_at, latency)
+        self._count("stores")
+        if self._conn is None:
+            return
+
+        def write() -> None:
+            with self._conn_lock, self._conn:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO llm_cache (key, value, expires_at, latency) VALUES (?, ?, ?, ?)",
+                    (key, value, expires_at, latency),
+                )
+                now = time.time()
+                if now - self._purged_at >= _PURGE_INTERVAL:
+                    self._conn.execute("DELETE FROM llm_cache WHERE expires_at <= ?", (now,))
+                    self._purged_at = now
+
+        try:
+            await asyncio.to_thread(write)
+        except sqlite3.Error as e:
+            self._count("disk_errors")
+            logger.warning(f"Failed to write LLM result cache: {e}")
+
+    def clear(self) -> None:
+        """メモリのキャッシュを破棄する（ディスクの内容は残す）"""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """ヒット率と、ヒットにより省いたLLMの呼び出し時間"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._entries)
+        hits = stats["memory_hits"] + stats["disk_hits"] + stats["joined"]
+        requests = hits + stats["misses"]
+        stats["hit_rate"] = hits / requests if requests else 0.0
+        stats["disk"] = bool(self._conn is not None)
+        return stats
+
+
+# プロセス全体で共有するキャッシュ
+llm_result_cache = LLMResultCache()
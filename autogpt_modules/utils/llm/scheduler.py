@@ -0,0 +1,299 @@
+import os
+import asyncio
+import itertools
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Deque, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# 優先度のクラス（小さいほど優先）
+PRIORITY_INTERACTIVE = 0  # ユーザーへの返信を決める決定ステップ
+PRIORITY_PLANNING = 1     # plan_action のプラン生成（先読みを含む）
+PRIORITY_SUMMARY = 2      # save_result の要約・チャット履歴の圧縮
+PRIORITY_NAMES = {
+    PRIORITY_INTERACTIVE: "interactive",
+    PRIORITY_PLANNING: "planning",
+    PRIORITY_SUMMARY: "summary",
+}
+
+# キューの待ち時間の集計に使う直近の件数
+_WAIT_SAMPLES = 1000
+
+
+def _env_number(name: str, provider: str, default: str) -> float:
+    """プロバイダ別の設定（NAME_PROVIDER）があればそれを、無ければ NAME を読む"""
+    return float(os.getenv(f"{name}_{provider.upper()}", os.getenv(name, default)))
+
+
+def _percentile(samples: List[float], ratio: float) -> float:
+    if not samples:
+        return 0.0
+    return samples[min(int(len(samples) * ratio), len(samples) - 1)]
+
+
+class LLMTicket:
+    """スケジューラに並んでいる（または実行中の）1回のLLM呼び出し"""
+    def __init__(
+        self,
+        provider: str,
+        room_id: Optional[str],
+        priority: int,
+        cost: float,
+        start_tag: float,
+        seq: int,
+        loop: asyncio.AbstractEventLoop,
+    ):
+        self.provider = provider
+        self.room_id = room_id
+        self.priority = priority
+        # 予約したトークン数（実行後に record_tokens で実際の使用量に置き換える）
+        self.cost = cost
+        self.tokens: Optional[float] = None
+        self.start_tag = start_tag
+        self.seq = seq
+        self.loop = loop
+        self.future: asyncio.Future = loop.create_future()
+        self.enqueued_at = time.monotonic()
+        self.wait_seconds = 0.0
+        self.granted = False
+
+    def record_tokens(self, tokens: float) -> None:
+        """実際に使ったトークン数を記録する（トークンの予算の過不足を精算する）"""
+        if tokens > 0:
+            self.tokens = tokens
+
+
+class _ProviderState:
+    """プロバイダごとの同時実行数・トークンの予算・待ち行列"""
+    def __init__(self, provider: str, max_concurrency: int, tokens_per_minute: float):
+        self.provider = provider
+        self.max_concurrency = max(max_concurrency, 1)
+        self.tokens_per_minute = tokens_per_minute
+        self.tokens = tokens_per_minute
+        self.refilled_at = time.monotonic()
+        self.running = 0
+        self.waiting: List[LLMTicket] = []
+        # 重み付き公平キューイング（start-time fair queueing）の仮想時刻と、ルームごとの最後の終了タグ
+        self.virtual_time = 0.0
+        self.room_finish: Dict[Optional[str], float] = {}
+        self.retry_scheduled = False
+        self.throttled = 0
+
+    def refill(self, now: float) -> None:
+        if self.tokens_per_minute <= 0:
+            return
+        elapsed = now - self.refilled_at
+        self.refilled_at = now
+        self.tokens = min(self.tokens + elapsed * self.tokens_per_minute / 60, self.tokens_per_minute)
+
+
+class LLMScheduler:
+    """プロセス全体のLLM呼び出しを、プロバイダごとの上限の中で公平に割り当てるスケジューラ
+
+    すべての呼び出し（決定ステップ・プラン生成・要約）は slot() で実行枠を得てから行う。
+    - プロバイダごとに同時実行数（LLM_MAX_CONCURRENCY）と1分あたりのトークン数
+      （LLM_TOKENS_PER_MINUTE, 0 は無制限）の上限を持ち、上限に達した呼び出しは待たせる。
+      プロバイダ別の値は LLM_MAX_CONCURRENCY_DEEPSEEK のように指定する。
+    - 待っている呼び出しは優先度のクラス（返信 > プラン > 要約）の順に実行する。
+      低い優先度が待ち続けないよう、aging_seconds 待つごとに1クラスずつ優先度を上げる。
+    - 同じクラスの中ではルームごとに重み付き公平キューイングを行い、
+      呼び出しの多いルームが他のルームを待たせないようにする（コストは予約トークン数）。
+
+    ルームを複数のイベントループ（LoopShardPool）で動かす場合も同じ上限を共有できるよう、
+    状態はロックで守り、実行枠はそれぞれのイベントループに call_soon_threadsafe で渡す。
+    ワーカープロセスに分けた場合（WorkerPool）の上限はプロセスごと。
+
+    Args:
+        max_concurrency (Optional[int]): プロバイダごとの同時実行数の既定値
+        tokens_per_minute (Optional[float]): プロバイダごとの1分あたりのトークン数の既定値
+        aging_seconds (Optional[float]): 優先度を1クラス上げるまでの待ち時間（秒）
+    """
+    def __init__(
+        self,
+        max_concurrency: Optional[int] = None,
+        tokens_per_minute: Optional[float] = None,
+        aging_seconds: Optional[float] = None,
+    ):
+        self._max_concurrency = max_concurrency
+        self._tokens_per_minute = tokens_per_minute
+        self.aging_seconds = aging_seconds if aging_seconds is not None else float(os.getenv("LLM_PRIORITY_AGING_SECONDS", "30"))
+        self._lock = threading.Lock()
+        self._providers: Dict[str, _ProviderState] = {}
+        self._seq = itertools.count()
+        self._waits: Dict[int, Deque[float]] = {priority: deque(maxlen=_WAIT_SAMPLES) for priority in PRIORITY_NAMES}
+        self._granted: Dict[int, int] = {priority: 0 for priority in PRIORITY_NAMES}
+        self._cancelled = 0
+
+    def _provider(self, provider: str) -> _ProviderState:
+        state = self._providers.get(provider)
+        if state is None:
+            state = _ProviderState(
+                provider,
+                int(self._max_concurrency or _env_number("LLM_MAX_CONCURRENCY", provider, "8")),
+                self._tokens_per_minute if self._tokens_per_minute is not None
+                else _env_number("LLM_TOKENS_PER_MINUTE", provider, "0"),
+            )
+            self._providers[provider] = state
+        return state
+
+    @asynccontextmanager
+    async def slot(
+        self,
+        provider: str,
+        room_id: Optional[str] = None,
+        priority: int = PRIORITY_INTERACTIVE,
+        estimated_tokens: float = 0,
+        weight: float = 1.0,
+    ) -> AsyncIterator[LLMTicket]:
+        """実行枠を得るまで待ち、ブロックを抜けたら枠を返す
+
+        Args:
+            provider (str): 上限を共有するプロバイダ名
+            room_id (Optional[str]): 公平性の単位になるルームID
+            priority (int): 優先度のクラス（PRIORITY_*）
+            estimated_tokens (float): 予約するトークン数の見積もり（入力＋出力）
+            weight (float): ルームの重み. 大きいほど多く割り当てる
+
+        Yields:
+            LLMTicket: 実際の使用量を record_tokens で記録できる
+        """
+        ticket = await self._acquire(provider, room_id, priority, estimated_tokens, weight)
+        try:
+            yield ticket
+        finally:
+            self._release(ticket)
+
+    async def _acquire(
+        self, provider: str, room_id: Optional[str], priority: int, estimated_tokens: float, weight: float
+    ) -> LLMTicket:
+        loop = asyncio.get_running_loop()
+        cost = max(float(estimated_tokens), 1.0)
+        with self._lock:
+            state = self._provider(provider)
+            start_tag = max(state.virtual_time, state.room_finish.get(room_id, 0.0))
+            state.room_finish[room_id] = start_tag + cost / max(weight, 1e-6)
+            ticket = LLMTicket(provider, room_id, priority, cost, start_tag, next(self._seq), loop)
+            state.waiting.append(ticket)
+            self._dispatch_locked(state)
+
+        try:
+            await ticket.future
+        except asyncio.CancelledError:
+            with self._lock:
+                if ticket in state.waiting:
+                    state.waiting.remove(ticket)
+                    self._cancelled += 1
+                    ticket = None
+            # 枠を渡された直後に取り消された場合は、そのまま返す
+            if ticket is not None:
+                self._release(ticket)
+            raise
+        return ticket
+
+    def _effective_priority(self, ticket: LLMTicket, now: float) -> float:
+        if self.aging_seconds <= 0:
+            return ticket.priority
+        return ticket.priority - int((now - ticket.enqueued_at) / self.aging_seconds)
+
+    def _dispatch_locked(self, state: _ProviderState) -> None:
+        """空いている枠とトークンの予算の範囲で、待っている呼び出しに枠を渡す"""
+        now = time.monotonic()
+        state.refill(now)
+        while state.waiting and state.running < state.max_concurrency:
+            ticket = min(
+                state.waiting,
+                key=lambda t: (self._effective_priority(t, now), t.start_tag, t.seq),
+            )
+            if state.tokens_per_minute > 0:
+                # 予算より大きい呼び出しも、予算が満タンになれば通す
+                needed = min(ticket.cost, state.tokens_per_minute)
+                if state.tokens < needed:
+                    state.throttled += 1
+                    self._schedule_retry_locked(state, ticket, (needed - state.tokens) * 60 / state.tokens_per_minute)
+                    return
+                state.tokens -= ticket.cost
+
+            state.waiting.remove(ticket)
+            state.running += 1
+            state.virtual_time = max(state.virtual_time, ticket.start_tag)
+            ticket.granted = True
+            ticket.wait_seconds = now - ticket.enqueued_at
+            self._waits[ticket.priority].append(ticket.wait_seconds)
+            self._granted[ticket.priority] += 1
+            ticket.loop.call_soon_threadsafe(self._grant, ticket)
+
+        # 終わったルームの終了タグは仮想時刻に追い越されたら不要になる
+        if len(state.room_finish) > 1000:
+            state.room_finish = {room: tag for room, tag in state.room_finish.items() if tag > state.virtual_time}
+
+    def _grant(self, ticket: LLMTicket) -> None:
+        if not ticket.future.done():
+            ticket.future.set_result(ticket)
+
+    def _schedule_retry_locked(self, state: _ProviderState, ticket: LLMTicket, delay: float) -> None:
+        """トークンの予算が回復する頃に割り当てをやり直す"""
+        if state.retry_scheduled:
+            return
+        state.retry_scheduled = True
+
+        def retry() -> None:
+            with self._lock:
+                state.retry_scheduled = False
+                self._dispatch_locked(state)
+
+        ticket.loop.call_soon_threadsafe(ticket.loop.call_later, delay, retry)
+
+    def _release(self, ticket: LLMTicket) -> None:
+        with self._lock:
+            state = self._providers[ticket.provider]
+            state.running -= 1
+            if state.tokens_per_minute > 0 and ticket.tokens is not None:
+                # 予約した分と実際の使用量の差を精算する
+                state.tokens = min(state.tokens + ticket.cost - ticket.tokens, state.tokens_per_minute)
+            self._dispatch_locked(state)
+
+    def queue_depth(self, priority: Optional[int] = None) -> int:
+        """全プロバイダで枠を待っている呼び出しの数（priority を指定した場合はそのクラスのみ）"""
+        with self._lock:
+            return sum(
+                1
+                for state in self._providers.values()
+                for ticket in state.waiting
+                if priority is None or ticket.priority == priority
+            )
+
+    def stats(self) -> Dict[str, Any]:
+        """プロバイダごとの実行数・待ち行列と、優先度ごとの待ち時間（ミリ秒）"""
+        with self._lock:
+            now = time.monotonic()
+            providers = {}
+            for name, state in self._providers.items():
+                state.refill(now)
+                providers[name] = {
+                    "running": state.running,
+                    "waiting": len(state.waiting),
+                    "max_concurrency": state.max_concurrency,
+                    "tokens_per_minute": state.tokens_per_minute,
+                    "tokens_available": round(state.tokens) if state.tokens_per_minute > 0 else None,
+                    "throttled": state.throttled,
+                }
+            classes = {}
+            for priority, name in PRIORITY_NAMES.items():
+                waits = sorted(self._waits[priority])
+                classes[name] = {
+                    "granted": self._granted[priority],
+                    "wait_ms": {
+                        "p50": _percentile(waits, 0.5) * 1000,
+                        "p95": _percentile(waits, 0.95) * 1000,
+                        "max": waits[-1] * 1000 if waits else 0.0,
+                    },
+                }
+            return {"providers": providers, "priorities": classes, "cancelled": self._cancelled}
+
+
+# プロセス全体で共有するスケジューラ
+llm_scheduler = LLMScheduler()
@@ -0,0 +1,87 @@
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, Optional
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.outputs import LLMResult
+from langchain_core.tracers.context import register_configure_hook
+
+
+def extract_token_usage(message: Any) -> Dict[str, int]:
+    """LLMの応答メッセージからトークン使用量を取り出す
+
+    langchain標準の usage_metadata を優先し、無い場合はプロバイダが返す
+    token_usage（OpenAI: prompt_tokens_details.cached_tokens,
+    DeepSeek: prompt_cache_hit_tokens）を参照する。
+
+    Args:
+        message (Any): AIMessage などの応答
+
+    Returns:
+        Dict[str, int]: input_tokens, output_tokens, cached_input_tokens
+    """
+    usage = {"input_tokens": 0, "output_tokens": 0, "cached_input_tokens": 0}
+
+    usage_metadata = getattr(message, "usage_metadata", None) or {}
+    if usage_metadata:
+        usage["input_tokens"] = usage_metadata.get("input_tokens", 0) or 0
+        usage["output_tokens"] = usage_metadata.get("output_tokens", 0) or 0
+        usage["cached_input_tokens"] = (usage_metadata.get("input_token_details") or {}).get("cache_read", 0) or 0
+
+    response_metadata = getattr(message, "response_metadata", None) or {}
+    token_usage = response_metadata.get("token_usage") or response_metadata.get("usage") or {}
+    if token_usage:
+        if not usage["input_tokens"]:
+            usage["input_tokens"] = token_usage.get("prompt_tokens", 0) or 0
+        if not usage["output_tokens"]:
+            usage["output_tokens"] = token_usage.get("completion_tokens", 0) or 0
+        if not usage["cached_input_tokens"]:
+            usage["cached_input_tokens"] = (
+                token_usage.get("prompt_cache_hit_tokens")
+                or (token_usage.get("prompt_tokens_details") or {}).get("cached_tokens")
+                or 0
+            )
+
+    return usage
+
+
+class TokenUsageCollector(BaseCallbackHandler):
+    """collect_token_usage の中で呼び出したLLMのトークン使用量を合計するコールバック"""
+    # イベントループ上で呼ばせる（スレッドに回さない）
+    run_inline = True
+
+    def __init__(self):
+        super().__init__()
+        self.usage = {"input_tokens": 0, "output_tokens": 0, "cached_input_tokens": 0}
+        self._lock = threading.Lock()
+
+    @property
+    def total_tokens(self) -> int:
+        return self.usage["input_tokens"] + self.usage["output_tokens"]
+
+    def on_llm_end(self, response: LLMResult, **kwargs: Any) -> None:
+        for generations in response.generations:
+            for generation in generations:
+                usage = extract_token_usage(getattr(generation, "message", None))
+                with self._lock:
+                    for key, value in usage.items():
+                        self.usage[key] += value
+
+
+_usage_collector: ContextVar[Optional[TokenUsageCollector]] = ContextVar("llm_usage_collector", default=None)
+register_configure_hook(_usage_collector, True)
+
+
+@contextmanager
+def collect_token_usage() -> Iterator[TokenUsageCollector]:
+    """この中で実行したチェーンのLLMのトークン使用量を集める
+
+    チェーンが StrOutputParser で文字列にしてしまう場合でも、LLMの応答の usage_metadata から数えられる。
+    """
+    collector = TokenUsageCollector()
+    token = _usage_collector.set(collector)
+    try:
+        yield collector
+    finally:
+        _usage_collector.reset(token)
@@ -0,0 +1,175 @@
+"""LoopShardPool のシャード数ごとの応答遅延のベンチマーク
+
+多数のヒアリングを同時に動かす合成負荷で、1シャードとNシャードを比べる。
+各ルームはメッセージを受け取るたびに、プロンプト構築とJSON処理に相当するCPU処理と
+LLM呼び出しに相当する待機を行ってから返信する。LLMは呼び出さない。
+HEAVY_EVERY 件に1件のルームは履歴が長く、処理が HEAVY_FACTOR 倍かかる。
+
+ゲートウェイでメッセージを転送してから返信が届くまでの時間（軽いルーム・重いルーム別）と、
+ゲートウェイのイベントループの遅れ（送受信の詰まり具合）を計測する。
+
+負荷は2種類:
+    gil_bound: Pythonのコードだけの処理（JSONの変換）. GILを離さないため、シャードを増やしても速くならない
+    blocking:  上に加えて、GILを離して待つ同期処理（履歴のファイルへの追い出し、SQLite、トークナイザなど）.
+               1つのループではこれがループ全体を止めるが、シャードに分けると他のシャードは進める
+
+    python benchmarks/bench_loop_shards.py [hearings] [messages_per_hearing]
+"""
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi import WebSocketDisconnect
+
+from autogpt_modules.communication import LoopShardPool, run_worker
+
+SHARD_COUNTS = [1, 2, 4]
+LLM_LATENCY = 0.05
+# ユーザーのメッセージの間隔
+MESSAGE_INTERVAL = 0.5
+HEAVY_EVERY = 10
+HEAVY_FACTOR = 10
+# 負荷ごとの (JSON変換の回数, GILを離す同期処理の秒数). 重いルームはどちらも HEAVY_FACTOR 倍
+WORKLOADS = {
+    "gil_bound": (1, 0.0),
+    "blocking": (1, 0.002),
+}
+workload = WORKLOADS["gil_bound"]
+# 1ステップ分のプロンプトに相当する大きさのデータ
+PROMPT_PAYLOAD = {"events": [{"action": f"tool_execution : reply_message {i}", "result": "結果 " * 20} for i in range(300)]}
+
+
+def build_prompt(text: str, repeat: int = 1) -> str:
+    """プロンプト構築とJSON処理に相当するCPU処理"""
+    for _ in range(repeat):
+        encoded = json.dumps({**PROMPT_PAYLOAD, "message": text}, ensure_ascii=False)
+        text = json.loads(encoded)["message"]
+    return text
+
+
+def is_heavy(user_id: str) -> bool:
+    return int(user_id.rsplit("_", 1)[1]) % HEAVY_EVERY == 0
+
+
+async def synthetic_hearing(websocket, user_id):
+    """main の handle_websocket の代わりに、CPU処理と待機だけを行うルーム"""
+    await websocket.accept()
+    factor = HEAVY_FACTOR if is_heavy(user_id) else 1
+    repeat, blocking = workload[0] * factor, workload[1] * factor
+    try:
+        while True:
+            text = await websocket.receive_text()
+            prompt = build_prompt(text, repeat)
+            time.sleep(blocking)
+            await asyncio.sleep(LLM_LATENCY)
+            await websocket.send_text(build_prompt(prompt, repeat))
+    except WebSocketDisconnect:
+        return
+
+
+def shard_main(index, num_shards, inbox, outbox):
+    run_worker(index, num_shards, inbox, outbox, handler=synthetic_hearing)
+
+
+class BenchSocket:
+    """ゲートウェイ側の WebSocket の代わり. 返信が届いた時刻を記録する"""
+    def __init__(self):
+        self.sent_at = {}
+        self.latencies = []
+        self.replied = asyncio.Event()
+        self.expected = 0
+
+    async def send_text(self, text: str) -> None:
+        self.latencies.append(time.perf_counter() - self.sent_at.pop(text))
+        if len(self.latencies) >= self.expected:
+            self.replied.set()
+
+    async def close(self) -> None:
+        pass
+
+
+async def measure_loop_lag(stop: asyncio.Event, lags: list, interval: float = 0.005) -> None:
+    """ゲートウェイのイベントループが予定より何秒遅れて動けたか"""
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        expected = loop.time() + interval
+        await asyncio.sleep(interval)
+        lags.append(loop.time() - expected)
+
+
+async def bench(num_shards: int, hearings: int, messages: int):
+    pool = LoopShardPool(num_shards, shard_main)
+    pool.start()
+    stop = asyncio.Event()
+    lags = []
+    lag_task = asyncio.create_task(measure_loop_lag(stop, lags))
+
+    sockets = []
+    for i in range(hearings):
+        websocket = BenchSocket()
+        websocket.expected = messages
+        websocket.heavy = is_heavy(f"user_{i}")
+        sockets.append((pool.open(websocket, f"user_{i}"), websocket))
+
+    started = time.perf_counter()
+    for n in range(messages):
+        for conn_id, websocket in sockets:
+            text = f"{conn_id}:{n}"
+            websocket.sent_at[text] = time.perf_counter()
+            pool.forward(conn_id, text)
+        await asyncio.sleep(MESSAGE_INTERVAL)
+    await asyncio.gather(*(websocket.replied.wait() for _, websocket in sockets))
+    elapsed = time.perf_counter() - started
+
+    stop.set()
+    await lag_task
+    for conn_id, _ in sockets:
+        pool.disconnect(conn_id)
+    await pool.stop()
+
+    def percentiles(heavy: bool):
+        latencies = sorted(l for _, ws in sockets if ws.heavy == heavy for l in ws.latencies)
+        return statistics.median(latencies), latencies[max(int(len(latencies) * 0.99) - 1, 0)]
+
+    light_p50, light_p99 = percentiles(False)
+    heavy_p50, heavy_p99 = percentiles(True)
+    return {
+        "light_p50": light_p50,
+        "light_p99": light_p99,
+        "heavy_p50": heavy_p50,
+        "heavy_p99": heavy_p99,
+        "max_loop_lag": max(lags) if lags else 0.0,
+        "throughput": hearings * messages / elapsed,
+    }
+
+
+def main():
+    hearings = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    messages = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    print(
+        f"hearings={hearings} (heavy: 1/{HEAVY_EVERY}, x{HEAVY_FACTOR} CPU), messages/hearing={messages}, "
+        f"llm_latency={LLM_LATENCY * 1000:.0f}ms"
+    )
+    global workload
+    for name, workload in WORKLOADS.items():
+        print(f"\n[{name}] (latencies in ms)")
+        print(
+            f"{'shards':>6} | {'light p50':>9} | {'light p99':>9} | {'heavy p50':>9} | {'heavy p99':>9} | "
+            f"{'gateway lag':>11} | {'replies/s':>9}"
+        )
+        for num_shards in SHARD_COUNTS:
+            result = asyncio.run(bench(num_shards, hearings, messages))
+            print(
+                f"{num_shards:>6} | {result['light_p50'] * 1000:>9.1f} | {result['light_p99'] * 1000:>9.1f} | "
+                f"{result['heavy_p50'] * 1000:>9.1f} | {result['heavy_p99'] * 1000:>9.1f} | "
+                f"{result['max_loop_lag'] * 1000:>11.1f} | {result['throughput']:>9.0f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""AutoGPTPrompt.construct_full_prompt のマイクロベンチマーク
+
+履歴（イベント・チャット）の件数を増やしながら、1ステップ分のプロンプト構築に
+かかる時間を計測する。LLMは呼び出さない。
+
+    python benchmarks/bench_prompt.py
+"""
+import asyncio
+import contextlib
+import io
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from autogpt_modules.communication import WebSocketManager
+from autogpt_modules.core import AutoGPTPrompt
+from autogpt_modules.tools import ReplyMessage, Wait, Finish, GoNext
+from autogpt_modules.tools.plan_action import PlanAction
+from autogpt_modules.tools.save_result import SaveResult
+from hearing_module.goals import hearing_goals
+from utils import dict_to_string
+
+HISTORY_SIZES = [0, 50, 200, 500, 1000]
+STEPS = 50
+
+
+def build_prompt(websocket_manager, room, send_token_limit):
+    tools = [
+        ReplyMessage(websocket_manager=websocket_manager, room_id=room.id),
+        Wait(websocket_manager=websocket_manager, event_manager=room.event_manager, room_id=room.id),
+        PlanAction(websocket_manager=websocket_manager, room_id=room.id),
+        SaveResult(websocket_manager=websocket_manager, room_id=room.id),
+        Finish(),
+        GoNext(),
+    ]
+    return AutoGPTPrompt(
+        ai_name="bench",
+        ai_role="bench",
+        tools=tools,
+        input_variables=["goals", "current_goal", "common_rule", "flags"],
+        token_counter=lambda text: len(text) // 2 + 1,
+        send_token_limit=send_token_limit,
+        get_chat_history=room.message_manager.get_chat_history,
+        get_event_history=room.event_manager.get_event_history,
+        event_cursor=room.event_manager.cursor(),
+        get_consecutive_message_number=room.message_manager.get_consecutive_message_number,
+        get_is_new_response_from_user_came=room.message_manager.has_new_messages,
+        get_summaries=lambda: [],
+        get_waiting_info=tools[1].get_waiting_info,
+    )
+
+
+async def bench(history_size: int, send_token_limit: int) -> float:
+    websocket_manager = WebSocketManager()
+    room = websocket_manager.get_or_create_room(f"bench_{history_size}")
+    for i in range(history_size):
+        await room.message_manager.add_message(f"メッセージ {i} " * 5, "user" if i % 2 else "assistant")
+        await room.event_manager.add_event("tool_execution : reply_message", purpose=f"purpose {i}", result=f"result {i}")
+
+    prompt = build_prompt(websocket_manager, room, send_token_limit)
+    goals = [dict_to_string(goal) for goal in hearing_goals["plan_details"]]
+    common_rule = dict_to_string(hearing_goals["common_rules"])
+    flags = {"finish": False, "go_next": False, "plan_action": True, "reply_message": False}
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        # 初回（コンパイル・フォーマットのキャッシュ作成）は計測から除く
+        prompt.construct_full_prompt(goals, goals[0], common_rule, flags)
+        started = time.perf_counter()
+        for step in range(STEPS):
+            await room.event_manager.add_event("wait", purpose=f"step {step}")
+            prompt.construct_full_prompt(goals, goals[0], common_rule, flags)
+        elapsed = time.perf_counter() - started
+    return elapsed / STEPS * 1000
+
+
+async def main():
+    print(f"{'history':>8} {'unbounded (ms/step)':>20} {'budget 10k (ms/step)':>21}")
+    for size in HISTORY_SIZES:
+        unbounded = await bench(size, send_token_limit=10**9)
+        budgeted = await bench(size, send_token_limit=10000)
+        print(f"{size:>8} {unbounded:>20.3f} {budgeted:>21.3f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
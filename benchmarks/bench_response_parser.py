@@ -0,0 +1,85 @@
+"""決定ステップの応答解析のベンチマーク
+
+記録済みの応答（benchmarks/data/recorded_responses.jsonl、1行に応答全文のJSON文字列）に対して
+以下を比較する。
+
+- double parse: 従来の AutoGPTOutputParser.parse + json.loads
+- single pass: parse_response（完成済みの応答を json.loads で1回だけ解析する）
+- streamed: StreamingResponseParser にLLMのトークン程度の断片で渡す（決定ステップで使う. 生成と並行して処理される）
+
+    python benchmarks/bench_response_parser.py
+"""
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from langchain_experimental.autonomous_agents.autogpt.output_parser import AutoGPTOutputParser
+from autogpt_modules.core.stream_parser import StreamingResponseParser, parse_response
+from utils import string_to_bool
+
+DATA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "recorded_responses.jsonl")
+ITERATIONS = 2000
+CHUNK_SIZE = 4
+
+
+def load_responses():
+    with open(DATA_PATH, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def double_parse(text, output_parser):
+    action = output_parser.parse(text)
+    parsed = json.loads(text)
+    thoughts = parsed.get("thoughts", {})
+    return action, thoughts.get("text", ""), string_to_bool(thoughts.get("is_finish", "false")), string_to_bool(thoughts.get("is_go_next", "false"))
+
+
+def single_pass(text, output_parser):
+    parsed = parse_response(text, output_parser)
+    return parsed.action, parsed.purpose, parsed.is_finish, parsed.is_go_next
+
+
+def streamed(text, output_parser):
+    parser = StreamingResponseParser()
+    for i in range(0, len(text), CHUNK_SIZE):
+        parser.feed(text[i:i + CHUNK_SIZE])
+    parsed = parser.to_response(output_parser)
+    return parsed.action, parsed.purpose, parsed.is_finish, parsed.is_go_next
+
+
+def bench(func, responses, output_parser):
+    started = time.perf_counter()
+    for _ in range(ITERATIONS):
+        for text in responses:
+            func(text, output_parser)
+    return (time.perf_counter() - started) / (ITERATIONS * len(responses)) * 1e6
+
+
+def main():
+    responses = load_responses()
+    output_parser = AutoGPTOutputParser()
+
+    # 結果が一致することを確認してから計測する
+    for text in responses:
+        assert double_parse(text, output_parser) == single_pass(text, output_parser) == streamed(text, output_parser)
+
+    print(f"{len(responses)} recorded responses, average {sum(map(len, responses)) // len(responses)} chars")
+    for name, func in [("double parse", double_parse), ("single pass", single_pass), ("streamed", streamed)]:
+        print(f"{name:>14}: {bench(func, responses, output_parser):8.1f} us/response")
+
+    # ストリーミングでは解析の大半が生成中に済み、最後のトークン到着後に残る処理は小さい
+    parser = StreamingResponseParser()
+    head, last_token = responses[0][:-CHUNK_SIZE], responses[0][-CHUNK_SIZE:]
+    for i in range(0, len(head), CHUNK_SIZE):
+        parser.feed(head[i:i + CHUNK_SIZE])
+    started = time.perf_counter()
+    parser.feed(last_token)
+    parser.to_response(output_parser)
+    print(f"{'after last token':>14}: {(time.perf_counter() - started) * 1e6:8.1f} us (streamed)")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,12 @@
 import asyncio
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from autogpt_modules.communication import WebSocketManager
-from autogpt_modules.core import AutoGPT
+from fastapi.responses import JSONResponse
+from autogpt_modules.communication import WebSocketManager, WorkerPool, LoopShardPool, get_plan_prefetch_stats, run_worker
+from autogpt_modules.core import AutoGPT, AdmissionController, HibernationScheduler, StartupWarmup, create_session_store, get_preemption_stats
+from autogpt_modules.core.autogpt_prompt import precompile_base_prompt
+from autogpt_modules.core.base_prompt import validate_prompt_layout
+from autogpt_modules.core.hibernation import WAKE_BY_MESSAGE
 from autogpt_modules.tools import (
     ReplyMessage,
     ReplyMessageWithStamp,
@@ -11,13 +15,14 @@ from autogpt_modules.tools import (
     GoNext
 )
 import os
-from datetime import datetime
+from datetime import datetime, timedelta
 from langchain_openai import ChatOpenAI
 from autogpt_modules.core.custom_congif import MODEL
-from autogpt_modules.tools.plan_action import PlanAction
+from autogpt_modules.tools.plan_action import PlanAction, warm_up_plan
 from autogpt_modules.tools.save_result import SaveResult
+from autogpt_modules.utils.llm import llm_client_registry, llm_result_cache, llm_scheduler, PRIORITY_INTERACTIVE
 from hearing_module.goals import hearing_goals
-from utils import dict_to_string
+from utils import dict_to_string, string_to_bool
 import logging
 import json
 import traceback
@@ -35,6 +40,10 @@ logging.getLogger("httpcore").setLevel(logging.WARNING)
 
 logger = logging.getLogger(__name__)
 
+# ヒアリングのゴールと共通ルールの文字列（セッションごとに変換し直さない）
+HEARING_GOALS = [dict_to_string(goal_dict) for goal_dict in hearing_goals["plan_details"]]
+HEARING_COMMON_RULE = dict_to_string(hearing_goals["common_rules"])
+
 app = FastAPI()
 # CORS設定
 origins = [
@@ -53,143 +62,411 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-websocket_manager = WebSocketManager(room_timeout=30)
-
-def create_autogpt_instance(room):
-    """AutoGPTインスタンスを作成"""
-
-    if room is None:
-        raise ValueError("Room not found")
-    
-    llm = ChatOpenAI(
-        temperature=0, 
-        model=os.getenv("BASE_MODEL"), 
-        api_key=os.getenv("DEEPSEEK_API_KEY"),
-        streaming=True,
-        base_url=os.getenv("DEEPSEEK_BASE_URL")
-    ).bind(
-        response_format={"type": "json_object"}
-    )
+class AgentRuntime:
+    """1つのイベントループでルームとエージェントを動かすための一式
 
-    tools = [
-        ReplyMessage(
-            websocket_manager=websocket_manager,
-            room_id=room.id
-        ),
-        ReplyMessageWithStamp(
-            websocket_manager=websocket_manager,
-            room_id=room.id
-        ),
-        Wait(
-            websocket_manager=websocket_manager,
-            event_manager=room.event_manager,
-            room_id=room.id
-        ),
-        PlanAction(
-            websocket_manager=websocket_manager,
-            room_id=room.id
-        ),
-        SaveResult(
+    単一プロセスの場合は起動時にモジュールの runtime を作り、ワーカープロセスやシャードのスレッドでは
+    それぞれのイベントループで新しく作る（ストアやスケジューラはイベントループに紐づくため共有しない）。
+    """
+    def __init__(self):
+        # 設定の誤りは最初のヒアリングを待たずに起動時に知らせる
+        self.prompt_layout = validate_prompt_layout(os.getenv("PROMPT_LAYOUT", "default"))
+        # ルームの状態の保存先（既定はメモリ. SESSION_STORE=sqlite なら再起動後も進行中のヒアリングを復元できる）
+        self.session_store = create_session_store(
+            os.getenv("SESSION_STORE", "memory"),
+            path=os.getenv("SESSION_DB_PATH", "sessions.db"),
+        )
+        self.websocket_manager = WebSocketManager(
+            room_timeout=30,
+            sweep_interval=float(os.getenv("ROOM_SWEEP_INTERVAL", "60")),
+            session_store=self.session_store,
+        )
+        # 長い wait の間はエージェントを解放し、起床時刻または新着メッセージで作り直す
+        self.hibernation_scheduler = HibernationScheduler(on_wake=self.wake_room)
+        # 実行中のヒアリングやLLMの待ち行列が多い間は、新しいヒアリングを到着順に待たせる
+        self.admission = AdmissionController(queue_depth=lambda: llm_scheduler.queue_depth(PRIORITY_INTERACTIVE))
+        # 起動時のウォームアップ（start() で始める. 終わるまで /ready は 503 を返す）
+        self.warmup = StartupWarmup({})
+
+    def _get_decision_llm(self):
+        """決定ステップのLLMクライアント（全ルームで共有し、DeepSeekへの接続を使い回す）"""
+        return llm_client_registry.get_or_create(
+            "openai",
+            ChatOpenAI,
+            temperature=0, 
+            model=os.getenv("BASE_MODEL"), 
+            api_key=os.getenv("DEEPSEEK_API_KEY"),
+            streaming=True,
+            stream_usage=True,
+            base_url=os.getenv("DEEPSEEK_BASE_URL")
+        )
+
+    def _create_tools(self, room):
+        """エージェントのツール一式を作成（room が None の場合はプロンプトのウォームアップ用）"""
+        websocket_manager = self.websocket_manager
+        room_id = room.id if room is not None else None
+        return [
+            ReplyMessage(
+                websocket_manager=websocket_manager,
+                room_id=room_id
+            ),
+            ReplyMessageWithStamp(
+                websocket_manager=websocket_manager,
+                room_id=room_id
+            ),
+            Wait(
+                websocket_manager=websocket_manager,
+                event_manager=room.event_manager if room is not None else None,
+                room_id=room_id
+            ),
+            PlanAction(
+                websocket_manager=websocket_manager,
+                room_id=room_id
+            ),
+            SaveResult(
+                websocket_manager=websocket_manager,
+                room_id=room_id
+            ),
+            Finish(),
+            GoNext()
+        ]
+
+    def create_autogpt_instance(self, room):
+        """AutoGPTインスタンスを作成"""
+
+        if room is None:
+            raise ValueError("Room not found")
+        
+        llm = self._get_decision_llm().bind(
+            response_format={"type": "json_object"}
+        )
+
+        websocket_manager = self.websocket_manager
+        tools = self._create_tools(room)
+
+        return AutoGPT.from_llm_and_tools(
+            ai_name="認知症サポーター",
+            ai_role="認知症患者の生活における意思決定支援や不安解消を行う情緒的なケアを行うエージェント",
+            tools=tools,
+            flag_names=["finish", "go_next", "plan_action", "reply_message"],
+            llm=llm,
+            room_id=room.id,
+            verbose=True,
             websocket_manager=websocket_manager,
-            room_id=room.id
-        ),
-        Finish(),
-        GoNext()
-    ]
-
-    return AutoGPT.from_llm_and_tools(
-        ai_name="認知症サポーター",
-        ai_role="認知症患者の生活における意思決定支援や不安解消を行う情緒的なケアを行うエージェント",
-        tools=tools,
-        flag_names=["finish", "go_next", "plan_action", "reply_message"],
-        llm=llm,
-        room_id=room.id,
-        verbose=True,
-        websocket_manager=websocket_manager
+            prompt_layout=self.prompt_layout,
+            stream_reply=string_to_bool(os.getenv("STREAM_REPLY", "false")),
+            prefetch_plans=string_to_bool(os.getenv("PREFETCH_PLANS", "false")),
+            compact_chat=string_to_bool(os.getenv("COMPACT_CHAT", "false")),
+            hibernation_scheduler=self.hibernation_scheduler if string_to_bool(os.getenv("HIBERNATE_AGENTS", "false")) else None,
+            llm_provider="deepseek"
+        )
+
+    def wake_room(self, room_id: str, reason: str):
+        """休止していたエージェントを作り直し、チェックポイントから再開する"""
+        room = self.websocket_manager.get_room(room_id)
+        if room is None:
+            logger.info(f"Room {room_id} was removed while its agent was hibernating")
+            self.admission.forget(room_id)
+            return
+        logger.info(f"Waking agent for room {room_id} ({reason})")
+        if room.autogpt is None:
+            room.autogpt = self.create_autogpt_instance(room)
+        room.agent_task = asyncio.create_task(
+            self._run_admitted(room, lambda: room.autogpt.resume(room_id=room.id, woke_by=reason), wait_in_queue=False)
+        )
+
+    async def _run_admitted(self, room, run, wait_in_queue: bool = True):
+        """ヒアリングの枠を取ってからエージェントを動かし、終わったら（休止した場合も）枠を返す
+
+        Args:
+            room: ルーム
+            run: エージェントの実行を開始する関数（コルーチンを返す）
+            wait_in_queue: False の場合は待たせずに開始する（既に始まっているヒアリングの再開）
+        """
+        if wait_in_queue:
+            admitted = await self.admission.admit(
+                room.id, lambda position, eta: self._notify_queue_position(room, position, eta)
+            )
+            if not admitted:
+                logger.info(f"Queued hearing for room {room.id} was cancelled before it started")
+                return None
+        else:
+            self.admission.admit_now(room.id)
+        try:
+            return await run()
+        finally:
+            # 休止・切断した場合はセッションが続いているため、所要時間は完了・中止したときに記録する
+            status = (room.checkpoint or {}).get("status")
+            self.admission.release(room.id, finished=status in ("completed", "stopped"))
+
+    async def _notify_queue_position(self, room, position: int, eta):
+        """待っているクライアントに順番と開始までの見積もりを送る（開始するときは admitted）"""
+        now = datetime.now()
+        data = {"position": position}
+        if position > 0:
+            data["estimated_wait_seconds"] = eta
+            data["estimated_start_at"] = (now + timedelta(seconds=eta)).isoformat() if eta is not None else None
+        await self.websocket_manager.send_message(room.id, json.dumps({
+            "type": "queued" if position > 0 else "admitted",
+            "room_id": room.id,
+            "user_id": room.user_id,
+            "timestamp": now.isoformat(),
+            "data": data,
+        }))
+
+    def _warmup_steps(self):
+        """起動時のウォームアップのステップ（最初のユーザーが待たされる準備を先に済ませる）"""
+
+        async def decision_llm():
+            # クライアントを生成し、DeepSeekへのTLS接続を張っておく（トークンを使わない models の一覧を取得する）
+            llm = self._get_decision_llm()
+            await llm.root_async_client.models.list()
+
+        async def prompt():
+            # 不変セクションをコンパイルし、トークン数の計算に使うエンコーディングを読み込んでおく
+            compiled = precompile_base_prompt(
+                self._create_tools(None), HEARING_GOALS, HEARING_COMMON_RULE, self.prompt_layout
+            )
+            await asyncio.to_thread(self._get_decision_llm().get_num_tokens, compiled.head)
+
+        steps = {"decision_llm": decision_llm, "prompt": prompt}
+        if string_to_bool(os.getenv("PREFETCH_PLANS", "false")):
+            # 開始時に先読みする最初のゴールのプランを結果のキャッシュに入れておく（プランのLLMへの接続も張られる）
+            steps["first_plan"] = lambda: warm_up_plan(HEARING_GOALS[0])
+        return steps
+
+    async def start(self, owns=None):
+        """ルームとエージェントを動かすための準備
+
+        Args:
+            owns: 復元するユーザーを判定する関数. ワーカーでは担当するユーザーだけを復元する
+        """
+        if string_to_bool(os.getenv("WARMUP_ON_STARTUP", "false")):
+            self.warmup = StartupWarmup(self._warmup_steps())
+        self.warmup.start()
+        await self.session_store.start()
+        await self.websocket_manager.restore_rooms(user_filter=owns)
+        # 休止したまま再起動したルームは、保存していた起床時刻で起こす
+        for room in list(self.websocket_manager._rooms.values()):
+            if room.checkpoint and room.checkpoint.get("status") == "hibernating":
+                self.hibernation_scheduler.hibernate(room.id, room.checkpoint["wait"]["wake_at"])
+        self.hibernation_scheduler.start()
+        self.websocket_manager.start_sweeper()
+
+    async def stop(self):
+        await self.warmup.stop()
+        await self.websocket_manager.stop_sweeper()
+        await self.hibernation_scheduler.stop()
+        self.websocket_manager.cleanup_inactive_rooms()
+        await self.session_store.close()
+        await llm_client_registry.aclose()
+
+    async def metrics(self):
+        return {
+            "llm_clients": llm_client_registry.stats(),
+            "rooms": self.websocket_manager.stats(),
+            "session_store": self.session_store.stats(),
+            "plan_prefetch": get_plan_prefetch_stats(),
+            "chat_compaction": self._chat_compaction_stats(),
+            "hibernation": self.hibernation_scheduler.stats(),
+            "outbound": self.websocket_manager.outbound_stats(),
+            "input_coalescing": self.websocket_manager.input_stats(),
+            "decision_preemption": get_preemption_stats(),
+            "llm_scheduler": llm_scheduler.stats(),
+            "llm_result_cache": llm_result_cache.stats(),
+            "admission": self.admission.stats(),
+            "warmup": self.warmup.stats(),
+        }
+
+    def _chat_compaction_stats(self):
+        """接続中のルームのチャット履歴の圧縮状況を集計"""
+        totals = {"rooms": 0, "compactions": 0, "folded_messages": 0, "failures": 0}
+        for room in list(self.websocket_manager._rooms.values()):
+            stats = room.chat_compactor.stats()
+            totals["rooms"] += 1
+            for key in ("compactions", "folded_messages", "failures"):
+                totals[key] += stats[key]
+        return totals
+
+    async def handle_websocket(self, websocket: WebSocket, user_id: str):
+        """1つのWebSocket接続を処理する"""
+        websocket_manager = self.websocket_manager
+        hibernation_scheduler = self.hibernation_scheduler
+        try:
+            logger.info(f"WebSocket connection attempt from user_id: {user_id}")
+            logger.debug(f"WebSocket headers: {websocket.headers}")
+            logger.debug(f"WebSocket query params: {websocket.query_params}")
+        
+            room = await websocket_manager.connect(websocket, user_id)
+            logger.info(f"WebSocket connected successfully for user_id: {user_id}")
+            logger.debug(f"Created room with ID: {room.id}")
+            logger.debug(f"Current rooms in manager: {list(websocket_manager._rooms.keys())}")
+
+            logger.debug(f"room: {room}")
+            # 発言が確定したら、休止中のエージェントを起こす
+            room.on_user_turn = lambda: hibernation_scheduler.wake(room.id, WAKE_BY_MESSAGE)
+        
+            # 休止中のエージェントは起こすときに作り直す
+            if not hibernation_scheduler.is_hibernating(room.id):
+                logger.debug(f"Creating AutoGPT instance for room ID: {room.id}")
+                room.autogpt = self.create_autogpt_instance(room)
+                logger.debug(f"AutoGPT instance created for room: {room.id}")
+            logger.debug(f"Rooms after AutoGPT creation: {list(websocket_manager._rooms.keys())}")
+
+            # 前のプロセスや落ちたタスクで途中まで進んでいたヒアリングは、チェックポイントから再開する
+            if room.has_resumable_run():
+                logger.info(f"Resuming hearing session for user: {user_id}")
+                room.agent_task = asyncio.create_task(
+                    self._run_admitted(room, lambda: room.autogpt.resume(room_id=room.id), wait_in_queue=False)
+                )
+
+            # 開始を待っている間に再接続した場合は、今の順番を送り直す
+            position = self.admission.position(room.id)
+            if position is not None:
+                await self._notify_queue_position(room, position, self.admission.estimate_wait(position))
+
+            while True:
+                try:
+                    message = await websocket.receive_text()
+                    data = json.loads(message)
+                    room.update_activity()
+                    logger.debug(f"Received message: {data}")
+
+                    if data["type"] == "start_hearing":
+                        logger.info(f"Starting hearing session for user: {user_id}")
+                        hibernation_scheduler.cancel(room.id)
+                        if room.autogpt is None:
+                            room.autogpt = self.create_autogpt_instance(room)
+                        # 処理能力に空きが無い場合は、空くまで queued フレームで順番を知らせながら待たせる
+                        room.agent_task = asyncio.create_task(self._run_admitted(room, lambda: room.autogpt.run(
+                            goals=HEARING_GOALS,
+                            common_rule=HEARING_COMMON_RULE,
+                            room_id=room.id,
+                        )))
+                    elif data["type"] == "message":
+                        logger.debug(f"Processing message from user {user_id}: {data['data']['content']}")
+                        # 連投はまとめてから履歴に追加し、new_message_come を発火する（room.on_user_turn）
+                        await room.add_user_message(data["data"]["content"])
+                    elif data["type"] == "stamp":
+                        logger.debug(f"Processing stamp - Package ID: {data['data']['package_id']}, Sticker ID: {data['data']['sticker_id']}")
+                    elif data["type"] == "finish":
+                        logger.info(f"Finishing session for user: {user_id}")
+                        await room.input_coalescer.flush()
+
+                        self.admission.cancel(room.id)
+                        if hibernation_scheduler.cancel(room.id):
+                            room.save_checkpoint({**room.checkpoint, "status": "stopped"})
+                            self.admission.finish(room.id)
+                        if room.autogpt is not None:
+                            room.autogpt.finish()
+                        await room.event_manager.add_event("finish_session", result="finish")
+
+                        break
+
+                except json.JSONDecodeError as e:
+                    logger.error(f"JSON decode error: {e}")
+                    await websocket.send_text(json.dumps({
+                        "error": "Invalid JSON format",
+                        "details": str(e)
+                    }))
+                except WebSocketDisconnect as e:
+                    logger.error(f"WebSocketDisconnect: code={e.code}, reason={e.reason}")
+                    return
+                except Exception as e:
+                    logger.error(f"Error processing message: {e}")
+                    try:
+                        await websocket.send_text(json.dumps({
+                            "error": "Error processing message",
+                            "details": str(e)
+                        }))
+                    except RuntimeError:
+                        pass
+
+        except Exception as outer_e:
+            logger.error(f"Critical error in WebSocket connection: {outer_e}")
+            traceback.print_exc()
+        finally:
+            logger.info("WebSocket cleanup")
+            websocket_manager.detach(websocket)
+
+# 単一プロセスで動かす場合のルームとエージェント（startup で作る. ゲートウェイやワーカーでは作らない）
+runtime: AgentRuntime = None
+
+# AGENT_WORKERS > 0 の場合、このプロセスはWebSocketの送受信だけを行うゲートウェイになり、
+# エージェントは AGENT_WORKERS 個のワーカープロセスで動かす（ユーザーごとに同じワーカーへ割り当てる）
+AGENT_WORKERS = int(os.getenv("AGENT_WORKERS", "0"))
+# 複数プロセスを使えない環境では、AGENT_LOOP_SHARDS 個のスレッドのイベントループにルームを分ける
+AGENT_LOOP_SHARDS = int(os.getenv("AGENT_LOOP_SHARDS", "0"))
+worker_pool: WorkerPool = None
+
+def agent_worker_main(index, num_workers, inbox, outbox):
+    """ワーカープロセスまたはシャードのスレッドの本体（ゲートウェイから起動される）"""
+    if AGENT_WORKERS > 0:
+        logging.getLogger().setLevel(logging.INFO)
+    worker_runtime = AgentRuntime()
+    run_worker(
+        index, num_workers, inbox, outbox,
+        handler=worker_runtime.handle_websocket,
+        on_start=worker_runtime.start,
+        on_stop=worker_runtime.stop,
+        collect_metrics=worker_runtime.metrics,
     )
 
 # 起動時のイベントハンドラ
 @app.on_event("startup")
 async def startup_event():
+    global worker_pool, runtime
     print("Starting up...")
+    if AGENT_WORKERS > 0:
+        worker_pool = WorkerPool(AGENT_WORKERS, agent_worker_main)
+        worker_pool.start()
+    elif AGENT_LOOP_SHARDS > 0:
+        worker_pool = LoopShardPool(AGENT_LOOP_SHARDS, agent_worker_main)
+        worker_pool.start()
+    else:
+        runtime = AgentRuntime()
+        await runtime.start()
 
 # 終了時のイベントハンドラ
 @app.on_event("shutdown")
 async def shutdown_event():
     print("Shutting down...")
-    websocket_manager.cleanup_inactive_rooms()
+    if worker_pool is not None:
+        await worker_pool.stop()
+    elif runtime is not None:
+        await runtime.stop()
+
+# 稼働状況の確認用エンドポイント
+@app.get("/metrics")
+async def metrics():
+    if worker_pool is not None:
+        return {
+            "gateway": worker_pool.stats(),
+            "workers": await worker_pool.collect_metrics(),
+        }
+    return await runtime.metrics()
+
+# 起動時のウォームアップが終わったか（ロードバランサーのヘルスチェック用. 終わるまで 503）
+@app.get("/ready")
+async def ready():
+    if worker_pool is not None:
+        workers = await worker_pool.collect_metrics()
+        warmups = {index: worker_metrics.get("warmup", {}) for index, worker_metrics in workers.items()}
+        is_ready = len(warmups) == worker_pool.num_workers and all(w.get("ready") for w in warmups.values())
+        body = {"ready": is_ready, "workers": warmups}
+    else:
+        body = runtime.warmup.stats()
+        is_ready = body["ready"]
+    return JSONResponse(body, status_code=200 if is_ready else 503)
 
 # WebSocketエンドポイント
 @app.websocket("/ws/{user_id}")
 async def websocket_endpoint(websocket: WebSocket, user_id: str):
-    try:
-        logger.info(f"WebSocket connection attempt from user_id: {user_id}")
-        logger.debug(f"WebSocket headers: {websocket.headers}")
-        logger.debug(f"WebSocket query params: {websocket.query_params}")
-        
-        room = await websocket_manager.connect(websocket, user_id)
-        logger.info(f"WebSocket connected successfully for user_id: {user_id}")
-        logger.debug(f"Created room with ID: {room.id}")
-        logger.debug(f"Current rooms in manager: {list(websocket_manager._rooms.keys())}")
-
-        logger.debug(f"room: {room}")
-        
-        logger.debug(f"Creating AutoGPT instance for room ID: {room.id}")
-        room.autogpt = create_autogpt_instance(room)
-        logger.debug(f"AutoGPT instance created for room: {room.id}")
-        logger.debug(f"Rooms after AutoGPT creation: {list(websocket_manager._rooms.keys())}")
-
-        while True:
-            try:
-                message = await websocket.receive_text()
-                data = json.loads(message)
-                logger.debug(f"Received message: {data}")
-
-                if data["type"] == "start_hearing":
-                    logger.info(f"Starting hearing session for user: {user_id}")
-                    asyncio.create_task(room.autogpt.run(
-                        goals=[dict_to_string(goal_dict) for goal_dict in hearing_goals["plan_details"]],
-                        common_rule=dict_to_string(hearing_goals["common_rules"]),
-                        room_id=room.id,
-                    ))
-                elif data["type"] == "message":
-                    logger.debug(f"Processing message from user {user_id}: {data['data']['content']}")
-                    await room.message_manager.add_message(data["data"]["content"], "user")
-                    await room.event_manager.add_event("new_message_come", result=data["data"]["content"])
-                elif data["type"] == "stamp":
-                    logger.debug(f"Processing stamp - Package ID: {data['data']['package_id']}, Sticker ID: {data['data']['sticker_id']}")
-                elif data["type"] == "finish":
-                    logger.info(f"Finishing session for user: {user_id}")
-
-                    room.autogpt.finish()
-                    room.event_manager.add_event("finish_session", result="finish")
-
-                    break
-
-            except json.JSONDecodeError as e:
-                logger.error(f"JSON decode error: {e}")
-                await websocket.send_text(json.dumps({
-                    "error": "Invalid JSON format",
-                    "details": str(e)
-                }))
-            except WebSocketDisconnect as e:
-                logger.error(f"WebSocketDisconnect: code={e.code}, reason={e.reason}")
-                return
-            except Exception as e:
-                logger.error(f"Error processing message: {e}")
-                try:
-                    await websocket.send_text(json.dumps({
-                        "error": "Error processing message",
-                        "details": str(e)
-                    }))
-                except RuntimeError:
-                    pass
-
-    except Exception as outer_e:
-        logger.error(f"Critical error in WebSocket connection: {outer_e}")
-        traceback.print_exc()
-    finally:
-        logger.info("WebSocket cleanup")
+    if worker_pool is not None:
+        # ゲートウェイでは受信を担当のワーカーへ転送するだけ. 接続の処理はワーカーで RemoteWebSocket に対して行う
+        await worker_pool.serve(websocket, user_id)
+        return
+    await runtime.handle_websocket(websocket, user_id)
 
 if __name__ == "__main__":
     import uvicorn
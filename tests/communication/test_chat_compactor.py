@@ -0,0 +1,92 @@
+import asyncio
+import pytest
+from autogpt_modules.communication.message_manager import MessageManager
+from autogpt_modules.communication.chat_compactor import ChatCompactor
+
+
+@pytest.mark.asyncio
+async def test_older_messages_are_folded_incrementally():
+    """古いメッセージだけが要約に畳み込まれ、原文は最新N件以上に増え続けないテスト"""
+    message_manager = MessageManager()
+    calls = []
+
+    async def summarize(summary, messages):
+        calls.append((summary, [m["content"] for m in messages]))
+        return summary + "".join(m["content"] for m in messages)
+
+    compactor = ChatCompactor(message_manager, keep_recent=2, batch_size=2, summarize=summarize)
+
+    for i in range(5):
+        await message_manager.add_message(str(i), "user")
+    compactor.get_compacted_history()
+    await compactor.wait()
+
+    summary, offset, recent = compactor.get_compacted_history()
+    assert (summary, offset) == ("012", 3)
+    assert [m["content"] for m in recent] == ["3", "4"]
+
+    for i in range(5, 8):
+        await message_manager.add_message(str(i), "assistant")
+    compactor.get_compacted_history()
+    await compactor.wait()
+
+    summary, offset, recent = compactor.get_compacted_history()
+    # 2回目の更新では、まだ畳み込んでいないメッセージだけを渡す
+    assert calls[1] == ("012", ["3", "4", "5"])
+    assert (summary, offset) == ("012345", 6)
+    assert [m["content"] for m in recent] == ["6", "7"]
+
+
+@pytest.mark.asyncio
+async def test_failed_compaction_keeps_full_history():
+    """要約に失敗した場合は原文をそのまま使い続けるテスト"""
+    message_manager = MessageManager()
+
+    async def summarize(summary, messages):
+        raise RuntimeError("boom")
+
+    compactor = ChatCompactor(message_manager, keep_recent=1, batch_size=1, summarize=summarize)
+    for i in range(4):
+        await message_manager.add_message(str(i), "user")
+
+    compactor.get_compacted_history()
+    await compactor.wait()
+
+    summary, offset, recent = compactor.get_compacted_history()
+    assert (summary, offset, len(recent)) == ("", 0, 4)
+    assert compactor.stats()["failures"] == 1
+
+
+@pytest.mark.asyncio
+async def test_failed_compaction_backs_off():
+    """要約に失敗したら、さらに batch_size 件（失敗が続くたびに倍）届くまでやり直さないテスト"""
+    message_manager = MessageManager()
+    calls = []
+
+    async def summarize(summary, messages):
+        calls.append(len(messages))
+        if len(calls) <= 2:
+            raise RuntimeError("boom")
+        return "summary"
+
+    async def add_messages(n):
+        for _ in range(n):
+            await message_manager.add_message("m", "user")
+            compactor.get_compacted_history()
+            await compactor.wait()
+
+    compactor = ChatCompactor(message_manager, keep_recent=1, batch_size=2, summarize=summarize)
+    await add_messages(4)
+    assert len(calls) == 1
+
+    # 1回目の失敗の後は2件、2回目の失敗の後は4件届くまで待つ
+    await add_messages(1)
+    assert len(calls) == 1
+    await add_messages(1)
+    assert len(calls) == 2
+    await add_messages(3)
+    assert len(calls) == 2
+    await add_messages(1)
+    assert len(calls) == 3
+    assert compactor.summary == "summary"
+    assert compactor.stats()["failures"] == 2 and compactor.stats()["backed_off"] > 0
@@ -0,0 +1,98 @@
+import asyncio
+import pytest
+from autogpt_modules.communication import WebSocketManager
+from autogpt_modules.communication.input_coalescer import InputCoalescer
+
+
+class Recorder:
+    def __init__(self):
+        self.turns = []
+
+    async def __call__(self, text, fragments):
+        self.turns.append((text, fragments))
+
+
+@pytest.mark.asyncio
+async def test_burst_is_committed_as_one_turn():
+    """待ち時間内の連投が1回の発言にまとまるテスト"""
+    commit = Recorder()
+    coalescer = InputCoalescer(commit, min_window=0.05, max_window=0.2, gap_factor=1.5, max_hold=5)
+    for text in ["あのね", "今日", "病院に行ったの"]:
+        await coalescer.add(text)
+        await asyncio.sleep(0.01)
+    assert commit.turns == []
+
+    await asyncio.sleep(0.2)
+    assert commit.turns == [("あのね\n今日\n病院に行ったの", 3)]
+    stats = coalescer.stats()
+    assert stats["fragments"] == 3 and stats["turns"] == 1 and stats["pending"] == 0
+
+
+@pytest.mark.asyncio
+async def test_window_adapts_to_message_gaps():
+    """連投の間隔が長いユーザーほど待ち時間が長くなり、上限で止まるテスト"""
+    coalescer = InputCoalescer(Recorder(), min_window=0.05, max_window=0.3, gap_factor=2, max_hold=5)
+    initial = coalescer.window()
+    for _ in range(4):
+        await coalescer.add("…")
+        await asyncio.sleep(0.08)
+    assert coalescer.window() > initial
+    assert coalescer.window() <= 0.3
+    await coalescer.flush()
+
+
+@pytest.mark.asyncio
+async def test_window_shrinks_for_single_message_turns():
+    """1通で言い終えるユーザーには待ち時間が下限に近づくテスト"""
+    coalescer = InputCoalescer(Recorder(), min_window=0.01, max_window=0.02, gap_factor=2, max_hold=5)
+    coalescer._gap = 0.01
+    for _ in range(3):
+        await coalescer.add("はい")
+        await asyncio.sleep(0.05)
+    assert coalescer.window() < 0.02
+    assert coalescer.stats()["turns"] == 3
+
+
+@pytest.mark.asyncio
+async def test_max_hold_commits_long_bursts():
+    """連投が続いても max_hold を過ぎたら確定させるテスト"""
+    commit = Recorder()
+    coalescer = InputCoalescer(commit, min_window=0.05, max_window=0.1, gap_factor=1, max_hold=0.1)
+    for i in range(6):
+        await coalescer.add(f"m{i}")
+        await asyncio.sleep(0.03)
+    await coalescer.flush()
+
+    assert len(commit.turns) >= 2
+    assert "\n".join(text for text, _ in commit.turns) == "\n".join(f"m{i}" for i in range(6))
+    assert coalescer.stats()["max_hold_flushes"] >= 1
+
+
+@pytest.mark.asyncio
+async def test_disabled_coalescer_commits_immediately():
+    """min_window=0 の場合は1通ごとにすぐ確定させるテスト"""
+    commit = Recorder()
+    coalescer = InputCoalescer(commit, min_window=0)
+    await coalescer.add("a")
+    await coalescer.add("b")
+    assert commit.turns == [("a", 1), ("b", 1)]
+
+
+@pytest.mark.asyncio
+async def test_room_adds_one_message_and_event_per_turn():
+    """ルームでは確定した発言ごとにメッセージと new_message_come が1件ずつ追加されるテスト"""
+    manager = WebSocketManager()
+    room = manager.get_or_create_room("u1")
+    room.input_coalescer = InputCoalescer(room._commit_user_turn, min_window=0.05, max_window=0.2)
+    woken = []
+    room.on_user_turn = lambda: woken.append(room.id)
+
+    waiter = asyncio.create_task(room.event_manager.wait_for_event(["new_message_come"], timeout=1))
+    await room.add_user_message("えっと")
+    await room.add_user_message("薬を飲み忘れた")
+    event = await waiter
+
+    assert event.result == "えっと\n薬を飲み忘れた"
+    assert [m["content"] for m in room.message_manager.get_messages()] == ["えっと\n薬を飲み忘れた"]
+    assert woken == [room.id]
+    assert manager.input_stats()["coalesced_fragments"] == 1
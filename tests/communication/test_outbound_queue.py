@@ -0,0 +1,114 @@
+import asyncio
+import pytest
+from autogpt_modules.communication import WebSocketManager
+from autogpt_modules.communication.outbound_queue import LATENCY_BUCKETS, OutboundQueue, merge_outbound_stats
+
+
+class SlowWebSocket:
+    def __init__(self, delay: float = 0.05):
+        self.delay = delay
+        self.sent = []
+
+    async def send_text(self, text):
+        await asyncio.sleep(self.delay)
+        self.sent.append(text)
+
+    async def close(self):
+        pass
+
+
+@pytest.mark.asyncio
+async def test_send_message_does_not_wait_for_slow_client():
+    """遅いクライアントでも送信はキューに積むだけで戻り、順番どおりに届くテスト"""
+    manager = WebSocketManager()
+    room = manager.get_or_create_room("u1")
+    room.websocket = SlowWebSocket(delay=0.05)
+
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    for i in range(5):
+        assert await manager.send_message(room.id, f"m{i}")
+    assert loop.time() - started < 0.05
+    assert manager.outbound_stats()["depth"] > 0
+
+    await room.outbound.flush()
+    assert room.websocket.sent == [f"m{i}" for i in range(5)]
+    stats = manager.outbound_stats()
+    assert stats["sent"] == 5 and stats["depth"] == 0
+    assert stats["send_latency_ms"]["max"] >= 50
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("policy, expected", [
+    ("drop_oldest", ["m0", "m3", "m4"]),
+    ("drop_newest", ["m0", "m1", "m2"]),
+])
+async def test_overflow_drop_policies(policy, expected):
+    """キューが一杯のときに古い/新しいメッセージを捨てるテスト（m0 は送信中）"""
+    websocket = SlowWebSocket(delay=0.02)
+    queue = OutboundQueue(websocket.send_text, max_size=2, policy=policy)
+    for i in range(5):
+        await queue.put(f"m{i}")
+        await asyncio.sleep(0)
+
+    await queue.flush()
+    assert websocket.sent == expected
+    assert queue.stats()["dropped"] == 2
+
+
+@pytest.mark.asyncio
+async def test_overflow_block_policy_applies_backpressure():
+    """block では空きができるまで送信側を待たせ、何も捨てないテスト"""
+    websocket = SlowWebSocket(delay=0.02)
+    queue = OutboundQueue(websocket.send_text, max_size=1, policy="block")
+    await queue.put("m0")
+    await asyncio.sleep(0)
+    await queue.put("m1")
+
+    blocked = asyncio.create_task(queue.put("m2"))
+    await asyncio.sleep(0.005)
+    assert not blocked.done()
+
+    assert await asyncio.wait_for(blocked, timeout=1)
+    await queue.flush()
+    assert websocket.sent == ["m0", "m1", "m2"]
+    assert queue.stats()["blocked"] == 1 and queue.stats()["dropped"] == 0
+
+
+@pytest.mark.asyncio
+async def test_overflow_close_policy_disconnects_slow_client():
+    """close ではあふれたクライアントとの接続を閉じるテスト"""
+    manager = WebSocketManager()
+    room = manager.get_or_create_room("u1")
+    room.outbound = OutboundQueue(room._send_to_socket, max_size=1, policy="close", on_close=room._close_slow_socket)
+    room.websocket = SlowWebSocket(delay=0.05)
+
+    assert await manager.send_message(room.id, "m0")
+    await asyncio.sleep(0)
+    assert await manager.send_message(room.id, "m1")
+    assert not await manager.send_message(room.id, "m2")
+
+    assert room.websocket is None
+    assert room.outbound.stats()["overflow_closes"] == 1
+
+
+def test_merge_outbound_stats_uses_latency_histograms():
+    """ルームごとのヒストグラムを足し合わせて分位点を求めるテスト"""
+    def room_stats(counts, latency_max):
+        histogram = [0] * (len(LATENCY_BUCKETS) + 1)
+        for bucket, count in counts.items():
+            histogram[bucket] = count
+        return {
+            "depth": 0, "max_depth": 1, "enqueued": 0, "sent": sum(counts.values()), "send_failures": 0,
+            "dropped": 0, "blocked": 0, "overflow_closes": 0,
+            "latency_histogram": histogram, "latency_max": latency_max,
+        }
+
+    # 1ms以下が 98件、8ms以下が 1件、最大 0.2秒が 1件
+    stats = merge_outbound_stats([room_stats({0: 60}, 0.001), room_stats({0: 38, 3: 1, 8: 1}, 0.2)])
+
+    assert stats["rooms"] == 2 and stats["sent"] == 100
+    assert stats["send_latency_ms"]["p50"] == pytest.approx(1.0)
+    assert stats["send_latency_ms"]["p99"] == pytest.approx(8.0)
+    assert stats["send_latency_ms"]["max"] == pytest.approx(200.0)
+    assert merge_outbound_stats([])["send_latency_ms"] == {"p50": 0.0, "p99": 0.0, "max": 0.0}
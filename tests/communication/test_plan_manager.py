@@ -0,0 +1,75 @@
+import asyncio
+import pytest
+from autogpt_modules.communication.plan_manager import ActionPlanManager
+
+
+async def _plan(text: str, delay: float = 0) -> str:
+    await asyncio.sleep(delay)
+    return text
+
+
+@pytest.mark.asyncio
+async def test_fresh_prefetched_plan_is_used():
+    """先読みしたプランが新鮮なうちは plan_action で使われるテスト"""
+    manager = ActionPlanManager()
+    manager.prefetch("g2", user_message_count=3, generate=_plan("plan for g2"))
+    await asyncio.sleep(0.01)
+
+    # LLMがゴールに番号を付けて渡しても対応する先読みが見つかる
+    plan = await manager.take_prefetched("goal index: 2, g2", user_message_count=4, max_new_messages=2)
+
+    assert plan == "plan for g2"
+    stats = manager.get_prefetch_stats()
+    assert stats["used"] == 1
+    assert stats["hit_rate"] == 1.0
+
+
+@pytest.mark.asyncio
+async def test_prefetched_plan_goes_stale_after_new_messages():
+    """先読み後にユーザーメッセージが増えるとプランを破棄するテスト"""
+    manager = ActionPlanManager()
+    manager.prefetch("g2", user_message_count=3, generate=_plan("plan for g2"))
+    await asyncio.sleep(0.01)
+
+    assert manager.needs_prefetch("g2", user_message_count=5, max_new_messages=2)
+    assert await manager.take_prefetched("g2", user_message_count=5, max_new_messages=2) is None
+    assert manager.get_prefetch_stats()["stale"] == 1
+    # 破棄した後は次の plan_action で改めて生成する
+    assert await manager.take_prefetched("g2", user_message_count=5, max_new_messages=2) is None
+    assert manager.get_prefetch_stats()["missed"] == 1
+
+
+@pytest.mark.asyncio
+async def test_in_flight_prefetch_is_joined():
+    """生成中の先読みには合流して二重にLLMを呼ばないテスト"""
+    manager = ActionPlanManager()
+    manager.prefetch("g2", user_message_count=0, generate=_plan("plan for g2", delay=0.05))
+
+    assert not manager.needs_prefetch("g2", user_message_count=0, max_new_messages=2)
+    plan = await manager.take_prefetched("g2", user_message_count=0, max_new_messages=2)
+
+    assert plan == "plan for g2"
+    assert manager.get_prefetch_stats()["joined"] == 1
+
+
+@pytest.mark.asyncio
+async def test_prefetched_plan_goes_stale_after_new_result():
+    """先読み後にゴールの結果が加わった場合は使わないテスト"""
+    manager = ActionPlanManager()
+    manager.prefetch("g2", user_message_count=0, generate=_plan("plan for g2"), result_count=0)
+    await asyncio.sleep(0)
+
+    assert manager.needs_prefetch("g2", user_message_count=0, max_new_messages=2, result_count=1)
+    assert await manager.take_prefetched("g2", user_message_count=0, max_new_messages=2, result_count=1) is None
+    assert manager.get_prefetch_stats()["stale"] == 1
+
+
+@pytest.mark.asyncio
+async def test_prefetch_is_not_matched_by_substring():
+    """別のゴールの先読みを部分一致で使わないテスト"""
+    manager = ActionPlanManager()
+    manager.prefetch("g2", user_message_count=0, generate=_plan("plan for g2"))
+    await asyncio.sleep(0)
+
+    assert await manager.take_prefetched("g2 and g3", user_message_count=0, max_new_messages=2) is None
+    assert await manager.take_prefetched("goal index: 2,  g2 ", user_message_count=0, max_new_messages=2) == "plan for g2"
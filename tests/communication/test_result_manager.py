@@ -0,0 +1,42 @@
+import asyncio
+import pytest
+from autogpt_modules.communication.result_manager import ResultManager, PENDING_RESULT_PLACEHOLDER
+
+
+@pytest.mark.asyncio
+async def test_pending_result_is_joined_before_read():
+    """バックグラウンドで保存中の結果に wait_for_pending() で合流できるテスト"""
+    manager = ResultManager()
+
+    async def save():
+        await asyncio.sleep(0.05)
+        await manager.add_result("summary", goal="g1")
+
+    manager.track_pending("g1", asyncio.create_task(save()))
+
+    assert manager.has_pending()
+    assert manager.get_goal_result_pairs() == []
+    assert manager.get_goal_result_pairs(include_pending=True) == [
+        {"goal": "g1", "result": PENDING_RESULT_PLACEHOLDER}
+    ]
+
+    await manager.wait_for_pending()
+
+    assert not manager.has_pending()
+    assert manager.get_goal_result_pairs(include_pending=True) == [{"goal": "g1", "result": "summary"}]
+    assert [r.summary for r in manager.get_results_for_goal("g1")] == ["summary"]
+
+
+@pytest.mark.asyncio
+async def test_failed_pending_result_does_not_raise():
+    """保存に失敗したタスクがあっても合流時に例外を投げないテスト"""
+    manager = ResultManager()
+
+    async def fail():
+        raise RuntimeError("boom")
+
+    manager.track_pending("g1", asyncio.create_task(fail()))
+    await manager.wait_for_pending()
+
+    assert not manager.has_pending()
+    assert manager.get_results() == []
@@ -0,0 +1,49 @@
+import asyncio
+from datetime import datetime, timedelta
+import pytest
+from autogpt_modules.communication.websocket_manager import WebSocketManager
+
+
+def _expire(room, minutes: int = 31):
+    room.last_active = datetime.now() - timedelta(minutes=minutes)
+
+
+def test_room_is_found_by_user_id():
+    """同じユーザーの接続では有効期限内のルームを使い回すテスト"""
+    manager = WebSocketManager(room_timeout=30)
+    room = manager.get_or_create_room("u1")
+
+    assert manager.get_or_create_room("u1") is room
+    assert manager.get_or_create_room("u2") is not room
+
+    _expire(room)
+    assert manager.get_or_create_room("u1") is not room
+
+
+@pytest.mark.asyncio
+async def test_sweep_evicts_expired_rooms_and_cancels_agent():
+    """期限切れのルームを破棄し、エージェントのタスクを取り消すテスト"""
+    manager = WebSocketManager(room_timeout=30)
+    expired = manager.get_or_create_room("u1")
+    active = manager.get_or_create_room("u2")
+    connected = manager.get_or_create_room("u3")
+    connected.websocket = object()
+
+    expired.agent_task = asyncio.create_task(asyncio.sleep(60))
+    await expired.message_manager.add_message("こんにちは", "user")
+    manager._expiry_heap = [(0, room_id) for _, room_id in manager._expiry_heap]
+    _expire(expired)
+    _expire(connected)
+
+    result = manager.sweep_expired()
+    await asyncio.sleep(0)
+
+    assert result["evicted_rooms"] == 1
+    assert result["cancelled_agent_tasks"] == 1
+    assert result["reclaimed_bytes_estimate"] > 0
+    assert expired.agent_task.cancelled()
+    assert manager.get_room(expired.id) is None
+    assert manager.get_room(active.id) is active
+    # 接続中のルームは期限が延長される
+    assert manager.get_room(connected.id) is connected
+    assert manager.stats()["evicted_rooms"] == 1
@@ -0,0 +1,173 @@
+import asyncio
+import queue
+import pytest
+from fastapi import WebSocketDisconnect
+from autogpt_modules.communication.worker_pool import (
+    HashRing,
+    LoopShardPool,
+    run_worker,
+    serve_worker,
+    FRAME_OPEN,
+    FRAME_MESSAGE,
+    FRAME_DISCONNECT,
+    FRAME_STOP,
+    FRAME_SEND,
+    FRAME_CLOSE,
+)
+
+
+def test_hash_ring_is_stable_and_moves_few_users():
+    """同じユーザーは常に同じワーカーに割り当てられ、ワーカーを増やしても移動は一部に収まるテスト"""
+    users = [f"user_{i}" for i in range(2000)]
+    ring = HashRing(range(4))
+    before = {user: ring.node_for(user) for user in users}
+
+    same = HashRing(range(4))
+    assert before == {user: same.node_for(user) for user in users}
+    assert set(before.values()) == {0, 1, 2, 3}
+
+    grown = HashRing(range(5))
+    moved = sum(1 for user in users if grown.node_for(user) != before[user])
+    # 理想は 1/5. 仮想ノードの偏りを見込んでも半分より十分少ない
+    assert moved < len(users) * 0.35
+
+
+@pytest.mark.asyncio
+async def test_worker_runs_endpoint_against_remote_websocket():
+    """ワーカーがゲートウェイのフレームから接続を再現し、送信をゲートウェイへ返すテスト"""
+    inbox, outbox = queue.Queue(), queue.Queue()
+
+    async def echo_endpoint(websocket, user_id):
+        await websocket.accept()
+        try:
+            while True:
+                text = await websocket.receive_text()
+                if text == "finish":
+                    break
+                await websocket.send_text(f"{user_id}:{text}")
+        except WebSocketDisconnect:
+            return
+
+    worker = asyncio.create_task(serve_worker(0, inbox, outbox, echo_endpoint))
+    inbox.put((FRAME_OPEN, 1, "u1", {}, {}))
+    inbox.put((FRAME_OPEN, 2, "u2", {}, {}))
+    inbox.put((FRAME_MESSAGE, 1, "hello"))
+    inbox.put((FRAME_MESSAGE, 2, "finish"))
+    inbox.put((FRAME_DISCONNECT, 1, 1001))
+
+    frames = [await asyncio.to_thread(outbox.get, True, 1) for _ in range(2)]
+    assert (FRAME_SEND, 1, "u1:hello") in frames
+    # ワーカー側で終わったセッションはゲートウェイに閉じるよう伝える
+    assert (FRAME_CLOSE, 2) in frames
+
+    inbox.put((FRAME_STOP,))
+    await asyncio.wait_for(worker, timeout=1)
+    assert outbox.empty()
+
+
+async def _shard_echo(websocket, user_id):
+    await websocket.accept()
+    loop_id = id(asyncio.get_running_loop())
+    try:
+        while True:
+            text = await websocket.receive_text()
+            await websocket.send_text(f"{loop_id}:{text}")
+    except WebSocketDisconnect:
+        return
+
+
+def _shard_main(index, num_shards, inbox, outbox):
+    run_worker(index, num_shards, inbox, outbox, handler=_shard_echo)
+
+
+class _GatewaySocket:
+    def __init__(self):
+        self.received = asyncio.Queue()
+
+    async def send_text(self, text):
+        self.received.put_nowait(text)
+
+    async def close(self):
+        pass
+
+
+@pytest.mark.asyncio
+async def test_loop_shards_run_rooms_on_their_own_loops():
+    """ルームは担当シャードのイベントループで動き、ゲートウェイのループへは送信だけが戻るテスト"""
+    pool = LoopShardPool(2, _shard_main)
+    pool.start()
+    users = ["u0", "u1", "u2", "u3", "u4", "u5"]
+    sockets = {user: _GatewaySocket() for user in users}
+    conns = {user: pool.open(sockets[user], user) for user in users}
+    for user in users:
+        pool.forward(conns[user], "hello")
+
+    loops = {}
+    for user in users:
+        loop_id, text = (await asyncio.wait_for(sockets[user].received.get(), timeout=2)).split(":")
+        assert text == "hello"
+        loops[user] = int(loop_id)
+
+    gateway_loop = id(asyncio.get_running_loop())
+    assert gateway_loop not in loops.values()
+    # 同じシャードのユーザーは同じループ、別のシャードのユーザーは別のループ
+    for a in users:
+        for b in users:
+            assert (loops[a] == loops[b]) == (pool.worker_for(a) == pool.worker_for(b))
+
+    for conn_id in conns.values():
+        pool.disconnect(conn_id)
+    await pool.stop()
+    assert pool.stats()["alive_workers"] == 0
+
+
+_shard_starts = []
+
+
+def _crashing_shard_main(index, num_shards, inbox, outbox):
+    """最初の起動ではすぐに止まり、起動し直すと動くシャード"""
+    _shard_starts.append(index)
+    if _shard_starts.count(index) > 1:
+        run_worker(index, num_shards, inbox, outbox, handler=_shard_echo)
+
+
+@pytest.mark.asyncio
+async def test_dead_worker_connections_are_closed_and_worker_restarts():
+    """止まったワーカーの接続は閉じ、ワーカーを起動し直して次の接続から処理するテスト"""
+    _shard_starts.clear()
+    pool = LoopShardPool(1, _crashing_shard_main)
+    pool.start()
+    await asyncio.to_thread(pool._workers[0].join, 1)
+
+    closed = asyncio.Event()
+    stale = _GatewaySocket()
+    stale.close = closed.set
+    conn_id = pool.open(stale, "u0")
+    # open の時点で止まっていたワーカーは起動し直している
+    assert pool.stats()["restarted_workers"] == 1
+    pool.forward(conn_id, "hello")
+    assert (await asyncio.wait_for(stale.received.get(), timeout=2)).endswith(":hello")
+
+    old_inbox, old_thread = pool._inboxes[0], pool._workers[0]
+    pool._workers[0] = _DeadWorker()
+    pool.forward(conn_id, "lost")
+    await asyncio.wait_for(closed.wait(), timeout=2)
+    stats = pool.stats()
+    assert stats["dropped_connections"] == 1
+    assert stats["restarted_workers"] == 2
+    assert stats["open_connections"] == 0
+
+    fresh = _GatewaySocket()
+    pool.forward(pool.open(fresh, "u0"), "again")
+    assert (await asyncio.wait_for(fresh.received.get(), timeout=2)).endswith(":again")
+    await pool.stop()
+    old_inbox.put((FRAME_STOP,))
+    await asyncio.to_thread(old_thread.join, 2)
+
+
+class _DeadWorker:
+    """止まったように見せるワーカー（実体のスレッドはテストの最後に止める）"""
+    name = "agent-shard-0"
+
+    def is_alive(self):
+        return False
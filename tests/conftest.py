@@ -28,4 +28,22 @@ def mock_env_vars(monkeypatch):
 def setup_path():
     """テスト実行前にPythonパスを設定"""
     if str(PROJECT_ROOT) not in sys.path:
-        sys.path.insert(0, str(PROJECT_ROOT)) 
\ No newline at end of file
+        sys.path.insert(0, str(PROJECT_ROOT))
+
+
+@pytest.fixture(autouse=True)
+def clear_llm_result_cache():
+    """テスト間でLLMの結果のキャッシュを共有しない"""
+    from autogpt_modules.utils.llm.result_cache import llm_result_cache
+    llm_result_cache.clear()
+    yield
+    llm_result_cache.clear()
+
+
+@pytest.fixture(autouse=True)
+def clear_llm_client_registry():
+    """テスト間で共有のLLMクライアント（モックを含む）を持ち越さない"""
+    from autogpt_modules.utils.llm.client_pool import llm_client_registry
+    llm_client_registry.clear()
+    yield
+    llm_client_registry.clear()
@@ -0,0 +1,108 @@
+import asyncio
+import pytest
+from autogpt_modules.core.admission import AdmissionController
+
+
+class Notifications:
+    def __init__(self):
+        self.sent = []
+
+    def for_room(self, room_id):
+        async def notify(position, eta):
+            self.sent.append((room_id, position, eta))
+        return notify
+
+
+@pytest.mark.asyncio
+async def test_sessions_beyond_capacity_wait_in_fifo_order():
+    """上限を超えたセッションは到着順に待ち、枠が空いた順に開始するテスト"""
+    admission = AdmissionController(max_active=1, max_llm_queue=0)
+    notifications = Notifications()
+    assert await admission.admit("r1")
+
+    second = asyncio.create_task(admission.admit("r2", notifications.for_room("r2")))
+    third = asyncio.create_task(admission.admit("r3", notifications.for_room("r3")))
+    await asyncio.sleep(0.01)
+    assert admission.position("r2") == 1 and admission.position("r3") == 2
+    assert ("r3", 2, None) in notifications.sent
+
+    admission.release("r1")
+    assert await second
+    assert not third.done()
+    await asyncio.sleep(0.01)
+    # 開始したセッションには順番 0、繰り上がったセッションには新しい順番と見積もりを知らせる
+    assert ("r2", 0, 0.0) in notifications.sent
+    room_id, position, eta = notifications.sent[-1]
+    assert (room_id, position) == ("r3", 1) and eta is not None
+
+    admission.release("r2")
+    assert await third
+    stats = admission.stats()
+    assert stats["active"] == 1 and stats["waiting"] == 0 and stats["queued"] == 2
+
+
+@pytest.mark.asyncio
+async def test_llm_queue_depth_holds_new_sessions():
+    """LLMの待ち行列が長い間は、枠が空いていても新しいセッションを開始しないテスト"""
+    depth = {"value": 5}
+    admission = AdmissionController(max_active=10, max_llm_queue=3, queue_depth=lambda: depth["value"], recheck_seconds=0.02)
+
+    waiter = asyncio.create_task(admission.admit("r1"))
+    await asyncio.sleep(0.05)
+    assert not waiter.done()
+
+    depth["value"] = 0
+    assert await asyncio.wait_for(waiter, timeout=1)
+    assert admission.is_active("r1")
+
+
+@pytest.mark.asyncio
+async def test_cancel_and_resumed_sessions():
+    """開始前に終了したセッションは待ち行列から外し、再開するセッションは待たせないテスト"""
+    admission = AdmissionController(max_active=1, max_llm_queue=0)
+    assert await admission.admit("r1")
+    waiter = asyncio.create_task(admission.admit("r2"))
+    await asyncio.sleep(0.01)
+
+    assert admission.cancel("r2")
+    assert await waiter is False
+
+    admission.admit_now("resumed")
+    assert admission.stats()["active"] == 2
+
+    # 待っているタスクが取り消された場合も待ち行列に残さない
+    cancelled = asyncio.create_task(admission.admit("r3"))
+    await asyncio.sleep(0.01)
+    cancelled.cancel()
+    await asyncio.gather(cancelled, return_exceptions=True)
+    assert admission.position("r3") is None
+
+
+@pytest.mark.asyncio
+async def test_session_duration_spans_hibernation():
+    """休止で枠を返しても、所要時間は最初に枠を取ってから終了するまでで測るテスト"""
+    admission = AdmissionController(max_active=1, max_llm_queue=0)
+    assert await admission.admit("r1")
+    await asyncio.sleep(0.05)
+    admission.release("r1", finished=False)
+    assert admission.stats()["avg_session_seconds"] is None
+
+    await asyncio.sleep(0.05)
+    admission.admit_now("r1")
+    await asyncio.sleep(0.05)
+    admission.release("r1")
+
+    average = admission.stats()["avg_session_seconds"]
+    assert average >= 0.15
+
+    # 休止中に中止されたセッションは finish() で記録し、削除されたルームは forget() で記録せずに捨てる
+    assert await admission.admit("r2")
+    admission.release("r2", finished=False)
+    admission.finish("r2")
+    assert admission.stats()["avg_session_seconds"] < average
+    average = admission.stats()["avg_session_seconds"]
+    assert await admission.admit("r3")
+    admission.release("r3", finished=False)
+    admission.forget("r3")
+    admission.finish("r3")
+    assert admission.stats()["avg_session_seconds"] == average
@@ -0,0 +1,93 @@
+import asyncio
+import pytest
+from autogpt_modules.core.bounded_history import BoundedHistory
+from autogpt_modules.core.event_manager import EventManager
+from autogpt_modules.communication.message_manager import MessageManager
+
+
+def test_old_items_spill_to_disk_and_stay_readable(tmp_path):
+    """上限を超えた古い要素はファイルに追い出され、リストと同じように読めるテスト"""
+    history = BoundedHistory(str(tmp_path / "history.jsonl"), max_in_memory=4)
+    for i in range(10):
+        history.append({"i": i})
+
+    assert len(history) == 10
+    assert len(history.hot) <= 4
+    assert history.spilled_count == 10 - len(history.hot)
+    assert [item["i"] for item in history] == list(range(10))
+    assert [item["i"] for item in reversed(history)] == list(range(9, -1, -1))
+    assert history[0] == {"i": 0}
+    assert history[-1] == {"i": 9}
+    assert [item["i"] for item in history[3:8]] == [3, 4, 5, 6, 7]
+
+    history.clear()
+    assert len(history) == 0
+    assert not (tmp_path / "history.jsonl").exists()
+
+
+@pytest.mark.asyncio
+async def test_managers_keep_working_after_spill(tmp_path):
+    """メッセージとイベントの既存の読み出しが追い出し後も変わらないテスト"""
+    messages = MessageManager(spill_path=str(tmp_path / "messages.jsonl"), max_in_memory=3)
+    events = EventManager(spill_path=str(tmp_path / "events.jsonl"), max_in_memory=3)
+    for i in range(8):
+        await messages.add_message(f"m{i}", "user" if i % 2 else "assistant")
+        await events.add_event("wait", result=str(i))
+
+    assert [m["content"] for m in messages.get_chat_history()] == [f"m{i}" for i in range(8)]
+    assert [m["content"] for m in messages.get_chat_history(start=6)] == ["m6", "m7"]
+    assert messages.count_messages("user") == 4
+    assert messages.has_new_messages()
+
+    assert [e["result"] for e in events.get_event_history()] == [str(i) for i in range(8)]
+    assert [e.seq for e in events.events_since(5)] == [6, 7, 8]
+    assert [e.result for e in events.cursor(0).read()] == [str(i) for i in range(8)]
+
+
+@pytest.mark.asyncio
+async def test_spill_runs_off_the_event_loop(tmp_path):
+    """イベントループの中では書き込みをスレッドで行い、書き終わるまでメモリから外さないテスト"""
+    history = BoundedHistory(str(tmp_path / "history.jsonl"), max_in_memory=4, sizeof=lambda item: 10)
+    for i in range(10):
+        history.append({"i": i})
+
+    # 書き込み中も全件読める
+    assert [item["i"] for item in history] == list(range(10))
+    await history.wait_for_spill()
+
+    assert history.spilled_count > 0
+    assert len(history.hot) <= 4
+    assert history.hot_bytes == len(history.hot) * 10
+    assert [item["i"] for item in history] == list(range(10))
+    assert len((tmp_path / "history.jsonl").read_text().splitlines()) == history.spilled_count
+
+
+@pytest.mark.asyncio
+async def test_clear_discards_inflight_spill(tmp_path):
+    """書き込み中に clear() した場合、古い要素がファイルに残らないテスト"""
+    history = BoundedHistory(str(tmp_path / "history.jsonl"), max_in_memory=4)
+    for i in range(6):
+        history.append({"i": i})
+    spill = history._spill_task
+    history.clear()
+    await asyncio.gather(spill, return_exceptions=True)
+
+    history.append({"i": "new"})
+    assert list(history) == [{"i": "new"}]
+    assert not (tmp_path / "history.jsonl").exists()
+
+
+@pytest.mark.asyncio
+async def test_room_memory_estimate_uses_counters(tmp_path):
+    """ルームのメモリ見積もりは追い出したファイルを読まずに数えるテスト"""
+    from autogpt_modules.core.room import Room
+
+    room = Room("u1")
+    await room.message_manager.add_message("こんにちは", "user")
+    await room.event_manager.add_event("wait", result="done")
+    estimate = room.estimate_memory()
+    assert estimate > 0
+
+    room.message_manager._messages.iter_spilled = lambda *args, **kwargs: pytest.fail("read spill file")
+    assert room.estimate_memory() == estimate
+    room.discard()
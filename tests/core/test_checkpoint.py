@@ -0,0 +1,142 @@
+import json
+import pytest
+from langchain_core.language_models.fake_chat_models import GenericFakeChatModel
+from langchain_core.messages import AIMessage
+from autogpt_modules.communication import WebSocketManager
+from autogpt_modules.core import AutoGPT
+from autogpt_modules.core.session_store import InMemorySessionStore
+from autogpt_modules.tools import ReplyMessage, Wait, Finish, GoNext
+
+
+class RecordingWebSocket:
+    def __init__(self):
+        self.sent = []
+
+    async def send_text(self, text):
+        self.sent.append(json.loads(text))
+
+
+def reply(command, args):
+    return json.dumps({"thoughts": {"text": "t"}, "command": {"name": command, "args": args}}, ensure_ascii=False)
+
+
+def create_agent(websocket_manager, room, responses):
+    tools = [
+        ReplyMessage(websocket_manager=websocket_manager, room_id=room.id),
+        Wait(websocket_manager=websocket_manager, event_manager=room.event_manager, room_id=room.id),
+        Finish(),
+        GoNext(),
+    ]
+    agent = AutoGPT.from_llm_and_tools(
+        ai_name="test",
+        ai_role="test",
+        tools=tools,
+        flag_names=["finish", "go_next", "plan_action", "reply_message"],
+        llm=GenericFakeChatModel(messages=iter([AIMessage(content=r) for r in responses])),
+        room_id=room.id,
+        verbose=False,
+        websocket_manager=websocket_manager,
+    )
+    room.autogpt = agent
+    return agent
+
+
+def create_room(session_store=None):
+    websocket_manager = WebSocketManager(session_store=session_store)
+    room = websocket_manager.get_or_create_room("test_user")
+    room.websocket = RecordingWebSocket()
+    return websocket_manager, room
+
+
+def record_checkpoints(room):
+    """ルームに保存されたチェックポイントを順に記録する"""
+    saved = []
+    save_checkpoint = room.save_checkpoint
+
+    def save(checkpoint):
+        saved.append(checkpoint)
+        save_checkpoint(checkpoint)
+    room.save_checkpoint = save
+    return saved
+
+
+@pytest.mark.asyncio
+async def test_write_checkpoint_upserts_room_data():
+    """チェックポイントは履歴に追記せず、ルームの data の最新の1件を上書きするテスト"""
+    store = InMemorySessionStore()
+    websocket_manager, room = create_room(store)
+    agent = create_agent(websocket_manager, room, [])
+    room.save_run_config(["g1"], "r")
+
+    agent.set_flag("plan_action")
+    agent._write_checkpoint(1)
+    agent.set_flag("na")
+    agent.add_count()
+    agent._write_checkpoint(1)
+
+    checkpoint = (await store.load_room(room.id))["data"]["checkpoint"]
+    assert checkpoint["goal_index"] == 1
+    assert checkpoint["count"] == 1
+    assert checkpoint["status"] == "running"
+    assert checkpoint["flags"] == agent.get_flag_history(1)
+    assert "checkpoint" not in await store.load_records(room.id)
+
+
+@pytest.mark.asyncio
+async def test_resume_skips_finished_goals_and_restores_state():
+    """再開すると完了済みのゴールを飛ばし、ステップ数・フラグを戻して要約中のゴールを要約し直すテスト"""
+    websocket_manager, room = create_room()
+    agent = create_agent(websocket_manager, room, [reply("finish", {})])
+    flags = {"finish": False, "go_next": False, "plan_action": False, "reply_message": True}
+    room.save_run_config(["g1", "g2"], "r")
+    room.save_checkpoint({
+        "goal_index": 2,
+        "count": 3,
+        "flags": flags,
+        "save_result_flag": True,
+        "saving_goals": ["g1"],
+        "status": "running",
+    })
+
+    relaunched = []
+    agent._save_result_in_background = lambda goal: relaunched.append(goal) or "saving"
+    saved = record_checkpoints(room)
+
+    result = await agent.resume(room_id=room.id)
+
+    assert result == "=== All goals completed successfully! ==="
+    assert relaunched == ["g1"]
+    # ゴール1はやり直さず、ゴール2をステップ3・保存済みのフラグから続ける
+    assert all(checkpoint["goal_index"] >= 2 for checkpoint in saved)
+    assert saved[0]["goal_index"] == 2
+    assert saved[0]["count"] == 3
+    assert saved[0]["flags"] == flags
+    assert saved[0]["save_result_flag"] is True
+    assert room.checkpoint["status"] == "completed"
+
+
+@pytest.mark.asyncio
+async def test_resume_does_not_resummarize_saved_goal():
+    """要約中だったゴールの結果が保存済みなら、要約し直さないテスト"""
+    websocket_manager, room = create_room()
+    agent = create_agent(websocket_manager, room, [reply("finish", {})])
+    room.save_run_config(["g1", "g2"], "r")
+    room.save_checkpoint({"goal_index": 2, "count": 0, "flags": None, "saving_goals": ["g1"], "status": "running"})
+    await room.result_manager.add_result("summary", goal="g1")
+
+    relaunched = []
+    agent._save_result_in_background = lambda goal: relaunched.append(goal) or "saving"
+    await agent.resume(room_id=room.id)
+
+    assert "g1" not in relaunched
+
+
+@pytest.mark.asyncio
+async def test_resume_after_completion_does_nothing():
+    """完了した実行は再開しないテスト"""
+    websocket_manager, room = create_room()
+    agent = create_agent(websocket_manager, room, [])
+    room.save_run_config(["g1"], "r")
+    room.save_checkpoint({"goal_index": 2, "status": "completed"})
+
+    assert await agent.resume(room_id=room.id) == "Nothing to resume (last run completed)"
@@ -0,0 +1,170 @@
+import asyncio
+import json
+import pytest
+from langchain_core.language_models.fake_chat_models import GenericFakeChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from autogpt_modules.communication import WebSocketManager
+from autogpt_modules.core import AutoGPT, DecisionPreempted
+from autogpt_modules.core.auto_gpt import parse_preempt_policy
+from autogpt_modules.tools import ReplyMessage, Wait, Finish, GoNext
+from autogpt_modules.utils.llm.scheduler import LLMTicket
+
+
+class RecordingWebSocket:
+    def __init__(self):
+        self.sent = []
+
+    async def send_text(self, text):
+        self.sent.append(json.loads(text))
+
+
+class SlowChain:
+    """応答を1文字ずつ遅れて返すチェーン. 呼び出しごとに responses を順に使う"""
+    def __init__(self, responses, delay=0.01):
+        self.responses = list(responses)
+        self.delay = delay
+        self.calls = 0
+
+    async def astream(self, input_dict):
+        text = self.responses[self.calls]
+        self.calls += 1
+        for char in text:
+            await asyncio.sleep(self.delay)
+            yield AIMessageChunk(content=char)
+
+
+def reply(command, args, **thoughts):
+    return json.dumps({"thoughts": {"text": "t", **thoughts}, "command": {"name": command, "args": args}}, ensure_ascii=False)
+
+
+def create_agent(responses, **kwargs):
+    websocket_manager = WebSocketManager()
+    room = websocket_manager.get_or_create_room("test_user")
+    room.websocket = RecordingWebSocket()
+    tools = [
+        ReplyMessage(websocket_manager=websocket_manager, room_id=room.id),
+        Wait(websocket_manager=websocket_manager, event_manager=room.event_manager, room_id=room.id),
+        Finish(),
+        GoNext(),
+    ]
+    agent = AutoGPT.from_llm_and_tools(
+        ai_name="test",
+        ai_role="test",
+        tools=tools,
+        flag_names=["finish", "go_next", "plan_action", "reply_message"],
+        llm=GenericFakeChatModel(messages=iter([AIMessage(content="{}")])),
+        room_id=room.id,
+        verbose=False,
+        websocket_manager=websocket_manager,
+        **kwargs,
+    )
+    agent.chain = SlowChain(responses)
+    room.autogpt = agent
+    return agent, room
+
+
+async def send_user_message_after(room, seconds, content="やっぱり違う"):
+    await asyncio.sleep(seconds)
+    await room.message_manager.add_message(content, "user")
+    await room.event_manager.add_event("new_message_come", result=content)
+
+
+def test_parse_preempt_policy():
+    assert parse_preempt_policy("always") == ("always", None)
+    assert parse_preempt_policy("max_tokens:50") == ("max_tokens", 50)
+    with pytest.raises(ValueError):
+        parse_preempt_policy("max_tokens:many")
+    with pytest.raises(ValueError):
+        parse_preempt_policy("sometimes")
+
+
+@pytest.mark.asyncio
+async def test_new_message_preempts_decision():
+    """生成中に新着メッセージが届くと呼び出しを取り消すテスト"""
+    agent, room = create_agent([reply("reply_message", {"message": "古い返事"})], preempt_policy="always")
+    asyncio.create_task(send_user_message_after(room, 0.05))
+
+    with pytest.raises(DecisionPreempted):
+        await agent._invoke_chain({})
+    assert agent.preemption_stats["preempted"] == 1
+    assert 0 < agent.preemption_stats["discarded_chunks"] < len(agent.chain.responses[0])
+
+
+@pytest.mark.asyncio
+async def test_preempted_step_restarts_with_fresh_context():
+    """取り消したステップは同じフラグのままやり直し、古い返事は送らないテスト"""
+    agent, room = create_agent(
+        [
+            reply("reply_message", {"message": "古い返事"}),
+            reply("reply_message", {"message": "新しい返事"}),
+            reply("finish", {"response": "done"}),
+        ],
+        preempt_policy="always",
+    )
+    asyncio.create_task(send_user_message_after(room, 0.05))
+    await asyncio.wait_for(agent._run_subtask(["g1"], "g1", "", 1, room_id=room.id), timeout=10)
+
+    replies = [frame["data"]["content"] for frame in room.websocket.sent if frame["type"] == "response"]
+    assert replies == ["新しい返事"]
+    assert agent.chain.calls == 3
+    assert agent.preemption_stats["preempted"] == 1
+
+
+@pytest.mark.asyncio
+async def test_max_tokens_policy_lets_long_generations_finish():
+    """max_tokens を超えて生成していた場合は取り消さずに最後まで生成するテスト"""
+    response = reply("reply_message", {"message": "古い返事"})
+    agent, room = create_agent([response], preempt_policy="max_tokens:3")
+    asyncio.create_task(send_user_message_after(room, 0.1))
+
+    _, parsed, _ = await agent._invoke_chain({})
+    assert parsed.action.name == "reply_message"
+    assert agent.preemption_stats["preempted"] == 0
+    assert agent.preemption_stats["ignored"] == 1
+
+
+@pytest.mark.asyncio
+async def test_before_reply_policy_keeps_streamed_reply():
+    """before_reply では返信を送信し始めた後は取り消さないテスト"""
+    response = reply("reply_message", {"message": "とても長い返事です。" * 3})
+    agent, room = create_agent([response], preempt_policy="before_reply", stream_reply=True)
+    asyncio.create_task(send_user_message_after(room, len(response) * 0.01 - 0.05))
+
+    _, parsed, stream_id = await agent._invoke_chain({})
+    assert stream_id is not None
+    assert agent.preemption_stats["ignored"] == 1
+    assert not any(frame["type"] == "response_cancel" for frame in room.websocket.sent)
+
+
+@pytest.mark.asyncio
+async def test_preemptions_are_capped_per_step():
+    """同じステップで取り消せる回数には上限があり、上限に達したら最後まで生成するテスト"""
+    response = reply("reply_message", {"message": "古い返事"})
+    agent, room = create_agent([response, response], preempt_policy="always")
+    agent.max_preemptions = 1
+
+    asyncio.create_task(send_user_message_after(room, 0.05))
+    with pytest.raises(DecisionPreempted):
+        await agent._invoke_chain({})
+
+    asyncio.create_task(send_user_message_after(room, 0.05, "もう一度"))
+    _, parsed, _ = await agent._invoke_chain({})
+    assert parsed.action.name == "reply_message"
+    assert agent.preemption_stats["preempted"] == 1
+    assert agent.preemption_stats["capped"] == 1
+
+
+@pytest.mark.asyncio
+async def test_preempted_call_is_charged_to_the_token_budget(monkeypatch):
+    """取り消した呼び出しの使用量もスケジューラの予算に記録するテスト"""
+    recorded = []
+    monkeypatch.setattr(LLMTicket, "record_tokens", lambda self, tokens: recorded.append(tokens))
+    agent, room = create_agent([reply("reply_message", {"message": "古い返事"})], preempt_policy="always")
+    agent._last_input_tokens = 100
+    asyncio.create_task(send_user_message_after(room, 0.05))
+
+    with pytest.raises(DecisionPreempted):
+        await agent._invoke_chain({})
+    chunks = agent.preemption_stats["discarded_chunks"]
+    assert agent.preemption_stats["discarded_tokens"] == 100 + chunks
+    assert recorded == [100 + chunks]
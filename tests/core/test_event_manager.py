@@ -0,0 +1,71 @@
+import asyncio
+import pytest
+from autogpt_modules.core.event_manager import EventManager
+
+
+@pytest.mark.asyncio
+async def test_wait_for_event_wakes_on_matching_action():
+    """対象actionのイベント追加で待機が即座に解除されるテスト"""
+    event_manager = EventManager()
+    waiter = asyncio.create_task(
+        event_manager.wait_for_event(["new_message_come", "finish_session"], timeout=5)
+    )
+    await asyncio.sleep(0)
+
+    await event_manager.add_event("wait", purpose="対象外のイベント")
+    assert not waiter.done()
+
+    await event_manager.add_event("new_message_come", result="こんにちは")
+    event = await asyncio.wait_for(waiter, timeout=1)
+    assert event.action == "new_message_come"
+    assert event.result == "こんにちは"
+    assert event_manager._waiters == {}
+
+
+@pytest.mark.asyncio
+async def test_wait_for_event_timeout():
+    """タイムアウト時にNoneを返し、待機者が残らないことのテスト"""
+    event_manager = EventManager()
+    event = await event_manager.wait_for_event(["new_message_come"], timeout=0.01)
+    assert event is None
+    assert event_manager._waiters == {}
+
+
+@pytest.mark.asyncio
+async def test_events_since_and_cursor():
+    """シーケンス番号による差分読み出しのテスト"""
+    event_manager = EventManager()
+    await event_manager.add_event("wait")
+    await event_manager.add_event("new_message_come", result="はい")
+    assert event_manager.last_seq == 2
+    assert [e.seq for e in event_manager.events_since(0)] == [1, 2]
+    assert [e.action for e in event_manager.events_since(1)] == ["new_message_come"]
+
+    cursor = event_manager.cursor()
+    assert len(cursor.read()) == 2
+    assert cursor.read() == []
+
+    await event_manager.add_event("tool_execution : reply_message")
+    new_events = cursor.read()
+    assert [e.seq for e in new_events] == [3]
+    assert cursor.seq == 3
+
+
+@pytest.mark.asyncio
+async def test_events_since_after_restoring_cleared_history():
+    """clear 後の履歴（シーケンス番号が1から始まらない）を復元しても、差分読み出しの位置が合うテスト"""
+    original = EventManager()
+    for action in ["a", "b"]:
+        await original.add_event(action)
+    original.clear()
+    for action in ["c", "d", "e"]:
+        await original.add_event(action)
+    records = [event.to_record() for event in original.events_since(0)]
+
+    restored = EventManager()
+    restored.restore(records)
+
+    assert restored.last_seq == 5
+    assert [e.action for e in restored.events_since(0)] == ["c", "d", "e"]
+    assert [e.action for e in restored.events_since(3)] == ["d", "e"]
+    assert restored.events_since(5) == []
@@ -0,0 +1,137 @@
+import asyncio
+import json
+import time
+import pytest
+from langchain_core.language_models.fake_chat_models import GenericFakeChatModel
+from langchain_core.messages import AIMessage
+from autogpt_modules.communication import WebSocketManager
+from autogpt_modules.core import AutoGPT
+from autogpt_modules.core.hibernation import HibernationScheduler, WAKE_BY_TIMER, WAKE_BY_MESSAGE
+from autogpt_modules.tools import ReplyMessage, Wait, Finish, GoNext
+
+
+class RecordingWebSocket:
+    def __init__(self):
+        self.sent = []
+
+    async def send_text(self, text):
+        self.sent.append(json.loads(text))
+
+
+def reply(command, args):
+    return json.dumps({"thoughts": {"text": "t"}, "command": {"name": command, "args": args}}, ensure_ascii=False)
+
+
+def create_agent(websocket_manager, room, scheduler, responses):
+    tools = [
+        ReplyMessage(websocket_manager=websocket_manager, room_id=room.id),
+        Wait(websocket_manager=websocket_manager, event_manager=room.event_manager, room_id=room.id),
+        Finish(),
+        GoNext(),
+    ]
+    agent = AutoGPT.from_llm_and_tools(
+        ai_name="test",
+        ai_role="test",
+        tools=tools,
+        flag_names=["finish", "go_next", "plan_action", "reply_message"],
+        llm=GenericFakeChatModel(messages=iter([AIMessage(content=r) for r in responses])),
+        room_id=room.id,
+        verbose=False,
+        websocket_manager=websocket_manager,
+        hibernation_scheduler=scheduler,
+    )
+    room.autogpt = agent
+    return agent
+
+
+def create_room():
+    websocket_manager = WebSocketManager()
+    room = websocket_manager.get_or_create_room("test_user")
+    room.websocket = RecordingWebSocket()
+    return websocket_manager, room
+
+
+@pytest.mark.asyncio
+async def test_scheduler_wakes_rooms_in_deadline_order():
+    """1つのタイマーで、後から登録した早い起床時刻も含めて順に起こすテスト"""
+    woken = []
+    scheduler = HibernationScheduler(on_wake=lambda room_id, reason: woken.append((room_id, reason)))
+    scheduler.start()
+    now = time.time()
+    scheduler.hibernate("late", now + 0.2)
+    await asyncio.sleep(0.01)
+    scheduler.hibernate("early", now + 0.05)
+
+    await asyncio.sleep(0.3)
+    assert woken == [("early", WAKE_BY_TIMER), ("late", WAKE_BY_TIMER)]
+    assert scheduler.stats()["hibernating"] == 0
+    await scheduler.stop()
+
+
+@pytest.mark.asyncio
+async def test_message_wakes_room_once_and_cancel_skips_wake():
+    """新着メッセージで即座に起こし、タイマーで二重に起こさないテスト"""
+    woken = []
+    scheduler = HibernationScheduler(on_wake=lambda room_id, reason: woken.append((room_id, reason)))
+    scheduler.start()
+    scheduler.hibernate("room1", time.time() + 0.05)
+    scheduler.hibernate("room2", time.time() + 0.05)
+
+    assert scheduler.wake("room1", WAKE_BY_MESSAGE)
+    assert scheduler.cancel("room2")
+    assert not scheduler.wake("room2", WAKE_BY_MESSAGE)
+
+    await asyncio.sleep(0.1)
+    assert woken == [("room1", WAKE_BY_MESSAGE)]
+    stats = scheduler.stats()
+    assert stats["woken_by_message"] == 1 and stats["cancelled"] == 1 and stats["woken_by_timer"] == 0
+    await scheduler.stop()
+
+
+@pytest.mark.asyncio
+async def test_agent_hibernates_and_resumes_on_message():
+    """長い wait で休止したエージェントを新着メッセージで作り直し、wait の続きから再開するテスト"""
+    websocket_manager, room = create_room()
+    scheduler = HibernationScheduler()
+    agent = create_agent(websocket_manager, room, scheduler, [reply("wait", {"minutes": 30})])
+
+    result = await agent.run(goals=["g1"], common_rule="r", room_id=room.id)
+    assert "Hibernated" in result
+    assert scheduler.is_hibernating(room.id)
+    assert room.autogpt is None
+    assert room.checkpoint["status"] == "hibernating"
+    assert room.checkpoint["count"] == 1
+
+    await room.message_manager.add_message("戻りました", "user")
+    await room.event_manager.add_event(WAKE_BY_MESSAGE, result="戻りました")
+    assert scheduler.wake(room.id, WAKE_BY_MESSAGE)
+
+    woken = create_agent(websocket_manager, room, scheduler, [reply("reply_message", {"message": "おかえりなさい"}), reply("finish", {})])
+    result = await woken.resume(room_id=room.id, woke_by=WAKE_BY_MESSAGE)
+
+    assert result == "=== All goals completed successfully! ==="
+    waits = [e for e in room.event_manager.get_event_history() if e["action"] == "tool_execution : wait"]
+    assert WAKE_BY_MESSAGE in waits[-1]["result"]
+    assert any(m["type"] == "response" and m["data"]["content"] == "おかえりなさい" for m in room.websocket.sent if "data" in m)
+
+
+@pytest.mark.asyncio
+async def test_message_during_hibernation_setup_wakes_agent():
+    """休止の準備中（要約の完了待ち）に届いたメッセージで、登録直後に起こすテスト"""
+    websocket_manager, room = create_room()
+    woken = []
+    scheduler = HibernationScheduler(on_wake=lambda room_id, reason: woken.append(reason))
+    agent = create_agent(websocket_manager, room, scheduler, [reply("wait", {"minutes": 30})])
+
+    async def summary_while_user_types():
+        await asyncio.sleep(0.02)
+        await room.message_manager.add_message("まだいます", "user")
+        await room.event_manager.add_event(WAKE_BY_MESSAGE, result="まだいます")
+        # まだ登録されていないため起こせない
+        assert not scheduler.wake(room.id, WAKE_BY_MESSAGE)
+
+    room.result_manager.track_pending("g0", asyncio.create_task(summary_while_user_types()))
+    await agent.run(goals=["g1"], common_rule="r", room_id=room.id)
+
+    assert woken == [WAKE_BY_MESSAGE]
+    assert not scheduler.is_hibernating(room.id)
@@ -0,0 +1,60 @@
+from autogpt_modules.core.prompt_budget import BudgetSection, TokenBudgeter, OMITTED_MARKER
+
+
+def _count_chars(text: str) -> int:
+    return len(text)
+
+
+def test_fit_keeps_everything_within_budget():
+    """予算内であれば何も削らないテスト"""
+    budgeter = TokenBudgeter(_count_chars, send_token_limit=100)
+    lines = ["a1. x", "a2. y"]
+    fitted = budgeter.fit("fixed", [BudgetSection("event_history", lines)])
+    assert fitted["event_history"] == lines
+
+
+def test_fit_drops_oldest_unpinned_lines_first():
+    """古い行から削り、pinnedと最新行は残すテスト"""
+    budgeter = TokenBudgeter(_count_chars, send_token_limit=30)
+    events = ["e1" * 5, "e2" * 5, "e3" * 5, "e4" * 5]
+    chat = ["c1" * 5, "c2" * 5]
+    fitted = budgeter.fit("", [
+        BudgetSection("event_history", events, pinned=[True, False, False, False], min_keep=1),
+        BudgetSection("chat_history", chat, min_keep=1),
+    ])
+
+    assert fitted["event_history"][1:] == [events[0], events[3]]
+    assert fitted["event_history"][0] == OMITTED_MARKER
+    assert fitted["chat_history"][-1] == chat[-1]
+    assert len(fitted["chat_history"]) == 2
+
+
+def test_fit_trims_in_blocks_to_keep_prefix_stable():
+    """追記されていく履歴を trim_block 単位で削り、その間はプロンプトの先頭が変わらないテスト"""
+    budgeter = TokenBudgeter(_count_chars, send_token_limit=25)
+    lines = [f"e{i:02d}" for i in range(12)]
+
+    prefixes = []
+    for n in range(10, 13):
+        fitted = budgeter.fit("", [BudgetSection("event_history", lines[:n], trim_block=4)])
+        kept = fitted["event_history"]
+        assert kept[0] == OMITTED_MARKER
+        assert (len(lines[:n]) - (len(kept) - 1)) % 4 == 0
+        prefixes.append(kept[:2])
+
+    # 予算は8行分. 10〜12行のどれでも先頭の4行だけを削るため、先頭は変わらない
+    assert prefixes[0] == prefixes[1] == prefixes[2] == [OMITTED_MARKER, "e04"]
+
+
+def test_count_uses_cache():
+    """同じテキストのトークン数はキャッシュされるテスト"""
+    calls = []
+
+    def counter(text):
+        calls.append(text)
+        return len(text)
+
+    budgeter = TokenBudgeter(counter, send_token_limit=10)
+    assert budgeter.count("abc") == 3
+    assert budgeter.count("abc") == 3
+    assert calls == ["abc"]
@@ -0,0 +1,158 @@
+import json
+import pytest
+from langchain_core.language_models.fake_chat_models import GenericFakeChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from autogpt_modules.communication import WebSocketManager
+from autogpt_modules.core import AutoGPT
+from autogpt_modules.tools import ReplyMessage, Wait, Finish, GoNext
+
+
+class RecordingWebSocket:
+    def __init__(self):
+        self.sent = []
+
+    async def send_text(self, text):
+        self.sent.append(json.loads(text))
+
+
+class ChunkedChain:
+    """応答を数文字ずつ返すチェーン. 呼び出しごとに responses を順に使う"""
+    def __init__(self, responses, size=4):
+        self.responses = list(responses)
+        self.size = size
+        self.calls = 0
+
+    async def astream(self, input_dict):
+        text = self.responses[self.calls]
+        self.calls += 1
+        for i in range(0, len(text), self.size):
+            yield AIMessageChunk(content=text[i:i + self.size])
+
+
+def response(command, args, thoughts=None):
+    """command を thoughts より先に並べた応答（thoughts を読む前に本文が届く）"""
+    return json.dumps(
+        {"command": {"name": command, "args": args}, "thoughts": {"text": "t", **(thoughts or {})}},
+        ensure_ascii=False,
+    )
+
+
+def create_agent(responses):
+    websocket_manager = WebSocketManager()
+    room = websocket_manager.get_or_create_room("test_user")
+    room.websocket = RecordingWebSocket()
+    tools = [
+        ReplyMessage(websocket_manager=websocket_manager, room_id=room.id),
+        Wait(websocket_manager=websocket_manager, event_manager=room.event_manager, room_id=room.id),
+        Finish(),
+        GoNext(),
+    ]
+    agent = AutoGPT.from_llm_and_tools(
+        ai_name="test",
+        ai_role="test",
+        tools=tools,
+        flag_names=["finish", "go_next", "plan_action", "reply_message"],
+        llm=GenericFakeChatModel(messages=iter([AIMessage(content="{}")])),
+        room_id=room.id,
+        verbose=False,
+        websocket_manager=websocket_manager,
+        stream_reply=True,
+        preempt_policy="never",
+    )
+    agent.chain = ChunkedChain(responses)
+    room.autogpt = agent
+    return agent, room
+
+
+def frames(room, frame_type):
+    return [frame["data"] for frame in room.websocket.sent if frame["type"] == frame_type]
+
+
+@pytest.mark.asyncio
+async def test_streamed_reply_is_finalized_with_stream_id():
+    """返信の本文を response_delta で送り、最終の response を同じストリームIDで送るテスト"""
+    message = "こんにちは。今日はどんな一日でしたか？"
+    agent, room = create_agent([response("reply_message", {"message": message}), response("finish", {})])
+
+    await agent._run_subtask(["g1"], "g1", "", 1, room_id=room.id)
+
+    deltas = frames(room, "response_delta")
+    [final] = frames(room, "response")
+    assert len(deltas) > 1
+    assert "".join(delta["content"] for delta in deltas) == message
+    assert {delta["stream_id"] for delta in deltas} == {final["stream_id"]}
+    assert final["content"] == message
+    assert frames(room, "response_cancel") == []
+
+
+@pytest.mark.asyncio
+async def test_streamed_reply_is_cancelled_when_not_sent():
+    """送信し始めた返信が is_go_next で実行されない場合は response_cancel を送るテスト"""
+    agent, room = create_agent([
+        response("reply_message", {"message": "まだ送らない返事"}, {"is_go_next": "true"}),
+        response("go_next", {}),
+    ])
+
+    await agent._run_subtask(["g1"], "g1", "", 1, room_id=room.id)
+
+    deltas = frames(room, "response_delta")
+    assert deltas
+    assert frames(room, "response_cancel") == [{"stream_id": deltas[0]["stream_id"]}]
+    assert frames(room, "response") == []
+
+
+@pytest.mark.asyncio
+async def test_cancelled_stream_id_is_not_reused():
+    """取り消したストリームIDが、次のステップの返信に付かないテスト"""
+    agent, room = create_agent([
+        response("reply_message", {"message": "取り消される返事"}, {"is_go_next": "true"}),
+        response("go_next", {}),
+        response("reply_message", {"message": "次の返事"}),
+        response("finish", {}),
+    ])
+
+    await agent._run_subtask(["g1", "g2"], "g1", "", 1, room_id=room.id)
+    await agent._run_subtask(["g1", "g2"], "g2", "", 2, room_id=room.id)
+
+    [cancelled] = frames(room, "response_cancel")
+    [final] = frames(room, "response")
+    assert final["content"] == "次の返事"
+    assert final["stream_id"] != cancelled["stream_id"]
+
+
+@pytest.mark.asyncio
+async def test_reply_without_stream_has_no_stream_id():
+    """ストリーミングしていない返信の response には stream_id を付けないテスト"""
+    agent, room = create_agent([])
+
+    await agent.tools_dict["reply_message"]._arun(message="こんにちは")
+    await room.outbound.flush()
+
+    [final] = frames(room, "response")
+    assert "stream_id" not in final
+
+
+@pytest.mark.asyncio
+async def test_command_is_decided_before_generation_finishes():
+    """stream_reply が無効でも、command.name が確定した時点で生成完了前にリスナーが呼ばれるテスト"""
+    text = response("finish", {"response": "done"}, {"reasoning": "長い思考" * 20})
+    agent, room = create_agent([text])
+    agent.stream_reply = False
+    streamed = []
+    original = agent.chain.astream
+
+    async def astream(input_dict):
+        async for chunk in original(input_dict):
+            streamed.append(chunk.content)
+            yield chunk
+    agent.chain.astream = astream
+
+    decided = []
+    agent.add_command_listener(lambda name: decided.append((name, len("".join(streamed)))))
+    _, parsed, stream_id = await agent._invoke_chain({})
+
+    assert parsed.action.name == "finish"
+    assert stream_id is None
+    [(name, received)] = decided
+    assert name == "finish"
+    assert received < len(text)
@@ -0,0 +1,164 @@
+import asyncio
+from datetime import datetime, timedelta
+import pytest
+from autogpt_modules.core.session_store import SQLiteSessionStore, InMemorySessionStore
+from autogpt_modules.communication.websocket_manager import WebSocketManager
+
+
+@pytest.mark.asyncio
+async def test_sqlite_store_batches_writes(tmp_path):
+    """記録はキューに積まれ、まとめて1回で書き込まれるテスト"""
+    store = SQLiteSessionStore(str(tmp_path / "sessions.db"), flush_interval=60)
+    for i in range(50):
+        store.record("room1", "message", {"i": i})
+    store.save_room("room1", "u1", 1.0)
+    store.save_room("room1", "u1", 2.0)
+
+    assert store.stats()["pending_records"] == 50
+    assert store.stats()["batches"] == 0
+
+    records = await store.load_records("room1")
+    assert [r["i"] for r in records["message"]] == list(range(50))
+    assert (await store.load_room("room1"))["last_active"] == 2.0
+    assert store.stats()["batches"] == 1
+    await store.close()
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("backend", ["memory", "sqlite"])
+async def test_room_is_restored_after_restart(tmp_path, backend):
+    """プロセスを作り直しても、同じユーザーのルームと履歴が復元されるテスト"""
+    def make_store():
+        if backend == "memory":
+            return memory_store
+        return SQLiteSessionStore(str(tmp_path / "sessions.db"))
+
+    memory_store = InMemorySessionStore()
+    store = make_store()
+    manager = WebSocketManager(session_store=store)
+    room = manager.get_or_create_room("u1")
+    await room.message_manager.add_message("こんにちは", "user")
+    await room.event_manager.add_event("new_message_come", result="こんにちは")
+    await room.plan_manager.add_plan("plan", goal="g1")
+    await room.result_manager.add_result("summary", goal="g1")
+    await store.close()
+
+    # 再起動後
+    store = make_store()
+    manager = WebSocketManager(session_store=store)
+    restored = await manager.restore_room("u1")
+
+    assert restored is not None and restored.id == room.id
+    assert restored.message_manager.get_chat_history() == [{"role": "user", "content": "こんにちは"}]
+    assert [e.seq for e in restored.event_manager.events_since(0)] == [1]
+    assert restored.event_manager.last_seq == 1
+    assert restored.plan_manager.get_latest_plan().plan == "plan"
+    assert restored.result_manager.get_goal_result_pairs() == [{"goal": "g1", "result": "summary"}]
+    assert manager.get_or_create_room("u1") is restored
+    await store.close()
+
+
+@pytest.mark.asyncio
+async def test_checkpoint_is_restored_after_restart(tmp_path):
+    """最後のチェックポイントが復元され、途中の実行を再開できると判定されるテスト"""
+    store = SQLiteSessionStore(str(tmp_path / "sessions.db"))
+    manager = WebSocketManager(session_store=store)
+    room = manager.get_or_create_room("u1")
+    room.save_run_config(["g1", "g2"], "rule")
+    room.save_checkpoint({"goal_index": 2, "count": 1, "status": "running"})
+    room.save_checkpoint({"goal_index": 2, "count": 3, "status": "running"})
+    await store.close()
+
+    store = SQLiteSessionStore(str(tmp_path / "sessions.db"))
+    restored = await WebSocketManager(session_store=store).restore_room("u1")
+
+    assert restored.run_config == {"goals": ["g1", "g2"], "common_rule": "rule"}
+    assert restored.checkpoint["count"] == 3
+    assert restored.has_resumable_run()
+
+    restored.save_checkpoint({"goal_index": 3, "status": "completed"})
+    assert not restored.has_resumable_run()
+    await store.close()
+
+
+@pytest.mark.asyncio
+async def test_failed_flush_keeps_batch(tmp_path, monkeypatch):
+    """書き込みに失敗したバッチは捨てられず、次の書き込みで書かれるテスト"""
+    store = SQLiteSessionStore(str(tmp_path / "sessions.db"), flush_interval=60)
+    store.record("room1", "message", {"i": 0})
+    store.save_room("room1", "u1", 1.0)
+
+    write_batch = store._write_batch
+    def fail_once(*args):
+        monkeypatch.setattr(store, "_write_batch", write_batch)
+        raise OSError("disk I/O error")
+    monkeypatch.setattr(store, "_write_batch", fail_once)
+
+    with pytest.raises(OSError):
+        await store.flush()
+    # 失敗している間に積まれたものは、戻したバッチの後ろに並ぶ
+    store.record("room1", "message", {"i": 1})
+    store.save_room("room1", "u1", 2.0)
+    assert store.stats()["pending_records"] == 2
+
+    records = await store.load_records("room1")
+    assert [r["i"] for r in records["message"]] == [0, 1]
+    assert (await store.load_room("room1"))["last_active"] == 2.0
+    await store.close()
+
+
+@pytest.mark.asyncio
+async def test_restored_room_keeps_last_active(tmp_path):
+    """復元したルームは最後に使われた時刻を引き継ぎ、保存し直さないテスト"""
+    store = InMemorySessionStore()
+    last_active = (datetime.now() - timedelta(minutes=10)).timestamp()
+    store.save_room("room1", "u1", last_active)
+
+    manager = WebSocketManager(session_store=store)
+    assert await manager.restore_rooms() == 1
+
+    room = manager._rooms["room1"]
+    assert room.last_active == datetime.fromtimestamp(last_active)
+    assert (await store.load_room("room1"))["last_active"] == last_active
+
+
+@pytest.mark.asyncio
+async def test_idle_writer_does_not_wake_up(tmp_path):
+    """書き込むものがない間は書き込みタスクが起きず、積まれてから flush_interval 後に書き込むテスト"""
+    store = SQLiteSessionStore(str(tmp_path / "sessions.db"), flush_interval=0.02)
+    flushes = []
+    flush = store.flush
+
+    async def counting_flush():
+        flushes.append(1)
+        await flush()
+    store.flush = counting_flush
+
+    await store.start()
+    await asyncio.sleep(0.1)
+    assert flushes == []
+
+    store.save_room("room1", "u1", 1.0)
+    await asyncio.sleep(0.1)
+    assert len(flushes) == 1
+    assert store.stats()["batches"] == 1
+    await store.close()
+
+
+@pytest.mark.asyncio
+async def test_update_activity_saves_on_a_throttle():
+    """ツールの呼び出しごとの update_activity はメモリだけを更新し、保存は間引くテスト"""
+    store = InMemorySessionStore()
+    manager = WebSocketManager(session_store=store)
+    room = manager.get_or_create_room("u1")
+    saved = []
+    save_room = store.save_room
+    store.save_room = lambda *args, **kwargs: saved.append(args[2]) or save_room(*args, **kwargs)
+
+    for _ in range(10):
+        manager.get_room(room.id)
+    assert saved == []
+
+    room._saved_active -= timedelta(minutes=5)
+    manager.get_room(room.id)
+    assert saved == [room.last_active.timestamp()]
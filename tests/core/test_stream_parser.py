@@ -0,0 +1,67 @@
+import json
+from langchain_experimental.autonomous_agents.autogpt.output_parser import AutoGPTOutputParser
+from autogpt_modules.core.stream_parser import StreamingResponseParser, parse_response
+
+RESPONSE = {
+    "thoughts": {
+        "text": "ユーザーに \"買い物\" について聞く",
+        "is_finish": "false",
+        "is_go_next": "true",
+    },
+    "command": {
+        "name": "reply_message",
+        "args": {"message": "こんにちは\nどのあたりが大変ですか？"},
+    },
+}
+
+
+def _feed_in_chunks(parser, text, size):
+    deltas = []
+    for i in range(0, len(text), size):
+        deltas.extend(parser.feed(text[i:i + size]))
+    return deltas
+
+
+def test_streamed_message_deltas_and_command():
+    """分割して届いた応答から本文の差分とコマンド名を取り出せるテスト"""
+    text = json.dumps(RESPONSE, ensure_ascii=True)
+    decided = []
+    parser = StreamingResponseParser(on_command=decided.append)
+
+    deltas = _feed_in_chunks(parser, text, 3)
+    message = "".join(d for path, d in deltas if path == ("command", "args", "message"))
+
+    assert message == RESPONSE["command"]["args"]["message"]
+    assert decided == ["reply_message"]
+    assert parser.command_name == "reply_message"
+
+
+def test_single_pass_response_matches_json():
+    """1回の解析で command / args / thoughts のフラグが得られるテスト"""
+    parsed = parse_response(json.dumps(RESPONSE, ensure_ascii=False, indent=2), AutoGPTOutputParser())
+
+    assert parsed.action.name == "reply_message"
+    assert parsed.action.args == RESPONSE["command"]["args"]
+    assert parsed.purpose == RESPONSE["thoughts"]["text"]
+    assert parsed.is_finish is False
+    assert parsed.is_go_next is True
+
+
+def test_incomplete_response_falls_back():
+    """JSONとして完結していない応答はエラーアクションになるテスト"""
+    parsed = parse_response('{"thoughts": {"text": "途中', AutoGPTOutputParser())
+    assert parsed.action.name == "ERROR"
+    assert parsed.thoughts == {}
+    assert parsed.is_finish is False
+
+
+def test_streamed_and_single_pass_results_match():
+    """逐次解析と json.loads による解析で同じ結果になるテスト"""
+    text = json.dumps(RESPONSE, ensure_ascii=False)
+    parser = StreamingResponseParser()
+    _feed_in_chunks(parser, text, 4)
+
+    streamed = parser.to_response(AutoGPTOutputParser())
+    parsed = parse_response(text, AutoGPTOutputParser())
+
+    assert (streamed.action, streamed.thoughts) == (parsed.action, parsed.thoughts)
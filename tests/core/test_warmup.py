@@ -0,0 +1,80 @@
+import asyncio
+import pytest
+from langchain.tools.base import BaseTool
+from autogpt_modules.core.warmup import StartupWarmup, WARMUP_DONE, WARMUP_FAILED, WARMUP_TIMEOUT
+from autogpt_modules.core.autogpt_prompt import precompile_base_prompt, _COMPILED_PROMPT_CACHE, _MAX_SHARED_PROMPTS
+
+
+@pytest.mark.asyncio
+async def test_ready_after_all_steps():
+    done = []
+
+    async def step(name, delay):
+        await asyncio.sleep(delay)
+        done.append(name)
+
+    warmup = StartupWarmup({"a": lambda: step("a", 0.02), "b": lambda: step("b", 0.01)})
+    assert not warmup.ready
+
+    warmup.start()
+    assert await warmup.wait_ready(timeout=1)
+
+    assert sorted(done) == ["a", "b"]
+    stats = warmup.stats()
+    assert stats["ready"] is True
+    assert all(step["status"] == WARMUP_DONE for step in stats["steps"].values())
+
+
+@pytest.mark.asyncio
+async def test_failed_and_slow_steps_do_not_block_readiness():
+    async def fail():
+        raise RuntimeError("no api key")
+
+    async def hang():
+        await asyncio.sleep(10)
+
+    warmup = StartupWarmup({"fail": fail, "hang": hang}, timeout=0.05)
+    warmup.start()
+    assert await warmup.wait_ready(timeout=1)
+
+    steps = warmup.stats()["steps"]
+    assert steps["fail"]["status"] == WARMUP_FAILED
+    assert steps["fail"]["error"] == "no api key"
+    assert steps["hang"]["status"] == WARMUP_TIMEOUT
+
+
+@pytest.mark.asyncio
+async def test_no_steps_is_ready_immediately():
+    warmup = StartupWarmup({})
+    warmup.start()
+    assert await warmup.wait_ready(timeout=1)
+
+
+class DummyTool(BaseTool):
+    name: str = "dummy"
+    description: str = "dummy tool"
+
+    def _run(self, text: str) -> str:
+        return text
+
+
+def test_precompiled_prompt_is_shared():
+    first = precompile_base_prompt([DummyTool()], ["goal 1", "goal 2"], "rule")
+    second = precompile_base_prompt([DummyTool()], ["goal 1", "goal 2"], "rule")
+    other = precompile_base_prompt([DummyTool()], ["goal 1"], "rule")
+
+    assert first is second
+    assert other is not first
+    assert "1. goal 1" in first.head
+    assert "dummy: dummy tool" in first.tail
+
+
+def test_shared_prompts_are_bounded():
+    """ヒアリングの構成ごとに共有のプロンプトが増え続けず、最近使ったものを残すテスト"""
+    kept = precompile_base_prompt([DummyTool()], ["kept goal"], "rule")
+    for i in range(_MAX_SHARED_PROMPTS * 2):
+        precompile_base_prompt([DummyTool()], [f"goal {i}"], "rule")
+        precompile_base_prompt([DummyTool()], ["kept goal"], "rule")
+
+    assert len(_COMPILED_PROMPT_CACHE) == _MAX_SHARED_PROMPTS
+    assert precompile_base_prompt([DummyTool()], ["kept goal"], "rule") is kept
@@ -0,0 +1,55 @@
+import asyncio
+import pytest
+from unittest.mock import AsyncMock, patch
+from autogpt_modules.communication import WebSocketManager
+from autogpt_modules.tools.plan_action import PlanAction, PREFETCH_CONTEXT
+
+
+def _setup():
+    websocket_manager = WebSocketManager()
+    room = websocket_manager.get_or_create_room("test_user")
+    tool = PlanAction(websocket_manager=websocket_manager, room_id=room.id)
+    return room, tool
+
+
+@pytest.mark.asyncio
+async def test_prefetched_plan_is_used_by_plan_action():
+    """先読みしたプランを plan_action で使うテスト（先読みにもコンテキストが渡る）"""
+    room, tool = _setup()
+    with patch("autogpt_modules.tools.plan_action.generate_plan", AsyncMock(return_value="prefetched plan")) as mock_generate:
+        assert tool.prefetch("g2")
+        plan = await tool._arun(goal="goal index: 2, g2")
+
+    assert plan == "prefetched plan"
+    mock_generate.assert_awaited_once()
+    assert mock_generate.await_args.kwargs["context"] == PREFETCH_CONTEXT
+    assert room.plan_manager.get_prefetch_stats()["used"] + room.plan_manager.get_prefetch_stats()["joined"] == 1
+
+
+@pytest.mark.asyncio
+async def test_prefetched_plan_is_regenerated_after_goal_result():
+    """先読み後に前のゴールの結果が加わった場合は、結果を含めて生成し直すテスト"""
+    room, tool = _setup()
+    with patch("autogpt_modules.tools.plan_action.generate_plan", AsyncMock(side_effect=["stale plan", "new plan"])) as mock_generate:
+        assert tool.prefetch("g2")
+        await asyncio.sleep(0.01)
+        await room.result_manager.add_result("summary of g1", goal="g1")
+        plan = await tool._arun(goal="g2")
+
+    assert plan == "new plan"
+    assert mock_generate.await_args.kwargs["past_results"] == [{"goal": "g1", "result": "summary of g1"}]
+    assert room.plan_manager.get_prefetch_stats()["stale"] == 1
+
+
+@pytest.mark.asyncio
+async def test_context_from_llm_bypasses_prefetch():
+    """plan_action にコンテキストが渡された場合は、先読みを使わずにそのコンテキストで生成するテスト"""
+    room, tool = _setup()
+    with patch("autogpt_modules.tools.plan_action.generate_plan", AsyncMock(side_effect=["prefetched plan", "plan with context"])) as mock_generate:
+        assert tool.prefetch("g2")
+        await asyncio.sleep(0.01)
+        plan = await tool._arun(goal="g2", context="ユーザーは買い物を選んだ")
+
+    assert plan == "plan with context"
+    assert mock_generate.await_args.kwargs["context"] == "ユーザーは買い物を選んだ"
+    assert room.plan_manager.get_prefetch_stats()["bypassed"] == 1
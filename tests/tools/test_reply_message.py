@@ -0,0 +1,37 @@
+import pytest
+from autogpt_modules.communication import WebSocketManager
+from autogpt_modules.tools import ReplyMessage
+
+
+class RecordingWebSocket:
+    def __init__(self):
+        self.sent = []
+
+    async def send_text(self, text):
+        self.sent.append(text)
+
+
+@pytest.mark.asyncio
+async def test_reply_is_added_to_history_when_queued():
+    """送信キューに積めたメッセージだけを送信済みとして履歴に追加するテスト"""
+    manager = WebSocketManager()
+    room = manager.get_or_create_room("u1")
+    room.websocket = RecordingWebSocket()
+    tool = ReplyMessage(websocket_manager=manager, room_id=room.id)
+
+    assert await tool._arun(message="こんにちは") == "こんにちは"
+    assert room.message_manager.get_chat_history() == [{"role": "assistant", "content": "こんにちは"}]
+
+
+@pytest.mark.asyncio
+async def test_undelivered_reply_is_reported_and_not_recorded():
+    """送信できなかったメッセージはエラーを返し、履歴に追加しないテスト"""
+    manager = WebSocketManager()
+    room = manager.get_or_create_room("u1")
+    room.websocket = None
+    tool = ReplyMessage(websocket_manager=manager, room_id=room.id)
+
+    result = await tool._arun(message="こんにちは")
+
+    assert result.startswith("Error: message was not delivered")
+    assert room.message_manager.get_chat_history() == []
@@ -0,0 +1,50 @@
+import asyncio
+import pytest
+from autogpt_modules.communication import WebSocketManager
+from autogpt_modules.tools import Wait
+
+
+@pytest.mark.asyncio
+async def test_wait_resumes_on_new_message():
+    """new_message_come イベントで待機が即座に終了するテスト"""
+    websocket_manager = WebSocketManager()
+    room = websocket_manager.get_or_create_room("test_user")
+    wait = Wait(
+        websocket_manager=websocket_manager,
+        event_manager=room.event_manager,
+        room_id=room.id
+    )
+
+    task = asyncio.create_task(wait._arun(minutes=10))
+    await asyncio.sleep(0.01)
+    await room.event_manager.add_event("new_message_come", result="はい")
+
+    result = await asyncio.wait_for(task, timeout=1)
+    assert "new_message_come" in result
+    assert wait.get_waiting_info()["prev_waiting_info"] < 1
+
+
+@pytest.mark.asyncio
+async def test_wait_resumes_from_hibernation():
+    """エージェントを解放していた待機も、通常の待機と同じ結果と待機情報になるテスト"""
+    websocket_manager = WebSocketManager()
+    room = websocket_manager.get_or_create_room("test_user")
+    wait = Wait(
+        websocket_manager=websocket_manager,
+        event_manager=room.event_manager,
+        room_id=room.id
+    )
+
+    state = await wait.begin_hibernation(minutes=90)
+    assert state["minutes"] == 60
+    assert room.event_manager.events_since(0)[-1].action == "wait"
+
+    # 起床後は新しいインスタンスで終わらせる
+    woken = Wait(
+        websocket_manager=websocket_manager,
+        event_manager=room.event_manager,
+        room_id=room.id
+    )
+    result = woken.resume_from_hibernation(state)
+    assert result == "60分間の待機が完了しました。"
+    assert woken.get_waiting_info() == {"consecutive_waiting_duration": 60, "prev_waiting_info": 60}
@@ -0,0 +1,57 @@
+import asyncio
+import threading
+import pytest
+from langchain_openai import ChatOpenAI
+from autogpt_modules.utils.llm.client_pool import LLMClientRegistry
+
+
+PARAMS = dict(model="deepseek-chat", api_key="test", base_url="http://localhost:9/v1")
+
+
+@pytest.mark.asyncio
+async def test_openai_clients_are_shared_per_event_loop():
+    """同じイベントループでは共有し、別のイベントループ（シャード）では別の接続プールを使うテスト"""
+    registry = LLMClientRegistry()
+    client = registry.get_or_create("openai", ChatOpenAI, **PARAMS)
+    assert registry.get_or_create("openai", ChatOpenAI, **PARAMS) is client
+
+    other = {}
+    def run_in_other_loop():
+        async def create():
+            other["client"] = registry.get_or_create("openai", ChatOpenAI, **PARAMS)
+            await registry.aclose()
+        asyncio.run(create())
+    thread = threading.Thread(target=run_in_other_loop)
+    thread.start()
+    thread.join()
+
+    assert other["client"] is not client
+    # 別のループで aclose しても、このループのクライアントは残る
+    assert registry.get_or_create("openai", ChatOpenAI, **PARAMS) is client
+    assert registry.stats()["clients"] == 1
+    await registry.aclose()
+    assert registry.stats()["clients"] == 0
+
+
+@pytest.mark.asyncio
+async def test_clear_closes_http_pools():
+    """clear でクライアントを破棄するときに、共有の接続プールも閉じるテスト"""
+    registry = LLMClientRegistry()
+    client = registry.get_or_create("openai", ChatOpenAI, **PARAMS)
+    http_client = client.http_async_client
+
+    registry.clear()
+    await asyncio.sleep(0)
+
+    assert http_client.is_closed
+    assert client.root_client._client.is_closed
+    assert registry.stats()["clients"] == 0
+    assert registry.get_or_create("openai", ChatOpenAI, **PARAMS) is not client
+    await registry.aclose()
+
+
+def test_explicit_zero_limits_are_kept():
+    """0 を指定した上限は環境変数の既定値で置き換えないテスト"""
+    registry = LLMClientRegistry(max_keepalive_connections=0, keepalive_expiry=0)
+    assert registry._limits.max_keepalive_connections == 0
+    assert registry._limits.keepalive_expiry == 0
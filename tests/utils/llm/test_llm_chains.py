@@ -1,5 +1,5 @@
 import pytest
-from unittest.mock import patch, AsyncMock, MagicMock
+from unittest.mock import patch, AsyncMock, MagicMock, ANY
 from langchain_core.messages import HumanMessage, AIMessage
 from langchain_core.outputs import Generation, LLMResult
 from autogpt_modules.utils.llm.llm_chains import (
@@ -38,7 +38,8 @@ def test_get_llm_gpt():
         mock_chat.assert_called_once_with(
             model_name="gpt-4",
             temperature=0.7,
-            streaming=True
+            streaming=True,
+            http_async_client=ANY
         )
 
 def test_get_llm_gemini():
@@ -140,3 +141,47 @@ async def test_generate_summary_validation():
     
     with pytest.raises(ValueError):
         await generate_summary("goal", "")
+
+def test_get_llm_reuses_shared_client():
+    """同じモデルのクライアントが共有されることのテスト"""
+    with patch("autogpt_modules.utils.llm.llm_chains.ChatOpenAI") as mock_chat:
+        mock_chat.side_effect = lambda **kwargs: MagicMock()
+
+        first = get_llm("gpt-4o-shared-test")
+        second = get_llm("gpt-4o-shared-test")
+        assert first is second
+        mock_chat.assert_called_once()
+
+
+@pytest.mark.asyncio
+async def test_background_calls_settle_tokens_with_reported_usage(monkeypatch):
+    """プラン生成は、チェーンが文字列を返しても LLM の usage_metadata で予約を精算するテスト"""
+    from langchain_core.language_models.fake_chat_models import GenericFakeChatModel
+    from langchain_core.output_parsers import StrOutputParser
+    from autogpt_modules.utils.llm.prompt import plan_prompt
+    from autogpt_modules.utils.llm.scheduler import LLMTicket
+
+    recorded = []
+    monkeypatch.setattr(LLMTicket, "record_tokens", lambda self, tokens: recorded.append(tokens))
+    message = AIMessage(
+        content="プラン",
+        usage_metadata={"input_tokens": 300, "output_tokens": 20, "total_tokens": 320},
+    )
+    chain = plan_prompt | GenericFakeChatModel(messages=iter([message])) | StrOutputParser()
+
+    with patch("autogpt_modules.utils.llm.llm_chains.get_plan_chain", return_value=chain):
+        assert await generate_plan(goal="g", context="c", past_results="") == "プラン"
+    assert recorded == [320]
+
+
+@pytest.mark.asyncio
+async def test_background_calls_count_output_without_usage(monkeypatch):
+    """使用量を返さない場合は、入力と出力の文字数で精算するテスト"""
+    from autogpt_modules.utils.llm.scheduler import LLMTicket
+
+    recorded = []
+    monkeypatch.setattr(LLMTicket, "record_tokens", lambda self, tokens: recorded.append(tokens))
+    with patch("autogpt_modules.utils.llm.llm_chains.get_summary_chain") as mock_get_chain:
+        mock_get_chain.return_value.ainvoke = AsyncMock(return_value="要約")
+        await generate_summary(goal="ゴール", chat_history="履歴です")
+    assert recorded == [len("ゴール") + len("履歴です") + len("要約")]
@@ -0,0 +1,180 @@
+import asyncio
+import time
+import pytest
+from langchain_core.messages import HumanMessage
+from autogpt_modules.utils.llm.result_cache import LLMResultCache, make_cache_key
+
+
+class Counter:
+    """呼ばれた回数を数えるLLMの代わり"""
+    def __init__(self, result="プラン", delay=0.0):
+        self.calls = 0
+        self.result = result
+        self.delay = delay
+
+    async def __call__(self):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        return f"{self.result}{self.calls}"
+
+
+@pytest.mark.asyncio
+async def test_hit_and_miss():
+    cache = LLMResultCache(max_entries=10, ttl=60, path="")
+    compute = Counter()
+
+    first = await cache.get_or_compute("plan", "model", {"goal": "a"}, compute)
+    second = await cache.get_or_compute("plan", "model", {"goal": "a"}, compute)
+    other = await cache.get_or_compute("plan", "other-model", {"goal": "a"}, compute)
+
+    assert first == second == "プラン1"
+    assert other == "プラン2"
+    stats = cache.stats()
+    assert stats["memory_hits"] == 1
+    assert stats["misses"] == 2
+    assert stats["hit_rate"] == pytest.approx(1 / 3)
+
+
+def test_key_ignores_whitespace_and_volatile_fields():
+    base = make_cache_key("plan", "m", {
+        "goal": "ゴール  の\n説明",
+        "past_results": [{"id": "1", "timestamp": "t1", "content": "結果"}],
+        "history": [HumanMessage(content="こんにちは")],
+    })
+    same = make_cache_key("plan", "m", {
+        "goal": " ゴール の 説明 ",
+        "past_results": [{"id": "2", "timestamp": "t2", "content": "結果"}],
+        "history": [HumanMessage(content="こんにちは ")],
+    })
+    different = make_cache_key("plan", "m", {
+        "goal": "ゴール の 説明",
+        "past_results": [{"id": "2", "timestamp": "t2", "content": "別の結果"}],
+        "history": [HumanMessage(content="こんにちは")],
+    })
+    assert base == same
+    assert base != different
+    assert base != make_cache_key("summary", "m", {"goal": "ゴール の 説明"})
+
+
+@pytest.mark.asyncio
+async def test_ttl_expiry():
+    cache = LLMResultCache(max_entries=10, ttl=0.05, path="")
+    compute = Counter()
+
+    await cache.get_or_compute("plan", "m", {"goal": "a"}, compute)
+    await asyncio.sleep(0.06)
+    result = await cache.get_or_compute("plan", "m", {"goal": "a"}, compute)
+
+    assert result == "プラン2"
+    assert cache.stats()["expired"] == 1
+
+
+@pytest.mark.asyncio
+async def test_lru_eviction():
+    cache = LLMResultCache(max_entries=2, ttl=60, path="")
+    compute = Counter()
+
+    for goal in ("a", "b"):
+        await cache.get_or_compute("plan", "m", {"goal": goal}, compute)
+    # a を使ったので、次に追い出されるのは b
+    await cache.get_or_compute("plan", "m", {"goal": "a"}, compute)
+    await cache.get_or_compute("plan", "m", {"goal": "c"}, compute)
+
+    assert await cache.get_or_compute("plan", "m", {"goal": "a"}, compute) == "プラン1"
+    assert await cache.get_or_compute("plan", "m", {"goal": "b"}, compute) == "プラン4"
+    assert cache.stats()["evictions"] == 2
+
+
+@pytest.mark.asyncio
+async def test_disk_shared_between_instances(tmp_path):
+    path = str(tmp_path / "llm_cache.sqlite3")
+    compute = Counter(delay=0.01)
+
+    writer = LLMResultCache(max_entries=10, ttl=60, path=path)
+    await writer.get_or_compute("plan", "m", {"goal": "a"}, compute)
+
+    # 別のワーカー（または再起動後）のキャッシュ
+    reader = LLMResultCache(max_entries=10, ttl=60, path=path)
+    result = await reader.get_or_compute("plan", "m", {"goal": "a"}, compute)
+
+    assert result == "プラン1"
+    assert compute.calls == 1
+    stats = reader.stats()
+    assert stats["disk"] is True
+    assert stats["disk_hits"] == 1
+    assert stats["saved_seconds"] > 0
+
+
+@pytest.mark.asyncio
+async def test_disk_purges_expired_rows_periodically(tmp_path):
+    """期限切れの行は書き込みのたびではなく一定間隔で、expires_at の索引を使って消すテスト"""
+    cache = LLMResultCache(max_entries=10, ttl=0.01, path=str(tmp_path / "llm_cache.sqlite3"))
+    plan = cache._conn.execute("EXPLAIN QUERY PLAN DELETE FROM llm_cache WHERE expires_at <= 0").fetchall()
+    assert any("idx_llm_cache_expires_at" in row[-1] for row in plan)
+
+    await cache.get_or_compute("plan", "m", {"goal": "a"}, Counter())
+    await asyncio.sleep(0.02)
+    await cache.get_or_compute("plan", "m", {"goal": "b"}, Counter())
+    # 直前に消したばかりなので、期限切れの a はまだ残っている
+    assert cache._conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0] == 2
+
+    cache._purged_at = 0.0
+    await asyncio.sleep(0.02)
+    await cache.get_or_compute("plan", "m", {"goal": "c"}, Counter())
+    assert cache._conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0] == 1
+
+
+@pytest.mark.asyncio
+async def test_concurrent_calls_share_one_computation():
+    cache = LLMResultCache(max_entries=10, ttl=60, path="")
+    compute = Counter(delay=0.05)
+
+    results = await asyncio.gather(*[
+        cache.get_or_compute("plan", "m", {"goal": "a"}, compute) for _ in range(5)
+    ])
+
+    assert results == ["プラン1"] * 5
+    assert compute.calls == 1
+    assert cache.stats()["joined"] == 4
+
+
+@pytest.mark.asyncio
+async def test_cancelled_computation_does_not_cancel_joined_calls():
+    cache = LLMResultCache(max_entries=10, ttl=60, path="")
+    compute = Counter(delay=0.05)
+
+    owner = asyncio.create_task(cache.get_or_compute("plan", "m", {"goal": "a"}, compute))
+    await asyncio.sleep(0.01)
+    joined = asyncio.create_task(cache.get_or_compute("plan", "m", {"goal": "a"}, compute))
+    await asyncio.sleep(0.01)
+    owner.cancel()
+
+    assert await joined == "プラン2"
+    with pytest.raises(asyncio.CancelledError):
+        await owner
+
+
+@pytest.mark.asyncio
+async def test_errors_are_not_cached():
+    cache = LLMResultCache(max_entries=10, ttl=60, path="")
+
+    async def fail():
+        raise RuntimeError("rate limited")
+
+    with pytest.raises(RuntimeError):
+        await cache.get_or_compute("plan", "m", {"goal": "a"}, fail)
+    result = await cache.get_or_compute("plan", "m", {"goal": "a"}, Counter())
+
+    assert result == "プラン1"
+    assert cache.stats()["stores"] == 1
+
+
+@pytest.mark.asyncio
+async def test_disabled_cache_always_computes():
+    cache = LLMResultCache(max_entries=0, ttl=60, path="")
+    compute = Counter()
+
+    await cache.get_or_compute("plan", "m", {"goal": "a"}, compute)
+    await cache.get_or_compute("plan", "m", {"goal": "a"}, compute)
+
+    assert compute.calls == 2
@@ -0,0 +1,155 @@
+import asyncio
+import threading
+import time
+import pytest
+from autogpt_modules.utils.llm.scheduler import (
+    LLMScheduler,
+    PRIORITY_INTERACTIVE,
+    PRIORITY_PLANNING,
+    PRIORITY_SUMMARY,
+)
+
+
+async def call(scheduler, order, name, room_id=None, priority=PRIORITY_INTERACTIVE, duration=0.01, **kwargs):
+    async with scheduler.slot("test", room_id, priority, **kwargs):
+        order.append(name)
+        await asyncio.sleep(duration)
+
+
+async def queue_behind_running_call(scheduler, order, calls):
+    """1つ目の呼び出しが枠を使っている間に calls を順に並べ、全部終わるまで待つ"""
+    tasks = [asyncio.create_task(call(scheduler, order, "first", room_id="busy", duration=0.05))]
+    await asyncio.sleep(0.01)
+    for kwargs in calls:
+        tasks.append(asyncio.create_task(call(scheduler, order, **kwargs)))
+        await asyncio.sleep(0)
+    await asyncio.gather(*tasks)
+
+
+@pytest.mark.asyncio
+async def test_concurrency_limit():
+    """プロバイダごとの同時実行数を超えないテスト"""
+    scheduler = LLMScheduler(max_concurrency=2, tokens_per_minute=0)
+    running, peak = 0, 0
+
+    async def tracked():
+        nonlocal running, peak
+        async with scheduler.slot("test", "room"):
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(0.01)
+            running -= 1
+
+    await asyncio.gather(*(tracked() for _ in range(6)))
+    assert peak == 2
+    assert scheduler.stats()["providers"]["test"]["running"] == 0
+
+
+@pytest.mark.asyncio
+async def test_interactive_calls_run_before_background_calls():
+    """待っている呼び出しは 返信 > プラン > 要約 の順に実行するテスト"""
+    scheduler = LLMScheduler(max_concurrency=1, tokens_per_minute=0, aging_seconds=0)
+    order = []
+    await queue_behind_running_call(scheduler, order, [
+        dict(name="summary", priority=PRIORITY_SUMMARY),
+        dict(name="planning", priority=PRIORITY_PLANNING),
+        dict(name="reply", priority=PRIORITY_INTERACTIVE),
+    ])
+    assert order == ["first", "reply", "planning", "summary"]
+    assert scheduler.stats()["priorities"]["summary"]["wait_ms"]["max"] > 0
+
+
+@pytest.mark.asyncio
+async def test_rooms_share_capacity_fairly():
+    """呼び出しの多いルームがあっても、他のルームの呼び出しを後回しにしないテスト"""
+    scheduler = LLMScheduler(max_concurrency=1, tokens_per_minute=0)
+    order = []
+    await queue_behind_running_call(
+        scheduler, order,
+        [dict(name=f"a{i}", room_id="a", estimated_tokens=100) for i in range(4)]
+        + [dict(name="b0", room_id="b", estimated_tokens=100)],
+    )
+    assert order.index("b0") <= 2
+
+
+@pytest.mark.asyncio
+async def test_aging_prevents_starvation():
+    """長く待った低い優先度の呼び出しは、後から来た高い優先度より先に実行するテスト"""
+    scheduler = LLMScheduler(max_concurrency=1, tokens_per_minute=0, aging_seconds=0.02)
+    order = []
+    tasks = [asyncio.create_task(call(scheduler, order, "first", duration=0.1))]
+    await asyncio.sleep(0.01)
+    tasks.append(asyncio.create_task(call(scheduler, order, "summary", priority=PRIORITY_SUMMARY)))
+    await asyncio.sleep(0.08)
+    tasks.append(asyncio.create_task(call(scheduler, order, "reply", priority=PRIORITY_INTERACTIVE)))
+    await asyncio.gather(*tasks)
+    assert order == ["first", "summary", "reply"]
+
+
+@pytest.mark.asyncio
+async def test_tokens_per_minute_limit_delays_calls():
+    """1分あたりのトークン数を使い切ったら、予算が回復するまで待たせるテスト"""
+    # 6000トークン/分 = 100トークン/秒
+    scheduler = LLMScheduler(max_concurrency=10, tokens_per_minute=6000, aging_seconds=0)
+    order = []
+    await asyncio.gather(*(call(scheduler, order, f"c{i}", estimated_tokens=3000, duration=0) for i in range(2)))
+
+    started = time.monotonic()
+    await call(scheduler, order, "throttled", estimated_tokens=10, duration=0)
+    assert time.monotonic() - started >= 0.08
+    assert scheduler.stats()["providers"]["test"]["throttled"] >= 1
+
+
+@pytest.mark.asyncio
+async def test_recorded_usage_refunds_budget():
+    """実際の使用量が見積もりより少なければ、差分を予算に戻すテスト"""
+    scheduler = LLMScheduler(max_concurrency=1, tokens_per_minute=1000)
+    async with scheduler.slot("test", "r", estimated_tokens=800) as ticket:
+        ticket.record_tokens(100)
+    assert scheduler.stats()["providers"]["test"]["tokens_available"] >= 900
+
+
+@pytest.mark.asyncio
+async def test_cancelled_waiter_leaves_queue():
+    """待っている間に取り消された呼び出しは枠を使わないテスト"""
+    scheduler = LLMScheduler(max_concurrency=1, tokens_per_minute=0)
+    order = []
+    first = asyncio.create_task(call(scheduler, order, "first", duration=0.05))
+    await asyncio.sleep(0.01)
+    waiter = asyncio.create_task(call(scheduler, order, "cancelled"))
+    await asyncio.sleep(0.01)
+    waiter.cancel()
+    await asyncio.gather(first, waiter, return_exceptions=True)
+
+    await call(scheduler, order, "after")
+    assert order == ["first", "after"]
+    stats = scheduler.stats()
+    assert stats["cancelled"] == 1 and stats["providers"]["test"]["running"] == 0
+
+
+def test_limits_are_shared_across_event_loops():
+    """別スレッドのイベントループ（シャード）の呼び出しも同じ同時実行数の上限に従うテスト"""
+    scheduler = LLMScheduler(max_concurrency=1, tokens_per_minute=0)
+    lock = threading.Lock()
+    running, peak = 0, 0
+
+    async def tracked():
+        nonlocal running, peak
+        async with scheduler.slot("test", "room"):
+            with lock:
+                running += 1
+                peak = max(peak, running)
+            await asyncio.sleep(0.02)
+            with lock:
+                running -= 1
+
+    async def shard():
+        await asyncio.gather(*(tracked() for _ in range(3)))
+
+    threads = [threading.Thread(target=asyncio.run, args=(shard(),)) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=5)
+    assert peak == 1
+    assert scheduler.stats()["priorities"]["interactive"]["granted"] == 9
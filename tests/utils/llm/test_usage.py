@@ -0,0 +1,49 @@
+from langchain_core.messages import AIMessage
+from autogpt_modules.utils.llm.usage import extract_token_usage
+
+
+def test_extract_token_usage_from_usage_metadata():
+    """usage_metadata からキャッシュヒット数を取り出すテスト"""
+    message = AIMessage(
+        content="{}",
+        usage_metadata={
+            "input_tokens": 1000,
+            "output_tokens": 200,
+            "total_tokens": 1200,
+            "input_token_details": {"cache_read": 768},
+        },
+    )
+    assert extract_token_usage(message) == {
+        "input_tokens": 1000,
+        "output_tokens": 200,
+        "cached_input_tokens": 768,
+    }
+
+
+def test_extract_token_usage_from_deepseek_token_usage():
+    """DeepSeek の prompt_cache_hit_tokens を取り出すテスト"""
+    message = AIMessage(
+        content="{}",
+        response_metadata={
+            "token_usage": {
+                "prompt_tokens": 900,
+                "completion_tokens": 100,
+                "prompt_cache_hit_tokens": 640,
+                "prompt_cache_miss_tokens": 260,
+            }
+        },
+    )
+    assert extract_token_usage(message) == {
+        "input_tokens": 900,
+        "output_tokens": 100,
+        "cached_input_tokens": 640,
+    }
+
+
+def test_extract_token_usage_without_usage():
+    """使用量が含まれない応答では0を返すテスト"""
+    assert extract_token_usage("plain text") == {
+        "input_tokens": 0,
+        "output_tokens": 0,
+        "cached_input_tokens": 0,
+    }
@@ -4,4 +4,4 @@ def dict_to_string(dict):
 def string_to_bool(input):
     if type(input) == bool:
         return input
-    return input.lower() == "true"
+    return str(input).lower() == "true"